@@ -111,8 +111,14 @@ def build_parser():
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float16", "bfloat16", "float32", "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training. float16/bfloat16 use torch.autocast, "
+                             "and O0-O3 are opt levels of apex")
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='multi-process training with DistributedDataParallel (launched by torchrun). '
+                             'Each process uses a single GPU (or CPU if n_gpus=0).')
+    parser.add_argument('--dist_backend', type=str, default=None, choices=['nccl', 'gloo'],
+                        help='backend of distributed training (nccl for GPU and gloo for CPU by default)')
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
@@ -123,6 +129,10 @@ def build_parser():
                         help='print to standard output during training')
     parser.add_argument('--remove_old_checkpoints', type=strtobool, default=True,
                         help='remove old checkpoints to save disk (turned off when training Transformer')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=True,
+                        help='write checkpoints in a background thread')
+    parser.add_argument('--shard_checkpoint', type=strtobool, default=False,
+                        help='save optimizer states to a separate file (*.optim)')
     # dataset
     parser.add_argument('--train_set', type=str,
                         help='tsv file path for the training set')
@@ -242,6 +252,12 @@ def build_parser():
                         help='epoch to convert to SGD fine-tuning')
     parser.add_argument('--print_step', type=int, default=200,
                         help='print log per this value')
+    parser.add_argument('--report_step', type=int, default=10,
+                        help='write averaged scalars to tensorboard per this value')
+    parser.add_argument('--profile_steps', type=int, default=0,
+                        help='number of training steps to be profiled (0 disables profiling)')
+    parser.add_argument('--profile_start_step', type=int, default=100,
+                        help='first training step to be profiled')
     parser.add_argument('--metric', type=str, default='edit_distance',
                         choices=['edit_distance', 'loss', 'accuracy', 'ppl', 'bleu', 'mse'],
                         help='metric for evaluation during training')
@@ -270,6 +286,14 @@ def build_parser():
                         help='gather the similar length of utterances and shuffle them')
     parser.add_argument('--eval_start_epoch', type=int, default=1,
                         help='first epoch to start evaluation')
+    parser.add_argument('--async_eval', type=strtobool, default=False,
+                        help='evaluate the dev set in a worker process without blocking training')
+    parser.add_argument('--async_eval_policy', type=str, default='wait', choices=['wait', 'skip'],
+                        help='how to proceed when the dev result of the previous epoch has not arrived at the end of the next epoch')
+    parser.add_argument('--async_eval_device', type=str, default='cpu',
+                        help='device for evaluation in the worker process (e.g., cpu, cuda:1)')
+    parser.add_argument('--dev_subset_n_batches', type=int, default=0,
+                        help='number of dev mini-batches fixed at the beginning and averaged for the dev loss at every print step (a new mini-batch every time if 0)')
     parser.add_argument('--warmup_start_lr', type=float, default=0,
                         help='initial learning rate for learning rate warm up')
     parser.add_argument('--warmup_n_steps', type=int, default=0,
@@ -369,6 +393,10 @@ def build_parser():
                         help='Teacher ASR model for knowledge distillation')
     parser.add_argument('--teacher_lm', default=False, nargs='?',
                         help='Teacher LM for knowledge distillation')
+    parser.add_argument('--teacher_logits', default=False, nargs='?',
+                        help='Store of top-k teacher distributions precomputed by generate_teacher_logits.py (used instead of --teacher/--teacher_lm during training)')
+    parser.add_argument('--teacher_logits_topk', type=int, default=16,
+                        help='number of tokens per position saved in the teacher logit store')
     parser.add_argument('--distillation_weight', type=float, default=0.1,
                         help='soft label weight for knowledge distillation')
     # special label
@@ -429,9 +457,9 @@ def build_parser():
     parser.add_argument('--recog_ctc_weight', type=float, default=0.0,
                         help='weight of CTC score')
     parser.add_argument('--recog_lm', type=str, default=False, nargs='?',
-                        help='path to first path LM for shallow fusion')
+                        help='path to first path LM for shallow fusion. ARPA files (*.arpa) and n-gram LMs compiled by utils/compile_ngram_lm.py are also supported')
     parser.add_argument('--recog_lm_second', type=str, default=False, nargs='?',
-                        help='path to second path LM for rescoring')
+                        help='path to second path LM for rescoring (including n-gram LMs)')
     parser.add_argument('--recog_lm_bwd', type=str, default=False, nargs='?',
                         help='path to second path LM in the reverse direction for rescoring')
     parser.add_argument('--recog_resolving_unk', type=strtobool, default=False,
@@ -452,6 +480,10 @@ def build_parser():
                         help='')
     parser.add_argument('--recog_n_average', type=int, default=1,
                         help='number of models for the model averaging of Transformer')
+    parser.add_argument('--recog_average_topk', type=strtobool, default=False,
+                        help='average top-k checkpoints recorded in the checkpoint instead of previous epochs')
+    parser.add_argument('--recog_average_ema_decay', type=float, default=None,
+                        help='decay rate for exponential moving average over checkpoints (uniform if not set)')
     parser.add_argument('--recog_streaming', type=strtobool, default=False,
                         help='streaming decoding')
     parser.add_argument('--recog_block_sync', type=strtobool, default=False,
@@ -472,4 +504,7 @@ def build_parser():
                         help='delay threshold for MMA decoder')
     parser.add_argument('--recog_mem_len', type=int, default=0,
                         help='number of tokens for memory in TransformerXL decoder during evaluation')
+    parser.add_argument('--recog_lm_dtype', type=str, default='float32',
+                        choices=['float32', 'bfloat16', 'int8'],
+                        help='data type of LM weights for shallow fusion and rescoring (int8 is for CPU only)')
     return parser
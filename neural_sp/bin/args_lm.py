@@ -69,8 +69,14 @@ def build_parser():
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float16", "bfloat16", "float32", "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training. float16/bfloat16 use torch.autocast, "
+                             "and O0-O3 are opt levels of apex")
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='multi-process training with DistributedDataParallel (launched by torchrun). '
+                             'Each process uses a single GPU (or CPU if n_gpus=0).')
+    parser.add_argument('--dist_backend', type=str, default=None, choices=['nccl', 'gloo'],
+                        help='backend of distributed training (nccl for GPU and gloo for CPU by default)')
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
@@ -81,6 +87,10 @@ def build_parser():
                         help='print to standard output')
     parser.add_argument('--remove_old_checkpoints', type=strtobool, default=True,
                         help='remove old checkpoints to save disk (turned off when training Transformer')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=True,
+                        help='write checkpoints in a background thread')
+    parser.add_argument('--shard_checkpoint', type=strtobool, default=False,
+                        help='save optimizer states to a separate file (*.optim)')
     # dataset
     parser.add_argument('--train_set', type=str,
                         help='tsv file path for the training set')
@@ -122,6 +132,9 @@ def build_parser():
                         help='mini-batch size')
     parser.add_argument('--bptt', type=int, default=200,
                         help='BPTT length')
+    parser.add_argument('--pack_sequences', type=strtobool, default=False, nargs='?',
+                        help='model sentences packed in each BPTT segment independently during training '
+                        '(block-diagonal attention masks for TransformerLM and state resets for RNNLM)')
     parser.add_argument('--optimizer', type=str, default='adam',
                         choices=['adam', 'adadelta', 'adagrad', 'sgd', 'momentum', 'nesterov', 'noam'],
                         help='type of optimizer')
@@ -131,6 +144,12 @@ def build_parser():
                         help='epoch to convert to SGD fine-tuning')
     parser.add_argument('--print_step', type=int, default=100,
                         help='print log per this value')
+    parser.add_argument('--report_step', type=int, default=10,
+                        help='write averaged scalars to tensorboard per this value')
+    parser.add_argument('--profile_steps', type=int, default=0,
+                        help='number of training steps to be profiled (0 disables profiling)')
+    parser.add_argument('--profile_start_step', type=int, default=100,
+                        help='first training step to be profiled')
     parser.add_argument('--lr', type=float, default=1e-3,
                         help='initial learning rate')
     parser.add_argument('--lr_factor', type=float, default=10.0,
@@ -152,6 +171,14 @@ def build_parser():
                         help='epoch to stop soring utterances by length')
     parser.add_argument('--eval_start_epoch', type=int, default=1,
                         help='first epoch to start evaluation')
+    parser.add_argument('--async_eval', type=strtobool, default=False,
+                        help='evaluate the dev set in a worker process without blocking training')
+    parser.add_argument('--async_eval_policy', type=str, default='wait', choices=['wait', 'skip'],
+                        help='how to proceed when the dev result of the previous epoch has not arrived at the end of the next epoch')
+    parser.add_argument('--async_eval_device', type=str, default='cpu',
+                        help='device for evaluation in the worker process (e.g., cpu, cuda:1)')
+    parser.add_argument('--dev_subset_n_batches', type=int, default=0,
+                        help='number of dev mini-batches fixed at the beginning and averaged for the dev loss at every print step (a new mini-batch every time if 0)')
     parser.add_argument('--warmup_start_lr', type=float, default=0,
                         help='initial learning rate for learning rate warm up')
     parser.add_argument('--warmup_n_steps', type=int, default=0,
@@ -199,7 +226,9 @@ def build_parser():
     parser.add_argument('--recog_dir', type=str, default=False,
                         help='directory to save decoding results')
     parser.add_argument('--recog_batch_size', type=int, default=1,
-                        help='size of mini-batch in evaluation')
+                        help='size of mini-batch in evaluation. The corpus is split into this number of independent streams')
+    parser.add_argument('--recog_n_workers', type=int, default=1,
+                        help='number of CPU processes to evaluate the streams in parallel')
     parser.add_argument('--recog_n_average', type=int, default=5,
                         help='number of models for the model averaging of Transformer')
     parser.add_argument('--recog_n_caches', type=int, default=0,
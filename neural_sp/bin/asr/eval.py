@@ -14,7 +14,10 @@ import sys
 import time
 
 from neural_sp.bin.args_asr import parse_args_eval
-from neural_sp.bin.eval_utils import average_checkpoints
+from neural_sp.bin.eval_utils import (
+    average_checkpoints,
+    load_topk_list
+)
 from neural_sp.bin.train_utils import (
     compute_subsampling_factor,
     load_checkpoint,
@@ -30,6 +33,10 @@ from neural_sp.evaluators.word import eval_word
 from neural_sp.evaluators.wordpiece import eval_wordpiece
 from neural_sp.evaluators.wordpiece_bleu import eval_wordpiece_bleu
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.ngram import (
+    is_ngram_lm,
+    NgramLM
+)
 from neural_sp.models.seq2seq.speech2text import Speech2Text
 
 logger = logging.getLogger(__name__)
@@ -63,10 +70,11 @@ def main():
             epoch = int(args.recog_model[0].split('-')[-1])
             if args.recog_n_average > 1:
                 # Model averaging for Transformer
-                # topk_list = load_checkpoint(args.recog_model[0], model)
+                topk_list = load_topk_list(args.recog_model[0]) if args.recog_average_topk else []
                 model = average_checkpoints(model, args.recog_model[0],
-                                            # topk_list=topk_list,
-                                            n_average=args.recog_n_average)
+                                            n_average=args.recog_n_average,
+                                            topk_list=topk_list,
+                                            ema_decay=args.recog_average_ema_decay)
             else:
                 load_checkpoint(args.recog_model[0], model)
 
@@ -86,9 +94,15 @@ def main():
                     ensemble_models += [model_e]
 
             # Load the LM for shallow fusion
+            lm_dtype = args.recog_lm_dtype
+            if lm_dtype == 'int8' and args.recog_n_gpus >= 1:
+                logger.warning('int8 LMs are supported only on CPU. float32 is used instead.')
+                lm_dtype = 'float32'
             if not args.lm_fusion:
                 # first path
-                if args.recog_lm is not None and args.recog_lm_weight > 0:
+                if is_ngram_lm(args.recog_lm) and args.recog_lm_weight > 0:
+                    model.lm_fwd = NgramLM(args.recog_lm, os.path.join(dir_name, 'dict.txt'))
+                elif args.recog_lm is not None and args.recog_lm_weight > 0:
                     conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
                     args_lm = argparse.Namespace()
                     for k, v in conf_lm.items():
@@ -98,13 +112,16 @@ def main():
                                   lm_dict_path=os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
                                   asr_dict_path=os.path.join(dir_name, 'dict.txt'))
                     load_checkpoint(args.recog_lm, lm)
+                    lm.prepare_for_inference(lm_dtype)
                     if args_lm.backward:
                         model.lm_bwd = lm
                     else:
                         model.lm_fwd = lm
 
                 # second path (forward)
-                if args.recog_lm_second is not None and args.recog_lm_second_weight > 0:
+                if is_ngram_lm(args.recog_lm_second) and args.recog_lm_second_weight > 0:
+                    model.lm_second = NgramLM(args.recog_lm_second, os.path.join(dir_name, 'dict.txt'))
+                elif args.recog_lm_second is not None and args.recog_lm_second_weight > 0:
                     conf_lm_second = load_config(os.path.join(os.path.dirname(args.recog_lm_second), 'conf.yml'))
                     args_lm_second = argparse.Namespace()
                     for k, v in conf_lm_second.items():
@@ -112,6 +129,7 @@ def main():
                     args_lm_second.recog_mem_len = args.recog_mem_len
                     lm_second = build_lm(args_lm_second)
                     load_checkpoint(args.recog_lm_second, lm_second)
+                    lm_second.prepare_for_inference(lm_dtype)
                     model.lm_second = lm_second
 
                 # second path (backward)
@@ -123,6 +141,7 @@ def main():
                     args_lm_bwd.recog_mem_len = args.recog_mem_len
                     lm_bwd = build_lm(args_lm_bwd)
                     load_checkpoint(args.recog_lm_bwd, lm_bwd)
+                    lm_bwd.prepare_for_inference(lm_dtype)
                     model.lm_bwd = lm_bwd
 
             if not args.recog_unit:
@@ -147,6 +166,7 @@ def main():
             logger.info('LM weight (first-pass): %.3f' % args.recog_lm_weight)
             logger.info('LM weight (second-pass): %.3f' % args.recog_lm_second_weight)
             logger.info('LM weight (backward): %.3f' % args.recog_lm_bwd_weight)
+            logger.info('LM dtype: %s' % lm_dtype)
             logger.info('GNMT: %s' % args.recog_gnmt_decoding)
             logger.info('forward-backward attention: %s' % args.recog_fwd_bwd_attention)
             logger.info('resolving UNK: %s' % args.recog_resolving_unk)
@@ -154,6 +174,8 @@ def main():
             logger.info('ASR decoder state carry over: %s' % (args.recog_asr_state_carry_over))
             logger.info('LM state carry over: %s' % (args.recog_lm_state_carry_over))
             logger.info('model average (Transformer): %d' % (args.recog_n_average))
+            logger.info('model average over top-k epochs: %s' % (args.recog_average_topk))
+            logger.info('model average EMA decay: %s' % (args.recog_average_ema_decay))
 
             # GPU setting
             if args.recog_n_gpus >= 1:
@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Precompute top-k teacher distributions for knowledge distillation.
+
+This takes the same arguments as train.py. The teacher (--teacher or
+--teacher_lm) is run once over the training set, and top-k log probabilities
+per output token are saved to --teacher_logits, which is loaded during
+training instead of the teacher.
+"""
+
+import argparse
+import copy
+import logging
+import numpy as np
+import os
+import sys
+import torch
+from tqdm import tqdm
+
+from neural_sp.bin.args_asr import parse_args_train
+from neural_sp.bin.train_utils import (
+    compute_subsampling_factor,
+    load_checkpoint,
+    load_config
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.datasets.teacher_logits import TeacherLogitWriter
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.models.torch_utils import (
+    np2tensor,
+    pad_list
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_teacher(args_teacher, teacher_path):
+    """Load the teacher ASR model with the configuration in the same directory."""
+    conf_teacher = load_config(os.path.join(os.path.dirname(teacher_path), 'conf.yml'))
+    for k, v in conf_teacher.items():
+        setattr(args_teacher, k, v)
+    args_teacher.ss_prob = 0
+    teacher = Speech2Text(args_teacher)
+    load_checkpoint(teacher_path, teacher)
+    return teacher
+
+
+def load_teacher_lm(lm_path):
+    """Load the teacher LM with the configuration in the same directory."""
+    conf_lm = load_config(os.path.join(os.path.dirname(lm_path), 'conf.yml'))
+    args_lm = argparse.Namespace()
+    for k, v in conf_lm.items():
+        setattr(args_lm, k, v)
+    teacher_lm = build_lm(args_lm)
+    load_checkpoint(lm_path, teacher_lm)
+    return teacher_lm
+
+
+def generate_lm_logits(lm, ys):
+    """Compute logits of the LM in teacher-forcing.
+
+    Args:
+        lm (LMBase):
+        ys (List): length `[B]`, token ids without <sos>/<eos>
+    Returns:
+        logits (FloatTensor): `[B, L_max + 1, vocab]`
+
+    """
+    device = next(lm.parameters()).device
+    ys_in = pad_list([np2tensor(np.array([lm.eos] + list(y), dtype=np.int64), device) for y in ys], lm.pad)
+    logits, _, _ = lm.decode(ys_in, None)
+    return logits
+
+
+def main():
+
+    args = parse_args_train(sys.argv[1:])
+    args_teacher = copy.deepcopy(args)
+    args = compute_subsampling_factor(args)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s')
+    assert args.teacher_logits, 'Set the output path by --teacher_logits.'
+    assert args.teacher or args.teacher_lm, 'Set --teacher or --teacher_lm.'
+
+    # Load dataloader with the same filtering as training
+    dataloader = build_dataloader(args=args,
+                                  tsv_path=args.train_set,
+                                  tsv_path_sub1=args.train_set_sub1,
+                                  tsv_path_sub2=args.train_set_sub2,
+                                  batch_size=args.batch_size,
+                                  n_epochs=1,
+                                  sort_by='input',
+                                  short2long=args.sort_short2long,
+                                  word_alignment_dir=args.train_word_alignment,
+                                  ctc_alignment_dir=args.train_ctc_alignment)
+
+    if args.teacher:
+        teacher = load_teacher(args_teacher, args.teacher)
+    else:
+        teacher = load_teacher_lm(args.teacher_lm)
+    if args.n_gpus >= 1:
+        teacher.cuda()
+    teacher.eval()
+
+    writer = TeacherLogitWriter(args.teacher_logits, args.teacher_logits_topk, dataloader.vocab)
+    pbar = tqdm(total=len(dataloader))
+    with torch.no_grad():
+        for batch, is_new_epoch in dataloader:
+            if args.teacher:
+                logits = teacher.generate_logits(batch)
+            else:
+                logits = generate_lm_logits(teacher, batch['ys'])
+            for b, utt_id in enumerate(batch['utt_ids']):
+                writer.add(utt_id, logits[b, :len(batch['ys'][b]) + 1])  # including <eos>
+            pbar.update(len(batch['utt_ids']))
+            if is_new_epoch:
+                break
+    pbar.close()
+    writer.close()
+    logger.info('Saved top-%d distributions of %d utterances to %s' % (
+        writer.topk, len(writer.utt_ids), args.teacher_logits))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,6 @@
 
 import argparse
 import copy
-import cProfile
 import logging
 import os
 from setproctitle import setproctitle
@@ -26,17 +25,37 @@ from neural_sp.bin.train_utils import (
     load_config,
     save_config,
     set_logger,
+    set_mixed_precision,
     set_save_path
 )
 from neural_sp.datasets.asr import build_dataloader
 from neural_sp.models.data_parallel import CustomDataParallel
 from neural_sp.models.data_parallel import CPUWrapperASR
+from neural_sp.models.data_parallel import (
+    broadcast_object,
+    init_distributed,
+    is_main_process,
+    wrap_distributed
+)
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.packing import report_packing_stats
 from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.trainers.async_evaluator import (
+    apply_eval_results,
+    AsyncEvaluator
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
 from neural_sp.trainers.optimizer import set_optimizer
-from neural_sp.trainers.reporter import Reporter
+from neural_sp.trainers.profiler import (
+    record_stage,
+    StepProfiler
+)
+from neural_sp.trainers.reporter import (
+    average_observations,
+    Reporter
+)
 from neural_sp.utils import mkdir_join
+from neural_sp.utils import null_context
 
 torch.manual_seed(1)
 torch.cuda.manual_seed_all(1)
@@ -60,8 +79,16 @@ def main():
 
     args = compute_subsampling_factor(args)
 
+    # for distributed training
+    rank, world_size = 0, 1
+    if args.distributed:
+        rank, world_size, _ = init_distributed(args.n_gpus >= 1, args.dist_backend)
+
     # for multi-GPUs
-    if args.n_gpus > 1:
+    if args.distributed:
+        batch_size = args.batch_size  # per process
+        accum_grad_n_steps = max(1, args.accum_grad_n_steps // world_size)
+    elif args.n_gpus > 1:
         batch_size = args.batch_size * args.n_gpus
         accum_grad_n_steps = max(1, args.accum_grad_n_steps // args.n_gpus)
     else:
@@ -81,7 +108,10 @@ def main():
                                  num_workers=args.n_gpus,
                                  pin_memory=True,
                                  word_alignment_dir=args.train_word_alignment,
-                                 ctc_alignment_dir=args.train_ctc_alignment)
+                                 ctc_alignment_dir=args.train_ctc_alignment,
+                                 teacher_logits=args.teacher_logits,
+                                 rank=rank,
+                                 world_size=world_size)
     dev_set = build_dataloader(args=args,
                                tsv_path=args.dev_set,
                                tsv_path_sub1=args.dev_set_sub1,
@@ -95,6 +125,8 @@ def main():
                                   tsv_path=s,
                                   batch_size=1,
                                   is_test=True) for s in args.eval_sets]
+    if not is_main_process():
+        eval_sets = []  # evaluated only in the main process
 
     args.vocab = train_set.vocab
     args.vocab_sub1 = train_set.vocab_sub1
@@ -107,16 +139,20 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_asr_model_name(args)
-        if args.mbr_training:
-            assert args.asr_init
-            save_path = mkdir_join(os.path.dirname(args.asr_init), dir_name)
-        else:
-            save_path = mkdir_join(args.model_save_dir, '_'.join(
-                os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = None
+        if is_main_process():
+            if args.mbr_training:
+                assert args.asr_init
+                save_path = mkdir_join(os.path.dirname(args.asr_init), dir_name)
+            else:
+                save_path = mkdir_join(args.model_save_dir, '_'.join(
+                    os.path.basename(args.train_set).split('.')[:-1]), dir_name)
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout,
+               main_process=is_main_process())
 
     # Load a LM conf file for LM fusion & LM initialization
     if not args.resume and args.external_lm:
@@ -130,7 +166,7 @@ def main():
     # Model setting
     model = Speech2Text(args, save_path, train_set.idx2token[0])
 
-    if not args.resume:
+    if not args.resume and is_main_process():
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
         if args.external_lm:
@@ -145,6 +181,8 @@ def main():
             if getattr(args, 'unit' + sub) == 'wp':
                 shutil.copy(getattr(args, 'wp_model' + sub), os.path.join(save_path, 'wp' + sub + '.model'))
 
+    if not args.resume:
+
         for k, v in sorted(vars(args).items(), key=lambda x: x[0]):
             logger.info('%s: %s' % (k, str(v)))
 
@@ -183,6 +221,9 @@ def main():
         resume_epoch = 0
         optimizer = set_optimizer(model, args.optimizer, args.lr, args.weight_decay)
 
+    # Mixed precision training setting with torch.autocast
+    autocast, scaler = set_mixed_precision(args.train_dtype, args.n_gpus >= 1)
+
     # Wrap optimizer by learning rate scheduler
     is_transformer = 'former' in args.enc_type or 'former' in args.dec_type
     scheduler = LRScheduler(optimizer, args.lr,
@@ -200,7 +241,10 @@ def main():
                                                getattr(args, 'transformer_dec_d_model', 0)),
                             factor=args.lr_factor,
                             noam=args.optimizer == 'noam',
-                            save_checkpoints_topk=10 if is_transformer else 1)
+                            save_checkpoints_topk=10 if is_transformer else 1,
+                            scaler=scaler,
+                            async_checkpoint=args.async_checkpoint,
+                            shard_checkpoint=args.shard_checkpoint)
 
     if args.resume:
         # Restore the last saved model
@@ -213,7 +257,10 @@ def main():
 
     # Load the teacher ASR model
     teacher = None
-    if args.teacher:
+    if args.teacher_logits:
+        # Soft labels are loaded from the store by the dataloader
+        args.lsm_prob = 0
+    elif args.teacher:
         assert os.path.isfile(args.teacher), 'There is no checkpoint.'
         conf_teacher = load_config(os.path.join(os.path.dirname(args.teacher), 'conf.yml'))
         for k, v in conf_teacher.items():
@@ -226,7 +273,7 @@ def main():
 
     # Load the teacher LM
     teacher_lm = None
-    if args.teacher_lm:
+    if args.teacher_lm and not args.teacher_logits:
         assert os.path.isfile(args.teacher_lm), 'There is no checkpoint.'
         conf_lm = load_config(os.path.join(os.path.dirname(args.teacher_lm), 'conf.yml'))
         args_lm = argparse.Namespace()
@@ -254,12 +301,17 @@ def main():
             amp.init()
             if args.resume:
                 load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = wrap_distributed(model, use_cuda=True)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
 
         if teacher is not None:
             teacher.cuda()
         if teacher_lm is not None:
             teacher_lm.cuda()
+    elif args.distributed:
+        model = wrap_distributed(model, use_cuda=False)
     else:
         model = CPUWrapperASR(model)
 
@@ -270,7 +322,23 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, write=is_main_process(), report_step=args.report_step)
+
+    # Set profiler
+    profiler = StepProfiler(save_path, start_step=args.profile_start_step,
+                            n_steps=args.profile_steps if is_main_process() else 0,
+                            use_cuda=args.n_gpus >= 1)
+
+    # Set evaluator of the dev set in a worker process
+    evaluator = None
+    if args.async_eval and is_main_process():
+        evaluator = AsyncEvaluator(build_dev_evaluator, evaluate_dev, args, save_path,
+                                   policy=args.async_eval_policy,
+                                   device=args.async_eval_device)
+
+    # Fix mini-batches for the dev loss at print steps
+    batches_dev = [iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]
+                   for _ in range(args.dev_subset_n_batches)]
 
     if args.mtl_per_batch:
         # NOTE: from easier to harder tasks
@@ -317,46 +385,68 @@ def main():
             # Change mini-batch depending on task
             if accum_n_steps == 1:
                 loss_train = 0  # average over gradient accumulation
+            # Synchronize gradients across ranks only before updating parameters
+            no_sync = args.distributed and not (accum_n_steps >= accum_grad_n_steps or is_new_epoch)
             for task in tasks:
-                loss, observation = model(batch_train, task=task,
-                                          teacher=teacher, teacher_lm=teacher_lm)
-                loss = loss / accum_grad_n_steps
-                reporter.add(observation)
-                if use_apex:
-                    with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                else:
-                    loss.backward()
+                with model.no_sync() if no_sync else null_context():
+                    with autocast(), record_stage('forward'):
+                        loss, observation = model(batch_train, task=task,
+                                                  teacher=teacher, teacher_lm=teacher_lm)
+                    loss = loss / accum_grad_n_steps
+                    with record_stage('report'):
+                        reporter.add(observation)
+                    with record_stage('backward'):
+                        if use_apex:
+                            with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
+                                scaled_loss.backward()
+                        elif scaler is not None:
+                            scaler.scale(loss).backward()
+                        else:
+                            loss.backward()
                 loss.detach()  # Truncate the graph
                 if accum_n_steps >= accum_grad_n_steps or is_new_epoch:
-                    if args.clip_grad_norm > 0:
-                        total_norm = torch.nn.utils.clip_grad_norm_(
-                            model.module.parameters(), args.clip_grad_norm)
-                        reporter.add_tensorboard_scalar('total_norm', total_norm)
-                    scheduler.step()
-                    scheduler.zero_grad()
+                    with record_stage('optimizer'):
+                        if args.clip_grad_norm > 0:
+                            scheduler.unscale_grad()
+                            total_norm = torch.nn.utils.clip_grad_norm_(
+                                model.module.parameters(), args.clip_grad_norm)
+                            reporter.add_tensorboard_scalar('total_norm', total_norm)
+                        scheduler.step()
+                        scheduler.zero_grad()
                     accum_n_steps = 0
                     # NOTE: parameters are forcibly updated at the end of every epoch
                 loss_train += loss.item()
                 del loss
 
             pbar_epoch.update(len(batch_train['utt_ids']))
-            reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
-            # NOTE: loss/acc/ppl are already added in the model
-            reporter.step()
+            with record_stage('report'):
+                reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
+                # NOTE: loss/acc/ppl are already added in the model
+                reporter.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
 
             if n_steps % args.print_step == 0:
                 # Compute loss in the dev set
-                batch_dev = iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]
-                # Change mini-batch depending on task
-                for task in tasks:
-                    loss, observation = model(batch_dev, task=task, is_eval=True)
-                    reporter.add(observation, is_eval=True)
-                    loss_dev = loss.item()
-                    del loss
-                reporter.step(is_eval=True)
+                with record_stage('dev'):
+                    if args.dev_subset_n_batches == 0:
+                        batches_dev = [iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]]
+                    # Change mini-batch depending on task
+                    for task in tasks:
+                        observations, loss_dev = [], 0
+                        for batch_dev in batches_dev:
+                            with torch.no_grad(), autocast():
+                                loss, observation = model(batch_dev, task=task, is_eval=True)
+                            observations.append(observation)
+                            loss_dev += loss.item() / len(batches_dev)
+                            del loss
+                        reporter.add(average_observations(observations), is_eval=True)
+                    reporter.step(is_eval=True)
+
+                # Receive results from the evaluation worker
+                if args.async_eval:
+                    results = broadcast_object(evaluator.poll() if is_main_process() else None)
+                    apply_eval_results(results, scheduler, reporter, args.metric)
 
                 duration_step = time.time() - start_time_step
                 if args.input_type == 'speech':
@@ -370,26 +460,31 @@ def main():
                              loss_train, loss_dev,
                              scheduler.lr, len(batch_train['utt_ids']),
                              xlen, ylen, duration_step / 60))
+                if getattr(args, 'pack_sequences', False):
+                    report_packing_stats(model.module.dec_fwd.packing_stats, reporter)
                 start_time_step = time.time()
 
             # Save fugures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
-                reporter.snapshot()
-                model.module.plot_attention()
-                model.module.plot_ctc()
+            if n_steps % (args.print_step * 10) == 0 and is_main_process():
+                with record_stage('plot'):
+                    reporter.snapshot()
+                    model.module.plot_attention()
+                    model.module.plot_ctc()
 
             # Ealuate model every 0.1 epoch during MBR training
             if args.mbr_training:
                 if int(train_set.epoch_detail * 10) != int(epoch_detail_prev * 10):
                     # dev
-                    evaluate([model.module], dev_set, recog_params, args,
-                             int(train_set.epoch_detail * 10) / 10, logger)
+                    if is_main_process():
+                        evaluate([model.module], dev_set, recog_params, args,
+                                 int(train_set.epoch_detail * 10) / 10, logger)
                     # Save the model
                     scheduler.save_checkpoint(
                         model, save_path, remove_old=False, amp=amp,
                         epoch_detail=train_set.epoch_detail)
                 epoch_detail_prev = train_set.epoch_detail
 
+            profiler.step()
             if is_new_epoch:
                 break
 
@@ -405,11 +500,39 @@ def main():
             # Save the model
             scheduler.save_checkpoint(
                 model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+        elif args.async_eval:
+            # dev
+            # NOTE: the dev set is evaluated in the worker process, and the metric is
+            # given to the scheduler when it arrives. Results of the previous epoch
+            # are settled here depending on --async_eval_policy.
+            results = broadcast_object(evaluator.resolve() if is_main_process() else None)
+            apply_eval_results(results, scheduler, reporter, args.metric)
+            scheduler.epoch(defer_metric=True)  # lr decay
+            reporter.epoch()  # plot
+            if is_main_process():
+                evaluator.submit(model.module, scheduler.n_epochs)
+
+            # Save the model every epoch because the metric is not known yet
+            scheduler.save_checkpoint(
+                model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+
+            # Early stopping
+            if scheduler.is_early_stop:
+                break
+
+            # Convert to fine-tuning stage
+            if scheduler.n_epochs == args.convert_to_sgd_epoch:
+                scheduler.convert_to_sgd(model, args.lr, args.weight_decay,
+                                         decay_type='always', decay_rate=0.5)
         else:
             start_time_eval = time.time()
             # dev
-            metric_dev = evaluate([model.module], dev_set, recog_params, args,
-                                  scheduler.n_epochs + 1, logger)
+            # NOTE: only the main process evaluates, and the others receive the result
+            metric_dev = None
+            if is_main_process():
+                metric_dev = evaluate([model.module], dev_set, recog_params, args,
+                                      scheduler.n_epochs + 1, logger)
+            metric_dev = broadcast_object(metric_dev)
             scheduler.epoch(metric_dev)  # lr decay
             reporter.epoch(metric_dev, name=args.metric)  # plot
 
@@ -418,8 +541,8 @@ def main():
                 scheduler.save_checkpoint(
                     model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
 
-                # test
-                if scheduler.is_topk:
+                # test (only in the main process)
+                if scheduler.is_topk and is_main_process():
                     for eval_set in eval_sets:
                         evaluate([model.module], eval_set, recog_params, args,
                                  scheduler.n_epochs, logger)
@@ -446,15 +569,41 @@ def main():
         start_time_step = time.time()
         start_time_epoch = time.time()
 
+    if args.async_eval:
+        results = broadcast_object(evaluator.close() if is_main_process() else None)
+        apply_eval_results(results, scheduler, reporter, args.metric)
+    scheduler.wait_checkpoint()
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    reporter.close()
+    profiler.close()
     pbar_epoch.close()
+    if args.distributed:
+        torch.distributed.destroy_process_group()
 
     return save_path
 
 
+def build_dev_evaluator(args, save_path):
+    """Build a replica of the model and the dev set in the evaluation worker."""
+    model = Speech2Text(args, save_path)
+    dev_set = build_dataloader(args=args,
+                               tsv_path=args.dev_set,
+                               tsv_path_sub1=args.dev_set_sub1,
+                               tsv_path_sub2=args.dev_set_sub2,
+                               batch_size=args.batch_size,
+                               num_workers=0,
+                               word_alignment_dir=args.dev_word_alignment,
+                               ctc_alignment_dir=args.dev_ctc_alignment)
+    return model, dev_set
+
+
+def evaluate_dev(model, dev_set, args, epoch):
+    """Evaluate the dev set in the evaluation worker."""
+    return evaluate([model], dev_set, vars(args), args, epoch, logger)
+
+
 def evaluate(models, dataloader, recog_params, args, epoch, logger):
 
     if args.metric == 'edit_distance':
@@ -511,7 +660,4 @@ def evaluate(models, dataloader, recog_params, args, epoch, logger):
 
 
 if __name__ == '__main__':
-    # Setting for profiling
-    pr = cProfile.Profile()
-    save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    main()
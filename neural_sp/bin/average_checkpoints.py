@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Average checkpoints offline.
+
+Checkpoints are loaded one by one and accumulated tensor by tensor, so that the
+peak memory is about three float32 models (a loaded checkpoint and the running
+sum in float64) regardless of the number of checkpoints.
+The same averaged checkpoint is reused by evaluation scripts given the same
+--recog_n_average, --recog_average_topk, and --recog_average_ema_decay options.
+"""
+
+import argparse
+import logging
+import sys
+
+from neural_sp.bin.eval_utils import (
+    average_checkpoints,
+    load_topk_list
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(input_args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, required=True,
+                        help='path to the best (or last) checkpoint (model.epoch-*)')
+    parser.add_argument('--n_average', type=int, default=10,
+                        help='number of checkpoints to be averaged')
+    parser.add_argument('--topk', action='store_true',
+                        help='average top-k checkpoints recorded in the checkpoint instead of previous epochs')
+    parser.add_argument('--ema_decay', type=float, default=None,
+                        help='decay rate for exponential moving average over checkpoints (uniform if not set)')
+    parser.add_argument('--out', type=str, default=None,
+                        help='path to the averaged checkpoint (model-avg{N}[_topk][_ema{decay}] in the same directory by default)')
+    return parser.parse_args(input_args)
+
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s')
+
+    topk_list = load_topk_list(args.model) if args.topk else []
+    average_checkpoints(None, args.model, args.n_average, topk_list,
+                        ema_decay=args.ema_decay, save_path=args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,48 +6,208 @@
 
 """Utility functions for evaluation."""
 
+from collections import OrderedDict
+import hashlib
 import logging
 import os
-import torch
+
+from neural_sp.trainers.checkpoint_writer import (
+    load_optimizer_shard,
+    load_to_cpu,
+    save_atomic
+)
 
 logger = logging.getLogger(__name__)
 
 
-def average_checkpoints(model, best_model_path, n_average, topk_list=[]):
-    if n_average == 1:
-        return model
+def load_model_state_dict(checkpoint_path):
+    """Load the model section of a checkpoint.
+
+    Checkpoints are memory-mapped if possible, so that tensors are read from
+    the disk when accessed and the optimizer states are never read.
+
+    Args:
+        checkpoint_path (str): path to the saved model (model.epoch-*)
+    Returns:
+        state_dict (OrderedDict)
+
+    """
+    try:
+        checkpoint = load_to_cpu(checkpoint_path, mmap=True)
+    except RuntimeError:
+        # legacy (non-zip) format
+        checkpoint = load_to_cpu(checkpoint_path)
+    return checkpoint['model_state_dict']
+
+
+def load_topk_list(checkpoint_path):
+    """Load the list of top-k epochs saved by LRScheduler.
+
+    Args:
+        checkpoint_path (str): path to the saved model (model.epoch-*)
+    Returns:
+        topk_list (List): (epoch, metric)
+
+    """
+    checkpoint = load_to_cpu(checkpoint_path)
+    checkpoint = load_optimizer_shard(checkpoint, checkpoint_path)
+    return checkpoint.get('optimizer_state_dict', {}).get('topk_list', [])
+
 
-    n_models = 0
-    checkpoint_avg = {'model_state_dict': None}
+def select_checkpoints(best_model_path, n_average, topk_list=[]):
+    """Select checkpoints to be averaged.
+
+    Args:
+        best_model_path (str): path to the best (or last) checkpoint
+        n_average (int): number of checkpoints
+        topk_list (List): (epoch, metric). Previous epochs are used if empty.
+    Returns:
+        checkpoint_paths (List[str]): paths to existing checkpoints
+
+    """
     if len(topk_list) == 0:
         epoch = int(best_model_path.split('model.epoch-')[1])
         topk_list = [(i, 0) for i in range(epoch, epoch - n_average - 1, -1)]
+    checkpoint_paths = []
     for ep, _ in topk_list:
-        if n_models == n_average:
+        if len(checkpoint_paths) == n_average:
             break
         checkpoint_path = best_model_path.split('model.epoch-')[0] + 'model.epoch-' + str(ep)
         if os.path.isfile(checkpoint_path):
-            logger.info("=> Loading checkpoint (epoch:%d): %s" % (ep, checkpoint_path))
-            checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
-            if checkpoint_avg['model_state_dict'] is None:
-                # first checkpoint
-                checkpoint_avg['model_state_dict'] = checkpoint['model_state_dict']
-                n_models += 1
-                continue
-            for k, v in checkpoint['model_state_dict'].items():
-                checkpoint_avg['model_state_dict'][k] += v
-            n_models += 1
-
-    # take an average
-    logger.info('Take average for %d models' % n_models)
-    for k, v in checkpoint_avg['model_state_dict'].items():
-        checkpoint_avg['model_state_dict'][k] /= n_models
-    model.load_state_dict(checkpoint_avg['model_state_dict'])
+            checkpoint_paths.append(checkpoint_path)
+    return checkpoint_paths
+
+
+def ema_weights(n_models, decay):
+    """Weights of exponential moving average over checkpoints from old to new.
+
+    Args:
+        n_models (int): number of checkpoints
+        decay (float): decay rate of EMA
+    Returns:
+        weights (List[float]): sum to 1
+
+    """
+    return [decay ** (n_models - 1)] + [(1 - decay) * decay ** (n_models - 1 - i)
+                                        for i in range(1, n_models)]
+
+
+def average_state_dicts(checkpoint_paths, weights=None):
+    """Take a (weighted) average of model parameters tensor by tensor.
+
+    Parameters are accumulated in float64, and a single checkpoint is loaded
+    at a time. Non-floating-point buffers (e.g., counters in BatchNorm) are
+    copied from the last checkpoint.
+
+    Args:
+        checkpoint_paths (List[str]): paths to checkpoints from old to new
+        weights (List[float]): weights for checkpoints (uniform if None)
+    Returns:
+        state_dict (OrderedDict)
+
+    """
+    if weights is None:
+        weights = [1.] * len(checkpoint_paths)
+    assert len(weights) == len(checkpoint_paths) > 0
+
+    state_dict_avg = OrderedDict()
+    dtypes = {}
+    for checkpoint_path, w in zip(checkpoint_paths, weights):
+        logger.info("=> Loading checkpoint (weight:%.3f): %s" % (w, checkpoint_path))
+        state_dict = load_model_state_dict(checkpoint_path)
+        for k, v in state_dict.items():
+            if not v.is_floating_point():
+                state_dict_avg[k] = v.clone()
+            elif k not in state_dict_avg:
+                dtypes[k] = v.dtype
+                state_dict_avg[k] = v.double() * w
+            else:
+                state_dict_avg[k].add_(v.double(), alpha=w)
+        del state_dict
+
+    w_sum = sum(weights)
+    for k, dtype in dtypes.items():
+        state_dict_avg[k] = state_dict_avg[k].div_(w_sum).to(dtype)
+    return state_dict_avg
+
+
+def checkpoint_cache_key(checkpoint_paths, weights):
+    """Identify averaged checkpoints by members and their modification times."""
+    key = [(os.path.basename(p), os.path.getmtime(p), os.path.getsize(p)) for p in checkpoint_paths]
+    return hashlib.md5(repr((key, weights)).encode('utf-8')).hexdigest()
+
+
+def averaged_checkpoint_path(best_model_path, n_average, topk=False, ema_decay=None):
+    """Default path to the averaged checkpoint.
+
+    The name includes how checkpoints are selected and weighted, so that
+    averages over different members never overwrite each other.
+
+    Args:
+        best_model_path (str): path to the best (or last) checkpoint
+        n_average (int): number of checkpoints
+        topk (bool): top-k epochs are averaged instead of previous epochs
+        ema_decay (float): decay rate for exponential moving average (uniform if None)
+    Returns:
+        save_path (str): model-avg{n_average}[_topk][_ema{ema_decay}]
+
+    """
+    save_path = best_model_path.split('model.epoch-')[0] + 'model-avg' + str(n_average)
+    if topk:
+        save_path += '_topk'
+    if ema_decay is not None:
+        save_path += '_ema' + str(ema_decay)
+    return save_path
+
+
+def average_checkpoints(model, best_model_path, n_average, topk_list=[],
+                        ema_decay=None, save_path=None):
+    """Load the average of checkpoints to a model.
+
+    The averaged checkpoint is cached and reused while the member checkpoints
+    are the same.
+
+    Args:
+        model (torch.nn.Module): model to be loaded (not loaded if None)
+        best_model_path (str): path to the best (or last) checkpoint
+        n_average (int): number of checkpoints
+        topk_list (List): (epoch, metric). Previous epochs are used if empty.
+        ema_decay (float): decay rate for exponential moving average (uniform if None)
+        save_path (str): path to the averaged checkpoint (see averaged_checkpoint_path by default)
+    Returns:
+        model (torch.nn.Module)
+
+    """
+    if n_average == 1:
+        return model
+
+    checkpoint_paths = select_checkpoints(best_model_path, n_average, topk_list)
+    checkpoint_paths = sorted(checkpoint_paths, key=lambda p: float(p.split('model.epoch-')[1]))
+    weights = None if ema_decay is None else ema_weights(len(checkpoint_paths), ema_decay)
+    cache_key = checkpoint_cache_key(checkpoint_paths, weights)
+
+    if save_path is None:
+        save_path = averaged_checkpoint_path(best_model_path, n_average, len(topk_list) > 0, ema_decay)
+
+    # Reuse the cache
+    if os.path.isfile(save_path):
+        checkpoint_avg = load_to_cpu(save_path)
+        if checkpoint_avg.get('cache_key') == cache_key:
+            logger.info('Load the averaged checkpoint: %s' % save_path)
+            if model is not None:
+                model.load_state_dict(checkpoint_avg['model_state_dict'])
+            return model
+
+    logger.info('Take average for %d models' % len(checkpoint_paths))
+    checkpoint_avg = {'model_state_dict': average_state_dicts(checkpoint_paths, weights),
+                      'checkpoints': [os.path.basename(p) for p in checkpoint_paths],
+                      'weights': weights,
+                      'cache_key': cache_key}
+    if model is not None:
+        model.load_state_dict(checkpoint_avg['model_state_dict'])
 
     # save as a new checkpoint
-    checkpoint_avg_path = best_model_path.split('model.epoch-')[0] + 'model-avg' + str(n_average)
-    if os.path.isfile(checkpoint_avg_path):
-        os.remove(checkpoint_avg_path)
-    torch.save(checkpoint_avg, checkpoint_avg_path)
+    save_atomic(checkpoint_avg, save_path)
+    logger.info('Saved the averaged checkpoint: %s' % save_path)
 
     return model
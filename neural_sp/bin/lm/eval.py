@@ -57,9 +57,12 @@ def main():
             logger.info('epoch: %d' % epoch)
             logger.info('batch size: %d' % args.recog_batch_size)
             logger.info('BPTT: %d' % (args.bptt))
+            logger.info('number of workers: %d' % (args.recog_n_workers))
             logger.info('cache size: %d' % (args.recog_n_caches))
             logger.info('cache theta: %.3f' % (args.recog_cache_theta))
             logger.info('cache lambda: %.3f' % (args.recog_cache_lambda))
+            if args.lm_type == 'transformer_xl':
+                logger.info('memory length: %d' % (model.mem_len))
             logger.info('model average (Transformer): %d' % (args.recog_n_average))
             model.cache_theta = args.recog_cache_theta
             model.cache_lambda = args.recog_cache_lambda
@@ -70,8 +73,9 @@ def main():
 
         start_time = time.time()
 
-        ppl, _ = eval_ppl([model], dataset, batch_size=1, bptt=args.bptt,
-                          n_caches=args.recog_n_caches, progressbar=True)
+        ppl, _ = eval_ppl([model], dataset, batch_size=args.recog_batch_size, bptt=args.bptt,
+                          n_caches=args.recog_n_caches, progressbar=True,
+                          n_workers=args.recog_n_workers)
         ppl_avg += ppl
         print('PPL (%s): %.2f' % (dataset.set, ppl))
         logger.info('Elapsed time: %.2f [sec]:' % (time.time() - start_time))
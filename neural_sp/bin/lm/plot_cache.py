@@ -84,40 +84,39 @@ def main():
             os.mkdir(save_path)
 
         hidden = None
+        model.reset_cache()
         fig_count = 0
-        token_count = 0
         n_tokens = args.recog_n_caches
+        query_ids, query_aws = [], []
         while True:
             ys, is_new_epoch = dataset.next()
-
-            for t in range(ys.shape[1] - 1):
-                loss, hidden = model(ys[:, t:t + 2], hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
-
-                if len(model.cache_attn) > 0:
-                    if token_count == n_tokens:
-                        tokens_keys = dataset.idx2token[0](model.cache_ids[:args.recog_n_caches], return_list=True)
-                        tokens_query = dataset.idx2token[0](model.cache_ids[-n_tokens:], return_list=True)
-
-                        # Slide attention matrix
-                        n_keys = len(tokens_keys)
-                        n_queries = len(tokens_query)
-                        cache_probs = np.zeros((n_keys, n_queries))  # `[n_keys, n_queries]`
-                        mask = np.zeros((n_keys, n_queries))
-                        for i, aw in enumerate(model.cache_attn[-n_tokens:]):
-                            cache_probs[:(n_keys - n_queries + i + 1), i] = aw[0, -(n_keys - n_queries + i + 1):]
-                            mask[(n_keys - n_queries + i + 1):, i] = 1
-
-                        plot_cache_weights(
-                            cache_probs,
-                            keys=tokens_keys,
-                            queries=tokens_query,
-                            save_path=mkdir_join(save_path, str(fig_count) + '.png'),
-                            figsize=(40, 16),
-                            mask=mask)
-                        token_count = 0
-                        fig_count += 1
-                    else:
-                        token_count += 1
+            loss, hidden = model(ys, hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
+
+            # Visualize the first utterance in the mini-batch
+            query_ids += ys[0, 1:].tolist()
+            query_aws += list(model.cache_attn[0].cpu().numpy())  # each of which is `[n_caches]`
+
+            while len(query_ids) >= n_tokens:
+                tokens = dataset.idx2token[0](query_ids[:n_tokens], return_list=True)
+
+                # Slide attention matrix
+                cache_probs = np.zeros((n_tokens, n_tokens))  # `[n_keys, n_queries]`
+                mask = np.zeros((n_tokens, n_tokens))
+                for i, aw in enumerate(query_aws[:n_tokens]):
+                    if i > 0:
+                        cache_probs[:i, i] = aw[-i:]
+                    mask[i:, i] = 1
+
+                plot_cache_weights(
+                    cache_probs,
+                    keys=tokens,
+                    queries=tokens,
+                    save_path=mkdir_join(save_path, str(fig_count) + '.png'),
+                    figsize=(40, 16),
+                    mask=mask)
+                fig_count += 1
+                query_ids = query_ids[n_tokens:]
+                query_aws = query_aws[n_tokens:]
 
             if is_new_epoch:
                 break
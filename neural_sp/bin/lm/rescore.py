@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Rescore N-best lists with forward/backward LMs offline.
+
+Each line of an N-best list is `utt_id<TAB>score<TAB>token ids`, where token ids
+do not include <sos>/<eos>. The output is written in the same format, and
+hypotheses of each utterance are sorted by the updated scores.
+"""
+
+import argparse
+import codecs
+from collections import OrderedDict
+import logging
+import numpy as np
+import os
+import sys
+import torch
+
+from neural_sp.bin.train_utils import (
+    load_checkpoint,
+    load_config
+)
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.ngram import (
+    is_ngram_lm,
+    NgramLM
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(input_args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nbest', type=str, required=True,
+                        help='path to the input N-best list')
+    parser.add_argument('--out', type=str, required=True,
+                        help='path to the output N-best list')
+    parser.add_argument('--dict', type=str, required=True,
+                        help='dictionary file of the ASR model')
+    parser.add_argument('--lm', type=str, default=None,
+                        help='path to the forward LM (checkpoint, ARPA or compiled n-gram LM)')
+    parser.add_argument('--lm_weight', type=float, default=0.3,
+                        help='weight of the forward LM score')
+    parser.add_argument('--lm_bwd', type=str, default=None,
+                        help='path to the backward LM (checkpoint, ARPA or compiled n-gram LM). '
+                        'n-gram LMs must be trained on reversed sentences.')
+    parser.add_argument('--lm_bwd_weight', type=float, default=0.3,
+                        help='weight of the backward LM score')
+    parser.add_argument('--normalize', action='store_true',
+                        help='normalize LM scores by length')
+    parser.add_argument('--share_prefix', action='store_true',
+                        help='evaluate common prefixes of hypotheses only once')
+    parser.add_argument('--batch_size', type=int, default=256,
+                        help='number of hypotheses (across utterances) rescored at once')
+    parser.add_argument('--n_gpus', type=int, default=0,
+                        help='number of GPUs (0 indicates CPU)')
+    return parser.parse_args(input_args)
+
+
+def load_lm(lm_path, dict_path, use_cuda=False):
+    """Load a neural LM with the configuration in the same directory, or an n-gram LM."""
+    if is_ngram_lm(lm_path):
+        return NgramLM(lm_path, dict_path)
+    conf = load_config(os.path.join(os.path.dirname(lm_path), 'conf.yml'))
+    args_lm = argparse.Namespace()
+    for k, v in conf.items():
+        setattr(args_lm, k, v)
+    args_lm.recog_mem_len = 0
+    lm = build_lm(args_lm)
+    load_checkpoint(lm_path, lm)
+    if use_cuda:
+        lm.cuda()
+    lm.eval()
+    return lm
+
+
+def read_nbest(nbest_path):
+    """Read an N-best list.
+
+    Returns:
+        nbest (OrderedDict): utt_id -> list of `(score, token ids)`
+
+    """
+    nbest = OrderedDict()
+    with codecs.open(nbest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2:
+                continue
+            utt_id, score = fields[0], float(fields[1])
+            token_id = fields[2] if len(fields) > 2 else ''
+            if utt_id not in nbest:
+                nbest[utt_id] = []
+            nbest[utt_id].append((score, np.array(token_id.split(), dtype=np.int64)))
+    return nbest
+
+
+def rescore(hyps, lms, eos=2, normalize=False, share_prefix=False, batch_size=256):
+    """Rescore hypotheses with multiple LMs in batch.
+
+    Args:
+        hyps (List[np.ndarray]): token ids without <sos>/<eos>
+        lms (List[tuple]): `(lm, weight, reverse)`
+        eos (int): index for <sos>/<eos>
+        normalize (bool): normalize LM scores by length
+        share_prefix (bool): evaluate common prefixes only once
+        batch_size (int): number of hypotheses rescored at once
+    Returns:
+        scores (np.ndarray): `[N]`, weighted sum of LM scores
+
+    """
+    scores = np.zeros(len(hyps))
+    ys = [np.concatenate([[eos], y, [eos]]).astype(np.int64) for y in hyps]
+    for lm, weight, reverse in lms:
+        for i in range(0, len(ys), batch_size):
+            ys_batch = ys[i:i + batch_size]
+            if reverse:
+                ys_batch = [y[::-1] for y in ys_batch]
+            with torch.no_grad():
+                scores_lm = lm.score_sequences(ys_batch, share_prefix).cpu().numpy()
+            if normalize:
+                scores_lm /= np.array([len(y) - 1 for y in ys_batch])
+            scores[i:i + batch_size] += scores_lm * weight
+    return scores
+
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s')
+
+    lms = []
+    if args.lm:
+        lms.append((load_lm(args.lm, args.dict, args.n_gpus > 0), args.lm_weight, False))
+    if args.lm_bwd:
+        lms.append((load_lm(args.lm_bwd, args.dict, args.n_gpus > 0), args.lm_bwd_weight, True))
+    assert len(lms) > 0
+
+    nbest = read_nbest(args.nbest)
+    hyps = [hyp for utt_id in nbest.keys() for _, hyp in nbest[utt_id]]
+    scores = np.array([score for utt_id in nbest.keys() for score, _ in nbest[utt_id]])
+    logger.info('%d utterances, %d hypotheses' % (len(nbest), len(hyps)))
+
+    scores += rescore(hyps, lms, normalize=args.normalize,
+                      share_prefix=args.share_prefix, batch_size=args.batch_size)
+
+    with codecs.open(args.out, 'w', encoding='utf-8') as f:
+        offset = 0
+        for utt_id in nbest.keys():
+            n = len(nbest[utt_id])
+            for i in np.argsort(-scores[offset:offset + n], kind='stable'):
+                f.write('%s\t%.6f\t%s\n' % (utt_id, scores[offset + i],
+                                            ' '.join(map(str, hyps[offset + i]))))
+            offset += n
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,8 @@
 
 """Train LM."""
 
-import cProfile
 import logging
+import numpy as np
 import os
 from setproctitle import setproctitle
 import shutil
@@ -23,17 +23,37 @@ from neural_sp.bin.train_utils import (
     load_config,
     save_config,
     set_logger,
+    set_mixed_precision,
     set_save_path
 )
 from neural_sp.datasets.lm import Dataset
 from neural_sp.evaluators.ppl import eval_ppl
 from neural_sp.models.data_parallel import CustomDataParallel
 from neural_sp.models.data_parallel import CPUWrapperLM
+from neural_sp.models.data_parallel import (
+    broadcast_object,
+    init_distributed,
+    is_main_process,
+    wrap_distributed
+)
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.packing import report_packing_stats
+from neural_sp.trainers.async_evaluator import (
+    apply_eval_results,
+    AsyncEvaluator
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
 from neural_sp.trainers.optimizer import set_optimizer
-from neural_sp.trainers.reporter import Reporter
+from neural_sp.trainers.profiler import (
+    record_stage,
+    StepProfiler
+)
+from neural_sp.trainers.reporter import (
+    average_observations,
+    Reporter
+)
 from neural_sp.utils import mkdir_join
+from neural_sp.utils import null_context
 
 torch.manual_seed(1)
 torch.cuda.manual_seed_all(1)
@@ -52,8 +72,16 @@ def main():
             if k != 'resume':
                 setattr(args, k, v)
 
+    # for distributed training
+    rank, world_size = 0, 1
+    if args.distributed:
+        rank, world_size, _ = init_distributed(args.n_gpus >= 1, args.dist_backend)
+
     # for multi-GPUs
-    if args.n_gpus >= 1:
+    if args.distributed:
+        batch_size = args.batch_size  # per process
+        accum_grad_n_steps = max(1, args.accum_grad_n_steps // world_size)
+    elif args.n_gpus >= 1:
         batch_size = args.batch_size * args.n_gpus
         accum_grad_n_steps = max(1, args.accum_grad_n_steps // args.n_gpus)
     else:
@@ -67,13 +95,16 @@ def main():
                         nlsyms=args.nlsyms,
                         unit=args.unit,
                         wp_model=args.wp_model,
-                        batch_size=batch_size,
+                        batch_size=batch_size * world_size,
                         n_epochs=args.n_epochs,
                         min_n_tokens=args.min_n_tokens,
                         bptt=args.bptt,
                         shuffle=args.shuffle,
                         backward=args.backward,
                         serialize=args.serialize)
+    if world_size > 1:
+        # Each rank reads disjoint streams
+        train_set.select_streams(np.arange(rank * batch_size, (rank + 1) * batch_size))
     dev_set = Dataset(corpus=args.corpus,
                       tsv_path=args.dev_set,
                       dict_path=args.dict,
@@ -94,6 +125,8 @@ def main():
                          bptt=args.bptt,
                          backward=args.backward,
                          serialize=args.serialize) for s in args.eval_sets]
+    if not is_main_process():
+        eval_sets = []  # evaluated only in the main process
 
     args.vocab = train_set.vocab
 
@@ -103,17 +136,21 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_lm_name(args)
-        save_path = mkdir_join(args.model_save_dir, '_'.join(
-            os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = None
+        if is_main_process():
+            save_path = mkdir_join(args.model_save_dir, '_'.join(
+                os.path.basename(args.train_set).split('.')[:-1]), dir_name)
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout,
+               main_process=is_main_process())
 
     # Model setting
     model = build_lm(args, save_path)
 
-    if not args.resume:
+    if not args.resume and is_main_process():
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
 
@@ -124,6 +161,8 @@ def main():
         if args.unit == 'wp':
             shutil.copy(args.wp_model, os.path.join(save_path, 'wp.model'))
 
+    if not args.resume:
+
         for k, v in sorted(vars(args).items(), key=lambda x: x[0]):
             logger.info('%s: %s' % (k, str(v)))
 
@@ -144,6 +183,9 @@ def main():
         resume_epoch = 0
         optimizer = set_optimizer(model, args.optimizer, args.lr, args.weight_decay)
 
+    # Mixed precision training setting with torch.autocast
+    autocast, scaler = set_mixed_precision(args.train_dtype, args.n_gpus >= 1)
+
     # Wrap optimizer by learning rate scheduler
     is_transformer = args.lm_type in ['transformer', 'transformer_xl']
     scheduler = LRScheduler(optimizer, args.lr,
@@ -157,7 +199,10 @@ def main():
                             model_size=getattr(args, 'transformer_d_model', 0),
                             factor=args.lr_factor,
                             noam=args.optimizer == 'noam',
-                            save_checkpoints_topk=10 if is_transformer else 1)
+                            save_checkpoints_topk=10 if is_transformer else 1,
+                            scaler=scaler,
+                            async_checkpoint=args.async_checkpoint,
+                            shard_checkpoint=args.shard_checkpoint)
 
     if args.resume:
         # Restore the last saved model
@@ -184,7 +229,12 @@ def main():
             amp.init()
             if args.resume:
                 load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = wrap_distributed(model, use_cuda=True)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+    elif args.distributed:
+        model = wrap_distributed(model, use_cuda=False)
     else:
         model = CPUWrapperLM(model)
 
@@ -195,7 +245,22 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, write=is_main_process(), report_step=args.report_step)
+
+    # Set profiler
+    profiler = StepProfiler(save_path, start_step=args.profile_start_step,
+                            n_steps=args.profile_steps if is_main_process() else 0,
+                            use_cuda=args.n_gpus >= 1)
+
+    # Set evaluator of the dev set in a worker process
+    evaluator = None
+    if args.async_eval and is_main_process():
+        evaluator = AsyncEvaluator(build_dev_evaluator, evaluate_dev, args, save_path,
+                                   policy=args.async_eval_policy,
+                                   device=args.async_eval_device)
+
+    # Fix mini-batches for the dev loss at print steps
+    ys_devs = [iter(dev_set).next(bptt=args.bptt)[0] for _ in range(args.dev_subset_n_batches)]
 
     hidden = None
     start_time_train = time.time()
@@ -212,22 +277,32 @@ def main():
 
             if accum_n_steps == 1:
                 loss_train = 0  # moving average over gradient accumulation
-            loss, hidden, observation = model(ys_train, state=hidden)
-            loss = loss / accum_grad_n_steps
-            reporter.add(observation)
-            if use_apex:
-                with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
-                    scaled_loss.backward()
-            else:
-                loss.backward()
+            # Synchronize gradients across ranks only before updating parameters
+            no_sync = args.distributed and not (accum_n_steps >= accum_grad_n_steps or is_new_epoch)
+            with model.no_sync() if no_sync else null_context():
+                with autocast(), record_stage('forward'):
+                    loss, hidden, observation = model(ys_train, state=hidden)
+                loss = loss / accum_grad_n_steps
+                with record_stage('report'):
+                    reporter.add(observation)
+                with record_stage('backward'):
+                    if use_apex:
+                        with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
+                            scaled_loss.backward()
+                    elif scaler is not None:
+                        scaler.scale(loss).backward()
+                    else:
+                        loss.backward()
             loss.detach()  # Truncate the graph
             if accum_n_steps >= accum_grad_n_steps or is_new_epoch:
-                if args.clip_grad_norm > 0:
-                    total_norm = torch.nn.utils.clip_grad_norm_(
-                        model.module.parameters(), args.clip_grad_norm)
-                    reporter.add_tensorboard_scalar('total_norm', total_norm)
-                scheduler.step()
-                scheduler.zero_grad()
+                with record_stage('optimizer'):
+                    if args.clip_grad_norm > 0:
+                        scheduler.unscale_grad()
+                        total_norm = torch.nn.utils.clip_grad_norm_(
+                            model.module.parameters(), args.clip_grad_norm)
+                        reporter.add_tensorboard_scalar('total_norm', total_norm)
+                    scheduler.step()
+                    scheduler.zero_grad()
                 accum_n_steps = 0
                 # NOTE: parameters are forcibly updated at the end of every epoch
             loss_train += loss.item()
@@ -235,33 +310,49 @@ def main():
             hidden = model.module.repackage_state(hidden)
 
             pbar_epoch.update(ys_train.shape[0] * (ys_train.shape[1] - 1))
-            reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
-            # NOTE: loss/acc/ppl are already added in the model
-            reporter.step()
+            with record_stage('report'):
+                reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
+                # NOTE: loss/acc/ppl are already added in the model
+                reporter.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
 
             if n_steps % args.print_step == 0:
                 # Compute loss in the dev set
-                ys_dev = iter(dev_set).next(bptt=args.bptt)[0]
-                loss, _, observation = model(ys_dev, state=None, is_eval=True)
-                reporter.add(observation, is_eval=True)
-                loss_dev = loss.item()
-                del loss
-                reporter.step(is_eval=True)
+                with record_stage('dev'):
+                    if args.dev_subset_n_batches == 0:
+                        ys_devs = [iter(dev_set).next(bptt=args.bptt)[0]]
+                    observations, loss_dev = [], 0
+                    for ys_dev in ys_devs:
+                        with torch.no_grad(), autocast():
+                            loss, _, observation = model(ys_dev, state=None, is_eval=True)
+                        observations.append(observation)
+                        loss_dev += loss.item() / len(ys_devs)
+                        del loss
+                    reporter.add(average_observations(observations), is_eval=True)
+                    reporter.step(is_eval=True)
+
+                # Receive results from the evaluation worker
+                if args.async_eval:
+                    results = broadcast_object(evaluator.poll() if is_main_process() else None)
+                    apply_eval_results(results, scheduler, reporter, 'perplexity')
 
                 duration_step = time.time() - start_time_step
                 logger.info("step:%d(ep:%.2f) loss:%.3f(%.3f)/lr:%.5f/bs:%d (%.2f min)" %
                             (n_steps, scheduler.n_epochs + train_set.epoch_detail,
                              loss_train, loss_dev,
                              scheduler.lr, ys_train.shape[0], duration_step / 60))
+                if model.module.pack_sequences:
+                    report_packing_stats(model.module.packing_stats, reporter)
                 start_time_step = time.time()
 
             # Save figures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
-                reporter.snapshot()
-                model.module.plot_attention()
+            if n_steps % (args.print_step * 10) == 0 and is_main_process():
+                with record_stage('plot'):
+                    reporter.snapshot()
+                    model.module.plot_attention()
 
+            profiler.step()
             if is_new_epoch:
                 break
 
@@ -277,13 +368,41 @@ def main():
             # Save the model
             scheduler.save_checkpoint(
                 model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+        elif args.async_eval:
+            # dev
+            # NOTE: the dev set is evaluated in the worker process, and the metric is
+            # given to the scheduler when it arrives. Results of the previous epoch
+            # are settled here depending on --async_eval_policy.
+            results = broadcast_object(evaluator.resolve() if is_main_process() else None)
+            apply_eval_results(results, scheduler, reporter, 'perplexity')
+            scheduler.epoch(defer_metric=True)  # lr decay
+            reporter.epoch()  # plot
+            if is_main_process():
+                evaluator.submit(model.module, scheduler.n_epochs)
+
+            # Save the model every epoch because the metric is not known yet
+            scheduler.save_checkpoint(
+                model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+
+            # Early stopping
+            if scheduler.is_early_stop:
+                break
+
+            # Convert to fine-tuning stage
+            if scheduler.n_epochs == args.convert_to_sgd_epoch:
+                scheduler.convert_to_sgd(model, args.lr, args.weight_decay,
+                                         decay_type='always', decay_rate=0.5)
         else:
             start_time_eval = time.time()
             # dev
-            model.module.reset_length(args.bptt)
-            ppl_dev, _ = eval_ppl([model.module], dev_set,
-                                  batch_size=1, bptt=args.bptt)
-            model.module.reset_length(args.bptt)
+            # NOTE: only the main process evaluates, and the others receive the result
+            ppl_dev = None
+            if is_main_process():
+                model.module.reset_length(args.bptt)
+                ppl_dev, _ = eval_ppl([model.module], dev_set,
+                                      batch_size=1, bptt=args.bptt)
+                model.module.reset_length(args.bptt)
+            ppl_dev = broadcast_object(ppl_dev)
             scheduler.epoch(ppl_dev)  # lr decay
             reporter.epoch(ppl_dev, name='perplexity')  # plot
             logger.info('PPL (%s, ep:%d): %.2f' %
@@ -294,19 +413,20 @@ def main():
                 scheduler.save_checkpoint(
                     model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
 
-                # test
-                ppl_test_avg = 0.
-                for eval_set in eval_sets:
-                    model.module.reset_length(args.bptt)
-                    ppl_test, _ = eval_ppl([model.module], eval_set,
-                                           batch_size=1, bptt=args.bptt)
-                    model.module.reset_length(args.bptt)
-                    logger.info('PPL (%s, ep:%d): %.2f' %
-                                (eval_set.set, scheduler.n_epochs, ppl_test))
-                    ppl_test_avg += ppl_test
-                if len(eval_sets) > 0:
-                    logger.info('PPL (avg., ep:%d): %.2f' %
-                                (scheduler.n_epochs, ppl_test_avg / len(eval_sets)))
+                # test (only in the main process)
+                if is_main_process():
+                    ppl_test_avg = 0.
+                    for eval_set in eval_sets:
+                        model.module.reset_length(args.bptt)
+                        ppl_test, _ = eval_ppl([model.module], eval_set,
+                                               batch_size=1, bptt=args.bptt)
+                        model.module.reset_length(args.bptt)
+                        logger.info('PPL (%s, ep:%d): %.2f' %
+                                    (eval_set.set, scheduler.n_epochs, ppl_test))
+                        ppl_test_avg += ppl_test
+                    if len(eval_sets) > 0:
+                        logger.info('PPL (avg., ep:%d): %.2f' %
+                                    (scheduler.n_epochs, ppl_test_avg / len(eval_sets)))
 
             duration_eval = time.time() - start_time_eval
             logger.info('Evaluation time: %.2f min' % (duration_eval / 60))
@@ -326,17 +446,46 @@ def main():
         start_time_step = time.time()
         start_time_epoch = time.time()
 
+    if args.async_eval:
+        results = broadcast_object(evaluator.close() if is_main_process() else None)
+        apply_eval_results(results, scheduler, reporter, 'perplexity')
+    scheduler.wait_checkpoint()
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    reporter.close()
+    profiler.close()
     pbar_epoch.close()
+    if args.distributed:
+        torch.distributed.destroy_process_group()
 
     return save_path
 
 
+def build_dev_evaluator(args, save_path):
+    """Build a replica of the model and the dev set in the evaluation worker."""
+    model = build_lm(args, save_path)
+    dev_set = Dataset(corpus=args.corpus,
+                      tsv_path=args.dev_set,
+                      dict_path=args.dict,
+                      nlsyms=args.nlsyms,
+                      unit=args.unit,
+                      wp_model=args.wp_model,
+                      batch_size=1,
+                      bptt=args.bptt,
+                      backward=args.backward,
+                      serialize=args.serialize)
+    return model, dev_set
+
+
+def evaluate_dev(model, dev_set, args, epoch):
+    """Evaluate the dev set in the evaluation worker."""
+    model.reset_length(args.bptt)
+    ppl_dev, _ = eval_ppl([model], dev_set, batch_size=1, bptt=args.bptt)
+    model.reset_length(args.bptt)
+    logger.info('PPL (%s, ep:%d): %.2f' % (dev_set.set, epoch, ppl_dev))
+    return ppl_dev
+
+
 if __name__ == '__main__':
-    # Setting for profiling
-    pr = cProfile.Profile()
-    save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    main()
@@ -83,7 +83,7 @@ def set_asr_model_name(args):
     else:
         dir_name += '_lr' + str(args.lr)
     dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
+    if args.train_dtype in ["float16", "bfloat16", "O0", "O1", "O2", "O3"]:
         dir_name += '_' + args.train_dtype
     # if args.shuffle_bucket:
     #     dir_name += '_bucket'
@@ -152,6 +152,8 @@ def set_asr_model_name(args):
         dir_name += '_mem' + str(args.mem_len)
     if args.bptt > 0:
         dir_name += '_bptt' + str(args.bptt)
+    if getattr(args, 'pack_sequences', False):
+        dir_name += '_pack'
 
     # Pre-training
     if args.asr_init and os.path.isfile(args.asr_init):
@@ -167,6 +169,8 @@ def set_asr_model_name(args):
         dir_name += '_KD' + str(args.soft_label_weight)
     if args.teacher_lm:
         dir_name += '_lmKD' + str(args.soft_label_weight)
+    if args.teacher_logits:
+        dir_name += '_KDstore' + str(args.distillation_weight)
 
     # MBR training
     if args.mbr_training:
@@ -189,10 +193,12 @@ def set_lm_name(args):
     else:
         dir_name += '_lr' + str(args.lr)
     dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
+    if args.train_dtype in ["float16", "bfloat16", "O0", "O1", "O2", "O3"]:
         dir_name += '_' + args.train_dtype
 
     dir_name += '_bptt' + str(args.bptt)
+    if args.pack_sequences:
+        dir_name += '_pack'
 
     # regularization
     dir_name += '_dropI' + str(args.dropout_in) + 'H' + str(args.dropout_hidden)
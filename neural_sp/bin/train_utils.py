@@ -12,6 +12,12 @@ import time
 import torch
 import yaml
 
+from neural_sp.trainers.checkpoint_writer import (
+    load_optimizer_shard,
+    load_to_cpu
+)
+from neural_sp.utils import null_context
+
 logger = logging.getLogger(__name__)
 
 
@@ -85,15 +91,20 @@ def save_config(conf, save_path):
         f.write(yaml.dump({'param': conf}, default_flow_style=False))
 
 
-def set_logger(save_path, stdout=False):
+def set_logger(save_path, stdout=False, main_process=True):
     """Set logger.
 
     Args:
         save_path (str): path to save a log file
         stdout (bool):
+        main_process (bool): if False, only warnings are printed to stderr
+            (for non-main processes in distributed training)
 
     """
     format = '%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s'
+    if not main_process:
+        logging.basicConfig(level=logging.WARNING, format=format)
+        return
     logging.basicConfig(level=logging.DEBUG if stdout else logging.INFO,
                         format=format,
                         filename=save_path if not stdout else None)
@@ -123,6 +134,37 @@ def set_save_path(save_path):
     return save_path_new
 
 
+def set_mixed_precision(train_dtype, use_cuda):
+    """Set native mixed precision training with torch.autocast.
+
+    Args:
+        train_dtype (str): float16/bfloat16 enable autocast.
+            float16 is supported only on GPUs and uses gradient scaling.
+        use_cuda (bool): GPU mode
+    Returns:
+        autocast (callable): return a context manager for forward computation
+        scaler (torch.amp.GradScaler): gradient scaler (None except for float16)
+
+    """
+    if train_dtype not in ['float16', 'bfloat16']:
+        return null_context, None
+    if train_dtype == 'float16' and not use_cuda:
+        raise ValueError('float16 training is supported only on GPUs. Use bfloat16 instead.')
+    if not hasattr(torch, 'autocast'):
+        raise ValueError('%s training requires PyTorch >= 1.10.' % train_dtype)
+
+    device_type = 'cuda' if use_cuda else 'cpu'
+    dtype = torch.float16 if train_dtype == 'float16' else torch.bfloat16
+    scaler = None
+    if train_dtype == 'float16':
+        if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+            scaler = torch.amp.GradScaler(device_type)
+        else:
+            scaler = torch.cuda.amp.GradScaler()  # PyTorch < 2.3
+    # NOTE: the dynamic range of bfloat16 is the same as float32
+    return functools.partial(torch.autocast, device_type, dtype=dtype), scaler
+
+
 def load_checkpoint(checkpoint_path, model=None, scheduler=None, amp=None):
     """Load checkpoint.
 
@@ -136,7 +178,8 @@ def load_checkpoint(checkpoint_path, model=None, scheduler=None, amp=None):
 
     """
     if os.path.isfile(checkpoint_path):
-        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        # NOTE: checkpoints include states of the scheduler and the gradient scaler
+        checkpoint = load_to_cpu(checkpoint_path)
     else:
         raise ValueError("No checkpoint found at %s" % checkpoint_path)
 
@@ -149,6 +192,10 @@ def load_checkpoint(checkpoint_path, model=None, scheduler=None, amp=None):
     if model is not None:
         model.load_state_dict(checkpoint['model_state_dict'])
 
+    # Optimizer states may be saved in a separate shard
+    if scheduler is not None or amp is not None:
+        checkpoint = load_optimizer_shard(checkpoint, checkpoint_path)
+
     # Restore scheduler/optimizer
     if scheduler is not None:
         scheduler.load_state_dict(checkpoint['optimizer_state_dict'], model.use_cuda)
@@ -159,6 +206,13 @@ def load_checkpoint(checkpoint_path, model=None, scheduler=None, amp=None):
     else:
         logger.warning('Scheduler/Optimizer is not loaded.')
 
+    # Restore the gradient scaler for mixed precision training
+    if scheduler is not None and scheduler.scaler is not None:
+        if 'scaler_state_dict' in checkpoint.keys():
+            scheduler.scaler.load_state_dict(checkpoint['scaler_state_dict'])
+        else:
+            logger.warning('GradScaler is not loaded.')
+
     # Restore apex
     if amp is not None:
         amp.load_state_dict(checkpoint['amp_state_dict'])
@@ -31,6 +31,8 @@ from neural_sp.datasets.utils import count_vocab_size
 from neural_sp.datasets.utils import discourse_bucketing
 from neural_sp.datasets.utils import set_batch_size
 from neural_sp.datasets.utils import shuffle_bucketing
+from neural_sp.datasets.teacher_logits import TeacherLogitStore
+from neural_sp.trainers.profiler import record_stage
 
 random.seed(1)
 np.random.seed(1)
@@ -40,7 +42,8 @@ def build_dataloader(args, tsv_path, batch_size, n_epochs=1e10, is_test=False,
                      sort_by='utt_id', short2long=False, sort_stop_epoch=1e10,
                      tsv_path_sub1=False, tsv_path_sub2=False,
                      num_workers=1, pin_memory=False,
-                     first_n_utterances=-1, word_alignment_dir=None, ctc_alignment_dir=None):
+                     first_n_utterances=-1, word_alignment_dir=None, ctc_alignment_dir=None,
+                     teacher_logits=None, rank=0, world_size=1):
 
     dataset = CustomDataset(corpus=args.corpus,
                             tsv_path=tsv_path,
@@ -68,7 +71,8 @@ def build_dataloader(args, tsv_path, batch_size, n_epochs=1e10, is_test=False,
                             short2long=short2long,
                             is_test=is_test,
                             word_alignment_dir=word_alignment_dir,
-                            ctc_alignment_dir=ctc_alignment_dir)
+                            ctc_alignment_dir=ctc_alignment_dir,
+                            teacher_logits=teacher_logits)
 
     batch_sampler = CustomBatchSampler(df=dataset.df,  # filtered
                                        df_sub1=dataset.df_sub1,  # filtered
@@ -77,7 +81,9 @@ def build_dataloader(args, tsv_path, batch_size, n_epochs=1e10, is_test=False,
                                        dynamic_batching=args.dynamic_batching,
                                        shuffle_bucket=args.shuffle_bucket and not is_test,
                                        sort_stop_epoch=args.sort_stop_epoch,
-                                       discourse_aware=args.discourse_aware)
+                                       discourse_aware=args.discourse_aware,
+                                       rank=rank,
+                                       world_size=world_size)
 
     dataloader = CustomDataLoader(dataset=dataset,
                                   batch_sampler=batch_sampler,
@@ -145,27 +151,28 @@ class CustomDataLoader(DataLoader):
         if self.epoch >= self.n_epochs:
             raise StopIteration
 
-        indices, self.is_new_epoch = self.batch_sampler.sample_index(batch_size)
+        with record_stage('data'):
+            indices, self.is_new_epoch = self.batch_sampler.sample_index(batch_size)
 
-        if self.is_new_epoch:
-            # shuffle the whole data per epoch
-            if self.epoch + 1 == self.batch_sampler.sort_stop_epoch:
-                self.batch_sampler.df = self.batch_sampler.df.reindex(
-                    np.random.permutation(self.batch_sampler.df.index))
-                for i in range(1, 3):
-                    if getattr(self.batch_sampler, 'df_sub' + str(i)) is not None:
-                        setattr(self.batch_sampler, 'df_sub' + str(i),
-                                getattr(self.batch_sampler, 'df_sub' + str(i)).reindex(self.batch_sampler.df.index).reset_index())
+            if self.is_new_epoch:
+                # shuffle the whole data per epoch
+                if self.epoch + 1 == self.batch_sampler.sort_stop_epoch:
+                    self.batch_sampler.df = self.batch_sampler.df.reindex(
+                        self.batch_sampler.np_rng.permutation(self.batch_sampler.df.index))
+                    for i in range(1, 3):
+                        if getattr(self.batch_sampler, 'df_sub' + str(i)) is not None:
+                            setattr(self.batch_sampler, 'df_sub' + str(i),
+                                    getattr(self.batch_sampler, 'df_sub' + str(i)).reindex(self.batch_sampler.df.index).reset_index())
 
-                # Re-indexing
-                self.batch_sampler.df = self.batch_sampler.df.reset_index()
+                    # Re-indexing
+                    self.batch_sampler.df = self.batch_sampler.df.reset_index()
 
-            self.reset()
-            # calculate iteration again after shuffling
-            self.batch_sampler.calculate_iteration()
-            self.epoch += 1
+                self.reset()
+                # calculate iteration again after shuffling
+                self.batch_sampler.calculate_iteration()
+                self.epoch += 1
 
-        return self.dataset.__getitem__(indices), self.is_new_epoch
+            return self.dataset.__getitem__(indices), self.is_new_epoch
 
     @property
     def epoch_detail(self):
@@ -201,7 +208,7 @@ class CustomDataset(Dataset):
                  unit_sub1, unit_sub2,
                  wp_model_sub1, wp_model_sub2,
                  discourse_aware=False, first_n_utterances=-1,
-                 word_alignment_dir=None, ctc_alignment_dir=None):
+                 word_alignment_dir=None, ctc_alignment_dir=None, teacher_logits=None):
         """Custom Dataset class.
 
         Args:
@@ -225,6 +232,7 @@ class CustomDataset(Dataset):
             first_n_utterances (int): evaluate the first N utterances
             word_alignment_dir (str): path to word alignment directory
             ctc_alignment_dir (str): path to CTC alignment directory
+            teacher_logits (str): path to the store of top-k teacher distributions
 
         """
         super(Dataset, self).__init__()
@@ -249,6 +257,7 @@ class CustomDataset(Dataset):
         self.subsample_factor = subsample_factor
         self.word_alignment_dir = word_alignment_dir
         self.ctc_alignment_dir = ctc_alignment_dir
+        self.teacher_logits = TeacherLogitStore(teacher_logits) if teacher_logits else None
 
         self._idx2token = []
         self._token2idx = []
@@ -409,6 +418,12 @@ class CustomDataset(Dataset):
             df = df[df.apply(lambda x: x['trigger_points'] is not None, axis=1)]
             print('Removed %d utterances (for CTC alignment)' % (n_utts - len(df)))
 
+        # Soft labels for knowledge distillation
+        if self.teacher_logits is not None:
+            n_utts = len(df)
+            df = df[df.apply(lambda x: x['utt_id'] in self.teacher_logits, axis=1)]
+            print('Removed %d utterances (for teacher logits)' % (n_utts - len(df)))
+
         # Re-indexing
         if discourse_aware:
             self.df = df
@@ -445,6 +460,8 @@ class CustomDataset(Dataset):
                 utt_ids (list): name of each utterance
                 speakers (list): name of each speaker
                 sessions (list): name of each session
+                teacher_topk (list): `(indices, log_probs)` of size `[L + 1, topk]`
+                    from the teacher logit store
 
         """
         # inputs
@@ -496,6 +513,11 @@ class CustomDataset(Dataset):
         elif self._vocab_sub2 > 0 and not self.is_test:
             ys_sub2 = [self._token2idx[2](self.df['text'][i]) for i in indices]
 
+        # soft labels
+        teacher_topk = None
+        if self.teacher_logits is not None:
+            teacher_topk = [self.teacher_logits[utt_id] for utt_id in utt_ids]
+
         mini_batch_dict = {
             'xs': xs,
             'xlens': xlens,
@@ -508,6 +530,7 @@ class CustomDataset(Dataset):
             'text': texts,
             'feat_path': feat_paths,  # for plot
             'trigger_points': trigger_points,
+            'teacher_topk': teacher_topk,
         }
         return mini_batch_dict
 
@@ -517,7 +540,7 @@ class CustomBatchSampler(BatchSampler):
 
     def __init__(self, df, batch_size, dynamic_batching,
                  shuffle_bucket, discourse_aware, sort_stop_epoch,
-                 df_sub1=None, df_sub2=None):
+                 df_sub1=None, df_sub2=None, rank=0, world_size=1):
         """Custom BatchSampler.
 
         Args:
@@ -531,6 +554,8 @@ class CustomBatchSampler(BatchSampler):
                 back to a random order
             df_sub1 (pandas.DataFrame): dataframe for the first sub task
             df_sub2 (pandas.DataFrame): dataframe for the second sub task
+            rank (int): rank of the current process in distributed training
+            world_size (int): number of processes in distributed training
 
         """
         # super(BatchSampler, self).__init__()
@@ -546,14 +571,29 @@ class CustomBatchSampler(BatchSampler):
         self.sort_stop_epoch = sort_stop_epoch
         self.discourse_aware = discourse_aware
 
+        # for distributed training
+        self.rank = rank
+        self.world_size = world_size
+        if world_size > 1:
+            if discourse_aware:
+                raise ValueError('discourse_aware is not supported in distributed training.')
+            # NOTE: all ranks must draw the same sequence of mini-batches, so that
+            # random states are not shared with the model (e.g., scheduled sampling)
+            self.rng = random.Random(1)
+            self.np_rng = np.random.RandomState(1)
+        else:
+            self.rng = random
+            self.np_rng = np.random
+
         self._offset = 0
 
         if discourse_aware:
             self.indices_buckets = discourse_bucketing(self.df, batch_size)
             self._iteration = len(self.indices_buckets)
         elif shuffle_bucket:
-            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching)
-            self._iteration = len(self.indices_buckets)
+            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching,
+                                                     world_size, self.rng)
+            self._iteration = -(-len(self.indices_buckets) // world_size)
         else:
             self.indices = list(self.df.index)
             # calculate #iteration in advance
@@ -583,7 +623,8 @@ class CustomBatchSampler(BatchSampler):
         if self.discourse_aware:
             self.indices_buckets = discourse_bucketing(self.df, batch_size)
         elif self.shuffle_bucket:
-            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching)
+            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching,
+                                                     self.world_size, self.rng)
         else:
             self.indices = list(self.df.index)
         self._offset = 0
@@ -591,6 +632,12 @@ class CustomBatchSampler(BatchSampler):
     def sample_index(self, batch_size):
         """Sample data indices of mini-batch.
 
+        In distributed training, every rank draws the same `world_size`
+        mini-batches in a row and keeps the `rank`-th one, so that ranks
+        receive disjoint mini-batches of similar lengths. If the epoch ends
+        in the middle, the remaining ranks reuse the last mini-batch so that
+        all ranks perform the same number of steps.
+
         Args:
             batch_size (int): size of mini-batch
         Returns:
@@ -598,6 +645,15 @@ class CustomBatchSampler(BatchSampler):
             is_new_epoch (bool): flag for the end of the current epoch
 
         """
+        for r in range(self.world_size):
+            indices_r, is_new_epoch = self._sample_index(batch_size)
+            if r <= self.rank:
+                indices = indices_r
+            if is_new_epoch:
+                break
+        return indices, is_new_epoch
+
+    def _sample_index(self, batch_size):
         is_new_epoch = False
 
         if self.discourse_aware:
@@ -611,7 +667,7 @@ class CustomBatchSampler(BatchSampler):
             is_new_epoch = (len(self.indices_buckets) == 0)
 
             # Shuffle utterances in mini-batch
-            indices = random.sample(indices, len(indices))
+            indices = self.rng.sample(indices, len(indices))
 
         else:
             if batch_size is None:
@@ -633,7 +689,7 @@ class CustomBatchSampler(BatchSampler):
                 is_new_epoch = True
 
             # Shuffle utterances in mini-batch
-            indices = random.sample(indices, len(indices))
+            indices = self.rng.sample(indices, len(indices))
 
             for i in indices:
                 self.indices.remove(i)
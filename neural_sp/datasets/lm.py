@@ -24,6 +24,7 @@ from neural_sp.datasets.token_converter.word import Idx2word
 from neural_sp.datasets.token_converter.word import Word2idx
 from neural_sp.datasets.token_converter.wordpiece import Idx2wp
 from neural_sp.datasets.token_converter.wordpiece import Wp2idx
+from neural_sp.trainers.profiler import record_stage
 
 random.seed(1)
 np.random.seed(1)
@@ -41,7 +42,8 @@ class Dataset(object):
         """A class for loading dataset.
 
         Args:
-            tsv_path (str): path to the dataset tsv file
+            tsv_path (str): path to the dataset tsv file,
+                or the corpus binarized by binarize() (*.bin), which is memory-mapped
             dict_path (str): path to the dictionary
             unit (str): word or wp or char or phone or word_char
             batch_size (int): size of mini-batch
@@ -95,72 +97,171 @@ class Dataset(object):
         else:
             raise ValueError(unit)
 
-        # Load dataset tsv file
-        self.df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
-        self.df = self.df.loc[:, ['utt_id', 'speaker', 'feat_path',
-                                  'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
-
-        # Remove inappropriate utterances
-        if is_test:
-            print('Original utterance num: %d' % len(self.df))
-            n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] > 0, axis=1)]
-            print('Removed %d empty utterances' % (n_utts - len(self.df)))
+        self.bin_path = None
+        if tsv_path.endswith('.bin'):
+            # Memory-map the corpus binarized by binarize()
+            self.df = None
+            self.load_binarized(tsv_path)
+            self.utt_order = None
+            if shuffle:
+                self.utt_order = np.random.permutation(self.n_utts)
         else:
-            print('Original utterance num: %d' % len(self.df))
-            n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] >= min_n_tokens, axis=1)]
-            print('Removed %d utterances (threshold)' % (n_utts - len(self.df)))
-
-        # Sort tsv records
-        if shuffle:
-            assert not serialize
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
-        elif serialize:
-            assert not shuffle
-            assert corpus == 'swbd'
-            self.df['session'] = self.df['speaker'].apply(lambda x: str(x).split('-')[0])
-            self.df['onset'] = self.df['utt_id'].apply(lambda x: int(x.split('_')[-1].split('-')[0]))
-            self.df = self.df.sort_values(by=['session', 'onset'], ascending=True)
-        else:
-            self.df = self.df.sort_values(by='utt_id', ascending=True)
+            # Load dataset tsv file
+            self.df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
+            self.df = self.df.loc[:, ['utt_id', 'speaker', 'feat_path',
+                                      'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
+
+            # Remove inappropriate utterances
+            if is_test:
+                print('Original utterance num: %d' % len(self.df))
+                n_utts = len(self.df)
+                self.df = self.df[self.df.apply(lambda x: x['ylen'] > 0, axis=1)]
+                print('Removed %d empty utterances' % (n_utts - len(self.df)))
+            else:
+                print('Original utterance num: %d' % len(self.df))
+                n_utts = len(self.df)
+                self.df = self.df[self.df.apply(lambda x: x['ylen'] >= min_n_tokens, axis=1)]
+                print('Removed %d utterances (threshold)' % (n_utts - len(self.df)))
+
+            # Sort tsv records
+            if shuffle:
+                assert not serialize
+                self.df = self.df.reindex(np.random.permutation(self.df.index))
+            else:
+                self.df = sort_utterances(self.df, serialize, corpus)
+
+            # Pack token ids of all utterances into a flat buffer
+            stream, seg_lens = pack_token_ids(self.df['token_id'], self.eos)
+            self.stream = np.append(stream, self.eos)  # for the last sentence
+            self.utt_offsets = np.append(0, np.cumsum(seg_lens))
+            self.utt_order = None
 
         # Concatenate into a single sentence
-        self.concat_ids = self.concat_utterances(self.df)
-
-    def concat_utterances(self, df):
-        indices = list(df.index)
-        if self.backward:
-            indices = indices[::-1]
-        concat_ids = []
-        for i in indices:
-            assert df['token_id'][i] != ''
-            concat_ids += [self.eos] + list(map(int, df['token_id'][i].split()))
-        concat_ids += [self.eos]  # for the last sentence
-        # NOTE: <sos> and <eos> have the same index
-
-        # Reshape
-        n_utts = len(concat_ids)
-        concat_ids = concat_ids[:n_utts // self.batch_size * self.batch_size]
-        logger.info('Removed %d tokens / %d tokens' % (n_utts - len(concat_ids), n_utts))
-        concat_ids = np.array(concat_ids).reshape((self.batch_size, -1))
-
-        return concat_ids
+        if backward:
+            self.utt_order = np.arange(self.n_utts)[::-1] if self.utt_order is None else self.utt_order[::-1]
+        self.set_order(self.utt_order)
+        self.split_streams(batch_size)
+
+    @property
+    def n_utts(self):
+        return len(self.utt_offsets) - 1
+
+    def load_binarized(self, bin_path):
+        """Memory-map the token stream written by binarize().
+
+        Args:
+            bin_path (str): path to the binarized corpus
+
+        """
+        index = np.load(os.path.splitext(bin_path)[0] + '.idx.npz')
+        self.bin_path = bin_path
+        self.stream = np.memmap(bin_path, dtype=str(index['dtype']), mode='r')
+        self.utt_offsets = index['utt_offsets']
+        logger.info('Loaded %d utterances (%d tokens) from %s' % (self.n_utts, len(self.stream), bin_path))
+
+    def __getstate__(self):
+        # Pickling np.memmap copies the whole corpus (e.g., to spawned workers),
+        # so pass the path instead and map it again in __setstate__
+        state = self.__dict__.copy()
+        if self.bin_path is not None:
+            state['stream'] = None
+            state['stream_dtype'] = self.stream.dtype.str
+        return state
+
+    def __setstate__(self, state):
+        dtype = state.pop('stream_dtype', None)
+        self.__dict__.update(state)
+        if self.bin_path is not None:
+            self.stream = np.memmap(self.bin_path, dtype=dtype, mode='r')
+
+    def set_order(self, utt_order):
+        """Set the order of utterances in the concatenated stream.
+
+        Tokens are not copied. Positions in the reordered (virtual) stream are
+        mapped to the physical stream through the start positions of utterances.
+
+        Args:
+            utt_order (np.ndarray): permutation of utterance indices.
+                None indicates the physical order.
+
+        """
+        self.utt_order = utt_order
+        if utt_order is None:
+            return
+        seg_lens = np.diff(self.utt_offsets)[utt_order]
+        # NOTE: the last <eos> is always located at the end
+        self.phys_starts = np.append(self.utt_offsets[:-1][utt_order], self.utt_offsets[-1])
+        self.virt_starts = np.append(0, np.cumsum(seg_lens))
+
+    def split_streams(self, n_streams):
+        """Split the concatenated stream into independent streams for batched BPTT.
+
+        Args:
+            n_streams (int): number of streams (batch size)
+
+        """
+        self.n_streams = n_streams
+        self.stream_len = len(self.stream) // n_streams
+        self.stream_ids = None  # use all streams
+        n_tokens = len(self.stream)
+        logger.info('Removed %d tokens / %d tokens' % (n_tokens - self.stream_len * n_streams, n_tokens))
+
+    def select_streams(self, stream_ids):
+        """Restrict mini-batches to a subset of streams (e.g., a shard of a worker).
+
+        Args:
+            stream_ids (np.ndarray): indices of streams
+
+        """
+        self.stream_ids = np.asarray(stream_ids)
+
+    def get_streams(self, start, end):
+        """Slice all (selected) streams.
+
+        Args:
+            start (int): start position in each stream
+            end (int): end position in each stream
+        Returns:
+            ys (np.ndarray): `[B, end - start]`
+
+        """
+        end = min(end, self.stream_len)
+        if self.utt_order is None:
+            # strided view of the stream
+            concat_ids = self.stream[:self.n_streams * self.stream_len].reshape((self.n_streams, -1))
+            if self.stream_ids is None:
+                ys = concat_ids[:, start:end]
+            else:
+                ys = concat_ids[self.stream_ids, start:end]
+        else:
+            stream_ids = np.arange(self.n_streams) if self.stream_ids is None else self.stream_ids
+            pos = stream_ids[:, None] * self.stream_len + np.arange(start, end)[None]
+            utt_ids = np.searchsorted(self.virt_starts, pos, side='right') - 1
+            ys = self.stream[self.phys_starts[utt_ids] + pos - self.virt_starts[utt_ids]]
+        return ys.astype(np.int64)
+
+    @property
+    def concat_ids(self):
+        """Concatenated token ids of size `[B, T]`."""
+        return self.get_streams(0, self.stream_len)
 
     @property
     def epoch_detail(self):
         """Percentage of the current epoch."""
-        return float(self.offset * self.batch_size) / len(self)
+        return float(self.offset) / self.stream_len
 
     def reset(self):
         """Reset data counter and offset."""
         if self.shuffle:
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
-            self.concat_ids = self.concat_utterances(self.df)
+            utt_order = np.random.permutation(self.n_utts)
+            if self.backward:
+                utt_order = utt_order[::-1]
+            self.set_order(utt_order)
         self.offset = 0
 
     def __len__(self):
-        return len(self.concat_ids.reshape((-1,)))
+        n_streams = self.n_streams if self.stream_ids is None else len(self.stream_ids)
+        return n_streams * self.stream_len
 
     def __iter__(self):
         return self
@@ -179,10 +280,8 @@ class Dataset(object):
             is_new_epoch (bool): flag for the end of the current epoch
 
         """
-        if batch_size is None:
-            batch_size = self.batch_size
-        elif self.concat_ids.shape[0] != batch_size:
-            self.concat_ids = self.concat_ids.reshape((batch_size, -1))
+        if batch_size is not None and self.n_streams != batch_size:
+            self.split_streams(batch_size)
             # NOTE: only for the first iteration during evaluation
 
         if bptt is None:
@@ -191,18 +290,100 @@ class Dataset(object):
         if self.epoch >= self.max_epoch:
             raise StopIteration
 
-        ys = self.concat_ids[:, self.offset:self.offset + bptt]
+        with record_stage('data'):
+            ys = self.get_streams(self.offset, self.offset + bptt)
         self.offset += bptt - 1
-        # ys = self.concat_ids[:, self.offset:self.offset + (bptt + 1)]
-        # self.offset += (bptt + 1) - 1
         # NOTE: the last token in ys must be feeded as inputs in the next mini-batch
 
         is_new_epoch = False
 
         # Last mini-batch
-        if (self.offset + 1) * batch_size >= len(self):
+        if self.offset + 1 >= self.stream_len:
             is_new_epoch = True
             self.reset()
             self.epoch += 1
 
         return ys, is_new_epoch
+
+
+def sort_utterances(df, serialize=False, corpus=''):
+    """Sort utterances by utterance ID, or by onset in each session of dialogue.
+
+    Args:
+        df (pd.DataFrame): dataframe including `utt_id` and `speaker` columns
+        serialize (bool): serialize text according to contexts in dialogue
+        corpus (str): name of corpus
+    Returns:
+        df (pd.DataFrame): sorted dataframe
+
+    """
+    if serialize:
+        assert corpus == 'swbd'
+        df['session'] = df['speaker'].apply(lambda x: str(x).split('-')[0])
+        df['onset'] = df['utt_id'].apply(lambda x: int(x.split('_')[-1].split('-')[0]))
+        return df.sort_values(by=['session', 'onset'], ascending=True)
+    return df.sort_values(by='utt_id', ascending=True)
+
+
+def pack_token_ids(token_ids, eos, dtype=np.int64):
+    """Parse token ids of utterances into a flat stream.
+
+    Args:
+        token_ids (pd.Series): space-separated token ids of each utterance
+        eos (int): index for <eos>, which is inserted before each utterance
+        dtype (np.dtype): data type of the stream
+    Returns:
+        stream (np.ndarray): `<eos> utt_1 <eos> utt_2 ... <eos> utt_N`
+        seg_lens (np.ndarray): length of each utterance including <eos>
+
+    """
+    token_ids = token_ids.astype(str)
+    ylens = token_ids.str.split().str.len().values.astype(np.int64)
+    assert (ylens > 0).all()
+    seg_lens = ylens + 1
+    stream = np.full(seg_lens.sum(), eos, dtype=dtype)
+    is_token = np.ones(len(stream), dtype=bool)
+    is_token[np.cumsum(seg_lens) - seg_lens] = False
+    stream[is_token] = np.array(' '.join(token_ids).split(), dtype=dtype)
+    return stream, seg_lens
+
+
+def binarize(tsv_path, bin_path, vocab, min_n_tokens=1, serialize=False, corpus='',
+             eos=2, chunk_size=100000):
+    """Write token ids in a dataset tsv file to a binary stream for memory-mapping.
+
+    The stream is laid out as `<eos> utt_1 <eos> utt_2 ... <eos> utt_N <eos>`
+    in uint16 (or uint32 for a large vocabulary). Start positions of utterances
+    are saved to `<bin_path without extension>.idx.npz`.
+
+    Args:
+        tsv_path (str): path to the dataset tsv file
+        bin_path (str): path to the output file (*.bin)
+        vocab (int): vocabulary size
+        min_n_tokens (int): exclude utterances shorter than this value
+        serialize (bool): serialize text according to contexts in dialogue
+        corpus (str): name of corpus
+        eos (int): index for <eos>
+        chunk_size (int): number of utterances to parse at once
+    Returns:
+        n_tokens (int): length of the stream
+
+    """
+    assert bin_path.endswith('.bin')
+    dtype = np.uint16 if vocab <= np.iinfo(np.uint16).max + 1 else np.uint32
+    df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t',
+                     usecols=['utt_id', 'speaker', 'token_id', 'ylen'])
+    df = df[df['ylen'] >= max(1, min_n_tokens)]
+    df = sort_utterances(df, serialize, corpus)
+
+    seg_lens = []
+    with open(bin_path, 'wb') as f:
+        for i in range(0, len(df), chunk_size):
+            stream, seg_lens_i = pack_token_ids(df['token_id'].iloc[i:i + chunk_size], eos, dtype)
+            stream.tofile(f)
+            seg_lens.append(seg_lens_i)
+        np.array([eos], dtype=dtype).tofile(f)  # for the last sentence
+    utt_offsets = np.append(0, np.cumsum(np.concatenate(seg_lens + [np.zeros(0, dtype=np.int64)])))
+    np.savez(os.path.splitext(bin_path)[0] + '.idx.npz',
+             utt_offsets=utt_offsets, dtype=np.dtype(dtype).str)
+    return int(utt_offsets[-1]) + 1
@@ -0,0 +1,130 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Store of top-k teacher distributions for knowledge distillation."""
+
+import codecs
+import json
+import numpy as np
+import os
+import torch
+
+LOG_ZERO = -1e4  # log probability of tokens out of top-k
+
+
+class TeacherLogitWriter(object):
+    """Write top-k log probabilities of a teacher per token.
+
+    Entries are appended to flat binary files so that memory usage does not
+    grow with the number of utterances.
+
+    Args:
+        save_dir (str): path to the output directory
+        topk (int): number of tokens kept per output position
+        vocab (int): vocabulary size of the teacher
+
+    """
+
+    def __init__(self, save_dir, topk, vocab):
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        self.save_dir = save_dir
+        self.topk = min(topk, vocab)
+        self.vocab = vocab
+        self.utt_ids = []
+        self.offsets = [0]
+        self.f_indices = open(os.path.join(save_dir, 'indices.bin'), 'wb')
+        self.f_log_probs = open(os.path.join(save_dir, 'log_probs.bin'), 'wb')
+
+    def add(self, utt_id, logits):
+        """Add the distributions of an utterance.
+
+        Args:
+            utt_id (str): utterance ID
+            logits (FloatTensor): `[L, vocab]`
+
+        """
+        log_probs, indices = torch.topk(torch.log_softmax(logits.float(), dim=-1), k=self.topk, dim=-1)
+        self.f_indices.write(indices.cpu().numpy().astype(np.int32).tobytes())
+        self.f_log_probs.write(log_probs.cpu().numpy().astype(np.float16).tobytes())
+        self.utt_ids.append(utt_id)
+        self.offsets.append(self.offsets[-1] + logits.size(0))
+
+    def close(self):
+        self.f_indices.close()
+        self.f_log_probs.close()
+        np.save(os.path.join(self.save_dir, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        with codecs.open(os.path.join(self.save_dir, 'utt_ids.txt'), 'w', encoding='utf-8') as f:
+            for utt_id in self.utt_ids:
+                f.write(utt_id + '\n')
+        with open(os.path.join(self.save_dir, 'meta.json'), 'w') as f:
+            json.dump({'topk': self.topk, 'vocab': self.vocab, 'n_tokens': self.offsets[-1]}, f)
+
+
+class TeacherLogitStore(object):
+    """Memory-mapped top-k log probabilities of a teacher keyed by utterance ID.
+
+    Args:
+        save_dir (str): path to the directory written by TeacherLogitWriter
+
+    """
+
+    def __init__(self, save_dir):
+        with open(os.path.join(save_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.topk = meta['topk']
+        self.vocab = meta['vocab']
+        shape = (meta['n_tokens'], self.topk)
+        self.indices = np.memmap(os.path.join(save_dir, 'indices.bin'),
+                                 dtype=np.int32, mode='r', shape=shape)
+        self.log_probs = np.memmap(os.path.join(save_dir, 'log_probs.bin'),
+                                   dtype=np.float16, mode='r', shape=shape)
+        self.offsets = np.load(os.path.join(save_dir, 'offsets.npy'))
+        with codecs.open(os.path.join(save_dir, 'utt_ids.txt'), 'r', encoding='utf-8') as f:
+            self.utt2idx = {line.strip(): i for i, line in enumerate(f)}
+
+    def __len__(self):
+        return len(self.utt2idx)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.utt2idx
+
+    def __getitem__(self, utt_id):
+        """Load the distributions of an utterance.
+
+        Args:
+            utt_id (str): utterance ID
+        Returns:
+            indices (np.ndarray): `[L, topk]`
+            log_probs (np.ndarray): `[L, topk]`
+
+        """
+        if utt_id not in self.utt2idx:
+            raise KeyError('%s is not found in the teacher logit store.' % utt_id)
+        i = self.utt2idx[utt_id]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return np.array(self.indices[start:end]), np.array(self.log_probs[start:end])
+
+
+def topk2logits(teacher_topk, vocab, device):
+    """Expand top-k log probabilities to dense logits.
+
+    Tokens out of top-k are filled with a large negative value, so that
+    softmax renormalizes the teacher distribution over top-k tokens.
+
+    Args:
+        teacher_topk (List[tuple]): length `[B]`, `(indices, log_probs)` of size `[L, topk]`
+        vocab (int): vocabulary size
+        device (torch.device):
+    Returns:
+        logits (FloatTensor): `[B, L_max, vocab]`
+
+    """
+    bs = len(teacher_topk)
+    lmax = max(len(indices) for indices, _ in teacher_topk)
+    logits = torch.full((bs, lmax, vocab), LOG_ZERO, device=device)
+    for b, (indices, log_probs) in enumerate(teacher_topk):
+        logits[b, :len(indices)].scatter_(
+            1, torch.from_numpy(indices).long().to(device),
+            torch.from_numpy(log_probs).float().to(device))
+    return logits
@@ -32,7 +32,7 @@ def set_batch_size(batch_size, min_xlen, min_ylen, dynamic_batching):
     return max(1, batch_size)
 
 
-def shuffle_bucketing(df, batch_size, dynamic_batching):
+def shuffle_bucketing(df, batch_size, dynamic_batching, n_shards=1, rng=random):
     indices_buckets = []  # list of list
     offset = 0
     while True:
@@ -47,8 +47,13 @@ def shuffle_bucketing(df, batch_size, dynamic_batching):
             break
 
     # shuffle buckets
-    random.shuffle(indices_buckets)
-    return indices_buckets
+    # NOTE: every n_shards consecutive buckets are shuffled together so that
+    # all ranks in distributed training receive similar lengths at each step.
+    # The last incomplete group is kept at the end to align the groups with steps.
+    n_groups = len(indices_buckets) // n_shards
+    bucket_groups = [indices_buckets[i * n_shards:(i + 1) * n_shards] for i in range(n_groups)]
+    rng.shuffle(bucket_groups)
+    return [indices for group in bucket_groups for indices in group] + indices_buckets[n_groups * n_shards:]
 
 
 def discourse_bucketing(df, batch_size):
@@ -4,6 +4,9 @@
 """Functions for computing edit distance."""
 
 import numpy as np
+import torch
+
+from neural_sp.models.torch_utils import cummin
 
 
 def compute_per(ref, hyp, normalize=False):
@@ -337,3 +340,37 @@ def wer_align(ref, hyp, normalize=False, double_byte=False):
         wer /= len(ref)
 
     return wer * 100, n_sub * 100, n_ins * 100, n_del * 100
+
+
+def batch_edit_distance(refs, hyps, ref_lens, hyp_lens):
+    """Compute edit distances of a batch of token sequences with tensor operations.
+
+    The DP table is filled row by row over reference positions. Each row is
+    vectorized over the batch and hypothesis positions: insertions are resolved
+    with a cumulative minimum, `d[i][j] = j + min_{k<=j}(t[k] - k)`, where `t` is
+    the row without insertions.
+
+    Args:
+        refs (LongTensor): `[B, L_ref]`, padded references
+        hyps (LongTensor): `[B, L_hyp]`, padded hypotheses
+        ref_lens (LongTensor): `[B]`
+        hyp_lens (LongTensor): `[B]`
+    Returns:
+        dists (LongTensor): `[B]`, the number of substitution, insertion, and deletion errors
+
+    """
+    bs, lmax_hyp = hyps.size()
+    lmax_ref = refs.size(1)
+    ref_lens = ref_lens.to(hyps.device).long()
+    hyp_lens = hyp_lens.to(hyps.device).long()
+    js = torch.arange(lmax_hyp + 1, device=hyps.device).unsqueeze(0)  # `[1, L_hyp + 1]`
+
+    d = js.repeat(bs, 1)  # `[B, L_hyp + 1]`
+    d_last = d.clone()  # row at `i = ref_lens`
+    for i in range(1, lmax_ref + 1):
+        cost = (refs[:, i - 1:i] != hyps).long()  # `[B, L_hyp]`
+        t = torch.cat([d.new_full((bs, 1), i),
+                       torch.min(d[:, :-1] + cost, d[:, 1:] + 1)], dim=1)
+        d = js + cummin(t - js, dim=1)
+        d_last = torch.where((ref_lens == i).unsqueeze(1), d, d_last)
+    return d_last.gather(1, hyp_lens.unsqueeze(1)).squeeze(1)
@@ -5,6 +5,8 @@
 
 import logging
 import numpy as np
+import torch
+import torch.multiprocessing as mp
 from tqdm import tqdm
 
 from neural_sp.models.lm.gated_convlm import GatedConvLM
@@ -29,7 +31,7 @@ def check_lm(model):
 
 
 def eval_ppl(models, dataloader, batch_size=1, bptt=None,
-             n_caches=0, progressbar=False):
+             n_caches=0, progressbar=False, n_workers=1):
     """Evaluate a Seq2seq or LM by perprexity and loss.
 
     Args:
@@ -37,8 +39,11 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
         dataloader (torch.utils.data.DataLoader): evaluation dataloader
         batch_size (int): batch size
         bptt (int): BPTT length
-        n_caches (int):
+        n_caches (int): number of cached states for the neural cache LM
         progressbar (bool): if True, visualize progressbar
+        n_workers (int): number of CPU processes to evaluate the LM.
+            The `batch_size` independent streams are split into shards
+            evaluated in parallel.
     Returns:
         ppl (float): Average perplexity
         loss (float): Average loss
@@ -47,36 +52,26 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
     is_lm = check_lm(models[0])
     total_loss = 0
     n_tokens = 0
-    hidden = None  # for RNNLM
 
     # Reset data counter
     dataloader.reset()
 
+    pbar = None
     if progressbar:
         pbar = tqdm(total=len(dataloader))
 
-    while True:
-        if is_lm:
-            ys, is_new_epoch = dataloader.next(batch_size, bptt)
-            bs, time = ys.shape[:2]
-            if n_caches > 0:
-                assert isinstance(models[0], RNNLM)
-                # NOTE: cache is not supported for GatedConvLM/TransformerLM now
-                for t in range(time - 1):
-                    loss, hidden = models[0](ys[:, t:t + 2], hidden, is_eval=True, n_caches=n_caches)[:2]
-                    total_loss += loss.item() * bs
-                    n_tokens += bs
-
-                    if progressbar:
-                        pbar.update(bs)
-            else:
-                loss, hidden = models[0](ys, hidden, is_eval=True)[:2]
-                total_loss += loss.item() * bs * (time - 1)
-                n_tokens += bs * (time - 1)
-
-                if progressbar:
-                    pbar.update(bs * (time - 1))
+    if is_lm:
+        if n_workers > 1 and models[0].device.type != 'cpu':
+            logger.warning('Parallel LM evaluation is supported only on CPU.')
+            n_workers = 1
+        if n_workers > 1:
+            total_loss, n_tokens = _eval_lm_parallel(models[0], dataloader, batch_size, bptt,
+                                                     n_caches, n_workers, pbar)
         else:
+            total_loss, n_tokens = _eval_lm(models[0], dataloader, batch_size, bptt,
+                                            n_caches, pbar)
+    else:
+        while True:
             batch, is_new_epoch = dataloader.next(batch_size)
             bs = len(batch['ys'])
             loss, _ = models[0](batch, task='all', is_eval=True)
@@ -87,8 +82,8 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
             if progressbar:
                 pbar.update(bs)
 
-        if is_new_epoch:
-            break
+            if is_new_epoch:
+                break
 
     if progressbar:
         pbar.close()
@@ -103,3 +98,82 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
     logger.debug('Loss (%s): %.2f %%' % (dataloader.set, avg_loss))
 
     return ppl, avg_loss
+
+
+def _eval_lm(model, dataloader, batch_size, bptt, n_caches, pbar=None):
+    """Accumulate the negative log-likelihood over all BPTT segments.
+
+    Returns:
+        total_loss (float): sum of token-level negative log-likelihoods
+        n_tokens (int): number of evaluated tokens
+
+    """
+    total_loss = 0
+    n_tokens = 0
+    hidden = None  # for RNNLM
+    if n_caches > 0:
+        model.reset_cache()
+
+    while True:
+        ys, is_new_epoch = dataloader.next(batch_size, bptt)
+        bs, time = ys.shape[:2]
+        loss, hidden = model(ys, hidden, is_eval=True, n_caches=n_caches)[:2]
+        total_loss += loss.item() * bs * (time - 1)
+        n_tokens += bs * (time - 1)
+
+        if pbar is not None:
+            pbar.update(bs * (time - 1))
+
+        if is_new_epoch:
+            break
+
+    return total_loss, n_tokens
+
+
+_worker_args = {}  # set in each worker process by _init_worker
+
+
+def _init_worker(model, dataloader, bptt, n_caches, n_threads):
+    """Receive the model and the dataloader once per worker process."""
+    torch.set_num_threads(n_threads)
+    _worker_args['args'] = (model, dataloader, bptt, n_caches)
+
+
+def _eval_lm_shard(rows):
+    """Evaluate a subset of streams in a worker process."""
+    model, dataloader, bptt, n_caches = _worker_args['args']
+    dataloader.select_streams(rows)
+    with torch.no_grad():
+        return _eval_lm(model, dataloader, None, bptt, n_caches)
+
+
+def _eval_lm_parallel(model, dataloader, batch_size, bptt, n_caches, n_workers, pbar=None):
+    """Spread independent streams over worker processes and merge the results.
+
+    Workers are spawned rather than forked since the parent process has already
+    initialized thread pools (e.g., OpenMP), which are not safe to fork. The model
+    and the dataloader are pickled to each worker once, and only indices of
+    streams are sent for each shard.
+
+    Returns:
+        total_loss (float): sum of token-level negative log-likelihoods
+        n_tokens (int): number of evaluated tokens
+
+    """
+    if dataloader.n_streams != batch_size:
+        dataloader.split_streams(batch_size)
+    n_workers = min(n_workers, batch_size)
+    shards = np.array_split(np.arange(batch_size), n_workers)
+    n_threads = max(1, torch.get_num_threads() // n_workers)
+
+    total_loss = 0
+    n_tokens = 0
+    with mp.get_context('spawn').Pool(n_workers, initializer=_init_worker,
+                                      initargs=(model, dataloader, bptt, n_caches, n_threads)) as pool:
+        for loss_shard, n_tokens_shard in pool.imap(_eval_lm_shard, shards):
+            total_loss += loss_shard
+            n_tokens += n_tokens_shard
+            if pbar is not None:
+                pbar.update(n_tokens_shard)
+
+    return total_loss, n_tokens
@@ -22,15 +22,16 @@ class MBR(torch.autograd.Function):
 
         Args:
             log_probs (FloatTensor): `[N_best, L, vocab]`
-            hyps (LongTensor): `[N_best, L]`
+            hyps (LongTensor): `[N_best, L]`, padded with negative values
             exp_risk (FloatTensor): `[1]` (for forward)
-            grad_input (FloatTensor): `[1]` (for backward)
+            grad_input (FloatTensor): `[1]` or `[N_best, 1, 1]` (for backward)
         Returns:
             loss (FloatTensor): `[1]`
 
         """
-        device_id = torch.cuda.device_of(log_probs).idx
-        onehot = torch.eye(log_probs.size(-1)).cuda(device_id)[hyps]
+        mask = (hyps >= 0).unsqueeze(-1)
+        onehot = log_probs.new_zeros(log_probs.size()).scatter_(
+            -1, hyps.clamp(min=0).unsqueeze(-1), mask.type_as(log_probs))
         grads = grad_input * onehot  # mask out other classes
         log_probs = log_probs.requires_grad_()
         ctx.save_for_backward(log_probs, grads)
@@ -104,7 +105,7 @@ def distillation(logits_student, logits_teacher, ylens, temperature=5.0):
     log_probs_student = torch.log_softmax(logits_student, dim=-1)
     probs_teacher = torch.softmax(logits_teacher / temperature, dim=-1).data
     loss = -torch.mul(probs_teacher, log_probs_student)
-    loss_mean = np.sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
+    loss_mean = torch.stack([loss[b, :ylens[b], :].sum() for b in range(bs)]).sum() / ylens.sum()
     return loss_mean
 
 
@@ -3,11 +3,88 @@
 
 """Custom class for data parallel training."""
 
+import datetime
+import logging
+import os
+import torch
+import torch.distributed as dist
 import torch.nn as nn
 from torch.nn import DataParallel
 from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.nn.parallel.scatter_gather import gather
 
+logger = logging.getLogger(__name__)
+
+
+def init_distributed(use_cuda, backend=None, timeout_min=180):
+    """Initialize the default process group for DistributedDataParallel.
+
+    The rank and world size are read from environment variables set by
+    `torchrun` (or `python -m torch.distributed.launch --use_env`).
+
+    Args:
+        use_cuda (bool): use a GPU per process
+        backend (str): nccl/gloo (nccl for GPU and gloo for CPU by default)
+        timeout_min (int): timeout for collective operations in minutes.
+            Other ranks wait for the evaluation on the main process.
+    Returns:
+        rank (int): global rank of the current process
+        world_size (int): number of processes
+        local_rank (int): rank of the current process in the node
+
+    """
+    rank = int(os.environ.get('RANK', 0))
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if backend is None:
+        backend = 'nccl' if use_cuda else 'gloo'
+    if use_cuda:
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend, init_method='env://', rank=rank, world_size=world_size,
+                            timeout=datetime.timedelta(minutes=timeout_min))
+    logger.info('Initialized process group (backend: %s, rank: %d/%d)' % (backend, rank, world_size))
+    return rank, world_size, local_rank
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def broadcast_object(obj, src=0):
+    """Broadcast a picklable object from the src rank to all ranks."""
+    if get_world_size() == 1:
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def wrap_distributed(model, use_cuda):
+    """Wrap a model by DistributedDataParallel.
+
+    Args:
+        model (nn.Module): model on the device of the current process
+        use_cuda (bool): use a GPU per process
+    Returns:
+        model (DDP): `model.module` is the original model
+
+    """
+    device_ids = [torch.cuda.current_device()] if use_cuda else None
+    # NOTE: some parameters are not used depending on tasks (e.g., mtl_per_batch)
+    return DDP(model, device_ids=device_ids, find_unused_parameters=True)
+
 
 class CustomDataParallel(DataParallel):
 
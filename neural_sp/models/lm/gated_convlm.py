@@ -10,6 +10,7 @@ import torch
 
 from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.glu import ConvGLUBlock
+from neural_sp.models.torch_utils import register_non_persistent_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -38,10 +39,8 @@ class GatedConvLM(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
-        self.embed_cache = None
+        self.reset_cache()
+        register_non_persistent_buffer(self, 'embed_cache', None)  # `[vocab, emb_dim]`
 
         self.embed = nn.Embedding(self.vocab, args.emb_dim, padding_idx=self.pad)
         self.dropout_embed = nn.Dropout(p=args.dropout_in)
@@ -187,39 +186,59 @@ class GatedConvLM(LMBase):
             else:
                 raise ValueError(n)
 
-    def decode(self, ys, state=None, mems=None, incremental=False, emb_cache=False):
+    def embed_token_id(self, ys):
+        """Embed token IDs.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+        Returns:
+            ys_emb (FloatTensor): `[B, L, emb_dim]`
+
+        """
+        return self.dropout_embed(self.embed(ys.long()))
+
+    def decode(self, ys, state=None, mems=None, cache=None, incremental=False, emb_cache=False):
         """Decode function.
 
         Args:
             ys (LongTensor): `[B, L]`
-            state: dummy interfance for RNNLM
+            state (dict): left context of each block for incremental decoding
+                buffers (List[FloatTensor]): length `n_blocks`,
+                    each of which contains a tensor of size `[B, in_ch, kernel_size - 1, 1]`
+            mems: dummy interfance for TransformerXL
             cache: dummy interfance for TransformerLM/TransformerXL
-            incremental: dummy interfance for TransformerLM/TransformerXL
+            incremental (bool): keep left context of each block for the next call
             emb_cache (bool): precompute token embeddings for fast infernece
         Returns:
             logits (FloatTensor): `[B, L, vocab]`
             out (FloatTensor): `[B, L, d_model]` (for cache)
-            new_cache: dummy interfance for RNNLM/TransformerLM/TransformerXL
-            new_mems: dummy interfance for TransformerXL
+            new_state (dict): left context of each block (None if not incremental)
 
         """
         # Pre-compute embedding
         if emb_cache and self.embed_cache is None:
-            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64)
-            if self.use_cuda:
-                indices = indices.cuda()
-            self.embed_cache = self.dropout_emb(self.embed(indices))  # `[1, vocab, emb_dim]`
+            self.cache_embedding()
 
         if self.embed_cache is not None:
             out = self.embed_cache[ys]
         else:
-            out = self.dropout_emb(self.embed(ys.long()))
+            out = self.embed_token_id(ys)
 
         bs, max_ylen = out.size()[:2]
 
         # NOTE: consider embed_dim as in_ch
-        out = out.unsqueeze(3)
-        out = self.blocks(out.transpose(2, 1))  # [B, out_ch, T, 1]
+        out = out.unsqueeze(3).transpose(2, 1)  # `[B, in_ch, T, 1]`
+        new_state = None
+        if incremental:
+            if state is None:
+                state = {'buffers': [out.new_zeros(bs, block.in_ch, block.kernel_size - 1, 1)
+                                     for block in self.blocks]}
+            new_state = {'buffers': []}
+            for block, buffer in zip(self.blocks, state['buffers']):
+                out, buffer = block(out, cache=buffer)
+                new_state['buffers'].append(buffer)
+        else:
+            out = self.blocks(out)  # [B, out_ch, T, 1]
         out = out.transpose(2, 1).contiguous()  # `[B, T, out_ch, 1]`
         out = out.squeeze(3)
         if self.adaptive_softmax is None:
@@ -227,4 +246,24 @@ class GatedConvLM(LMBase):
         else:
             logits = out
 
-        return logits, out, None
+        return logits, out, new_state
+
+    def step(self, ys, state=None, candidates=None):
+        """Predict the next token given the last tokens for ASR decoding.
+           Each block keeps the last `kernel_size - 1` inputs, so that only a single
+           position is convolved at every step.
+
+        Args:
+            ys (LongTensor): `[B]` or `[B, 1]`, last tokens
+            state (dict): state returned in the previous step (None at the first step)
+                buffers (List[FloatTensor]): length `n_blocks`,
+                    each of which contains a tensor of size `[B, in_ch, kernel_size - 1, 1]`
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]` or `[B, K]`
+            new_state (dict):
+                buffers (List[FloatTensor]): length `n_blocks`
+
+        """
+        logits, out, new_state = self.decode(ys.view(-1, 1), state, incremental=True)
+        return self._log_softmax(logits[:, -1], out[:, -1], candidates), new_state
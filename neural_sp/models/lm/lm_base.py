@@ -6,12 +6,15 @@
 import logging
 import numpy as np
 import torch
+import torch.nn as nn
 
 from neural_sp.models.base import ModelBase
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.torch_utils import compute_accuracy
+from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
+from neural_sp.models.torch_utils import tensor2np
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,9 @@ logger = logging.getLogger(__name__)
 class LMBase(ModelBase):
     """Base class for language models."""
 
+    state_batch_dim = 0  # batch dimension of tensors in states returned by step()
+    pack_sequences = False  # model sentences in each row independently during training
+
     def __init__(self, args):
 
         super(ModelBase, self).__init__()
@@ -60,67 +66,182 @@ class LMBase(ModelBase):
         ys = pad_list(ys, self.pad)
         ys_in, ys_out = ys[:, :-1], ys[:, 1:]
 
-        logits, out, new_state = self.decode(ys_in, state=state, mems=state)
-        # NOTE: state=state is used for RNNLM while mems=state is used for TransformerXL.
-        # TransformerLM ignores both of them.
+        if self.pack_sequences and self.training:
+            # NOTE: each sentence starts with <eos>
+            segment_ids = torch.cumsum(ys_in == self.eos, dim=1)
+            self.add_packing_stats(segment_ids, ys_out)
+            logits, out, new_state = self.decode(ys_in, state=state, segment_ids=segment_ids)
+        else:
+            logits, out, new_state = self.decode(ys_in, state=state, mems=state)
+            # NOTE: state=state is used for RNNLM while mems=state is used for TransformerXL.
+            # TransformerLM ignores both of them.
 
         if predict_last:
             ys_out = ys_out[:, -1].unsqueeze(1)
             logits = logits[:, -1].unsqueeze(1)
 
         # Compute XE sequence loss
-        if n_caches > 0 and len(self.cache_ids) > 0:
-            assert ys_out.size(1) == 1
-            assert ys_out.size(0) == 1
-            if self.adaptive_softmax is None:
-                probs = torch.softmax(logits, dim=-1)
-            else:
-                probs = self.adaptive_softmax.log_prob(logits).exp()
-            cache_probs = probs.new_zeros(probs.size())
-
-            # Truncate cache
-            self.cache_ids = self.cache_ids[-n_caches:]  # list of `[B, 1]`
-            self.cache_keys = self.cache_keys[-n_caches:]  # list of `[B, 1, n_units]`
-
-            # Compute inner-product over caches
-            cache_attn = torch.softmax(self.cache_theta * torch.matmul(
-                torch.cat(self.cache_keys, dim=1), out.transpose(2, 1)).squeeze(2), dim=1)
-
-            # For visualization
-            if len(self.cache_ids) == n_caches:
-                self.cache_attn += [cache_attn.cpu().numpy()]
-                self.cache_attn = self.cache_attn[-n_caches:]
-
-            # Sum all probabilities
-            for offset, idx in enumerate(self.cache_ids):
-                cache_probs[:, :, idx] += cache_attn[:, offset]
-            probs = (1 - self.cache_lambda) * probs + self.cache_lambda * cache_probs
-            loss = -torch.log(probs[:, :, ys_out[:, -1]])
+        if n_caches > 0:
+            assert not predict_last
+            loss = self._cache_loss(logits, out, ys_out, n_caches)
+            ppl = np.exp(loss.item())
         else:
             if self.adaptive_softmax is None:
                 loss, ppl = cross_entropy_lsm(logits, ys_out.contiguous(),
                                               self.lsm_prob, self.pad, self.training,
                                               normalize_length=True)
             else:
-                loss = self.adaptive_softmax(logits.view((-1, logits.size(2))),
+                loss = self.adaptive_softmax(logits.reshape(-1, logits.size(2)),
                                              ys_out.contiguous().view(-1)).loss
                 ppl = np.exp(loss.item())
 
-        if n_caches > 0:
-            # Register to cache
-            self.cache_ids += [ys_out[0, -1].item()]
-            self.cache_keys += [out]
-
         # Compute token-level accuracy in teacher-forcing
         if self.adaptive_softmax is None:
             acc = compute_accuracy(logits, ys_out, pad=self.pad)
         else:
             acc = compute_accuracy(self.adaptive_softmax.log_prob(
-                logits.view((-1, logits.size(2)))), ys_out, pad=self.pad)
+                logits.reshape(-1, logits.size(2))), ys_out, pad=self.pad)
 
         observation = {'loss.lm': loss.item(), 'acc.lm': acc, 'ppl.lm': ppl}
         return loss, new_state, observation
 
+    def add_packing_stats(self, segment_ids, ys_out):
+        """Count sentences (including truncated ones) in each row.
+
+        Args:
+            segment_ids (LongTensor): `[B, L]`
+            ys_out (LongTensor): `[B, L]`
+
+        """
+        segment_ids = tensor2np(segment_ids)
+        mask = tensor2np(ys_out != self.pad)
+        seq_lens = []
+        for b in range(len(segment_ids)):
+            counts = np.bincount(segment_ids[b][mask[b]])
+            seq_lens += counts[counts > 0].tolist()
+        self.packing_stats.add(seq_lens, len(segment_ids), segment_ids.shape[1])
+
+    def reset_cache(self):
+        """Clear the neural cache used for perplexity evaluation."""
+        self.cache_ids = None  # `[B, n_caches]`
+        self.cache_keys = None  # `[B, n_caches, n_units]`
+        self.cache_attn = None  # `[B, L, n_caches]`
+
+    def _cache_loss(self, logits, out, ys_out, n_caches):
+        """Compute XE loss interpolated with the neural cache (Grave et al., 2017).
+
+        All positions in a segment are scored at once. Each query at time t
+        attends to the `n_caches` preceding hidden states, which are taken
+        from the current segment and from the cache carried over from the
+        previous segments.
+
+        Args:
+            logits (FloatTensor): `[B, L, vocab]`
+            out (FloatTensor): `[B, L, n_units]`
+            ys_out (LongTensor): `[B, L]`
+            n_caches (int): number of cached states
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
+        bs, ylen = ys_out.size()
+        if self.cache_keys is None or self.cache_keys.size(0) != bs or self.cache_keys.size(1) != n_caches:
+            self.cache_keys = out.new_zeros(bs, n_caches, out.size(2))
+            self.cache_ids = ys_out.new_full((bs, n_caches), -1)
+
+        ids = ys_out.masked_fill(ys_out == self.pad, -1)
+        keys_all = torch.cat([self.cache_keys, out], dim=1)  # `[B, n_caches + L, n_units]`
+        ids_all = torch.cat([self.cache_ids, ids], dim=1)  # `[B, n_caches + L]`
+
+        # Gather a sliding window of the n_caches preceding keys for each query
+        window = torch.arange(ylen, device=out.device).unsqueeze(1) + \
+            torch.arange(n_caches, device=out.device).unsqueeze(0)  # `[L, n_caches]`
+        scores = self.cache_theta * torch.matmul(out, keys_all.transpose(2, 1))
+        scores = torch.gather(scores, 2, window.unsqueeze(0).expand(bs, -1, -1))  # `[B, L, n_caches]`
+        ids_win = ids_all[:, window]  # `[B, L, n_caches]`
+        invalid = ids_win < 0
+        scores = scores.masked_fill(invalid, float('-inf'))
+        cache_attn = torch.softmax(scores, dim=-1).masked_fill(invalid, 0)
+        self.cache_attn = cache_attn  # for visualization
+
+        # Sum cache probabilities of the target tokens
+        cache_probs = (cache_attn * (ids_win == ys_out.unsqueeze(2))).sum(2)  # `[B, L]`
+        if self.adaptive_softmax is None:
+            logprobs = torch.log_softmax(logits, dim=-1)
+        else:
+            logprobs = self.adaptive_softmax.log_prob(logits.view((-1, logits.size(2)))).view(bs, ylen, -1)
+        probs = torch.gather(logprobs, 2, ys_out.unsqueeze(2)).squeeze(2).exp()  # `[B, L]`
+        # NOTE: fall back to the model distribution when the cache is empty
+        cache_lambda = (~invalid).any(2).float() * self.cache_lambda
+        probs = (1 - cache_lambda) * probs + cache_lambda * cache_probs
+
+        mask = ys_out != self.pad
+        loss = -torch.log(probs).masked_select(mask).sum() / mask.sum().clamp(min=1)
+
+        # Register to cache
+        self.cache_keys = keys_all[:, -n_caches:]
+        self.cache_ids = ids_all[:, -n_caches:]
+        return loss
+
+    def train(self, mode=True):
+        if mode and 'embed_cache' in self._buffers:
+            self.embed_cache = None  # invalidate since parameters will be updated
+        return super(LMBase, self).train(mode)
+
+    def load_state_dict(self, state_dict, strict=True):
+        if 'embed_cache' in self._buffers:
+            self.embed_cache = None  # invalidate
+        return super(LMBase, self).load_state_dict(state_dict, strict=strict)
+
+    def cache_embedding(self):
+        """Precompute embeddings of all tokens without dropout for fast inference.
+           The cache is registered as a non-persistent buffer, so that it follows
+           device and dtype conversion and is not saved in checkpoints.
+           The LM is switched to the evaluation mode, and the cache is cleared
+           when it is switched back to the training mode.
+
+        """
+        self.eval()
+        with torch.no_grad():
+            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64, device=self.device)
+            self.embed_cache = self.embed_token_id(indices)  # `[vocab, emb_dim]`
+
+    def fuse_output_layers(self):
+        """Fuse consecutive linear layers before softmax for inference."""
+        pass
+
+    def prepare_for_inference(self, dtype='float32'):
+        """Prepare the LM for ASR decoding and rescoring.
+           Output layers are fused if possible, weights are optionally converted
+           for CPU inference, and token embeddings are precomputed.
+           The returned LM outputs cannot be used for cold/deep fusion after fusing
+           output layers.
+
+        Args:
+            dtype (str): float32/bfloat16/int8.
+                int8 applies dynamic quantization to linear and recurrent layers (CPU only).
+        Returns:
+            self (LMBase)
+
+        """
+        self.eval()
+        self.fuse_output_layers()
+        if dtype == 'bfloat16':
+            self.to(torch.bfloat16)
+        elif dtype == 'int8':
+            if self.device.type != 'cpu':
+                raise ValueError('int8 quantization is supported only on CPU.')
+            if not hasattr(torch, 'quantization'):
+                raise ValueError('int8 quantization requires PyTorch >= 1.3.')
+            torch.quantization.quantize_dynamic(self, {nn.Linear, nn.LSTM, nn.GRU},
+                                                dtype=torch.qint8, inplace=True)
+        elif dtype != 'float32':
+            raise ValueError(dtype)
+        if hasattr(self, 'embed_token_id'):
+            self.cache_embedding()
+        logger.info('Prepared %s for inference (%s)' % (self.__class__.__name__, dtype))
+        return self
+
     def repackage_state(self, state):
         return state
 
@@ -158,9 +279,175 @@ class LMBase(ModelBase):
         """
         logits, lmout, new_state = self.decode(ys, state, mems=mems, cache=cache,
                                                incremental=True, emb_cache=emb_cache)
-        log_probs = torch.log_softmax(logits, dim=-1)
+        log_probs = self._log_softmax(logits, lmout)
         return lmout, new_state, log_probs
 
+    def step(self, ys, state=None, candidates=None):
+        """Predict the next token given the last tokens for ASR decoding.
+           This is the generic implementation, which re-encodes the whole history
+           at every step. Each LM can override this for incremental decoding.
+
+        Args:
+            ys (LongTensor): `[B]` or `[B, 1]`, last tokens
+            state (dict): state returned in the previous step (None at the first step)
+                ys (LongTensor): `[B, L]`, history
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]` or `[B, K]`
+            new_state (dict):
+                ys (LongTensor): `[B, L+1]`
+
+        """
+        ys = ys.view(-1, 1)
+        if state is not None:
+            ys = torch.cat([state['ys'], ys], dim=1)
+        logits, out, _ = self.decode(ys, None)
+        return self._log_softmax(logits[:, -1], out[:, -1], candidates), {'ys': ys}
+
+    def _log_softmax(self, logits, out, candidates=None):
+        """Normalize logits with (adaptive) softmax.
+
+        Args:
+            logits (FloatTensor): `[..., vocab]` or `[..., d_model]` (for adaptive softmax)
+            out (FloatTensor): `[..., d_model]`
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[..., vocab]` or `[B, K]`
+
+        """
+        if self.adaptive_softmax is None:
+            log_probs = torch.log_softmax(logits.float(), dim=-1)
+            if candidates is not None:
+                log_probs = torch.gather(log_probs, 1, candidates)
+            return log_probs
+        if candidates is not None:
+            return self._adaptive_log_probs_candidates(out, candidates).float()
+        log_probs = self.adaptive_softmax.log_prob(out.reshape(-1, out.size(-1))).float()
+        return log_probs.view(out.size()[:-1] + (self.vocab,))
+
+    def _adaptive_log_probs_candidates(self, out, candidates):
+        """Compute adaptive softmax log probabilities of candidate tokens only.
+           The head is always evaluated, while each tail cluster is evaluated only
+           for hypotheses having candidates in the cluster.
+
+        Args:
+            out (FloatTensor): `[B, d_model]`
+            candidates (LongTensor): `[B, K]`
+        Returns:
+            log_probs (FloatTensor): `[B, K]`
+
+        """
+        asm = self.adaptive_softmax
+        head_log_probs = torch.log_softmax(asm.head(out), dim=1)  # `[B, shortlist_size + n_clusters]`
+        log_probs = torch.gather(head_log_probs, 1, candidates.clamp(max=asm.shortlist_size - 1))
+        for i in range(asm.n_clusters):
+            start, end = asm.cutoffs[i], asm.cutoffs[i + 1]
+            in_cluster = (candidates >= start) & (candidates < end)
+            rows = torch.nonzero(in_cluster.any(1)).squeeze(1)
+            if rows.numel() == 0:
+                continue
+            cluster_log_probs = torch.log_softmax(asm.tail[i](out[rows]), dim=1)  # `[B', end - start]`
+            cluster_log_probs = torch.gather(cluster_log_probs, 1,
+                                             (candidates[rows] - start).clamp(0, end - start - 1))
+            cluster_log_probs += head_log_probs[rows, asm.shortlist_size + i].unsqueeze(1)
+            log_probs[rows] = torch.where(in_cluster[rows], cluster_log_probs, log_probs[rows])
+        return log_probs
+
+    def reorder_state(self, state, ids):
+        """Select hypotheses from the state for beam search.
+
+        Args:
+            state (dict): state returned by step()
+            ids (LongTensor or list): `[B']`, indices of hypotheses
+        Returns:
+            state (dict): state for `B'` hypotheses
+
+        """
+        if state is None:
+            return None
+        if not torch.is_tensor(ids):
+            ids = torch.tensor(ids, dtype=torch.int64)
+
+        def select(v):
+            if v is None:
+                return None
+            if isinstance(v, (list, tuple)):
+                return type(v)(select(v_l) for v_l in v)
+            return v.index_select(self.state_batch_dim, ids.to(v.device))
+
+        return {k: select(v) for k, v in state.items()}
+
+    def merge_states(self, states):
+        """Concatenate states of hypotheses for batch decoding.
+
+        Args:
+            states (list): length `B`, each of which is a state returned by step()
+        Returns:
+            state (dict): state for `B` hypotheses
+
+        """
+        if len(states) == 0 or states[0] is None:
+            return None
+
+        def cat(vs):
+            if vs[0] is None:
+                return None
+            if isinstance(vs[0], (list, tuple)):
+                return type(vs[0])(cat([v[lth] for v in vs]) for lth in range(len(vs[0])))
+            return torch.cat(vs, dim=self.state_batch_dim)
+
+        return {k: cat([state[k] for state in states]) for k in states[0].keys()}
+
+    def score_sequences(self, ys, share_prefix=False):
+        """Compute log-likelihoods of token sequences in batch for N-best rescoring.
+
+        Args:
+            ys (List[np.ndarray]): length `B`, each of which contains token ids of size `[L]`.
+                The first token is used only as the context (e.g., <sos>).
+            share_prefix (bool): walk the prefix tree of all sequences with step()
+                so that common prefixes are evaluated only once.
+                Otherwise, all sequences are padded and fed to the LM at once,
+                which is faster unless prefixes are long and step() is cheap.
+        Returns:
+            scores (FloatTensor): `[B]`, sums of token-level log probabilities
+
+        """
+        ylens = np.array([len(y) for y in ys])
+        scores = torch.zeros(len(ys), device=self.device)
+        if len(ys) == 0 or ylens.max() <= 1:
+            return scores
+
+        if not share_prefix:
+            ys = [np2tensor(np.fromiter(y, dtype=np.int64), self.device) for y in ys]
+            ys_in = pad_list([y[:-1] for y in ys], self.eos)  # `[B, L-1]`
+            ys_out = pad_list([y[1:] for y in ys], self.eos)  # `[B, L-1]`
+            _, _, log_probs = self.predict(ys_in, None)
+            log_probs = torch.gather(log_probs, 2, ys_out.unsqueeze(2)).squeeze(2)
+            mask = make_pad_mask(torch.from_numpy(ylens - 1).to(self.device))
+            return log_probs.masked_fill(~mask, 0).sum(1)
+
+        state = None
+        prefix_ids = np.zeros(len(ys), dtype=np.int64)  # index of the prefix at the previous depth
+        for t in range(ylens.max() - 1):
+            active = np.nonzero(ylens > t + 1)[0]
+            # Merge hypotheses sharing the same prefix
+            table = {}
+            parents, tokens, new_prefix_ids = [], [], []
+            for b in active:
+                key = (prefix_ids[b], ys[b][t])
+                if key not in table:
+                    table[key] = len(parents)
+                    parents.append(prefix_ids[b])
+                    tokens.append(ys[b][t])
+                new_prefix_ids.append(table[key])
+            if state is not None:
+                state = self.reorder_state(state, parents)
+            log_probs, state = self.step(torch.tensor(tokens, dtype=torch.int64, device=self.device), state)
+            targets = torch.tensor([ys[b][t + 1] for b in active], dtype=torch.int64, device=self.device)
+            scores[active] += log_probs[new_prefix_ids, targets]
+            prefix_ids[active] = new_prefix_ids
+        return scores
+
     def plot_attention(self):
         # raise NotImplementedError
         pass
@@ -0,0 +1,283 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Backoff n-gram language model for shallow fusion and rescoring."""
+
+import codecs
+import logging
+import math
+import numpy as np
+import os
+import torch
+
+from neural_sp.datasets.utils import count_vocab_size
+from neural_sp.models.lm.lm_base import LMBase
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = ['keys', 'logp', 'bow', 'backoff', 'order']
+
+
+def is_ngram_lm(lm_path):
+    """Check if the path is an ARPA file or a directory saved by NgramLM.save()."""
+    if not lm_path:
+        return False
+    return lm_path.endswith('.arpa') or os.path.isfile(os.path.join(lm_path, 'keys.npy'))
+
+
+def read_arpa(arpa_path):
+    """Read n-grams in ARPA format.
+
+    Args:
+        arpa_path (str): path to an ARPA file
+    Returns:
+        ngrams (dict): order -> list of `(words, log10 prob, log10 backoff weight)`
+
+    """
+    ngrams = {}
+    n = 0
+    with codecs.open(arpa_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('ngram ') or line in ['\\data\\', '\\end\\']:
+                continue
+            if line.startswith('\\') and line.endswith('-grams:'):
+                n = int(line[1:-len('-grams:')])
+                ngrams[n] = []
+                continue
+            if n == 0:
+                continue
+            fields = line.split()
+            logp = float(fields[0])
+            bow = float(fields[n + 1]) if len(fields) > n + 1 else 0.
+            ngrams[n].append((tuple(fields[1:n + 1]), logp, bow))
+    return ngrams
+
+
+class NgramLM(LMBase):
+    """Backoff n-gram LM.
+
+    N-grams are stored in flat arrays sorted by `context * (vocab + 1) + token`,
+    where `context` is the index of the (n-1)-gram and index 0 is the empty
+    context. The index of each n-gram is used as the LM state, so that
+    state transitions are binary searches and children of a context are
+    contiguous. All hypotheses are processed at once with vectorized NumPy
+    operations. The arrays can be saved to a directory and memory-mapped.
+
+    Args:
+        lm_path (str): path to an ARPA file or a directory saved by save()
+        dict_path (str): path to the dictionary of the ASR model
+
+    """
+
+    def __init__(self, lm_path, dict_path):
+
+        super(LMBase, self).__init__()
+        logger.info(self.__class__.__name__)
+
+        self.lm_type = 'ngram'
+        self.vocab = count_vocab_size(dict_path)
+        self.eos = 2
+        self.unk = 1
+        self.bos = self.vocab  # `<s>` is mapped to an extra index as an input token
+        self.backward = False
+        self.adaptive_softmax = None
+
+        if os.path.isdir(lm_path):
+            for name in ARRAY_NAMES:
+                setattr(self, name, np.load(os.path.join(lm_path, name + '.npy'), mmap_mode='r'))
+        else:
+            token2idx = {}
+            with codecs.open(dict_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    w, idx = line.strip().split(' ')
+                    token2idx[w] = int(idx)
+            token2idx['<s>'] = self.bos
+            token2idx['</s>'] = self.eos
+            self.build(read_arpa(lm_path), token2idx)
+        self.n_order = int(self.order.max())
+        logger.info('%d-gram LM: %d n-grams' % (self.n_order, len(self.keys) - 1))
+
+        # log probabilities of unigrams
+        start, end = np.searchsorted(self.keys, [0, self.vocab])
+        unk = min(np.searchsorted(self.keys, self.unk), len(self.keys) - 1)
+        unk_logp = self.logp[unk] if self.keys[unk] == self.unk else -99 * math.log(10)
+        self.logp_unigram = np.full(self.vocab, unk_logp, dtype=np.float32)
+        self.logp_unigram[self.keys[start:end]] = self.logp[start:end]
+        # NOTE: tokens missing in the n-gram LM are scored as <unk>
+
+    @property
+    def device(self):
+        return torch.device('cpu')
+
+    def build(self, ngrams, token2idx):
+        """Build sorted arrays from n-grams.
+
+        Args:
+            ngrams (dict): order -> list of `(words, log10 prob, log10 backoff weight)`
+            token2idx (dict): token -> index
+
+        """
+        log10 = math.log(10)
+        vocab = self.vocab + 1
+        nodes = [{(): 0}]  # n-gram -> index for each order
+        keys, logp, bow, backoff, order = [-1], [0.], [0.], [0], [0]
+        n_oovs = 0
+        for n in sorted(ngrams.keys()):
+            entries = []
+            for words, lp, bo in ngrams[n]:
+                ids = tuple(token2idx.get(w, -1) for w in words)
+                context = nodes[n - 1].get(ids[:-1])
+                if -1 in ids or context is None:
+                    n_oovs += 1
+                    continue
+                entries.append((context * vocab + ids[-1], lp, bo, ids))
+            entries.sort(key=lambda x: x[0])
+            # NOTE: indices of contexts increase with the order, so that keys are sorted globally
+
+            nodes.append({})
+            for key, lp, bo, ids in entries:
+                nodes[n][ids] = len(keys)
+                # the longest suffix in the LM for backoff
+                suffix = 0
+                for s in range(1, n):
+                    if ids[s:] in nodes[n - s]:
+                        suffix = nodes[n - s][ids[s:]]
+                        break
+                keys.append(key)
+                logp.append(lp * log10)
+                bow.append(bo * log10)
+                backoff.append(suffix)
+                order.append(n)
+        if n_oovs > 0:
+            logger.info('Removed %d n-grams including OOV tokens' % n_oovs)
+
+        self.keys = np.array(keys, dtype=np.int64)
+        self.logp = np.array(logp, dtype=np.float32)
+        self.bow = np.array(bow, dtype=np.float32)
+        self.backoff = np.array(backoff, dtype=np.int64)
+        self.order = np.array(order, dtype=np.int8)
+
+    def save(self, save_dir):
+        """Save arrays to be memory-mapped.
+
+        Args:
+            save_dir (str): path to the output directory
+
+        """
+        if not os.path.isdir(save_dir):
+            os.makedirs(save_dir)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(save_dir, name + '.npy'), getattr(self, name))
+
+    def transition(self, states, tokens):
+        """Move to the longest context in the LM after reading tokens.
+
+        Args:
+            states (np.ndarray): `[B]`, indices of contexts
+            tokens (np.ndarray): `[B]`
+        Returns:
+            new_states (np.ndarray): `[B]`
+
+        """
+        vocab = self.vocab + 1
+        tokens = np.where(tokens == self.eos, self.bos, tokens)
+        new_states = np.zeros_like(states)
+        todo = np.ones(len(states), dtype=bool)
+        context = states
+        for _ in range(self.n_order):
+            queries = context * vocab + tokens
+            idx = np.minimum(np.searchsorted(self.keys, queries), len(self.keys) - 1)
+            found = todo & (self.keys[idx] == queries)
+            new_states[found] = idx[found]
+            todo &= ~found & (context != 0)
+            # NOTE: unknown tokens at the empty context reset the state
+            if not todo.any():
+                break
+            context = np.where(todo, self.backoff[context], context)
+
+        # the highest-order n-grams cannot be extended
+        is_full = self.order[new_states] == self.n_order
+        new_states[is_full] = self.backoff[new_states[is_full]]
+        return new_states
+
+    def log_probs(self, states):
+        """Compute log probabilities over the vocabulary.
+
+        Args:
+            states (np.ndarray): `[B]`, indices of contexts
+        Returns:
+            log_probs (np.ndarray): `[B, vocab]`
+
+        """
+        vocab = self.vocab + 1
+        states, inverse = np.unique(states, return_inverse=True)
+
+        # Contexts for backoff aligned by order `[B', n_order - 1]`
+        contexts = np.full((len(states), max(1, self.n_order - 1)), -1, dtype=np.int64)
+        context = states
+        while (context > 0).any():
+            valid = context > 0
+            contexts[valid, self.order[context[valid]] - 1] = context[valid]
+            context = self.backoff[context]
+
+        log_probs = np.tile(self.logp_unigram, (len(states), 1))
+        for n in range(contexts.shape[1]):
+            rows = np.nonzero(contexts[:, n] >= 0)[0]
+            if len(rows) == 0:
+                continue
+            context = contexts[rows, n]
+            log_probs[rows] += self.bow[context][:, None]
+            # Overwrite probabilities of observed n-grams
+            start = np.searchsorted(self.keys, context * vocab)
+            n_children = np.searchsorted(self.keys, (context + 1) * vocab) - start
+            idx = np.repeat(start - np.cumsum(n_children) + n_children, n_children) + np.arange(n_children.sum())
+            rows = np.repeat(rows, n_children)
+            tokens = self.keys[idx] % vocab
+            mask = tokens < self.vocab
+            log_probs[rows[mask], tokens[mask]] = self.logp[idx[mask]]
+        return log_probs[inverse]
+
+    def step(self, ys, state=None, candidates=None):
+        """Predict the next token given the last tokens for ASR decoding.
+
+        Args:
+            ys (LongTensor): `[B]` or `[B, 1]`, last tokens
+            state (dict): state returned in the previous step (None at the first step)
+                node (LongTensor): `[B]`, indices of contexts
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]` or `[B, K]`
+            new_state (dict):
+                node (LongTensor): `[B]`
+
+        """
+        tokens = ys.view(-1).cpu().numpy()
+        if state is None:
+            states = np.zeros(len(tokens), dtype=np.int64)
+        else:
+            states = state['node'].cpu().numpy()
+        states = self.transition(states, tokens)
+        log_probs = torch.from_numpy(self.log_probs(states)).to(ys.device)
+        if candidates is not None:
+            log_probs = torch.gather(log_probs, 1, candidates)
+        return log_probs, {'node': torch.from_numpy(states).to(ys.device)}
+
+    def predict(self, ys, state=None, mems=None, cache=None, emb_cache=False):
+        """Precict function for ASR.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (dict): state returned in the previous step
+        Returns:
+            lmout: None
+            state (dict):
+                node (LongTensor): `[B]`
+            log_probs (FloatTensor): `[B, L, vocab]`
+
+        """
+        log_probs = []
+        for t in range(ys.size(1)):
+            log_probs_t, state = self.step(ys[:, t], state)
+            log_probs.append(log_probs_t.unsqueeze(1))
+        return None, state, torch.cat(log_probs, dim=1)
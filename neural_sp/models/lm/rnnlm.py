@@ -10,7 +10,11 @@ import torch.nn as nn
 
 from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.glu import LinearGLUBlock
-from neural_sp.models.torch_utils import repeat
+from neural_sp.models.packing import PackingStats
+from neural_sp.models.torch_utils import (
+    register_non_persistent_buffer,
+    repeat
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +22,8 @@ logger = logging.getLogger(__name__)
 class RNNLM(LMBase):
     """RNN language model."""
 
+    state_batch_dim = 1  # `[n_layers, B, n_units]`
+
     def __init__(self, args, save_path=None):
 
         super(LMBase, self).__init__()
@@ -41,13 +47,15 @@ class RNNLM(LMBase):
         self.pad = 3
         # NOTE: reserved in advance
 
+        # for packed sequences
+        self.pack_sequences = getattr(args, 'pack_sequences', False)
+        self.packing_stats = PackingStats()
+
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
-        self.embed_cache = None
+        self.reset_cache()
+        register_non_persistent_buffer(self, 'embed_cache', None)  # `[vocab, emb_dim]`
 
         self.embed = nn.Embedding(self.vocab, args.emb_dim, padding_idx=self.pad)
         self.dropout_emb = nn.Dropout(p=args.dropout_in)
@@ -144,8 +152,37 @@ class RNNLM(LMBase):
             else:
                 raise ValueError(n)
 
+    def fuse_output_layers(self):
+        """Fuse the projection before the tied output layer into a single linear layer
+           if it reduces computation.
+
+        """
+        if self.output_proj is None:
+            return
+        idim, emb_dim = self.output_proj.in_features, self.output_proj.out_features
+        if idim * self.vocab > (idim + self.vocab) * emb_dim:
+            return
+        output = nn.Linear(idim, self.vocab).to(self.device)
+        with torch.no_grad():
+            output.weight.copy_(torch.matmul(self.output.weight, self.output_proj.weight))
+            output.bias.copy_(torch.matmul(self.output.weight, self.output_proj.bias) + self.output.bias)
+        self.output = output
+        self.output_proj = None
+        logger.info('Fused output layers: %d -> %d' % (idim, self.vocab))
+
+    def embed_token_id(self, ys):
+        """Embed token IDs.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+        Returns:
+            ys_emb (FloatTensor): `[B, L, emb_dim]`
+
+        """
+        return self.dropout_emb(self.embed(ys.long()))
+
     def decode(self, ys, state, mems=None, cache=None, incremental=False,
-               emb_cache=False):
+               emb_cache=False, segment_ids=None):
         """Decode function.
 
         Args:
@@ -156,6 +193,7 @@ class RNNLM(LMBase):
             cache: dummy interfance for TransformerLM/TransformerXL
             incremental: dummy interfance for TransformerLM/TransformerXL
             emb_cache (bool): precompute token embeddings for fast infernece
+            segment_ids (LongTensor): `[B, L]`, reset states at the beginning of each segment
         Returns:
             logits (FloatTensor): `[B, L, vocab]`
             ys_emb (FloatTensor): `[B, L, n_units]` (for cache)
@@ -169,15 +207,12 @@ class RNNLM(LMBase):
 
         # Pre-compute embedding
         if emb_cache and self.embed_cache is None:
-            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64)
-            if self.use_cuda:
-                indices = indices.cuda()
-            self.embed_cache = self.dropout_emb(self.embed(indices))  # `[1, vocab, emb_dim]`
+            self.cache_embedding()
 
         if self.embed_cache is not None:
             ys_emb = self.embed_cache[ys]
         else:
-            ys_emb = self.dropout_emb(self.embed(ys.long()))
+            ys_emb = self.embed_token_id(ys)
 
         if state is None:
             state = self.zero_state(bs)
@@ -188,18 +223,32 @@ class RNNLM(LMBase):
             cv = ys.new_zeros(bs, ymax, self.n_units_cv).float()
             ys_emb = torch.cat([ys_emb, cv], dim=-1)
 
+        reset = None
+        if segment_ids is not None:
+            reset = torch.ones_like(segment_ids, dtype=torch.bool)
+            reset[:, 0] = segment_ids[:, 0] > 0
+            reset[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+
         residual = None
         new_hxs, new_cxs = [], []
         for lth in range(self.n_layers):
-            self.rnn[lth].flatten_parameters()  # for multi-GPUs
+            if hasattr(self.rnn[lth], 'flatten_parameters'):
+                self.rnn[lth].flatten_parameters()  # for multi-GPUs (not for quantized RNNs)
 
             # Path through RNN
             if self.rnn_type == 'lstm':
-                ys_emb, (h, c) = self.rnn[lth](ys_emb, hx=(state['hxs'][lth:lth + 1],
-                                                           state['cxs'][lth:lth + 1]))
+                hx = (state['hxs'][lth:lth + 1], state['cxs'][lth:lth + 1])
+            elif self.rnn_type == 'gru':
+                hx = state['hxs'][lth:lth + 1]
+            if reset is None:
+                ys_emb, hx = self.rnn[lth](ys_emb, hx=hx)
+            else:
+                ys_emb, hx = self._forward_rnn_with_reset(self.rnn[lth], ys_emb, hx, reset)
+            if self.rnn_type == 'lstm':
+                h, c = hx
                 new_cxs.append(c)
             elif self.rnn_type == 'gru':
-                ys_emb, h = self.rnn[lth](ys_emb, hx=state['hxs'][lth:lth + 1])
+                h = hx
             new_hxs.append(h)
             ys_emb = self.dropout(ys_emb)
             if self.n_projs > 0:
@@ -232,6 +281,53 @@ class RNNLM(LMBase):
 
         return logits, ys_emb, new_state
 
+    def _forward_rnn_with_reset(self, rnn, xs, hx, reset):
+        """Run a RNN layer while resetting states at the beginning of each segment.
+
+        Time steps without any reset in the mini-batch are processed at once.
+
+        Args:
+            rnn (nn.Module): RNN layer
+            xs (FloatTensor): `[B, L, in_dim]`
+            hx (FloatTensor or tuple): initial state(s) of size `[1, B, n_units]`
+            reset (BoolTensor): `[B, L]`
+        Returns:
+            xs (FloatTensor): `[B, L, n_units]`
+            hx (FloatTensor or tuple): final state(s) of size `[1, B, n_units]`
+
+        """
+        ts = torch.nonzero(reset.any(0)).view(-1).tolist()
+        ts = sorted(set([0] + ts + [xs.size(1)]))
+        outs = []
+        for start, end in zip(ts[:-1], ts[1:]):
+            keep = (~reset[:, start]).to(xs.dtype).view(1, -1, 1)
+            if isinstance(hx, tuple):
+                hx = tuple(h * keep for h in hx)
+            else:
+                hx = hx * keep
+            out, hx = rnn(xs[:, start:end], hx=hx)
+            outs.append(out)
+        return torch.cat(outs, dim=1), hx
+
+    def step(self, ys, state=None, candidates=None):
+        """Predict the next token given the last tokens for ASR decoding.
+
+        Args:
+            ys (LongTensor): `[B]` or `[B, 1]`, last tokens
+            state (dict): state returned in the previous step (None at the first step)
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]` or `[B, K]`
+            new_state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+
+        """
+        logits, out, new_state = self.decode(ys.view(-1, 1), state)
+        return self._log_softmax(logits[:, -1], out[:, -1], candidates), new_state
+
     def zero_state(self, batch_size):
         """Initialize hidden state.
 
@@ -17,7 +17,10 @@ from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.initialization import init_like_transformer_xl
 from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
-from neural_sp.models.torch_utils import tensor2np
+from neural_sp.models.torch_utils import (
+    register_non_persistent_buffer,
+    tensor2np
+)
 from neural_sp.utils import mkdir_join
 
 import matplotlib
@@ -28,6 +31,59 @@ random.seed(1)
 logger = logging.getLogger(__name__)
 
 
+class RingMemory(object):
+    """Preallocated ring buffers of hidden states for segment-level recurrence.
+
+    Each step is written twice at `t % mem_len` and `t % mem_len + mem_len`,
+    so that the latest `mem_len` steps are always a contiguous view in
+    chronological order and memory is never re-concatenated.
+
+    Args:
+        mem_len (int): number of steps to keep
+
+    """
+
+    def __init__(self, mem_len):
+
+        self.mem_len = mem_len
+        self.buffers = None  # `[n_layers, B, mem_len * 2, d_model]`
+        self.offset = 0  # position to be written next
+        self.length = 0  # number of valid steps
+
+    def update(self, hidden_states):
+        """Append hidden states.
+
+        Args:
+            hidden_states (list): length `n_layers`, each of which contains `[B, L, d_model]`
+
+        """
+        bs, qlen, d_model = hidden_states[0].size()
+        if self.buffers is None or self.buffers.size(1) != bs:
+            self.buffers = hidden_states[0].new_zeros(len(hidden_states), bs, self.mem_len * 2, d_model)
+            self.offset, self.length = 0, 0
+        qlen = min(qlen, self.mem_len)
+        idx = (torch.arange(qlen, device=self.buffers.device) + self.offset) % self.mem_len
+        for buffer, h in zip(self.buffers, hidden_states):
+            h = h[:, -qlen:].detach()
+            buffer.index_copy_(1, idx, h)
+            buffer.index_copy_(1, idx + self.mem_len, h)
+        self.offset = (self.offset + qlen) % self.mem_len
+        self.length = min(self.length + qlen, self.mem_len)
+
+    def read(self):
+        """Return the latest hidden states.
+
+        Returns:
+            mems (list): length `n_layers`, each of which contains `[B, mlen, d_model]`
+                (None if empty)
+
+        """
+        if self.length == 0:
+            return None
+        end = self.offset + self.mem_len
+        return list(self.buffers[:, :, end - self.length:end].unbind(0))
+
+
 class TransformerXL(LMBase):
     """TransformerXL language model."""
 
@@ -60,10 +116,8 @@ class TransformerXL(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
-        self.embed_cache = None
+        self.reset_cache()
+        register_non_persistent_buffer(self, 'embed_cache', None)  # `[vocab, emb_dim]`
 
         # positional embedding
         self.pos_emb = XLPositionalEmbedding(self.d_model, args.dropout_in)
@@ -161,14 +215,24 @@ class TransformerXL(LMBase):
 
     def update_memory(self, memory_prev, hidden_states):
         """Update memory.
+           Ring buffers are used during inference, where memory is not involved in
+           backpropagation and can be overwritten in place.
 
         Args:
-            memory_prev (list): length `n_layers`, each of which contains `[B, mlen, d_model]`
+            memory_prev (list or RingMemory): length `n_layers`, each of which contains `[B, mlen, d_model]`
             hidden_states (list): length `n_layers`, each of which contains `[B, L, d_model]`
         Returns:
-            new_mems (list): length `n_layers`, each of which contains `[B, mlen, d_model]`
+            new_mems (list or RingMemory): length `n_layers`, each of which contains `[B, mlen, d_model]`
 
         """
+        if memory_prev is None and not torch.is_grad_enabled():
+            memory_prev = RingMemory(self.mem_len)
+        if isinstance(memory_prev, RingMemory):
+            if memory_prev.mem_len != self.mem_len:
+                memory_prev = RingMemory(self.mem_len)  # memory length has been reset
+            memory_prev.update(hidden_states)
+            return memory_prev
+
         if memory_prev is None:
             memory_prev = self.init_memory()  # 0-th to L-1-th layer
         assert len(hidden_states) == len(memory_prev)
@@ -190,6 +254,38 @@ class TransformerXL(LMBase):
 
         return new_mems
 
+    def memory_inputs(self, ys, cache):
+        """Recover inputs of each layer from outputs cached in incremental decoding.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L, d_model]`
+        Returns:
+            hidden_states (list): length `n_layers`, each of which contains a FloatTensor `[B, L, d_model]`
+
+        """
+        ys = ys[:, :cache[0].size(1)]
+        return [self.embed(ys.long()) * self.scale] + cache[:-1]
+
+    def memory_length(self, mems):
+        """Return the number of steps in memory."""
+        if mems is None:
+            return 0
+        if isinstance(mems, RingMemory):
+            return mems.length
+        return mems[0].size(1) if mems[0].dim() > 1 else 0
+
+    def embed_token_id(self, ys):
+        """Embed token IDs.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+        Returns:
+            ys_emb (FloatTensor): `[B, L, emb_dim]`
+
+        """
+        return self.dropout_emb(self.embed(ys.long()) * self.scale)
+
     def decode(self, ys, state=None, mems=None, cache=None, incremental=False,
                emb_cache=False):
         """Decode function.
@@ -197,7 +293,7 @@ class TransformerXL(LMBase):
         Args:
             ys (LongTensor): `[B, L]`
             state (list): dummy interfance for RNNLM
-            mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
+            mems (list or RingMemory): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
             cache (list): length `L`, each of which contains a FloatTensor `[B, L-1, d_model]`
             incremental (bool): ASR decoding mode
             emb_cache (bool): precompute token embeddings for fast infernece
@@ -211,11 +307,12 @@ class TransformerXL(LMBase):
         if cache is None:
             cache = [None] * self.n_layers  # 1-th to L-th layer
 
+        memory_prev = mems
+        if isinstance(mems, RingMemory):
+            mems = mems.read()
         if mems is None:
             mems = self.init_memory()
-            mlen = 0
-        else:
-            mlen = mems[0].size(1)
+        mlen = self.memory_length(mems)
 
         bs, ylen = ys.size()[:2]
         if incremental and cache[0] is not None:
@@ -228,15 +325,12 @@ class TransformerXL(LMBase):
 
         # Pre-compute embedding
         if emb_cache and self.embed_cache is None:
-            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64)
-            if self.use_cuda:
-                indices = indices.cuda()
-            self.embed_cache = self.dropout_emb(self.embed(indices) * self.scale)  # `[1, vocab, emb_dim]`
+            self.cache_embedding()
 
         if self.embed_cache is not None:
             out = self.embed_cache[ys]
         else:
-            out = self.dropout_emb(self.embed(ys.long()) * self.scale)
+            out = self.embed_token_id(ys)
 
         pos_embs = self.pos_emb(ys, mlen=mlen, zero_center_offset=self.zero_center_offset)
 
@@ -266,7 +360,7 @@ class TransformerXL(LMBase):
             return logits, out, new_cache
         else:
             # Update memory
-            new_mems = self.update_memory(mems, hidden_states)
+            new_mems = self.update_memory(memory_prev, hidden_states)
             return logits, out, new_mems
 
     def plot_attention(self, n_cols=4):
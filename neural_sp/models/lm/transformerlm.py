@@ -14,7 +14,15 @@ import torch.nn as nn
 from neural_sp.models.lm.lm_base import LMBase
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
-from neural_sp.models.torch_utils import tensor2np
+from neural_sp.models.packing import (
+    PackingStats,
+    segment_causal_mask,
+    segment_positions
+)
+from neural_sp.models.torch_utils import (
+    register_non_persistent_buffer,
+    tensor2np
+)
 from neural_sp.utils import mkdir_join
 
 import matplotlib
@@ -51,13 +59,18 @@ class TransformerLM(LMBase):
         self.pad = 3
         # NOTE: reserved in advance
 
+        # for packed sequences
+        self.pack_sequences = getattr(args, 'pack_sequences', False)
+        self.packing_stats = PackingStats()
+        if self.pack_sequences:
+            assert self.mem_len == 0
+            assert args.transformer_pe_type in ['add', 'none']
+
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
-        self.embed_cache = None
+        self.reset_cache()
+        register_non_persistent_buffer(self, 'embed_cache', None)  # `[vocab, emb_dim]`
 
         self.embed = nn.Embedding(self.vocab, self.d_model, padding_idx=self.pad)
         self.pos_enc = PositionalEncoding(self.d_model, args.dropout_in, args.transformer_pe_type,
@@ -182,8 +195,19 @@ class TransformerLM(LMBase):
                 new_mems.append(cat[:, start_idx:end_idx].detach())  # `[B, self.mem_len, d_model]`
         return new_mems
 
+    def embed_token_id(self, ys):
+        """Embed token IDs.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+        Returns:
+            ys_emb (FloatTensor): `[B, L, emb_dim]`
+
+        """
+        return self.embed(ys.long())
+
     def decode(self, ys, state=None, mems=None, cache=None, incremental=False,
-               emb_cache=False):
+               emb_cache=False, segment_ids=None):
         """Decode function.
 
         Args:
@@ -193,6 +217,7 @@ class TransformerLM(LMBase):
             cache (list): length `L`, each of which contains a FloatTensor `[B, L-1, d_model]`
             incremental (bool): ASR decoding mode
             emb_cache (bool): precompute token embeddings for fast infernece
+            segment_ids (LongTensor): `[B, L]`, attend only within each segment
         Returns:
             logits (FloatTensor): `[B, L, vocab]`
             out (FloatTensor): `[B, L, d_model]`
@@ -213,20 +238,19 @@ class TransformerLM(LMBase):
         causal_mask = ys.new_ones(ylen, ylen).byte()
         causal_mask = torch.tril(causal_mask, diagonal=0, out=causal_mask).unsqueeze(0)
         causal_mask = causal_mask.repeat([bs, 1, 1])
+        if segment_ids is not None:
+            causal_mask = segment_causal_mask(segment_ids)
 
         # Pre-compute embedding
         if emb_cache and self.embed_cache is None:
-            indices = torch.arange(0, self.vocab, 1, dtype=torch.int64)
-            if self.use_cuda:
-                indices = indices.cuda()
-            self.embed_cache = self.embed(indices)  # `[1, vocab, emb_dim]`
+            self.cache_embedding()
 
         if self.embed_cache is not None:
             out = self.embed_cache[ys]
         else:
-            out = self.embed(ys.long())
+            out = self.embed_token_id(ys)
 
-        out = self.pos_enc(out)
+        out = self.pos_enc(out, positions=segment_positions(segment_ids) if segment_ids is not None else None)
 
         new_mems = [None] * self.n_layers
         new_cache = [None] * self.n_layers
@@ -256,6 +280,48 @@ class TransformerLM(LMBase):
         else:
             return logits, out, mems
 
+    def step(self, ys, state=None, candidates=None):
+        """Predict the next token given the last tokens for ASR decoding.
+           Keys and values of the self-attention layers are cached so that
+           only the last position is computed at each step.
+
+        Args:
+            ys (LongTensor): `[B]` or `[B, 1]`, last tokens
+            state (dict): state returned in the previous step (None at the first step)
+                kv (list): length `n_layers`, each of which contains a tuple of
+                    key (FloatTensor): `[B, L-1, H, d_k]`
+                    value (FloatTensor): `[B, L-1, H, d_k]`
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            log_probs (FloatTensor): `[B, vocab]` or `[B, K]`
+            new_state (dict):
+                kv (list): length `n_layers`, each of which contains a tuple of
+                    key (FloatTensor): `[B, L, H, d_k]`
+                    value (FloatTensor): `[B, L, H, d_k]`
+
+        """
+        if '1dconv' in self.pos_enc.pe_type:
+            return super(TransformerLM, self).step(ys, state, candidates)  # re-encode the whole history
+
+        if state is None:
+            state = {'kv': [None] * self.n_layers}
+        offset = state['kv'][0][0].size(1) if state['kv'][0] is not None else 0
+
+        ys = ys.view(-1, 1)
+        if self.embed_cache is not None:
+            out = self.embed_cache[ys]
+        else:
+            out = self.embed_token_id(ys)
+        out = self.pos_enc(out, offset=offset)
+
+        new_kv = []
+        for lth, layer in enumerate(self.layers):
+            out, kv = layer.step(out, state['kv'][lth])
+            new_kv.append(kv)
+        out = self.norm_out(out)[:, 0]
+        logits = self.output(out) if self.adaptive_softmax is None else out
+        return self._log_softmax(logits, out, candidates), {'kv': new_kv}
+
     def plot_attention(self, n_cols=4):
         """Plot attention for each head in all layers."""
         from matplotlib import pyplot as plt
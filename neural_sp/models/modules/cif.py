@@ -8,7 +8,10 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.modules.initialization import init_with_xavier_uniform
-from neural_sp.models.torch_utils import make_pad_mask
+from neural_sp.models.torch_utils import (
+    cummin,
+    make_pad_mask
+)
 
 logger = logging.getLogger(__name__)
 
@@ -75,82 +78,75 @@ class CIF(nn.Module):
         alpha = torch.sigmoid(self.proj(conv_feat)).squeeze(2)  # `[B, T]`
 
         # normalization
+        device = eouts.device
+        mask = make_pad_mask(elens.to(device))
         if mode == 'parallel':
             # padding
             assert ylens is not None
-            device = eouts.device
             ylens = ylens.to(device)
-            mask = make_pad_mask(elens.to(device))
             alpha = alpha.clone().masked_fill_(mask == 0, 0)
-
             alpha_norm = alpha / alpha.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
             ymax = int(ylens.max().item())
+            n_tokens_max = ylens.long()
         elif mode == 'incremental':
-            alpha_norm = alpha  # infernece time
+            alpha_norm = alpha.masked_fill(mask == 0, 0)  # infernece time
             ymax = 1
-            if bs > 1:
-                raise NotImplementedError('Batch mode is not supported.')
-                # TODO(hirofumi0810): support batch mode
+            n_tokens_max = torch.ones(bs, dtype=torch.int64, device=device)
         else:
             raise ValueError(mode)
 
-        cv = eouts.new_zeros(bs, ymax + 1, enc_dim)
-        aws = eouts.new_zeros(bs, ymax + 1, xmax)
-        n_tokens = torch.zeros(bs, dtype=torch.int64)
-        state = eouts.new_zeros(bs, self.enc_dim)
-        alpha_accum = eouts.new_zeros(bs)
-        for j in range(xmax):
-            alpha_accum_prev = alpha_accum
-            alpha_accum += alpha_norm[:, j]
-
-            if mode == 'parallel' and (alpha_accum >= self.beta).sum() == 0:
-                # No boundary is located in all utterances in mini-batch
-                # Carry over to the next frame
-                state += alpha_norm[:, j, None] * eouts[:, j]
-                aws[:, n_tokens, j] += alpha_norm[:, j]
-            else:
-                for b in range(bs):
-                    # skip the padding region
-                    if j > elens[b] - 1:
-                        continue
-
-                    # skip all-fired utterance
-                    if mode == 'parallel' and n_tokens[b].item() >= ylens[b]:
-                        continue
-
-                    if alpha_accum[b] < self.beta:
-                        # No boundary is located
-                        # Carry over to the next frame
-                        state[b] += alpha_norm[b, j, None] * eouts[b, j]
-                        aws[b, n_tokens[b], j] += alpha_norm[b, j]
-
-                        # tail handling
-                        if mode == 'incremental' and j == elens[b] - 1:
-                            if alpha_accum[b] >= 0.5:
-                                n_tokens[b] += 1
-                                cv[b, n_tokens[b]] = state[b]
-                            break
-                    else:
-                        # A boundary is located
-                        ak1 = 1 - alpha_accum_prev[b]
-                        ak2 = alpha_norm[b, j] - ak1
-                        cv[b, n_tokens[b]] = state[b] + ak1 * eouts[b, j]
-                        aws[b, n_tokens[b], j] += ak1
-                        n_tokens[b] += 1
-                        # Carry over to the next frame
-                        state[b] = ak2 * eouts[b, j]
-                        alpha_accum[b] = ak2
-                        aws[b, n_tokens[b], j] += ak2
-
-                        if mode == 'incremental':
-                            break
-
-                if mode == 'incremental' and n_tokens[0] >= 1:
-                    break
-                    # TODO(hirofumi0810): support batch mode
+        aws, n_tokens = self.integrate(alpha_norm, mask, n_tokens_max, ymax)  # `[B, ymax + 1, T]`
+
+        fired = torch.arange(ymax, device=device).unsqueeze(0) < n_tokens.unsqueeze(1)  # `[B, ymax]`
+        if mode == 'incremental':
+            # tail handling: fire the last token if enough weights are accumulated
+            fired[:, 0] |= alpha_norm.sum(1) >= 0.5
 
         # truncate
-        cv = cv[:, :ymax]
         aws = aws[:, :ymax]
+        cv = torch.bmm(aws * fired.unsqueeze(2).to(aws.dtype), eouts)  # `[B, ymax, enc_dim]`
 
         return cv, alpha, aws
+
+    def integrate(self, alpha_norm, mask, n_tokens_max, ymax):
+        """Locate boundaries and distribute frame weights to tokens for all frames at once.
+
+        The i-th boundary is located at the first frame where the accumulated weight
+        reaches (i + beta), at most one boundary per frame. A boundary frame is split
+        into the current token and the next one so that every fired token has weights
+        summing up to 1.
+
+        Args:
+            alpha_norm (FloatTensor): `[B, T]`
+            mask (BoolTensor): `[B, T]`
+            n_tokens_max (LongTensor): `[B]`
+            ymax (int): maximum number of tokens
+        Returns:
+            aws (FloatTensor): `[B, ymax + 1, T]`
+            n_tokens (LongTensor): `[B]`
+
+        """
+        bs, xmax = alpha_norm.size()
+        # accumulate in double precision to locate boundaries robustly
+        # NOTE: a small margin absorbs rounding errors of the normalization so that the last token fires
+        a = alpha_norm.double()
+        a_accum = torch.cumsum(a, dim=1)
+        a_accum_prev = a_accum - a
+
+        # number of fired tokens until each frame, n_j = min(floor(c_j + 1 - beta), n_(j-1) + 1)
+        n_valid = torch.cumsum(mask.long(), dim=1)
+        n_fired = torch.floor(a_accum + (1 - self.beta) + 1e-4).long()
+        n_fired = n_valid + cummin(n_fired - n_valid, dim=1).clamp(max=0)
+        n_fired = torch.min(n_fired, n_tokens_max.unsqueeze(1))  # `[B, T]`
+        n_fired_prev = torch.cat([n_fired.new_zeros(bs, 1), n_fired[:, :-1]], dim=1)
+
+        fire = n_fired > n_fired_prev
+        w_cur = torch.where(fire, (n_fired_prev + 1).double() - a_accum_prev, a)
+        w_cur = w_cur.masked_fill(n_fired_prev >= n_tokens_max.unsqueeze(1), 0)  # skip all-fired utterances
+        w_next = torch.where(fire, a_accum - (n_fired_prev + 1).double(), a.new_zeros(1))
+
+        # segment-scatter frame weights into token slots (the last slot collects overflow)
+        aws = alpha_norm.new_zeros(bs, ymax + 1, xmax)
+        aws.scatter_add_(1, n_fired_prev.clamp(max=ymax).unsqueeze(1), w_cur.to(aws.dtype).unsqueeze(1))
+        aws.scatter_add_(1, (n_fired_prev + 1).clamp(max=ymax).unsqueeze(1), w_next.to(aws.dtype).unsqueeze(1))
+        return aws, n_fired[:, -1]
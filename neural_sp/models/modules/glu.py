@@ -4,6 +4,7 @@
 """Gated Linear Units (GLU) block."""
 
 from collections import OrderedDict
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -50,6 +51,8 @@ class ConvGLUBlock(nn.Module):
                           kernel_size=(1, 1)), name='weight', dim=0)
             self.dropout_residual = nn.Dropout(p=dropout)
 
+        self.kernel_size = kernel_size
+        self.in_ch = in_ch
         self.pad_left = nn.ConstantPad2d((0, 0, kernel_size - 1, 0), 0)
 
         layers = OrderedDict()
@@ -60,7 +63,7 @@ class ConvGLUBlock(nn.Module):
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             # TODO(hirofumi0810): padding?
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)
 
         elif bottlececk_dim > 0:
             layers['conv_in'] = nn.utils.weight_norm(
@@ -70,31 +73,42 @@ class ConvGLUBlock(nn.Module):
             layers['dropout_in'] = nn.Dropout(p=dropout)
             layers['conv_bottleneck'] = nn.utils.weight_norm(
                 nn.Conv2d(in_channels=bottlececk_dim,
-                          out_channels=bottlececk_dim,
+                          out_channels=bottlececk_dim * 2,
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)
             layers['conv_out'] = nn.utils.weight_norm(
                 nn.Conv2d(in_channels=bottlececk_dim,
-                          out_channels=out_ch * 2,
+                          out_channels=out_ch,
                           kernel_size=(1, 1)), name='weight', dim=0)
             layers['dropout_out'] = nn.Dropout(p=dropout)
 
         self.layers = nn.Sequential(layers)
 
-    def forward(self, xs):
+    def forward(self, xs, cache=None):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, in_ch, T, feat_dim]`
+            cache (FloatTensor): `[B, in_ch, kernel_size - 1, feat_dim]`,
+                left context of the previous inputs for incremental decoding.
+                Zero padding is used if None.
         Returns:
             out (FloatTensor): `[B, out_ch, T, feat_dim]`
+            new_cache (FloatTensor): `[B, in_ch, kernel_size - 1, feat_dim]`
+                (returned only when cache is given)
 
         """
         residual = xs
         if self.conv_residual is not None:
             residual = self.dropout_residual(self.conv_residual(residual))
-        xs = self.pad_left(xs)  # `[B, embed_dim, T+kernel-1, 1]`
+        if cache is None:
+            xs = self.pad_left(xs)  # `[B, embed_dim, T+kernel-1, 1]`
+        else:
+            xs = torch.cat([cache, xs], dim=2)
+            new_cache = xs[:, :, xs.size(2) - cache.size(2):]
         xs = self.layers(xs)  # `[B, out_ch * 2, T ,1]`
         xs = xs + residual
+        if cache is not None:
+            return xs, new_cache
         return xs
@@ -15,6 +15,7 @@ import torch.nn.functional as F
 
 from neural_sp.models.modules.causal_conv import CausalConv1d
 from neural_sp.models.modules.headdrop import headdrop
+from neural_sp.models.torch_utils import fp32_island
 
 
 logger = logging.getLogger(__name__)
@@ -95,6 +96,7 @@ class MonotonicEnergy(nn.Module):
         self.key = None
         self.mask = None
 
+    @fp32_island
     def forward(self, key, query, mask, cache=False,
                 boundary_leftmost=0):
         """Compute monotonic energy.
@@ -205,6 +207,7 @@ class ChunkEnergy(nn.Module):
         self.key = None
         self.mask = None
 
+    @fp32_island
     def forward(self, key, query, mask, cache=False,
                 boundary_leftmost=0, boundary_rightmost=100000):
         """Compute chunkwise energy.
@@ -381,6 +384,12 @@ class MoChA(nn.Module):
         # for chunkwise attention during streaming decoding
         self.key_prev_tail = key[:, -(self.w - 1):]
 
+    def _key_prev_tail(self, bs):
+        # share the tail among hypotheses unless each utterance in the batch has its own tail
+        if self.key_prev_tail.size(0) == bs:
+            return self.key_prev_tail
+        return self.key_prev_tail[0:1].repeat([bs, 1, 1])
+
     def recursive(self, e_ma, aw_prev):
         bs, n_heads_ma, qlen, klen = e_ma.size()
         p_choose = torch.sigmoid(add_gaussian_noise(e_ma, self.noise_std))  # `[B, H_ma, qlen, klen]`
@@ -407,17 +416,18 @@ class MoChA(nn.Module):
         alpha = []
         # safe_cumprod computes cumprod in logspace with numeric checks
         cumprod_1mp_choose = safe_cumprod(1 - p_choose, eps=self.eps)  # `[B, H_ma, qlen, klen]`
+        denom = 1 if self.no_denom else torch.clamp(cumprod_1mp_choose, min=self.eps, max=1.0)
+        p_cumprod = p_choose * cumprod_1mp_choose
+        # Mask the right part from the trigger point
+        if self.decot:
+            assert trigger_points is not None
+            decot_mask = decot_lookahead_mask(trigger_points, self.lookahead, klen)  # `[B, 1, qlen, klen]`
         # Compute recurrence relation solution
         for i in range(qlen):
-            denom = 1 if self.no_denom else torch.clamp(
-                cumprod_1mp_choose[:, :, i:i + 1], min=self.eps, max=1.0)
-            aw_prev = p_choose[:, :, i:i + 1] * cumprod_1mp_choose[:, :, i:i + 1] * torch.cumsum(
-                aw_prev / denom, dim=-1)  # `[B, H_ma, 1, klen]`
-            # Mask the right part from the trigger point
+            denom_i = 1 if self.no_denom else denom[:, :, i:i + 1]
+            aw_prev = p_cumprod[:, :, i:i + 1] * torch.cumsum(aw_prev / denom_i, dim=-1)  # `[B, H_ma, 1, klen]`
             if self.decot:
-                assert trigger_points is not None
-                for b in range(bs):
-                    aw_prev[b, :, :, trigger_points[b, i:i + 1] + self.lookahead + 1:] = 0
+                aw_prev = aw_prev.masked_fill(decot_mask[:, :, i:i + 1], 0)
             alpha.append(aw_prev)
 
         alpha = torch.cat(alpha, dim=2) if qlen > 1 else alpha[-1]  # `[B, H_ma, qlen, klen]`
@@ -458,23 +468,7 @@ class MoChA(nn.Module):
             alpha = p_choose_i * exclusive_cumprod(1 - p_choose_i)  # `[B, H_ma, 1 (qlen), klen]`
 
         if eps_wait > 0:
-            for b in range(bs):
-                # no boundary until the last frame for all heads
-                if alpha[b].sum() == 0:
-                    continue
-
-                leftmost = alpha[b, :, -1].nonzero()[:, -1].min().item()
-                rightmost = alpha[b, :, -1].nonzero()[:, -1].max().item()
-                for h in range(self.n_heads_ma):
-                    # no bondary at the h-th head
-                    if alpha[b, h, -1].sum().item() == 0:
-                        alpha[b, h, -1, min(rightmost, leftmost + eps_wait)] = 1
-                        continue
-
-                    # surpass acceptable latency
-                    if alpha[b, h, -1].nonzero()[:, -1].min().item() >= leftmost + eps_wait:
-                        alpha[b, h, -1, :] = 0  # reset
-                        alpha[b, h, -1, leftmost + eps_wait] = 1
+            alpha = head_synchronous_alpha(alpha, eps_wait)
 
         return alpha, None
 
@@ -549,7 +543,7 @@ class MoChA(nn.Module):
 
             if mode == 'hard':
                 if self.key_prev_tail is not None:
-                    key_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), key], dim=1)
+                    key_ = torch.cat([self._key_prev_tail(bs), key], dim=1)
                 else:
                     key_ = key
                 e_ca = self.chunk_energy(key_, query, mask, cache=cache,
@@ -600,7 +594,7 @@ class MoChA(nn.Module):
                 cv = torch.bmm(alpha.squeeze(1), value)  # `[B, 1, adim]`
             else:
                 if self.key_prev_tail is not None:
-                    value_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), value], dim=1)
+                    value_ = torch.cat([self._key_prev_tail(bs), value], dim=1)
                     cv = torch.bmm(beta.squeeze(1), value_)  # `[B, 1, adim]`
                 else:
                     cv = torch.bmm(beta.squeeze(1), value)  # `[B, 1, adim]`
@@ -662,6 +656,56 @@ def exclusive_cumprod(x):
                                     x[:, :, :, :-1]], dim=-1), dim=-1)
 
 
+def decot_lookahead_mask(trigger_points, lookahead, klen):
+    """Mask frames after trigger points plus lookahead frames for DeCoT.
+
+    Args:
+        trigger_points (IntTensor): `[B, qlen]`
+        lookahead (int): number of lookahead frames
+        klen (int): length of keys
+    Returns:
+        mask (BoolTensor): `[B, 1, qlen, klen]`, True for frames to be masked
+
+    """
+    js = torch.arange(klen, device=trigger_points.device)
+    mask = js > (trigger_points.long() + lookahead).unsqueeze(2)  # `[B, qlen, klen]`
+    return mask.unsqueeze(1)
+
+
+def head_synchronous_alpha(alpha, eps_wait):
+    """Synchronize boundaries among monotonic attention heads in MMA at test time.
+
+    Heads without a boundary are forced to attend to min(rightmost, leftmost + eps_wait),
+    and heads whose boundary surpasses leftmost + eps_wait are moved there,
+    where leftmost/rightmost are the earliest/latest boundaries among heads.
+
+    Args:
+        alpha (FloatTensor): `[B, H_ma, 1, klen]`
+        eps_wait (int): wait time delay for head-synchronous decoding
+    Returns:
+        alpha (FloatTensor): `[B, H_ma, 1, klen]`
+
+    """
+    klen = alpha.size(3)
+    js = torch.arange(klen, device=alpha.device)
+    is_bd = alpha[:, :, -1] != 0  # `[B, H_ma, klen]`
+    has_bd = is_bd.any(dim=-1)  # `[B, H_ma]`
+    first = torch.where(is_bd, js, js.new_full((1,), klen)).min(dim=-1)[0]  # `[B, H_ma]`
+    last = torch.where(is_bd, js, js.new_full((1,), -1)).max(dim=-1)[0]  # `[B, H_ma]`
+    leftmost = first.min(dim=-1, keepdim=True)[0]  # `[B, 1]`
+    rightmost = last.max(dim=-1, keepdim=True)[0]  # `[B, 1]`
+
+    # no boundary until the last frame for all heads in the utterance
+    active = has_bd.any(dim=-1, keepdim=True)  # `[B, 1]`
+    # no boundary at the head or surpass acceptable latency
+    update = active & (~has_bd | (first >= leftmost + eps_wait))  # `[B, H_ma]`
+    target = torch.where(has_bd, leftmost + eps_wait, torch.min(rightmost, leftmost + eps_wait))
+
+    alpha_sync = (js == target.unsqueeze(-1)).to(alpha.dtype)  # `[B, H_ma, klen]`
+    alpha_last = torch.where(update.unsqueeze(-1), alpha_sync, alpha[:, :, -1])
+    return torch.cat([alpha[:, :, :-1], alpha_last.unsqueeze(2)], dim=2)
+
+
 def moving_sum(x, back, forward):
     """Compute the moving sum of x over a chunk_size with the provided bounds.
 
@@ -5,11 +5,11 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
 from neural_sp.models.modules.mocha import headdrop
+from neural_sp.models.torch_utils import BandMask
 
 logger = logging.getLogger(__name__)
 
@@ -29,11 +29,15 @@ class MultiheadAttentionMechanism(nn.Module):
         bias (bool): use bias term in linear layers
         param_init (str): parameter initialization method
         xl_like: dummy argument for compatibility with relative MHA
+        attn_chunk_size: dummy argument for compatibility with relative MHA
+        fused (bool): use memory-efficient fused attention
+            (scaled_dot_product_attention) without returning attention weights
 
     """
 
     def __init__(self, kdim, qdim, adim, odim, n_heads, dropout, dropout_head=0.,
-                 atype='scaled_dot', bias=True, param_init='', xl_like=False):
+                 atype='scaled_dot', bias=True, param_init='', xl_like=False,
+                 attn_chunk_size=0, fused=False):
 
         super().__init__()
 
@@ -46,6 +50,9 @@ class MultiheadAttentionMechanism(nn.Module):
 
         self.dropout_attn = nn.Dropout(p=dropout)
         self.dropout_head = dropout_head
+        self.fused = fused and atype == 'scaled_dot'
+        if not hasattr(torch.nn.functional, 'scaled_dot_product_attention'):
+            self.fused = False
 
         if atype == 'scaled_dot':
             # for Transformer
@@ -95,7 +102,7 @@ class MultiheadAttentionMechanism(nn.Module):
             key (FloatTensor): `[B, klen, kdim]`
             value (FloatTensor): `[B, klen, vdim]`
             query (FloatTensor): `[B, qlen, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            mask (ByteTensor or BandMask): `[B, qlen, klen]`
             aw_prev: dummy interface
             cache (bool): cache key, value, and mask
             mode: dummy interface for MoChA/MMA
@@ -104,6 +111,7 @@ class MultiheadAttentionMechanism(nn.Module):
         Returns:
             cv (FloatTensor): `[B, qlen, vdim]`
             aw (FloatTensor): `[B, H, qlen, klen]`
+                None if fused attention is used
             beta: dummy interface for MoChA/MMA
             p_choose: dummy interface for MoChA/MMA
 
@@ -117,13 +125,17 @@ class MultiheadAttentionMechanism(nn.Module):
             self.value = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
             self.mask = mask
             if self.mask is not None:
-                self.mask = self.mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
-                mask_size = (bs, qlen, klen, self.n_heads)
+                mask_size = (bs, qlen, klen)
                 assert self.mask.size() == mask_size, (self.mask.size(), mask_size)
+                if not isinstance(self.mask, BandMask):
+                    self.mask = self.mask.unsqueeze(3)  # broadcast over heads
 
         key = self.key
         query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
 
+        if self.fused and not (self.dropout_head > 0 and self.training):
+            return self._forward_fused(query, bs), None, None, None
+
         if self.atype == 'scaled_dot':
             e = torch.einsum("bihd,bjhd->bijh", (query, key)) / self.scale
         elif self.atype == 'add':
@@ -131,8 +143,11 @@ class MultiheadAttentionMechanism(nn.Module):
         # e: `[B, qlen, klen, H]`
 
         # Compute attention weights
-        if self.mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+        if isinstance(self.mask, BandMask):
+            NEG_INF = float(torch.finfo(e.dtype).min)
+            e = self.mask.masked_fill_(e, NEG_INF)  # `[B, qlen, klen, H]`
+        elif self.mask is not None:
+            NEG_INF = float(torch.finfo(e.dtype).min)
             e = e.masked_fill_(self.mask == 0, NEG_INF)  # `[B, qlen, klen, H]`
         aw = torch.softmax(e, dim=2)
         aw = self.dropout_attn(aw)
@@ -150,3 +165,60 @@ class MultiheadAttentionMechanism(nn.Module):
         aw = aw.permute(0, 3, 1, 2)  # `[B, H, qlen, klen]`
 
         return cv, aw, None, None
+
+    def step(self, query, kv_cache=None):
+        """Incremental self-attention for a single query with cached keys and values.
+
+        Args:
+            query (FloatTensor): `[B, 1, qdim]`, also used as a new key and value
+            kv_cache (tuple): keys and values of previous positions (None at the first step)
+                key (FloatTensor): `[B, L-1, H, d_k]`
+                value (FloatTensor): `[B, L-1, H, d_k]`
+        Returns:
+            cv (FloatTensor): `[B, 1, vdim]`
+            kv_cache (tuple):
+                key (FloatTensor): `[B, L, H, d_k]`
+                value (FloatTensor): `[B, L, H, d_k]`
+
+        """
+        assert self.atype == 'scaled_dot'
+        bs = query.size(0)
+        key = self.w_key(query).view(bs, -1, self.n_heads, self.d_k)
+        value = self.w_value(query).view(bs, -1, self.n_heads, self.d_k)
+        if kv_cache is not None:
+            key = torch.cat([kv_cache[0], key], dim=1)
+            value = torch.cat([kv_cache[1], value], dim=1)
+        query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)
+        # NOTE: no mask is necessary since all cached positions are in the past
+
+        e = torch.einsum("bihd,bjhd->bijh", (query, key)) / self.scale  # `[B, 1, L, H]`
+        aw = self.dropout_attn(torch.softmax(e, dim=2))
+        cv = torch.einsum("bijh,bjhd->bihd", (aw, value))  # `[B, 1, H, d_k]`
+        cv = self.w_out(cv.contiguous().view(bs, -1, self.n_heads * self.d_k))
+        return cv, (key, value)
+
+    def _forward_fused(self, query, bs):
+        """Fused scaled dot-product attention without materializing attention weights.
+
+        Args:
+            query (FloatTensor): `[B, qlen, H, d_k]`
+            bs (int): batch size
+        Returns:
+            cv (FloatTensor): `[B, qlen, vdim]`
+
+        """
+        qlen = query.size(1)
+        attn_mask = None
+        if isinstance(self.mask, BandMask):
+            attn_mask = self.mask.to_dense().unsqueeze(1)  # `[B, 1, qlen, klen]`
+        elif self.mask is not None:
+            attn_mask = (self.mask != 0).squeeze(3).unsqueeze(1)  # `[B, 1, qlen, klen]`
+        if attn_mask is not None:
+            # avoid NaN for fully-masked (padded) queries
+            attn_mask = attn_mask | ~attn_mask.any(dim=-1, keepdim=True)
+        cv = torch.nn.functional.scaled_dot_product_attention(
+            query.transpose(2, 1), self.key.transpose(2, 1), self.value.transpose(2, 1),
+            attn_mask=attn_mask,
+            dropout_p=self.dropout_attn.p if self.training else 0.)  # `[B, H, qlen, d_k]`
+        cv = cv.transpose(2, 1).contiguous().view(bs, qlen, self.n_heads * self.d_k)
+        return self.w_out(cv)
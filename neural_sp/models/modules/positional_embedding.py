@@ -66,11 +66,14 @@ class PositionalEncoding(nn.Module):
 
         logger.info('Positional encoding: %s' % pe_type)
 
-    def forward(self, xs, scale=True):
+    def forward(self, xs, scale=True, offset=0, positions=None):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, T, d_model]`
+            scale (bool): multiply inputs by sqrt(d_model)
+            offset (int): position of the first frame (for incremental decoding)
+            positions (LongTensor): `[B, T]`, positions of each frame (for packed sequences)
         Returns:
             xs (FloatTensor): `[B, T, d_model]`
 
@@ -83,9 +86,13 @@ class PositionalEncoding(nn.Module):
             xs = self.dropout(xs)
             return xs
         elif self.pe_type == 'add':
-            xs = xs + self.pe[:, :xs.size(1)]
+            if positions is not None:
+                xs = xs + self.pe[0, positions]
+            else:
+                xs = xs + self.pe[:, offset:offset + xs.size(1)]
             xs = self.dropout(xs)
         elif '1dconv' in self.pe_type:
+            assert positions is None
             xs = self.pe(xs)
         else:
             raise NotImplementedError(self.pe_type)
@@ -127,7 +134,8 @@ class XLPositionalEmbedding(nn.Module):
             pos_idxs.clamp_(max=clamp_len)
 
         # outer product
-        sinusoid_inp = torch.einsum("i,j->ij", pos_idxs, self.inv_freq)
-        pos_emb = torch.cat([sinusoid_inp.sin(), sinusoid_inp.cos()], dim=-1)
+        sinusoid_inp = torch.einsum("i,j->ij", pos_idxs, self.inv_freq.float())
+        pos_emb = torch.cat([sinusoid_inp.sin(), sinusoid_inp.cos()], dim=-1).to(self.inv_freq.dtype)
+        # NOTE: positions are computed in float32 for low-precision inference
         pos_emb = self.dropout(pos_emb)
         return pos_emb.unsqueeze(1)
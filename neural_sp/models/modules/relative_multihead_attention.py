@@ -5,11 +5,12 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
 from neural_sp.models.modules.mocha import headdrop
+from neural_sp.models.torch_utils import BandMask
+from neural_sp.models.torch_utils import checkpoint
 
 
 logger = logging.getLogger(__name__)
@@ -30,11 +31,16 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
         param_init (str): parameter initialization method
         xl_like (bool): use TransformerXL like relative positional encoding.
             Otherwise, use relative positional encoding like Shaw et al. 2018
+        attn_chunk_size (int): number of queries processed at once.
+            If positive, scores are computed chunk by chunk and recomputed in backward
+            so that `[B, qlen, klen, H]` scores are never kept for long inputs.
+        fused: dummy argument for compatibility with MHA
 
     """
 
     def __init__(self, kdim, qdim, adim, odim, n_heads, dropout, dropout_head=0.,
-                 bias=False, param_init='', xl_like=False):
+                 bias=False, param_init='', xl_like=False, attn_chunk_size=0,
+                 fused=False):
 
         super().__init__()
 
@@ -43,6 +49,7 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
         self.n_heads = n_heads
         self.scale = math.sqrt(self.d_k)
         self.xl_like = xl_like
+        self.attn_chunk_size = attn_chunk_size
 
         self.dropout_attn = nn.Dropout(p=dropout)
         self.dropout_head = dropout_head
@@ -102,18 +109,94 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
                       .view_as(xs))
         return xs_shifted.view(qlen, klen, bs, n_heads).permute(2, 0, 1, 3)
 
+    def _rel_shift_chunk(self, xs, chunk, qlen, q_offset):
+        """Calculate _rel_shift for queries in [q_offset, q_offset + chunk).
+
+        Args:
+            xs (FloatTensor): `[B, chunk (+1), klen, H]`
+                position-based scores of the chunk and the next query if any
+            chunk (int): number of queries in the chunk
+            qlen (int): length of all queries
+            q_offset (int): index of the first query in the chunk
+        Returns:
+            xs_shifted (FloatTensor): `[B, chunk, klen, H]`
+
+        """
+        bs, n_rows, klen, n_heads = xs.size()
+        zero_pad = xs.new_zeros((bs, n_rows, 1, n_heads))
+        xs_pad = torch.cat([zero_pad, xs], dim=2).view(bs, n_rows * (klen + 1), n_heads)
+        # select the same flattened region as _rel_shift does for the whole sequence
+        start = qlen - q_offset
+        xs_shifted = xs_pad[:, start:start + chunk * klen].view(bs, chunk, klen, n_heads)
+        return xs_shifted
+
+    def _attend_chunk(self, q_u, q_v, k, v, pos_embs, mask, qlen, q_offset):
+        """Compute context vectors for a chunk of queries.
+
+        Args:
+            q_u (FloatTensor): `[B, chunk, H, d_k]`
+            q_v (FloatTensor): `[B, chunk (+1), H, d_k]`
+            k (FloatTensor): `[B, klen, H, d_k]`
+            v (FloatTensor): `[B, klen, H, d_k]`
+            pos_embs (FloatTensor): `[klen, H, d_k]`
+            mask (ByteTensor or BandMask): `[B, qlen, klen, 1]`
+            qlen (int): length of all queries
+            q_offset (int): index of the first query in the chunk
+        Returns:
+            cv (FloatTensor): `[B, chunk, H, d_k]`
+
+        """
+        chunk = q_u.size(1)
+        AC = torch.einsum("bihd,bjhd->bijh", (q_u, k))  # `[B, chunk, klen, H]`
+        BD = torch.einsum("bihd,jhd->bijh", (q_v, pos_embs))  # `[B, chunk (+1), klen, H]`
+        BD = self._rel_shift_chunk(BD, chunk, qlen, q_offset)
+        e = (AC + BD) / self.scale  # `[B, chunk, klen, H]`
+
+        if isinstance(mask, BandMask):
+            NEG_INF = float(torch.finfo(e.dtype).min)
+            e = mask.masked_fill_(e, NEG_INF, q_offset)
+        elif mask is not None:
+            NEG_INF = float(torch.finfo(e.dtype).min)
+            e = e.masked_fill_(mask[:, q_offset:q_offset + chunk] == 0, NEG_INF)
+        aw = torch.softmax(e, dim=2)
+        aw = self.dropout_attn(aw)
+        return torch.einsum("bijh,bjhd->bihd", (aw, v))  # `[B, chunk, H, d_k]`
+
+    def _forward_chunkwise(self, q_u, q_v, k, v, pos_embs, mask):
+        """Memory-efficient attention over chunks of queries.
+
+        Each chunk is checkpointed in training, so only a single chunk of
+        `[B, chunk, klen, H]` scores exists at a time in both forward and backward.
+
+        Returns:
+            cv (FloatTensor): `[B, qlen, H, d_k]`
+
+        """
+        qlen = q_u.size(1)
+        use_checkpoint = self.training and torch.is_grad_enabled()
+        cv = []
+        for q_offset in range(0, qlen, self.attn_chunk_size):
+            q_end = min(q_offset + self.attn_chunk_size, qlen)
+            args = (q_u[:, q_offset:q_end], q_v[:, q_offset:q_end + 1], k, v, pos_embs, mask, qlen, q_offset)
+            if use_checkpoint:
+                cv.append(checkpoint(self._attend_chunk, *args))
+            else:
+                cv.append(self._attend_chunk(*args))
+        return torch.cat(cv, dim=1)
+
     def forward(self, key, query, pos_embs, mask, u_bias=None, v_bias=None):
         """Forward pass.
 
         Args:
             cat (FloatTensor): `[B, mlen+qlen, kdim]`
-            mask (ByteTensor): `[B, qlen, mlen+qlen]`
+            mask (ByteTensor or BandMask): `[B, qlen, mlen+qlen]`
             pos_embs (LongTensor): `[qlen, 1, d_model]`
             u_bias (nn.Parameter): `[H, d_k]`
             v_bias (nn.Parameter): `[H, d_k]`
         Returns:
             cv (FloatTensor): `[B, qlen, vdim]`
             aw (FloatTensor): `[B, H, qlen, mlen+qlen]`
+                None if scores are computed chunk by chunk
 
         """
         bs, qlen = query.size()[:2]
@@ -121,9 +204,9 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
         # NOTE: cat already includes memory, i.e., klen=mlen+qlen
 
         if mask is not None:
-            mask = mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
-            assert mask.size() == (bs, qlen, mlen + qlen, self.n_heads), \
-                (mask.size(), (bs, qlen, mlen + qlen, self.n_heads))
+            assert mask.size() == (bs, qlen, mlen + qlen), (mask.size(), (bs, qlen, mlen + qlen))
+            if not isinstance(mask, BandMask):
+                mask = mask.unsqueeze(3)  # broadcast over heads
 
         k = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
         v = self.w_value(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
@@ -135,6 +218,13 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
             _pos_embs = self.w_value(pos_embs)  # NOTE: this is not w_value
         _pos_embs = _pos_embs.view(-1, self.n_heads, self.d_k)  # `[mlen+qlen, H, d_k]`
 
+        if self.attn_chunk_size > 0 and qlen > self.attn_chunk_size:
+            q_u = q + u_bias[None, None] if u_bias is not None else q
+            q_v = q + v_bias[None, None] if v_bias is not None else q
+            cv = self._forward_chunkwise(q_u, q_v, k, v, _pos_embs, mask)  # `[B, qlen, H, d_k]`
+            cv = cv.contiguous().view(bs, -1, self.n_heads * self.d_k)  # `[B, qlen, H * d_k]`
+            return self.w_out(cv), None
+
         # content-based attention term: (a) + (c)
         if u_bias is not None:
             assert self.xl_like
@@ -158,8 +248,11 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
         e = (AC + BD) / self.scale  # `[B, qlen, mlen+qlen, H]`
 
         # Compute attention weights
-        if mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+        if isinstance(mask, BandMask):
+            NEG_INF = float(torch.finfo(e.dtype).min)
+            e = mask.masked_fill_(e, NEG_INF)  # `[B, qlen, mlen+qlen, H]`
+        elif mask is not None:
+            NEG_INF = float(torch.finfo(e.dtype).min)
             e = e.masked_fill_(mask == 0, NEG_INF)  # `[B, qlen, mlen+qlen, H]`
         aw = torch.softmax(e, dim=2)
         aw = self.dropout_attn(aw)  # `[B, qlen, mlen+qlen, H]`
@@ -259,6 +259,32 @@ class TransformerDecoderBlock(nn.Module):
 
         return out
 
+    def step(self, ys, kv_cache=None):
+        """Incremental forward pass for a single position (w/o source-target attention).
+
+        Args:
+            ys (FloatTensor): `[B, 1, d_model]`
+            kv_cache (tuple): keys and values of the self-attention layer
+                key (FloatTensor): `[B, L-1, H, d_k]`
+                value (FloatTensor): `[B, L-1, H, d_k]`
+        Returns:
+            out (FloatTensor): `[B, 1, d_model]`
+            kv_cache (tuple):
+                key (FloatTensor): `[B, L, H, d_k]`
+                value (FloatTensor): `[B, L, H, d_k]`
+
+        """
+        assert not (self.src_tgt_attention or self.memory_transformer or self.lm_fusion)
+        self.reset_visualization()
+
+        # self-attention
+        out, kv_cache = self.self_attn.step(self.norm1(ys), kv_cache)
+        out = self.dropout(out) + ys
+
+        # position-wise feed-forward
+        out = self.dropout(self.feed_forward(self.norm3(out))) + out
+        return out, kv_cache
+
 
 class SyncBidirTransformerDecoderBlock(nn.Module):
     """A single layer of the synchronous bidirectional Transformer decoder.
@@ -0,0 +1,137 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Utilities for training with packed sequences.
+
+Multiple short sequences are concatenated into a row, and each of them is
+distinguished by a segment ID so that attention and recurrent states do not
+cross sequence boundaries.
+"""
+
+import logging
+import numpy as np
+import torch
+
+from neural_sp.models.torch_utils import cummax
+
+logger = logging.getLogger(__name__)
+
+
+def pack_lengths(lens, max_len):
+    """Assign sequences to rows by first-fit-decreasing bin packing.
+
+    Args:
+        lens (list): length `[N]`, lengths of sequences
+        max_len (int): capacity of each row (not smaller than max(lens))
+    Returns:
+        rows (list): length `[R]`, each of which contains indices of sequences in the row
+
+    """
+    rows, spaces = [], []
+    for i in sorted(range(len(lens)), key=lambda i: lens[i], reverse=True):
+        for r, space in enumerate(spaces):
+            if lens[i] <= space:
+                rows[r].append(i)
+                spaces[r] -= lens[i]
+                break
+        else:
+            rows.append([i])
+            spaces.append(max_len - lens[i])
+    return rows
+
+
+def segment_positions(segment_ids):
+    """Compute positions in each segment.
+
+    Args:
+        segment_ids (LongTensor): `[B, L]`
+    Returns:
+        positions (LongTensor): `[B, L]`
+
+    """
+    bs, ylen = segment_ids.size()
+    ts = torch.arange(ylen, device=segment_ids.device).unsqueeze(0).expand(bs, -1)
+    is_start = torch.ones_like(segment_ids, dtype=torch.bool)
+    is_start[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+    starts = cummax(ts.masked_fill(~is_start, 0), dim=1)
+    return ts - starts
+
+
+def segment_causal_mask(segment_ids):
+    """Make a block-diagonal causal self-attention mask.
+
+    Args:
+        segment_ids (LongTensor): `[B, L]`
+    Returns:
+        mask (BoolTensor): `[B, L (query), L (key)]`
+
+    """
+    ylen = segment_ids.size(1)
+    causal_mask = torch.tril(segment_ids.new_ones(ylen, ylen, dtype=torch.bool))
+    return (segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)) & causal_mask.unsqueeze(0)
+
+
+class PackingStats(object):
+    """Accumulate statistics of packed mini-batches."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_seqs = 0
+        self.n_rows = 0
+        self.n_tokens = 0
+        self.n_slots = 0
+        self.n_slots_unpacked = 0
+
+    def add(self, seq_lens, n_rows, row_len):
+        """Add a mini-batch.
+
+        Args:
+            seq_lens (list): lengths of sequences in the mini-batch
+            n_rows (int): number of rows after packing
+            row_len (int): length of each row after packing
+
+        """
+        if len(seq_lens) == 0:
+            return
+        self.n_seqs += len(seq_lens)
+        self.n_rows += n_rows
+        self.n_tokens += int(np.sum(seq_lens))
+        self.n_slots += n_rows * row_len
+        self.n_slots_unpacked += len(seq_lens) * int(np.max(seq_lens))
+
+    def summary(self):
+        """Summarize statistics.
+
+        Returns:
+            stats (dict):
+                seqs_per_row (float): average number of sequences per row
+                efficiency (float): ratio of real tokens to all token slots
+                efficiency_unpacked (float): ratio of real tokens to all token slots
+                    when each sequence is padded to the longest one in the mini-batch
+
+        """
+        if self.n_rows == 0:
+            return None
+        return {'seqs_per_row': self.n_seqs / self.n_rows,
+                'efficiency': self.n_tokens / self.n_slots,
+                'efficiency_unpacked': self.n_tokens / self.n_slots_unpacked}
+
+
+def report_packing_stats(stats, reporter):
+    """Log packing statistics since the last call and add them to tensorboard.
+
+    Args:
+        stats (PackingStats):
+        reporter (Reporter):
+
+    """
+    summary = stats.summary()
+    if summary is None:
+        return
+    logger.info('packing: %.2f sequences/row, efficiency: %.3f (%.3f w/o packing)' % (
+        summary['seqs_per_row'], summary['efficiency'], summary['efficiency_unpacked']))
+    for k, v in summary.items():
+        reporter.add_tensorboard_scalar('packing/' + k, v)
+    stats.reset()
@@ -6,11 +6,7 @@
 import numpy as np
 import torch
 
-from neural_sp.models.torch_utils import (
-    np2tensor,
-    pad_list,
-    tensor2np,
-)
+from neural_sp.models.torch_utils import tensor2np
 
 
 class BeamSearch(object):
@@ -103,24 +99,69 @@ class BeamSearch(object):
             lmout, lmstate, scores_lm = lm.predict(y, lmstate, emb_cache=emb_cache)
         return lmout, lmstate, scores_lm
 
+    def update_lm_state(self, lm, hyp, y):
+        """Update LM state for a single hypothesis for shallow fusion.
+
+        Args:
+            lm (LMBase): language model
+            hyp (dict): beam candiate
+            y (LongTensor): `[1, 1]`
+        Returns:
+            lmstate (dict):
+            scores_lm (FloatTensor): `[1, 1, vocab]`
+
+        """
+        lmstate, scores_lm = None, None
+        if lm is not None:
+            scores_lm, lmstate = lm.step(y, hyp['lmstate'])
+            scores_lm = scores_lm.unsqueeze(1)
+        return lmstate, scores_lm
+
+    def update_lm_state_batch(self, lm, hyps, y, candidates=None):
+        """Update LM state in batch-mode for shallow fusion.
+
+        Args:
+            lm (LMBase): language model
+            hyps (List[dict]): beam candidates
+            y (LongTensor): `[B, 1]`
+            candidates (LongTensor): `[B, K]`, token ids to be scored (all tokens if None)
+        Returns:
+            lmstate (dict):
+            scores_lm (FloatTensor): `[B, 1, vocab]` or `[B, 1, K]`
+
+        """
+        lmstate, scores_lm = None, None
+        if lm is not None:
+            lmstate = lm.merge_states([beam['lmstate'] for beam in hyps])
+            scores_lm, lmstate = lm.step(y, lmstate, candidates)
+            scores_lm = scores_lm.unsqueeze(1)
+        return lmstate, scores_lm
+
     def lm_rescoring(self, hyps, lm, lm_weight, reverse=False, normalize=False,
                      tag=''):
+        """Rescore N-best hypotheses with an LM in batch.
+
+        Args:
+            hyps (List[dict]): beam candidates
+            lm (LMBase): language model
+            lm_weight (float): weight of the LM score
+            reverse (bool): rescore with a backward LM
+            normalize (bool): normalize the LM score by length
+            tag (str): suffix of the key to save LM scores
+
+        """
         if lm is None:
             return
-        for i in range(len(hyps)):
-            ys = hyps[i]['hyp']  # include <sos>
-            if reverse:
-                ys = ys[::-1]
-
-            ys = [np2tensor(np.fromiter(ys, dtype=np.int64), self.device)]
-            ys_in = pad_list([y[:-1] for y in ys], -1)  # `[1, L-1]`
-            ys_out = pad_list([y[1:] for y in ys], -1)  # `[1, L-1]`
+        ys = [np.fromiter(hyp['hyp'], dtype=np.int64) for hyp in hyps]  # include <sos>
+        if reverse:
+            ys = [y[::-1] for y in ys]
+        scores_lm = lm.score_sequences(ys)
 
-            if ys_in.size(1) > 0:
-                _, _, scores_lm = lm.predict(ys_in, None)
-                score_lm = sum([scores_lm[0, t, ys_out[0, t]] for t in range(ys_out.size(1))])
+        for i in range(len(hyps)):
+            if len(ys[i]) > 1:
+                score_lm = scores_lm[i]
                 if normalize:
-                    score_lm /= ys_out.size(1)  # normalize by length
+                    score_lm = score_lm / (len(ys[i]) - 1)  # normalize by length
             else:
                 score_lm = 0
 
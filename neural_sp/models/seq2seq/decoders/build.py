@@ -61,7 +61,8 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             mma_first_layer=args.mocha_first_layer,
             share_chunkwise_attention=args.share_chunkwise_attention,
             external_lm=external_lm,
-            lm_fusion=args.lm_fusion)
+            lm_fusion=args.lm_fusion,
+            pack_sequences=args.pack_sequences)
 
     elif args.dec_type in ['lstm_transducer', 'gru_transducer']:
         from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
@@ -16,6 +16,7 @@ from neural_sp.models.criterion import kldiv_lsm_ctc
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
+    fp32_island,
     make_pad_mask,
     np2tensor,
     pad_list,
@@ -128,6 +129,7 @@ class CTC(DecoderBase):
 
         return loss, trigger_points
 
+    @fp32_island
     def loss_fn(self, logits, ys_ctc, elens, ylens):
         if self.use_warpctc:
             loss = self.ctc_loss(logits, ys_ctc, elens.cpu(), ylens).to(logits.device)
@@ -314,8 +316,8 @@ class CTC(DecoderBase):
 
                     # Update LM states for shallow fusion
                     if lm is not None:
-                        _, lmstate, lm_log_probs = lm.predict(
-                            eouts.new_zeros(1, 1).fill_(hyp[-1]), beam[i_beam]['lmstate'])
+                        lm_log_probs, lmstate = lm.step(
+                            eouts.new_zeros(1, 1, dtype=torch.int64).fill_(hyp[-1]), beam[i_beam]['lmstate'])
                     else:
                         lmstate = None
 
@@ -341,7 +343,7 @@ class CTC(DecoderBase):
                         score_ctc = np.logaddexp(new_p_b, new_p_nb)
                         score_lp = (len(hyp[1:]) + 1) * lp_weight
                         if lm_weight > 0 and lm is not None:
-                            local_score_lm = lm_log_probs[0, 0, c].item() * lm_weight
+                            local_score_lm = lm_log_probs[0, c].item() * lm_weight
                             score_lm += local_score_lm
                         new_beam.append({'hyp': hyp + [c],
                                          'score': score_ctc + score_lm + score_lp,
@@ -610,7 +612,8 @@ class CTCPrefixScore(object):
         self.eos = eos
         self.xlen_prev = 0
         self.xlen = len(log_probs)
-        self.log_probs = log_probs
+        self.log_probs = np.asarray(log_probs, dtype=np.float32)
+        # NOTE: accumulate in float32 even if the model runs in reduced precision
         self.log0 = LOG_0
 
         self.truncate = truncate
@@ -634,7 +637,7 @@ class CTCPrefixScore(object):
 
     def register_new_chunk(self, log_probs_chunk):
         self.xlen_prev = self.xlen
-        self.log_probs = np.concatenate([self.log_probs, log_probs_chunk], axis=0)
+        self.log_probs = np.concatenate([self.log_probs, log_probs_chunk.astype(np.float32)], axis=0)
         self.xlen = len(self.log_probs)
 
     def __call__(self, hyp, cs, r_prev, new_chunk=False):
@@ -11,7 +11,7 @@ import random
 import torch
 import torch.nn as nn
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import batch_edit_distance
 from neural_sp.models.criterion import (
     cross_entropy_lsm,
     distillation,
@@ -48,6 +48,8 @@ random.seed(1)
 
 logger = logging.getLogger(__name__)
 
+LOG_0 = -1e10
+
 
 class RNNDecoder(DecoderBase):
     """RNN decoder.
@@ -487,63 +489,41 @@ class RNNDecoder(DecoderBase):
             N_best = recog_params['recog_beam_width']
             alpha = 1.0
             assert N_best >= 2
-            loss_mbr = 0.
-            loss_ce = 0.
             bs = eouts.size(0)
-            for b in range(bs):
-                # 1. beam search
-                self.eval()
-                with torch.no_grad():
-                    nbest_hyps_id, _, log_scores = self.beam_search(
-                        eouts[b:b + 1], elens[b:b + 1], params=recog_params,
-                        nbest=N_best, exclude_eos=True)
-                nbest_hyps_id_b = [np.fromiter(y, dtype=np.int64) for y in nbest_hyps_id[0]]
-                log_scores_b = np2tensor(np.array(log_scores[0], dtype=np.float32), eouts.device)
-                scores_b_norm = torch.softmax(alpha * log_scores_b, dim=-1)  # `[N_best]`
-                # print((scores_b_norm * 100).int())
-
-                # 2. calculate expected WER
-                wers_b = np2tensor(np.array([
-                    compute_wer(ref=idx2token(ys[b]).split(' '),
-                                hyp=idx2token(nbest_hyps_id_b[n]).split(' '))[0] / 100
-                    for n in range(N_best)], dtype=np.float32), eouts.device)
-                exp_wer_b = (scores_b_norm * wers_b).sum()
-                grad_b = (scores_b_norm * (wers_b - exp_wer_b)).sum()
-                # print(wers_b)
-                # print(exp_wer_b)
-                # print(scores_b_norm * (wers_b - exp_wer_b))
-                # print(grad_b)
-
-                # 3. forward pass (teacher-forcing with hypotheses)
-                self.train()
-                logits_b = self.forward_mbr(eouts[b:b + 1].repeat([N_best, 1, 1]),
-                                            elens[b:b + 1].repeat([N_best]),
-                                            nbest_hyps_id_b)
-                log_probs_b = torch.log_softmax(logits_b, dim=-1)  # `[nbest, L, vocab]`
-
-                # 4. backward pass (attach gradient)
-                _eos = eouts.new_zeros((1,), dtype=torch.int64).fill_(self.eos)
-                nbest_hyps_id_b_pad = pad_list([torch.cat([np2tensor(y, eouts.device), _eos], dim=0)
-                                                for y in nbest_hyps_id_b], self.pad)
-                loss_mbr += self.mbr(log_probs_b, nbest_hyps_id_b_pad, exp_wer_b, grad_b)
-
-                # 4. calculate MBR loss
-                # loss_mbr_b, scores_b = minimum_bayes_risk(log_probs_b, nbest_hyps_id_b, wers_b,
-                #                                           self.eos, self.pad)
-                # loss_mbr += loss_mbr_b
-
-                # 5. CE loss regularization
-                loss_ce += self.forward_att(eouts[b:b + 1], elens[b:b + 1], ys[b:b + 1])[0]
-
-                # ys_out_b = append_sos_eos([ys[b]], self.eos, self.eos, self.pad, eouts.device)[1]
-                # ys_out_b = ys_out_b.repeat([N_best, 1])
-                # # NOTE: truncate to match the lengths
-                # ymax = min(logits_b.size(1), ys_out_b.size(1))
-                # logits_b = logits_b[:, :ymax].contiguous()
-                # ys_out_b = ys_out_b[:, :ymax].contiguous()
-                # for k in range(N_best):
-                #     loss_ce_k = cross_entropy_lsm(logits_b, ys_out_b, 0, self.pad, self.training)[0]
-                #     loss_ce += loss_ce_k * scores_b_norm[k]
+
+            # 1. batched beam search
+            self.eval()
+            with torch.no_grad():
+                nbest_hyps_id, log_scores = self.generate_nbest(eouts, elens, recog_params, N_best)
+            n_hyps = [len(hyps_b) for hyps_b in nbest_hyps_id]
+            nbest_hyps_id = [hyp for hyps_b in nbest_hyps_id for hyp in hyps_b]
+            log_scores = pad_list(log_scores, float('-inf'))  # `[B, N_max]`
+            scores_norm = torch.softmax(alpha * log_scores, dim=-1)  # `[B, N_max]`
+
+            # 2. calculate expected WER
+            utt_ids = torch.repeat_interleave(torch.arange(bs, device=eouts.device),
+                                              torch.tensor(n_hyps, device=eouts.device))
+            wers = self.compute_risks([ys[b] for b in tensor2np(utt_ids)], nbest_hyps_id,
+                                      idx2token, eouts.device)
+            mask = make_pad_mask(torch.tensor(n_hyps, device=eouts.device))  # `[B, N_max]`
+            wers = wers.new_zeros(mask.size()).masked_scatter_(mask, wers)
+            exp_wer = (scores_norm * wers).sum(1)  # `[B]`
+            grads = alpha * scores_norm * (wers - exp_wer.unsqueeze(1))  # `[B, N_max]`
+
+            # 3. forward pass (teacher-forcing with hypotheses)
+            self.train()
+            logits = self.forward_mbr(eouts[utt_ids], elens[utt_ids.to(elens.device)], nbest_hyps_id)
+            log_probs = torch.log_softmax(logits, dim=-1)  # `[N_total, L, vocab]`
+
+            # 4. backward pass (attach gradient per hypothesis)
+            _eos = eouts.new_zeros((1,), dtype=torch.int64).fill_(self.eos)
+            nbest_hyps_id_pad = pad_list([torch.cat([np2tensor(y, eouts.device), _eos], dim=0)
+                                          for y in nbest_hyps_id], -1)
+            loss_mbr = self.mbr(log_probs, nbest_hyps_id_pad, exp_wer.sum(0, keepdim=True),
+                                grads[mask].view(-1, 1, 1))
+
+            # 5. CE loss regularization (summed over utterances)
+            loss_ce = self.forward_att(eouts, elens, ys)[0] * bs
 
             # NOTE: MBR loss is accumlated over N-best and mini-batch
             loss = loss_mbr + loss_ce * self.mbr_ce_weight
@@ -618,6 +598,141 @@ class RNNDecoder(DecoderBase):
         logits = self.output(torch.cat(logits, dim=1))
         return logits
 
+    def generate_nbest(self, eouts, elens, params, nbest):
+        """Generate N-best lists for MBR training with batched beam search.
+
+        Beams of all utterances are decoded as a single batch of size `[B * beam_width]`,
+        and identical hypotheses in each N-best list are merged. Neither an external LM
+        nor CTC scores are used.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            nbest (int): maximum number of hypotheses per utterance
+        Returns:
+            nbest_hyps_idx (list): length `B`, each of which contains arrays of size `[L]` (w/o <eos>)
+            log_scores (list): length `B`, each of which contains FloatTensor of size `[N_b]`
+
+        """
+        bs = eouts.size(0)
+        beam_width = max(nbest, params['recog_beam_width'])
+        max_len_ratio = params['recog_max_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        device = eouts.device
+
+        # Initialization
+        eouts = eouts.repeat_interleave(beam_width, dim=0)
+        src_mask = make_pad_mask(elens.repeat_interleave(beam_width, dim=0).to(device)).unsqueeze(1)
+        dstates = self.zero_state(bs * beam_width)
+        cv = eouts.new_zeros(bs * beam_width, 1, self.enc_n_units)
+        self.score.reset()
+        aw = None
+        lmout, lmstate = None, None
+        y = eouts.new_zeros((bs * beam_width, 1), dtype=torch.int64).fill_(self.eos)
+
+        # only the first beam is alive at the beginning
+        scores = eouts.new_full((bs, beam_width), LOG_0)
+        scores[:, 0] = 0
+        hyps = eouts.new_zeros((bs, beam_width, 0), dtype=torch.int64)
+        ylens = eouts.new_zeros((bs, beam_width), dtype=torch.int64)  # including <eos>
+        eos_flags = eouts.new_zeros((bs, beam_width), dtype=torch.bool)
+        offsets = torch.arange(bs, device=device).unsqueeze(1) * beam_width  # `[B, 1]`
+        ymax_b = torch.ceil(elens.to(device).float() * max_len_ratio).long().clamp(min=1)  # `[B]`
+        for i in range(int(ymax_b.max())):
+            # Update LM states for LM fusion
+            if self.lm is not None:
+                lmout, lmstate, _ = self.lm.predict(y, lmstate)
+
+            # Recurrency -> Score -> Generate
+            y_emb = self.dropout_emb(self.embed(y))
+            dstates, cv, aw, attn_v, _, _ = self.decode_step(
+                eouts, dstates, cv, y_emb, src_mask, aw, lmout)
+            log_probs = torch.log_softmax(self.output(attn_v).squeeze(1), dim=-1)
+            log_probs = log_probs.view(bs, beam_width, -1)
+
+            # finished hypotheses are extended only with <eos> without changing scores,
+            # and <eos> is forced at the maximum length
+            force_eos = eos_flags | (i + 1 >= ymax_b).unsqueeze(1)
+            log_probs_eos = log_probs[:, :, self.eos].masked_fill(eos_flags, 0)
+            log_probs = log_probs.masked_fill(force_eos.unsqueeze(2), LOG_0)
+            log_probs[:, :, self.eos] = log_probs_eos
+
+            # Pick up top-K candidates over all beams per utterance
+            scores, topk_ids = (scores.unsqueeze(2) + log_probs).view(bs, -1).topk(beam_width, dim=1)
+            beam_ids = topk_ids // self.vocab
+            y = topk_ids % self.vocab
+            hyps = torch.cat([hyps.gather(1, beam_ids.unsqueeze(2).expand_as(hyps)),
+                              y.unsqueeze(2)], dim=2)
+            eos_flags_prev = eos_flags.gather(1, beam_ids)
+            ylens = ylens.gather(1, beam_ids) + (~eos_flags_prev).long()
+            eos_flags = eos_flags_prev | (y == self.eos)
+            y = y.view(-1, 1)
+
+            # Reorder states
+            ids = (offsets + beam_ids).view(-1)
+            hxs, cxs = dstates['dstate']
+            dstates = {'dstate': (hxs[:, ids], cxs[:, ids] if self.rnn_type == 'lstm' else None)}
+            cv = cv[ids]
+            if aw is not None:
+                aw = aw[ids]
+            if getattr(self.score, 'myu', None) is not None:
+                self.score.myu = self.score.myu[ids]  # GMM attention
+            if lmstate is not None:
+                lmstate = self.lm.reorder_state(lmstate, ids)
+
+            if bool(eos_flags.all()):
+                break
+
+        # Add length penalty
+        scores = scores + ylens.float() * lp_weight
+        if length_norm:
+            scores = scores / ylens.float()
+
+        # Merge identical hypotheses and pick up N-best
+        hyps = tensor2np(hyps)
+        ylens = tensor2np(ylens)
+        valid = tensor2np(scores > LOG_0 / 2)
+        scores_np = tensor2np(scores)
+        nbest_hyps_idx, log_scores = [], []
+        for b in range(bs):
+            hyp2score = {}
+            for k in range(beam_width):
+                if not valid[b, k]:
+                    continue
+                hyp = tuple(hyps[b, k, :ylens[b, k] - 1])
+                if hyp not in hyp2score or hyp2score[hyp] < scores_np[b, k]:
+                    hyp2score[hyp] = scores_np[b, k]
+            hyp_scores = sorted(hyp2score.items(), key=lambda x: x[1], reverse=True)[:nbest]
+            nbest_hyps_idx.append([np.array(hyp, dtype=np.int64) for hyp, _ in hyp_scores])
+            log_scores.append(np2tensor(np.array([score for _, score in hyp_scores], dtype=np.float32), device))
+        return nbest_hyps_idx, log_scores
+
+    def compute_risks(self, refs, hyps, idx2token, device):
+        """Compute word error rates of hypotheses with a batched edit-distance kernel.
+
+        Args:
+            refs (list): length `N`, each of which contains a list of size `[L]`
+            hyps (list): length `N`, each of which contains arrays of size `[L]`
+            idx2token (): converter from index to token (token errors are computed if None)
+            device (torch.device):
+        Returns:
+            risks (FloatTensor): `[N]`, the number of errors divided by the reference length
+
+        """
+        if idx2token is not None:
+            # map words to integers shared in the mini-batch
+            word2idx = {}
+            refs = [[word2idx.setdefault(w, len(word2idx)) for w in idx2token(y).split()] for y in refs]
+            hyps = [[word2idx.setdefault(w, len(word2idx)) for w in idx2token(y).split()] for y in hyps]
+        ref_lens = torch.tensor([len(y) for y in refs], dtype=torch.int64)
+        hyp_lens = torch.tensor([len(y) for y in hyps], dtype=torch.int64)
+        refs = pad_list([np2tensor(np.array(y, dtype=np.int64), device) for y in refs], -1)
+        hyps = pad_list([np2tensor(np.array(y, dtype=np.int64), device) for y in hyps], -1)
+        risks = batch_edit_distance(refs, hyps, ref_lens, hyp_lens).float()
+        return risks / ref_lens.to(risks.device).clamp(min=1).float()
+
     def forward_att(self, eouts, elens, ys,
                     return_logits=False, teacher_logits=None,
                     ctc_trigger_points=None, forced_trigger_points=None):
@@ -1098,6 +1213,10 @@ class RNNDecoder(DecoderBase):
         lm_second = helper.verify_lm_eval_mode(lm_second, lm_weight_second)
         lm_second_bwd = helper.verify_lm_eval_mode(lm_second_bwd, lm_weight_second_bwd)
         trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+        # NOTE: score only top-K candidates with adaptive softmax so that
+        # tail clusters without any candidate are skipped
+        score_lm_topk = lm is not None and self.lm is None and not isinstance(lm, TransformerXL) and \
+            lm.adaptive_softmax is not None
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
@@ -1123,6 +1242,8 @@ class RNNDecoder(DecoderBase):
                     ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
                 ctc_state = ctc_prefix_scorer.initial_state()
 
+            if not (lm_state_CO and speakers is not None and speakers[b] == self.prev_spk):
+                self.lmmemory = None  # TransformerXL memory is carried over within the same session only
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
                     if asr_state_CO:
@@ -1133,13 +1254,11 @@ class RNNDecoder(DecoderBase):
                         elif isinstance(lm, TransformerLM):
                             ys_prev = self.lmstate_final
                             # Re-encode past tokens here
-                            _, lmstate, _ = lm.predict(ys_prev)
+                            for t in range(ys_prev.size(1)):
+                                _, lmstate = lm.step(ys_prev[:, t], lmstate)
                             ys = torch.cat([ys_prev, ys], dim=1)
-                        # elif isinstance(lm, TransformerXL):
-                        #     ys_prev = self.lmstate_final
-                        #     # Re-encode past tokens here
-                        #     _, lmstate, _ = lm.predict(ys_prev, mems=self.lmmemory)
-                        #     ys = torch.cat([ys_prev, ys], dim=1)
+                        # NOTE: TransformerXL attends to past tokens through self.lmmemory
+                        # without re-encoding
                 else:
                     self.dstates_final = None  # reset
                     self.lmstate_final = None  # reset
@@ -1168,32 +1287,21 @@ class RNNDecoder(DecoderBase):
 
                 # Update LM states for LM fusion
                 lmout, lmstate, scores_lm = None, None, None
-                if lm is not None or self.lm is not None:
-                    if trfm_lm:
-                        y_lm = eouts.new_zeros((len(hyps), beam['ys'].size(1)), dtype=torch.int64)
-                        for j, cand in enumerate(hyps):
-                            y_lm[j, :] = cand['ys']
-                    else:
-                        y_lm = y
-
-                    if i > 0 or (i == 0 and trfm_lm and lm_state_CO and self.lmstate_final is not None):
-                        if isinstance(lm, RNNLM):
-                            lmstate = {'hxs': torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1),
-                                       'cxs': torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)}
-                        elif trfm_lm:
-                            if isinstance(lm, TransformerLM):
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
-                            elif i > 0:
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
-
-                    if self.lm is not None:  # cold/deep fusion
-                        lmout, lmstate, scores_lm = self.lm.predict(y_lm, lmstate)
-                    elif lm is not None:  # shallow fusion
-                        lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
-                                                               mems=self.lmmemory,
-                                                               cache=lmstate if cache_states else None)
+                if self.lm is not None:  # cold/deep fusion
+                    lmstate = self.lm.merge_states([beam['lmstate'] for beam in hyps])
+                    lmout, lmstate, scores_lm = self.lm.predict(y, lmstate)
+                elif isinstance(lm, TransformerXL):  # shallow fusion with memory
+                    y_lm = eouts.new_zeros((len(hyps), beam['ys'].size(1)), dtype=torch.int64)
+                    for j, cand in enumerate(hyps):
+                        y_lm[j, :] = cand['ys']
+                    if i > 0:
+                        lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
+                                   for lth in range(lm.n_layers)]
+                    lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
+                                                           mems=self.lmmemory,
+                                                           cache=lmstate if cache_states else None)
+                elif lm is not None and not score_lm_topk:  # shallow fusion
+                    lmstate, scores_lm = helper.update_lm_state_batch(lm, hyps, y)
 
                 # for the main model
                 dstates, cv, aw, attn_v, _, _ = self.decode_step(
@@ -1224,17 +1332,29 @@ class RNNDecoder(DecoderBase):
                 # Ensemble
                 scores_att = torch.log(probs / (len(ensmbl_decs) + 1))
 
+                # Score only top-K candidates of each hypothesis with the LM
+                if score_lm_topk:
+                    topk_ids_all = torch.topk(scores_att, k=beam_width, dim=1, largest=True, sorted=True)[1]
+                    lmstate, scores_lm = helper.update_lm_state_batch(lm, hyps, y, topk_ids_all)
+
                 new_hyps = []
                 for j, beam in enumerate(hyps):
                     # Attention scores
                     total_scores_att = beam['score_att'] + scores_att[j:j + 1]
                     total_scores = total_scores_att * (1 - ctc_weight)
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+                    if score_lm_topk:
+                        topk_ids = topk_ids_all[j:j + 1]
+                        total_scores_topk = torch.gather(total_scores, 1, topk_ids)
+                    else:
+                        total_scores_topk, topk_ids = torch.topk(
+                            total_scores, k=beam_width, dim=1, largest=True, sorted=True)
 
                     # Add LM score <after> top-K selection
                     if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
+                        if score_lm_topk:
+                            total_scores_lm = beam['score_lm'] + scores_lm[j, -1]
+                        else:
+                            total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
                         total_scores_topk += total_scores_lm * lm_weight
                     else:
                         total_scores_lm = eouts.new_zeros(beam_width)
@@ -1289,13 +1409,12 @@ class RNNDecoder(DecoderBase):
 
                         new_lmstate = None
                         if lmstate is not None:
-                            if isinstance(lm, RNNLM) or isinstance(self.lm, RNNLM):
-                                new_lmstate = {'hxs': lmstate['hxs'][:, j:j + 1],
-                                               'cxs': lmstate['cxs'][:, j:j + 1]}
-                            elif trfm_lm:
+                            if self.lm is not None:
+                                new_lmstate = self.lm.reorder_state(lmstate, [j])
+                            elif isinstance(lm, TransformerXL):
                                 new_lmstate = [lmstate_l[j:j + 1] for lmstate_l in lmstate]
                             else:
-                                raise ValueError
+                                new_lmstate = lm.reorder_state(lmstate, [j])
 
                         ys = torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1)
 
@@ -1403,8 +1522,11 @@ class RNNDecoder(DecoderBase):
             self.lmstate_final = end_hyps[0]['lmstate']
         elif trfm_lm:
             if isinstance(lm, TransformerXL):
-                self.lmmemory = lm.update_memory(self.lmmemory, end_hyps[0]['lmstate'])
-                logging.info('Memory: %d' % self.lmmemory[0].size(1))
+                if end_hyps[0]['lmstate'] is not None:
+                    with torch.no_grad():
+                        self.lmmemory = lm.update_memory(
+                            self.lmmemory, lm.memory_inputs(end_hyps[0]['ys'], end_hyps[0]['lmstate']))
+                logging.info('Memory: %d' % lm.memory_length(self.lmmemory))
             else:
                 ys = end_hyps[0]['ys']
                 # Exclude the last state corresponding to <eos>
@@ -1507,8 +1629,13 @@ class RNNDecoder(DecoderBase):
             dstates = {'dstate': (hxs, cxs)}
 
             # Update LM states for LM fusion
-            lmout, lmstate, scores_lm = helper.update_rnnlm_state_batch(
-                self.lm if self.lm is not None else lm, hyps, y, emb_cache=emb_cache)
+            if self.lm is not None:  # cold/deep fusion
+                lm_fusion = self.lm
+                lmout, lmstate, scores_lm = helper.update_rnnlm_state_batch(self.lm, hyps, y, emb_cache=emb_cache)
+            else:  # shallow fusion
+                lm_fusion = lm
+                lmout = None
+                lmstate, scores_lm = helper.update_lm_state_batch(lm, hyps, y)
 
             if self.embed_cache is not None:
                 y_emb = self.embed_cache[y]
@@ -1577,8 +1704,7 @@ class RNNDecoder(DecoderBase):
                          'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1])},
                          'cv': cv[j:j + 1],
                          'aws': beam['aws'] + [aw[j:j + 1]],
-                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                         'lmstate': lm_fusion.reorder_state(lmstate, [j]) if lmstate is not None else None,
                          'ctc_state': new_ctc_states[k] if self.ctc_prefix_scorer is not None else None,
                          'no_boundary': no_boundary})
 
@@ -15,6 +15,7 @@ from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.ctc import CTC
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import (
+    fp32_island,
     np2tensor,
     pad_list,
     repeat,
@@ -244,12 +245,27 @@ class RNNTransducer(DecoderBase):
         logits = self.joint(eouts, dout)  # `[B, T, L+1, vocab]`
 
         # Compute Transducer loss
+        assert logits.size(2) == ys_out.size(1) + 1
+        return self.loss_fn(logits, ys_out, elens, ylens)
+
+    @fp32_island
+    def loss_fn(self, logits, ys_out, elens, ylens):
+        """Compute Transducer loss.
+
+        Args:
+            logits (FloatTensor): `[B, T, L+1, vocab]`
+            ys_out (LongTensor): `[B, L]`
+            elens (IntTensor): `[B]`
+            ylens (IntTensor): `[B]`
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
         log_probs = torch.log_softmax(logits, dim=-1)
-        assert log_probs.size(2) == ys_out.size(1) + 1
         if self.device_id >= 0:
-            ys_out = ys_out.to(eouts.device)
-            elens = elens.to(eouts.device)
-            ylens = ylens.to(eouts.device)
+            ys_out = ys_out.to(logits.device)
+            elens = elens.to(logits.device)
+            ylens = ylens.to(logits.device)
             import warp_rnnt
             loss = warp_rnnt.rnnt_loss(log_probs, ys_out.int(), elens, ylens,
                                        average_frames=False,
@@ -506,15 +522,14 @@ class RNNTransducer(DecoderBase):
 
                             # Update LM states for shallow fusion
                             y_prev = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(beam['hyp'][-1])
-                            _, lmstate, scores_lm = helper.update_rnnlm_state(lm, beam, y_prev)
+                            lmstate, scores_lm = helper.update_lm_state(lm, beam, y_prev)
                             if lm is not None:
                                 total_score_lm += scores_lm[0, -1, idx].item()
 
                             self.state_cache[hyp_str] = {
                                 'dout': dout,
                                 'dstate': dstate,
-                                'lmstate': {'hxs': lmstate['hxs'],
-                                            'cxs': lmstate['cxs']} if lmstate is not None else None,
+                                'lmstate': lmstate,
                                 'total_score_lm': total_score_lm,
                             }
 
@@ -528,8 +543,7 @@ class RNNTransducer(DecoderBase):
                                          'score_lm': total_score_lm,
                                          'dout': dout,
                                          'dstate': dstate,
-                                         'lmstate': {'hxs': lmstate['hxs'],
-                                                     'cxs': lmstate['cxs']} if lmstate is not None else None})
+                                         'lmstate': lmstate})
 
                 # Merge hypotheses having the same token sequences
                 new_hyps_merged = {}
@@ -14,6 +14,12 @@ import torch.nn as nn
 
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.packing import (
+    PackingStats,
+    pack_lengths,
+    segment_causal_mask,
+    segment_positions
+)
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
@@ -26,6 +32,8 @@ from neural_sp.models.torch_utils import (
     append_sos_eos,
     compute_accuracy,
     make_pad_mask,
+    np2tensor,
+    pad_list,
     tensor2np,
     tensor2scalar
 )
@@ -85,6 +93,7 @@ class TransformerDecoder(DecoderBase):
         share_chunkwise_attention (bool): share chunkwise attention in the same layer of MMA
         external_lm (RNNLM): external RNNLM for LM fusion
         lm_fusion (str): type of LM fusion
+        pack_sequences (bool): pack multiple target sequences into a row during training
 
     """
 
@@ -102,7 +111,7 @@ class TransformerDecoder(DecoderBase):
                  mma_quantity_loss_weight, mma_headdiv_loss_weight,
                  latency_metric, latency_loss_weight,
                  mma_first_layer, share_chunkwise_attention,
-                 external_lm, lm_fusion):
+                 external_lm, lm_fusion, pack_sequences):
 
         super(TransformerDecoder, self).__init__()
 
@@ -138,6 +147,14 @@ class TransformerDecoder(DecoderBase):
 
         self.latency_metric = latency_metric
         self.latency_loss_weight = latency_loss_weight
+
+        # for packed sequences
+        self.pack_sequences = pack_sequences
+        self.packing_stats = PackingStats()
+        if pack_sequences:
+            assert attn_type != 'mocha'
+            assert external_lm is None
+            assert '1dconv' not in pe_type
         self.ctc_trigger = (self.latency_metric in ['ctc_sync'])
         if self.ctc_trigger:
             assert 0 < self.ctc_weight < 1
@@ -218,6 +235,8 @@ class TransformerDecoder(DecoderBase):
                            help='LayerDrop probability for Transformer decoder layers')
         group.add_argument('--dropout_head', type=float, default=0.0,
                            help='HeadDrop probability for masking out a head in the Transformer decoder')
+        group.add_argument('--pack_sequences', type=strtobool, default=False,
+                           help='pack multiple target sequences into a row with block-diagonal attention masks during training')
         # MMA specific
         parser.add_argument('--mocha_n_heads_mono', type=int, default=1,
                             help='number of heads for monotonic attention')
@@ -384,6 +403,9 @@ class TransformerDecoder(DecoderBase):
         """
         losses_auxiliary = {}
 
+        if self.pack_sequences and self.training:
+            return self.forward_att_packed(eouts, elens, ys)
+
         # Append <sos> and <eos>
         ys_in, ys_out, ylens = append_sos_eos(ys, self.eos, self.eos, self.pad, self.device, self.bwd)
         if not self.training:
@@ -454,6 +476,61 @@ class TransformerDecoder(DecoderBase):
 
         return loss, acc, ppl, losses_auxiliary
 
+    def forward_att_packed(self, eouts, elens, ys):
+        """Compute XE loss for the Transformer decoder with packed sequences.
+
+        Target sequences are packed into rows as long as the longest one in the
+        mini-batch, and encoder outputs of utterances in each row are concatenated.
+        Each token attends only to the preceding tokens and the encoder outputs
+        of the same utterance.
+
+        Args:
+            eouts (FloatTensor): `[B, T, d_model]`
+            elens (IntTensor): `[B]`
+            ys (list): length `B`, each of which contains a list of size `[L]`
+        Returns:
+            loss (FloatTensor): `[1]`
+            acc (float): accuracy for token prediction
+            ppl (float): perplexity
+            losses_auxiliary (dict):
+
+        """
+        bs, xmax = eouts.size()[:2]
+        ys_in, ys_out, ylens = append_sos_eos(ys, self.eos, self.eos, self.pad, self.device, self.bwd)
+        ymax = ys_in.size(1)
+        ylens = tensor2np(ylens)
+        elens = tensor2np(elens)
+        rows = pack_lengths(ylens, ymax)
+        self.packing_stats.add(ylens, len(rows), ymax)
+
+        # Gather tokens and encoder outputs of utterances in each row
+        tok_ids = pad_list([np2tensor(np.concatenate([b * ymax + np.arange(ylens[b]) for b in row]), self.device)
+                            for row in rows], -1)  # `[R, L]`
+        frame_ids = pad_list([np2tensor(np.concatenate([b * xmax + np.arange(elens[b]) for b in row]), self.device)
+                              for row in rows], -1)  # `[R, T']`
+        ys_in = ys_in.view(-1)[tok_ids.clamp(min=0)].masked_fill(tok_ids < 0, self.pad)
+        ys_out = ys_out.view(-1)[tok_ids.clamp(min=0)].masked_fill(tok_ids < 0, self.pad)
+        eouts = eouts.reshape(bs * xmax, -1)[frame_ids.clamp(min=0)]
+
+        # Create block-diagonal masks with utterance indices as segment IDs
+        # NOTE: padding is assigned to -1 (tokens) and -2 (frames)
+        tok_seg = (tok_ids // ymax).masked_fill(tok_ids < 0, -1)
+        frame_seg = (frame_ids // xmax).masked_fill(frame_ids < 0, -2)
+        tgt_mask = segment_causal_mask(tok_seg)  # `[R, L (query), L (key)]`
+        src_mask = tok_seg.unsqueeze(2) == frame_seg.unsqueeze(1)  # `[R, L, T']`
+
+        out = self.pos_enc(self.embed(ys_in), positions=segment_positions(tok_seg))  # scaled + dropout
+        for layer in self.layers:
+            out = layer(out, tgt_mask, eouts, src_mask, mode='parallel')
+        logits = self.output(self.norm_out(out))
+
+        # Compute XE loss (+ label smoothing)
+        loss, ppl = cross_entropy_lsm(logits, ys_out, self.lsm_prob, self.pad, self.training)
+        loss = loss * len(rows) / bs  # normalize by the number of utterances
+        acc = compute_accuracy(logits, ys_out, self.pad)
+
+        return loss, acc, ppl, {'loss_quantity': 0.}
+
     def greedy(self, eouts, elens, max_len_ratio, idx2token,
                exclude_eos=False, refs_id=None, utt_ids=None, speakers=None,
                cache_states=True):
@@ -672,7 +749,7 @@ class TransformerDecoder(DecoderBase):
 
                 # Update LM states for shallow fusion
                 y_lm = ys[:, -1:].clone()  # NOTE: this is important
-                _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
+                lmstate, scores_lm = helper.update_lm_state_batch(lm, hyps, y_lm)
 
                 # for the main model
                 causal_mask = eouts.new_ones(i + 1, i + 1).byte()
@@ -798,8 +875,7 @@ class TransformerDecoder(DecoderBase):
                              'score_ctc': total_scores_ctc[k].item(),
                              'score_lm': total_scores_lm[0, idx].item(),
                              'aws': new_aws,
-                             'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                         'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                             'lmstate': lm.reorder_state(lmstate, [j]) if lmstate is not None else None,
                              'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
                              'ensmbl_cache': [[new_cache_e_l[j:j + 1] for new_cache_e_l in new_cache_e] for new_cache_e in ensmbl_new_cache] if cache_states else None,
                              'streamable': streamable_global,
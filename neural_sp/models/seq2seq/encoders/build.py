@@ -14,6 +14,10 @@ def build_encoder(args):
         args.transformer_enc_d_ff = args.transformer_d_ff
     if not hasattr(args, 'transformer_enc_n_heads') and hasattr(args, 'transformer_n_heads'):
         args.transformer_enc_n_heads = args.transformer_n_heads
+    if not hasattr(args, 'transformer_enc_attn_chunk_size'):
+        args.transformer_enc_attn_chunk_size = 0
+    if not hasattr(args, 'transformer_enc_fused_attention'):
+        args.transformer_enc_fused_attention = False
 
     if args.enc_type == 'tds':
         from neural_sp.models.seq2seq.encoders.tds import TDSEncoder
@@ -77,7 +81,9 @@ def build_encoder(args):
             chunk_size_left=args.lc_chunk_size_left,
             chunk_size_current=args.lc_chunk_size_current,
             chunk_size_right=args.lc_chunk_size_right,
-            streaming_type=args.lc_type)
+            streaming_type=args.lc_type,
+            attn_chunk_size=args.transformer_enc_attn_chunk_size,
+            fused_attention=args.transformer_enc_fused_attention)
 
     elif 'conformer' in args.enc_type:
         from neural_sp.models.seq2seq.encoders.conformer import ConformerEncoder
@@ -120,7 +126,8 @@ def build_encoder(args):
             chunk_size_left=args.lc_chunk_size_left,
             chunk_size_current=args.lc_chunk_size_current,
             chunk_size_right=args.lc_chunk_size_right,
-            streaming_type=args.lc_type)
+            streaming_type=args.lc_type,
+            attn_chunk_size=args.transformer_enc_attn_chunk_size)
 
     else:
         from neural_sp.models.seq2seq.encoders.rnn import RNNEncoder
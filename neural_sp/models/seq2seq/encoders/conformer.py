@@ -63,6 +63,7 @@ class ConformerEncoder(TransformerEncoder):
         chunk_size_current (int): current chunk size for latency-controlled Conformer encoder
         chunk_size_right (int): right chunk size for latency-controlled Conformer encoder
         streaming_type (str): implementation methods of latency-controlled Conformer encoder
+        attn_chunk_size (int): query chunk size for memory-efficient self-attention
 
     """
 
@@ -75,7 +76,8 @@ class ConformerEncoder(TransformerEncoder):
                  conv_in_channel, conv_channels, conv_kernel_sizes, conv_strides, conv_poolings,
                  conv_batch_norm, conv_layer_norm, conv_bottleneck_dim, conv_param_init,
                  task_specific_layer, param_init, clamp_len,
-                 lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type):
+                 lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type,
+                 attn_chunk_size=0):
 
         super(ConformerEncoder, self).__init__(
             input_dim, enc_type, n_heads,
@@ -87,12 +89,13 @@ class ConformerEncoder(TransformerEncoder):
             conv_in_channel, conv_channels, conv_kernel_sizes, conv_strides, conv_poolings,
             conv_batch_norm, conv_layer_norm, conv_bottleneck_dim, conv_param_init,
             task_specific_layer, param_init, clamp_len,
-            lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type)
+            lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type,
+            attn_chunk_size)
 
         self.layers = nn.ModuleList([copy.deepcopy(ConformerEncoderBlock(
             d_model, d_ff, n_heads, kernel_size, dropout, dropout_att, dropout_layer,
             layer_norm_eps, ffn_activation, param_init, pe_type,
-            ffn_bottleneck_dim, self.unidir))
+            ffn_bottleneck_dim, self.unidir, attn_chunk_size))
             for _ in range(n_layers)])
 
         if n_layers_sub1 > 0:
@@ -100,14 +103,14 @@ class ConformerEncoder(TransformerEncoder):
                 self.layer_sub1 = ConformerEncoderBlock(
                     d_model, d_ff, n_heads, kernel_size, dropout, dropout_att, dropout_layer,
                     layer_norm_eps, ffn_activation, param_init, pe_type,
-                    ffn_bottleneck_dim, self.unidir)
+                    ffn_bottleneck_dim, self.unidir, attn_chunk_size)
 
         if n_layers_sub2 > 0:
             if task_specific_layer:
                 self.layer_sub2 = ConformerEncoderBlock(
                     d_model, d_ff, n_heads, kernel_size, dropout, dropout_att, dropout_layer,
                     layer_norm_eps, ffn_activation, param_init, pe_type,
-                    ffn_bottleneck_dim, self.unidir)
+                    ffn_bottleneck_dim, self.unidir, attn_chunk_size)
 
         self.reset_parameters(param_init)
 
@@ -147,6 +150,8 @@ class ConformerEncoder(TransformerEncoder):
                            help='LayerDrop probability for Conformer encoder layers')
         group.add_argument('--transformer_enc_clamp_len', type=int, default=-1,
                            help='maximum length for relative positional encoding. -1 means infinite length.')
+        group.add_argument('--transformer_enc_attn_chunk_size', type=int, default=0,
+                           help='query chunk size for memory-efficient self-attention in long inputs. 0 means disabled.')
         # streaming
         group.add_argument('--transformer_enc_lookaheads', type=str, default="0_0_0_0_0_0_0_0_0_0_0_0",
                            help='lookahead frames per layer for unidirectional Conformer encoder')
@@ -205,13 +210,14 @@ class ConformerEncoderBlock(nn.Module):
         pe_type (str): type of positional encoding
         ffn_bottleneck_dim (int): bottleneck dimension for the light-weight FFN layer
         unidirectional (bool): pad right context for unidirectional encoding
+        attn_chunk_size (int): query chunk size for memory-efficient self-attention
 
     """
 
     def __init__(self, d_model, d_ff, n_heads, kernel_size,
                  dropout, dropout_att, dropout_layer,
                  layer_norm_eps, ffn_activation, param_init, pe_type,
-                 ffn_bottleneck_dim, unidirectional):
+                 ffn_bottleneck_dim, unidirectional, attn_chunk_size=0):
         super(ConformerEncoderBlock, self).__init__()
 
         self.n_heads = n_heads
@@ -231,7 +237,8 @@ class ConformerEncoderBlock(nn.Module):
                                 n_heads=n_heads,
                                 dropout=dropout_att,
                                 param_init=param_init,
-                                xl_like=pe_type == 'relative_xl')
+                                xl_like=pe_type == 'relative_xl',
+                                attn_chunk_size=attn_chunk_size)
 
         # conv module
         self.norm3 = nn.LayerNorm(d_model, eps=layer_norm_eps)
@@ -261,7 +268,7 @@ class ConformerEncoderBlock(nn.Module):
 
         Args:
             xs (FloatTensor): `[B, T, d_model]`
-            xx_mask (ByteTensor): `[B, T (query), T (key)]`
+            xx_mask (ByteTensor or BandMask): `[B, T (query), T (key)]`
             pos_embs (LongTensor): `[L, 1, d_model]`
             u_bias (FloatTensor): global parameter for relative positional encoding
             v_bias (FloatTensor): global parameter for relative positional encoding
@@ -143,7 +143,14 @@ class RNNEncoder(EncoderBase):
             self._odim = input_dim * n_splices * n_stacks
 
         if enc_type != 'conv':
+            # Run all layers in a single multi-layer RNN call for full-context encoding
+            # when outputs of intermediate layers are not used
+            layerwise = n_projs > 0 or np.prod(subsamples) > 1 or bidir_sum_fwd_bwd
+            multitask = n_layers_sub1 > 0 or n_layers_sub2 > 0
+            stacked = n_layers > 1 and not (self.lc_bidir or layerwise or multitask)
+
             self.rnn = nn.ModuleList()
+            self.rnn_stacked = None
             if self.lc_bidir:
                 self.rnn_bwd = nn.ModuleList()
             self.dropout = nn.Dropout(p=dropout)
@@ -162,6 +169,10 @@ class RNNEncoder(EncoderBase):
                 if self.lc_bidir:
                     self.rnn += [rnn_i(self._odim, n_units, 1, batch_first=True)]
                     self.rnn_bwd += [rnn_i(self._odim, n_units, 1, batch_first=True)]
+                elif stacked:
+                    if lth == 0:
+                        self.rnn_stacked = rnn_i(self._odim, n_units, n_layers, batch_first=True,
+                                                 dropout=dropout, bidirectional=self.bidirectional)
                 else:
                     self.rnn += [rnn_i(self._odim, n_units, 1, batch_first=True,
                                        bidirectional=self.bidirectional)]
@@ -264,6 +275,15 @@ class RNNEncoder(EncoderBase):
             dir_name += '_RSP' + str(args.rsp_prob_enc)
         return dir_name
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Map per-layer RNN parameters in old checkpoints onto the multi-layer RNN
+        # e.g., rnn.1.weight_ih_l0_reverse -> rnn_stacked.weight_ih_l1_reverse
+        if getattr(self, 'rnn_stacked', None) is not None:
+            for k in [k for k in state_dict.keys() if k.startswith(prefix + 'rnn.')]:
+                lth, n = k[len(prefix + 'rnn.'):].split('.', 1)
+                state_dict[prefix + 'rnn_stacked.' + n.replace('_l0', '_l' + lth)] = state_dict.pop(k)
+        super(RNNEncoder, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def reset_parameters(self, param_init):
         """Initialize parameters with uniform distribution."""
         logger.info('===== Initialize %s with uniform distribution =====' % self.__class__.__name__)
@@ -336,12 +356,17 @@ class RNNEncoder(EncoderBase):
             if self.chunk_size_left <= 0:
                 xs, xlens, xs_sub1, xlens_sub1 = self._forward_full_context(
                     xs, xlens)
-            else:
+            elif streaming:
                 xs, xlens, xs_sub1, xlens_sub1 = self._forward_latency_controlled(
                     xs, xlens, N_l, N_r, streaming)
+            else:
+                xs, xlens, xs_sub1, xlens_sub1 = self._forward_latency_controlled_batch(
+                    xs, xlens, N_l, N_r)
             if task == 'ys_sub1':
                 eouts[task]['xs'], eouts[task]['xlens'] = xs_sub1, xlens_sub1
                 return eouts
+        elif self.rnn_stacked is not None:
+            xs, xlens = self._forward_stacked(xs, xlens, streaming)
         else:
             for lth in range(self.n_layers):
                 self.rnn[lth].flatten_parameters()  # for multi-GPUs
@@ -385,6 +410,43 @@ class RNNEncoder(EncoderBase):
             eouts['ys_sub2']['xs'], eouts['ys_sub2']['xlens'] = xs_sub2, xlens_sub2
         return eouts
 
+    def _forward_stacked(self, xs, xlens, streaming):
+        """Encode with a single multi-layer RNN call.
+           This is equivalent to the layer-wise loop when neither projection,
+           subsampling, nor sub tasks are used, but packs inputs only once.
+
+        Args:
+            xs (FloatTensor): `[B, T, input_dim]` (sorted by lengths)
+            xlens (IntTensor): `[B]`
+            streaming (bool): streaming encoding
+        Returns:
+            xs (FloatTensor): `[B, T, n_units (*2)]`
+            xlens (IntTensor): `[B]`
+
+        """
+        self.rnn_stacked.flatten_parameters()  # for multi-GPUs
+        hx = None
+        if self.hx_fwd[0] is not None:
+            if isinstance(self.hx_fwd[0], tuple):
+                hx = tuple(torch.cat([h[i] for h in self.hx_fwd], dim=0) for i in range(2))
+            else:
+                hx = torch.cat(self.hx_fwd, dim=0)
+
+        if not streaming and xlens is not None:
+            xs = pack_padded_sequence(xs, xlens.tolist(), batch_first=True)
+            xs, state = self.rnn_stacked(xs, hx)
+            xs = pad_packed_sequence(xs, batch_first=True)[0]
+        else:
+            xs, state = self.rnn_stacked(xs, hx)
+        xs = self.dropout(xs)
+
+        # split states into layers for streaming and RSP
+        if isinstance(state, tuple):
+            self.hx_fwd = list(zip(*[h.chunk(self.n_layers, dim=0) for h in state]))
+        else:
+            self.hx_fwd = list(state.chunk(self.n_layers, dim=0))
+        return xs, xlens
+
     def _forward_full_context(self, xs, xlens, task='all'):
         """Full context BPTT encoding.
            This is used for pre-training latency-controlled bidirectional encoder.
@@ -512,6 +574,116 @@ class RNNEncoder(EncoderBase):
 
         return xs, xlens, xs_sub1, xlens_sub1
 
+    def _forward_latency_controlled_batch(self, xs, xlens, N_l, N_r):
+        """Latency-controlled bidirectional encoding for all chunks at once.
+           Chunks are encoded layer by layer. Only the forward RNN over the
+           current blocks is run sequentially over chunks, and the backward RNN
+           and the forward RNN over the future blocks are run for all chunks
+           (with the same length) in a single call.
+           This is equivalent to _forward_latency_controlled.
+
+        Args:
+            xs (FloatTensor): `[B, T, n_units]`
+            xlens (IntTensor): `[B]`
+            N_l (int): number of frames in the current block
+            N_r (int): number of frames in the future block
+        Returns:
+            xs (FloatTensor): `[B, T, n_units]`
+            xlens (IntTensor): `[B]`
+            xs_sub1 (FloatTensor): `[B, T, n_units]`
+            xlens_sub1 (IntTensor): `[B]`
+
+        """
+        bs, xmax, idim = xs.size()
+        n_chunks = math.ceil(xmax / N_l)
+        W = N_l + N_r
+
+        # `[B, T, idim]` -> `[n_chunks, B, N_l+N_r, idim]`
+        xs = torch.nn.functional.pad(xs, (0, 0, 0, (n_chunks - 1) * N_l + W - xmax))
+        xs = xs.unfold(1, W, N_l).permute(1, 0, 3, 2)
+        # NOTE: the last chunks are truncated at the end of the longest utterance
+        clens = [min(W, xmax - N_l * c) for c in range(n_chunks)]
+
+        xs_sub1, xlens_sub1 = None, None
+        for lth in range(self.n_layers):
+            self.rnn[lth].flatten_parameters()  # for multi-GPUs
+            self.rnn_bwd[lth].flatten_parameters()  # for multi-GPUs
+            groups = {}  # chunks with the same length are processed together
+            for c, L in enumerate(clens):
+                groups.setdefault(L, []).append(c)
+
+            # fwd (current blocks)
+            xs_fwd = xs.new_zeros(n_chunks, bs, W, self.n_units)
+            states = [None] * n_chunks
+            for c in range(n_chunks):
+                L = min(N_l, clens[c])
+                xs_fwd[c, :, :L], self.hx_fwd[lth] = self.rnn[lth](xs[c, :, :L], hx=self.hx_fwd[lth])
+                states[c] = self.hx_fwd[lth]
+            # fwd (future blocks), bwd
+            xs_bwd = xs.new_zeros(n_chunks, bs, W, self.n_units)
+            for L, ids in groups.items():
+                xs_g = xs[ids, :, :L].reshape(len(ids) * bs, L, -1)
+                xs_bwd[ids, :, :L] = torch.flip(self.rnn_bwd[lth](
+                    torch.flip(xs_g, dims=[1]))[0], dims=[1]).view(len(ids), bs, L, -1)
+                if L > N_l:
+                    if isinstance(states[0], tuple):
+                        hx = tuple(torch.cat([states[c][i] for c in ids], dim=1) for i in range(2))
+                    else:
+                        hx = torch.cat([states[c] for c in ids], dim=1)
+                    xs_fwd[ids, :, N_l:L] = self.rnn[lth](xs_g[:, N_l:], hx=hx)[0].view(
+                        len(ids), bs, L - N_l, -1)
+            if self.bidir_sum:
+                xs = xs_fwd + xs_bwd
+            else:
+                xs = torch.cat([xs_fwd, xs_bwd], dim=-1)
+            xs = self.dropout(xs)
+
+            # Pick up outputs in the sub task before the projection layer
+            if lth == self.n_layers_sub1 - 1:
+                xs_sub1 = self._merge_chunks(xs, clens, N_l)
+                xlens_sub1 = xlens.clone()
+
+            # Projection layer
+            if self.proj is not None and lth != self.n_layers - 1:
+                xs = torch.relu(self.proj[lth](xs))
+            # Subsampling layer
+            if self.subsample is not None and self.subsample[lth].factor > 1:
+                xs_chunks = [None] * n_chunks
+                for L, ids in groups.items():
+                    xs_g, xlens_g = self.subsample[lth](xs[ids, :, :L].reshape(len(ids) * bs, L, -1), xlens)
+                    for i, c in enumerate(ids):
+                        xs_chunks[c] = xs_g[i * bs:(i + 1) * bs]
+                        clens[c] = xs_g.size(1)
+                xlens = xlens_g
+                N_l = N_l // self.subsample[lth].factor
+                N_r = N_r // self.subsample[lth].factor
+                W = N_l + N_r
+                xs = xs.new_zeros(n_chunks, bs, W, xs.size(-1))
+                for c in range(n_chunks):
+                    xs[c, :, :clens[c]] = xs_chunks[c]
+
+        xs = self._merge_chunks(xs, clens, N_l)
+        if self.n_layers_sub1 > 0:
+            xs_sub1, xlens_sub1 = self.sub_module(xs_sub1, xlens_sub1, None, 'sub1')
+
+        return xs, xlens, xs_sub1, xlens_sub1
+
+    @staticmethod
+    def _merge_chunks(xs, clens, N_l):
+        """Concatenate current blocks of all chunks.
+
+        Args:
+            xs (FloatTensor): `[n_chunks, B, N_l+N_r, n_units]`
+            clens (list): length of each chunk
+            N_l (int): number of frames in the current block
+        Returns:
+            xs (FloatTensor): `[B, T, n_units]`
+
+        """
+        n_chunks, bs = xs.size()[:2]
+        xs = xs[:, :, :N_l].transpose(0, 1).reshape(bs, n_chunks * N_l, -1)
+        return xs[:, :N_l * (n_chunks - 1) + min(N_l, clens[-1])]
+
     def sub_module(self, xs, xlens, perm_ids_unsort, module='sub1'):
         if self.task_specific_layer:
             xs_sub = self.dropout(torch.relu(getattr(self, 'layer_' + module)(xs)))
@@ -4,6 +4,7 @@
 """Transformer encoder."""
 
 import copy
+from distutils.util import strtobool
 import logging
 import math
 import numpy as np
@@ -28,6 +29,7 @@ from neural_sp.models.seq2seq.encoders.subsampling import (
     MaxpoolSubsampler
 )
 from neural_sp.models.seq2seq.encoders.utils import chunkwise
+from neural_sp.models.torch_utils import BandMask
 from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import tensor2np
 
@@ -79,6 +81,8 @@ class TransformerEncoder(EncoderBase):
         chunk_size_current (int): current chunk size for latency-controlled Transformer encoder
         chunk_size_right (int): right chunk size for latency-controlled Transformer encoder
         streaming_type (str): implementation methods of latency-controlled Transformer encoder
+        attn_chunk_size (int): query chunk size for memory-efficient self-attention
+        fused_attention (bool): use fused self-attention without attention weights
 
     """
 
@@ -91,7 +95,8 @@ class TransformerEncoder(EncoderBase):
                  conv_in_channel, conv_channels, conv_kernel_sizes, conv_strides, conv_poolings,
                  conv_batch_norm, conv_layer_norm, conv_bottleneck_dim, conv_param_init,
                  task_specific_layer, param_init, clamp_len,
-                 lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type):
+                 lookahead, chunk_size_left, chunk_size_current, chunk_size_right, streaming_type,
+                 attn_chunk_size=0, fused_attention=False):
 
         super(TransformerEncoder, self).__init__()
 
@@ -224,7 +229,8 @@ class TransformerEncoder(EncoderBase):
         self.layers = nn.ModuleList([copy.deepcopy(TransformerEncoderBlock(
             d_model, d_ff, n_heads, dropout, dropout_att, dropout_layer,
             layer_norm_eps, ffn_activation, param_init, pe_type,
-            ffn_bottleneck_dim))
+            ffn_bottleneck_dim, attn_chunk_size=attn_chunk_size,
+            fused_attention=fused_attention))
             for _ in range(n_layers)])
         self.norm_out = nn.LayerNorm(d_model, eps=layer_norm_eps)
         self._odim = d_model
@@ -234,7 +240,8 @@ class TransformerEncoder(EncoderBase):
                 self.layer_sub1 = TransformerEncoderBlock(
                     d_model, d_ff, n_heads, dropout, dropout_att, dropout_layer,
                     layer_norm_eps, ffn_activation, param_init, pe_type,
-                    ffn_bottleneck_dim)
+                    ffn_bottleneck_dim, attn_chunk_size=attn_chunk_size,
+                    fused_attention=fused_attention)
             self.norm_out_sub1 = nn.LayerNorm(d_model, eps=layer_norm_eps)
             if last_proj_dim > 0 and last_proj_dim != self.output_dim:
                 self.bridge_sub1 = nn.Linear(self._odim, last_proj_dim)
@@ -244,7 +251,8 @@ class TransformerEncoder(EncoderBase):
                 self.layer_sub2 = TransformerEncoderBlock(
                     d_model, d_ff, n_heads, dropout, dropout_att, dropout_layer,
                     layer_norm_eps, ffn_activation, param_init, pe_type,
-                    ffn_bottleneck_dim)
+                    ffn_bottleneck_dim, attn_chunk_size=attn_chunk_size,
+                    fused_attention=fused_attention)
             self.norm_out_sub2 = nn.LayerNorm(d_model, eps=layer_norm_eps)
             if last_proj_dim > 0 and last_proj_dim != self.output_dim:
                 self.bridge_sub2 = nn.Linear(self._odim, last_proj_dim)
@@ -290,6 +298,11 @@ class TransformerEncoder(EncoderBase):
                            help='LayerDrop probability for Transformer encoder layers')
         group.add_argument('--transformer_enc_clamp_len', type=int, default=-1,
                            help='maximum length for relative positional encoding. -1 means infinite length.')
+        group.add_argument('--transformer_enc_attn_chunk_size', type=int, default=0,
+                           help='query chunk size for memory-efficient self-attention in long inputs. 0 means disabled.')
+        group.add_argument('--transformer_enc_fused_attention', type=strtobool, default=False,
+                           help='use fused self-attention (scaled_dot_product_attention) for Transformer encoder. '
+                                'Attention weights are not saved.')
         # streaming
         group.add_argument('--transformer_enc_lookaheads', type=str, default="0_0_0_0_0_0_0_0_0_0_0_0",
                            help='lookahead frames per layer for unidirectional Transformer encoder')
@@ -421,7 +434,7 @@ class TransformerEncoder(EncoderBase):
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask if lth >= 1 else xx_mask_first,
                            pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
-                if not self.training:
+                if not self.training and layer.xx_aws is not None:
                     if self.streaming_type == 'reshape':
                         n_heads = layer.xx_aws.size(1)
                         xx_aws = layer.xx_aws[:, :, N_l:N_l + N_c, N_l:N_l + N_c]
@@ -435,6 +448,7 @@ class TransformerEncoder(EncoderBase):
                         self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(xx_aws_center)
                     elif self.streaming_type == 'mask':
                         self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
+                if not self.training:
                     self.data_dict['elens%d' % lth] = tensor2np(xlens)
 
                 if self.subsample is not None:
@@ -468,7 +482,8 @@ class TransformerEncoder(EncoderBase):
             for lth, layer in enumerate(self.layers):
                 xs = layer(xs, xx_mask, pos_embs=pos_embs, u_bias=self.u_bias, v_bias=self.v_bias)
                 if not self.training:
-                    self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
+                    if layer.xx_aws is not None:
+                        self.aws_dict['xx_aws_layer%d' % lth] = tensor2np(layer.xx_aws)
                     self.data_dict['elens%d' % lth] = tensor2np(xlens)
 
                 # Pick up outputs in the sub task before the projection layer
@@ -516,8 +531,10 @@ class TransformerEncoder(EncoderBase):
         xs_sub = getattr(self, 'norm_out_' + module)(xs_sub)
         if getattr(self, 'bridge_' + module) is not None:
             xs_sub = getattr(self, 'bridge_' + module)(xs_sub)
-        if not self.training:
-            self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = tensor2np(getattr(self, 'layer_' + module).xx_aws)
+        if not self.training and self.task_specific_layer:
+            xx_aws_sub = getattr(self, 'layer_' + module).xx_aws
+            if xx_aws_sub is not None:
+                self.aws_dict['xx_aws_%s_layer%d' % (module, lth)] = tensor2np(xx_aws_sub)
         return xs_sub
 
 
@@ -536,13 +553,16 @@ class TransformerEncoderBlock(nn.Module):
         param_init (str): parameter initialization method
         pe_type (str): type of positional encoding
         ffn_bottleneck_dim (int): bottleneck dimension for the light-weight FFN layer
+        attn_chunk_size (int): query chunk size for memory-efficient self-attention
+        fused_attention (bool): use fused self-attention without attention weights
 
     """
 
     def __init__(self, d_model, d_ff, n_heads,
                  dropout, dropout_att, dropout_layer,
                  layer_norm_eps, ffn_activation, param_init, pe_type,
-                 relative_attention=False, ffn_bottleneck_dim=0):
+                 relative_attention=False, ffn_bottleneck_dim=0, attn_chunk_size=0,
+                 fused_attention=False):
         super(TransformerEncoderBlock, self).__init__()
 
         self.n_heads = n_heads
@@ -558,7 +578,9 @@ class TransformerEncoderBlock(nn.Module):
                              n_heads=n_heads,
                              dropout=dropout_att,
                              param_init=param_init,
-                             xl_like=pe_type == 'relative_xl')
+                             xl_like=pe_type == 'relative_xl',
+                             attn_chunk_size=attn_chunk_size,
+                             fused=fused_attention)
 
         # position-wise feed-forward
         self.norm2 = nn.LayerNorm(d_model, eps=layer_norm_eps)
@@ -582,7 +604,7 @@ class TransformerEncoderBlock(nn.Module):
 
         Args:
             xs (FloatTensor): `[B, T, d_model]`
-            xx_mask (ByteTensor): `[B, T (query), T (key)]`
+            xx_mask (ByteTensor or BandMask): `[B, T (query), T (key)]`
             pos_embs (LongTensor): `[L, 1, d_model]`
             u_bias (FloatTensor): global parameter for relative positional encoding
             v_bias (FloatTensor): global parameter for relative positional encoding
@@ -660,17 +682,16 @@ def make_time_restricted_san_mask(xs, xlens, N_l, N_c, N_r, n_chunks):
         N_r (int): number of frames for right context
         n_chunks (int): number of chunks
     Returns:
-        xx_mask (ByteTensor): `[B, T (query), T (key)]`
+        xx_mask_first (BandMask): `[B, T (query), T (key)]` for the first layer
+        xx_mask (BandMask): `[B, T (query), T (key)]` for upper layers
 
     """
-    xx_mask = make_san_mask(xs, xlens)
-    xx_mask_first = xx_mask.clone()
-    for chunk_idx in range(n_chunks):
-        offset = chunk_idx * N_c
-        # for first layer
-        xx_mask_first[:, offset:offset + N_c, :max(0, offset - N_l)] = 0
-        xx_mask_first[:, offset:offset + N_c, offset + (N_c + N_r):] = 0
-        # for upper layers
-        xx_mask[:, offset:offset + N_c, :max(0, offset - N_l)] = 0
-        xx_mask[:, offset:offset + N_c, offset + N_c:] = 0
-    return xx_mask_first, xx_mask
+    xmax = xs.size(1)
+    offset = torch.arange(xmax, device=xs.device) // N_c * N_c
+    # queries beyond the last chunk are not restricted
+    restricted = offset < n_chunks * N_c
+    start = torch.where(restricted, (offset - N_l).clamp(min=0), offset.new_zeros(1))
+    end_first = torch.where(restricted, offset + (N_c + N_r), offset.new_full((1,), xmax))
+    end = torch.where(restricted, offset + N_c, offset.new_full((1,), xmax))
+    xlens = xlens.to(xs.device)
+    return BandMask(xlens, start, end_first), BandMask(xlens, start, end)
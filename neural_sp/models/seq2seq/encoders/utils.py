@@ -23,18 +23,22 @@ def chunkwise(xs, N_l, N_c, N_r):
     Returns:
         xs (FloatTensor): `[B * n_chunks, N_l + N_c + N_r, input_dim]`
             where n_chunks = ceil(T / N_c)
+            This is a view of xs when N_l == N_r == 0 and T is divisible by N_c.
 
     """
     bs, xmax, idim = xs.size()
 
     n_chunks = math.ceil(xmax / N_c)
-    xs_tmp = xs.new_zeros(bs, n_chunks, N_l + N_c + N_r, idim)
-    xs_pad = torch.cat([xs.new_zeros(bs, N_l, idim),
-                        xs,
-                        xs.new_zeros(bs, N_r, idim)], dim=1)
-    for chunk_idx, t in enumerate(range(N_l, N_l + xmax, N_c)):
-        xs_chunk = xs_pad[:, t - N_l:t + (N_c + N_r)]
-        xs_tmp[:, chunk_idx, :xs_chunk.size(1), :] = xs_chunk
-    xs = xs_tmp.view(bs * n_chunks, N_l + N_c + N_r, idim)
+    n_pad = n_chunks * N_c - xmax
+    if N_l == 0 and N_r == 0:
+        # non-overlapping chunks can be a view of the input
+        if n_pad > 0:
+            xs = torch.nn.functional.pad(xs, (0, 0, 0, n_pad))
+        return xs.contiguous().view(bs * n_chunks, N_c, idim)
+
+    xs_pad = torch.nn.functional.pad(xs, (0, 0, N_l, N_r + n_pad))
+    # `[B, n_chunks, idim, N_l + N_c + N_r]` -> `[B, n_chunks, N_l + N_c + N_r, idim]`
+    xs = xs_pad.unfold(1, N_l + N_c + N_r, N_c).transpose(2, 3)
+    xs = xs.reshape(bs * n_chunks, N_l + N_c + N_r, idim)
 
     return xs
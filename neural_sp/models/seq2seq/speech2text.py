@@ -11,6 +11,7 @@ import torch
 import torch.nn as nn
 
 from neural_sp.bin.train_utils import load_checkpoint
+from neural_sp.datasets.teacher_logits import topk2logits
 from neural_sp.models.base import ModelBase
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.seq2seq.decoders.build import build_decoder
@@ -29,6 +30,7 @@ from neural_sp.models.torch_utils import (
     tensor2np,
     pad_list
 )
+from neural_sp.trainers.profiler import record_stage
 from neural_sp.utils import mkdir_join
 
 random.seed(1)
@@ -275,16 +277,22 @@ class Speech2Text(ModelBase):
             teacher_logits = None
             if teacher is not None:
                 teacher.eval()
-                teacher_logits = teacher.generate_logits(batch)
+                with record_stage('teacher'):
+                    teacher_logits = teacher.generate_logits(batch)
                 # TODO(hirofumi): label smoothing, scheduled sampling, dropout?
             elif teacher_lm is not None:
                 teacher_lm.eval()
-                teacher_logits = self.generate_lm_logits(batch['ys'], lm=teacher_lm)
-
-            loss_fwd, obs_fwd = self.dec_fwd(eout_dict['ys']['xs'], eout_dict['ys']['xlens'],
-                                             batch['ys'], task,
-                                             teacher_logits, self.recog_params, self.idx2token,
-                                             batch['trigger_points'])
+                with record_stage('teacher'):
+                    teacher_logits = self.generate_lm_logits(batch['ys'], lm=teacher_lm)
+            elif batch.get('teacher_topk') is not None:
+                # precomputed by the teacher offline
+                teacher_logits = topk2logits(batch['teacher_topk'], self.vocab, self.device)
+
+            with record_stage('dec_fwd'):
+                loss_fwd, obs_fwd = self.dec_fwd(eout_dict['ys']['xs'], eout_dict['ys']['xlens'],
+                                                 batch['ys'], task,
+                                                 teacher_logits, self.recog_params, self.idx2token,
+                                                 batch['trigger_points'])
             loss += loss_fwd
             if isinstance(self.dec_fwd, RNNT):
                 observation['loss.transducer'] = obs_fwd['loss_transducer']
@@ -305,7 +313,8 @@ class Speech2Text(ModelBase):
 
         # for the backward decoder in the main task
         if self.bwd_weight > 0 and task in ['all', 'ys.bwd']:
-            loss_bwd, obs_bwd = self.dec_bwd(eout_dict['ys']['xs'], eout_dict['ys']['xlens'], batch['ys'], task)
+            with record_stage('dec_bwd'):
+                loss_bwd, obs_bwd = self.dec_bwd(eout_dict['ys']['xs'], eout_dict['ys']['xlens'], batch['ys'], task)
             loss += loss_bwd
             observation['loss.att-bwd'] = obs_bwd['loss_att']
             observation['acc.att-bwd'] = obs_bwd['acc_att']
@@ -320,9 +329,10 @@ class Speech2Text(ModelBase):
                     continue
                 # NOTE: this is for evaluation at the end of every opoch
 
-                loss_sub, obs_fwd_sub = getattr(self, 'dec_fwd_' + sub)(
-                    eout_dict['ys_' + sub]['xs'], eout_dict['ys_' + sub]['xlens'],
-                    batch['ys_' + sub], task)
+                with record_stage('dec_fwd_' + sub):
+                    loss_sub, obs_fwd_sub = getattr(self, 'dec_fwd_' + sub)(
+                        eout_dict['ys_' + sub]['xs'], eout_dict['ys_' + sub]['xlens'],
+                        batch['ys_' + sub], task)
                 loss += loss_sub
                 if isinstance(getattr(self, 'dec_fwd_' + sub), RNNT):
                     observation['loss.transducer-' + sub] = obs_fwd_sub['loss_transducer']
@@ -352,8 +362,7 @@ class Speech2Text(ModelBase):
         eos = next(lm.parameters()).new_zeros(1).fill_(self.eos).long()
         ys = [np2tensor(np.fromiter(y, dtype=np.int64), self.device)for y in ys]
         ys_in = pad_list([torch.cat([eos, y], dim=0) for y in ys], self.pad)
-        lmout, _ = lm.decode(ys_in, None)
-        logits = lm.output(lmout)
+        logits, _, _ = lm.decode(ys_in, None)
         return logits
 
     def encode(self, xs, task='all', streaming=False, lookback=False, lookahead=False):
@@ -369,43 +378,45 @@ class Speech2Text(ModelBase):
             eout_dict (dict):
 
         """
-        if self.input_type == 'speech':
-            # Frame stacking
-            if self.n_stacks > 1:
-                xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
-
-            # Splicing
-            if self.n_splices > 1:
-                xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
-
-            xlens = torch.IntTensor([len(x) for x in xs])
-            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
-
-            # SpecAugment
-            if self.specaug is not None and self.training:
-                xs = self.specaug(xs)
-
-            # Weight noise injection
-            if self.weight_noise_std > 0 and self.training:
-                self.add_weight_noise(std=self.weight_noise_std)
-
-            # Input Gaussian noise injection
-            if self.input_noise_std > 0 and self.training:
-                xs = add_input_noise(xs, std=self.input_noise_std)
-
-            # Sequence summary network
-            if self.ssn is not None:
-                xs = self.ssn(xs, xlens)
-
-        elif self.input_type == 'text':
-            xlens = torch.IntTensor([len(x) for x in xs])
-            xs = [np2tensor(np.fromiter(x, dtype=np.int64), self.device) for x in xs]
-            xs = pad_list(xs, self.pad)
-            xs = self.dropout_emb(self.embed(xs))
-            # TODO(hirofumi): fix for Transformer
+        with record_stage('frontend'):
+            if self.input_type == 'speech':
+                # Frame stacking
+                if self.n_stacks > 1:
+                    xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
+
+                # Splicing
+                if self.n_splices > 1:
+                    xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
+
+                xlens = torch.IntTensor([len(x) for x in xs])
+                xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+
+                # SpecAugment
+                if self.specaug is not None and self.training:
+                    xs = self.specaug(xs)
+
+                # Weight noise injection
+                if self.weight_noise_std > 0 and self.training:
+                    self.add_weight_noise(std=self.weight_noise_std)
+
+                # Input Gaussian noise injection
+                if self.input_noise_std > 0 and self.training:
+                    xs = add_input_noise(xs, std=self.input_noise_std)
+
+                # Sequence summary network
+                if self.ssn is not None:
+                    xs = self.ssn(xs, xlens)
+
+            elif self.input_type == 'text':
+                xlens = torch.IntTensor([len(x) for x in xs])
+                xs = [np2tensor(np.fromiter(x, dtype=np.int64), self.device) for x in xs]
+                xs = pad_list(xs, self.pad)
+                xs = self.dropout_emb(self.embed(xs))
+                # TODO(hirofumi): fix for Transformer
 
         # encoder
-        eout_dict = self.enc(xs, xlens, task.split('.')[0], streaming, lookback, lookahead)
+        with record_stage('encoder'):
+            eout_dict = self.enc(xs, xlens, task.split('.')[0], streaming, lookback, lookahead)
 
         if self.main_weight < 1 and self.enc_type in ['conv', 'tds', 'gated_conv']:
             for sub in ['sub1', 'sub2']:
@@ -4,8 +4,11 @@
 """Utility functions."""
 
 import copy
+import functools
+import inspect
 import numpy as np
 import torch
+import torch.utils.checkpoint
 
 
 def repeat(module, n_layers):
@@ -23,6 +26,8 @@ def tensor2np(x):
     """
     if x is None:
         return x
+    if x.dtype == torch.bfloat16:
+        x = x.float()  # not supported in NumPy
     return x.cpu().detach().numpy()
 
 
@@ -143,3 +148,172 @@ def compute_accuracy(logits, ys_ref, pad):
     denominator = torch.sum(mask)
     acc = float(numerator) * 100 / float(denominator)
     return acc
+
+
+class BandMask(object):
+    """Compact self-attention mask restricting every query to a contiguous key range.
+
+    The i-th query can attend to keys in [start[i], end[i]) that are not padded.
+    Only `[B]` lengths and two `[T]` boundaries are kept instead of
+    a dense `[B, T (query), T (key)]` mask, and the band pattern is built on the fly
+    only for the queries being attended.
+
+    Args:
+        xlens (IntTensor): `[B]`
+        start (LongTensor): `[T]`
+        end (LongTensor): `[T]`
+
+    """
+
+    def __init__(self, xlens, start, end):
+        self.xlens = xlens
+        self.start = start
+        self.end = end
+
+    def size(self, dim=None):
+        size = torch.Size([self.xlens.size(0), self.start.size(0), self.start.size(0)])
+        return size if dim is None else size[dim]
+
+    @property
+    def device(self):
+        return self.start.device
+
+    def band(self, q_offset=0, qlen=None):
+        """Boolean band pattern shared among batch for a range of queries.
+
+        Args:
+            q_offset (int): index of the first query
+            qlen (int): number of queries (all the rest if None)
+        Returns:
+            band (BoolTensor): `[qlen, T (key)]`
+
+        """
+        q_end = self.start.size(0) if qlen is None else q_offset + qlen
+        k_idx = torch.arange(self.start.size(0), device=self.start.device).unsqueeze(0)
+        return (k_idx >= self.start[q_offset:q_end].unsqueeze(1)) & (k_idx < self.end[q_offset:q_end].unsqueeze(1))
+
+    def pad_mask(self):
+        """Boolean padding mask for keys.
+
+        Returns:
+            mask (BoolTensor): `[B, T (key)]`
+
+        """
+        k_idx = torch.arange(self.start.size(0), device=self.start.device).unsqueeze(0)
+        return k_idx < self.xlens.to(self.start.device).unsqueeze(1)
+
+    def to_dense(self):
+        """Materialize the mask for visualization or modules without band support.
+
+        Returns:
+            mask (BoolTensor): `[B, T (query), T (key)]`
+
+        """
+        return self.band().unsqueeze(0) & self.pad_mask().unsqueeze(1)
+
+    def masked_fill_(self, e, value, q_offset=0):
+        """Fill masked attention scores in-place without materializing a dense mask.
+
+        Args:
+            e (FloatTensor): `[B, qlen, klen, H]`
+            value (float): value to fill
+            q_offset (int): index of the first query in e
+        Returns:
+            e (FloatTensor): `[B, qlen, klen, H]`
+
+        """
+        band = self.band(q_offset, e.size(1))  # `[qlen, klen]`
+        e = e.masked_fill_(~band[None, :, :, None], value)
+        e = e.masked_fill_(~self.pad_mask()[:, None, :, None], value)
+        return e
+
+
+def register_non_persistent_buffer(module, name, tensor):
+    """Register a buffer that is not saved in checkpoints.
+
+    The buffer is registered as a normal one with PyTorch < 1.6, where it is
+    saved in checkpoints while it is set.
+
+    Args:
+        module (torch.nn.Module):
+        name (str): name of the buffer
+        tensor (Tensor): initial value (can be None)
+
+    """
+    try:
+        module.register_buffer(name, tensor, persistent=False)
+    except TypeError:
+        # PyTorch < 1.6
+        module.register_buffer(name, tensor)
+
+
+def checkpoint(function, *args):
+    """Recompute `function` in backward instead of keeping its intermediate results.
+
+    The non-reentrant implementation is used if available (PyTorch >= 1.11).
+
+    """
+    if 'use_reentrant' in inspect.signature(torch.utils.checkpoint.checkpoint).parameters:
+        return torch.utils.checkpoint.checkpoint(function, *args, use_reentrant=False)
+    return torch.utils.checkpoint.checkpoint(function, *args)
+
+
+def is_autocast_enabled(device_type):
+    """Check if autocast is enabled for the device type (cuda/cpu)."""
+    if not hasattr(torch, 'autocast'):
+        return False  # PyTorch < 1.10
+    try:
+        return torch.is_autocast_enabled(device_type)
+    except TypeError:
+        # PyTorch < 2.4
+        if device_type == 'cpu':
+            return torch.is_autocast_cpu_enabled()
+        return torch.is_autocast_enabled()
+
+
+def cummin(x, dim):
+    """Cumulative minimum of elements along `dim` (values only)."""
+    if hasattr(torch, 'cummin'):
+        return torch.cummin(x, dim=dim)[0]
+    # PyTorch < 1.5
+    return _cumulate(torch.min, x, dim)
+
+
+def cummax(x, dim):
+    """Cumulative maximum of elements along `dim` (values only)."""
+    if hasattr(torch, 'cummax'):
+        return torch.cummax(x, dim=dim)[0]
+    # PyTorch < 1.5
+    return _cumulate(torch.max, x, dim)
+
+
+def _cumulate(op, x, dim):
+    if x.size(dim) == 0:
+        return x.clone()
+    out = list(torch.unbind(x, dim))
+    for t in range(1, len(out)):
+        out[t] = op(out[t - 1], out[t])
+    return torch.stack(out, dim)
+
+
+def fp32_island(func):
+    """Decorator to run a function in float32 during mixed precision training.
+
+    Autocast is disabled inside the function, and floating-point tensors in
+    arguments are cast to float32. This is a no-op when autocast is disabled.
+
+    """
+    def to_fp32(x):
+        if isinstance(x, torch.Tensor) and x.is_floating_point():
+            return x.float()
+        return x
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tensors = [a for a in list(args) + list(kwargs.values()) if isinstance(a, torch.Tensor)]
+        if len(tensors) == 0 or not is_autocast_enabled(tensors[0].device.type):
+            return func(*args, **kwargs)
+        with torch.autocast(tensors[0].device.type, enabled=False):
+            return func(*[to_fp32(a) for a in args],
+                        **{k: to_fp32(v) for k, v in kwargs.items()})
+    return wrapper
@@ -0,0 +1,219 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Evaluation of the dev set in a worker process."""
+
+from collections import OrderedDict
+import logging
+import os
+import queue
+import time
+import torch
+import traceback
+
+from neural_sp.trainers.checkpoint_writer import snapshot
+
+logger = logging.getLogger(__name__)
+
+LATE_POLICIES = ['wait', 'skip']
+
+
+def _run_worker(build_fn, eval_fn, args, save_path, device, jobs, results):
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(save_path, 'eval.log'),
+                        format='%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s')
+    model, dataloader = build_fn(args, save_path)
+    model.to(device)
+    model.eval()
+    stop = False
+    while not stop:
+        job = jobs.get()
+        if job is None:
+            break
+        # Evaluate only the latest snapshot when evaluation is slower than training
+        while True:
+            try:
+                newer = jobs.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                stop = True
+                break
+            results.put((job[0], None, 0., None))
+            job = newer
+
+        epoch, state_dict = job
+        start_time = time.time()
+        try:
+            model.load_state_dict(state_dict)
+            with torch.no_grad():
+                metric = eval_fn(model, dataloader, args, epoch)
+            results.put((epoch, metric, time.time() - start_time, None))
+        except Exception:
+            results.put((epoch, None, time.time() - start_time, traceback.format_exc()))
+        del state_dict
+
+
+class AsyncEvaluator(object):
+    """Evaluate snapshots of a model on the dev set in a worker process.
+
+    Parameters are copied to CPU memory on the training process, and the worker
+    loads them into its own replica of the model. The training process polls
+    results and gives them to the scheduler when they arrive. At most one
+    snapshot is evaluated at a time, and if snapshots are queued faster than they
+    are evaluated, only the latest one is evaluated.
+
+    Args:
+        build_fn (callable): `build_fn(args, save_path)` returns a model and the dev set in the worker.
+            This must be a module-level function so that it can be pickled, and the
+            dataloader must not use worker processes (the worker is daemonic).
+        eval_fn (callable): `eval_fn(model, dataloader, args, epoch)` returns a metric
+        args (Namespace): configuration passed to `build_fn` and `eval_fn`
+        save_path (str): path to the model directory, where decoding results and
+            the log of the worker (`eval.log`) are saved
+        policy (str): how to proceed when the result of the previous epoch
+            has not arrived by the end of the next epoch
+            wait) block training until the result arrives
+            skip) proceed without the metric. The result is logged but not used.
+        device (str): device for evaluation in the worker
+
+    """
+
+    def __init__(self, build_fn, eval_fn, args, save_path, policy='wait', device='cpu'):
+        assert policy in LATE_POLICIES, policy
+        self.policy = policy
+
+        ctx = torch.multiprocessing.get_context('spawn')
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(target=_run_worker,
+                                    args=(build_fn, eval_fn, args, save_path, device,
+                                          self._jobs, self._results),
+                                    daemon=True)
+        self._process.start()
+
+        self.pending = OrderedDict()  # epoch -> time of submission
+        self.dropped = set()  # epochs whose results are not used
+
+    def submit(self, model, epoch):
+        """Queue evaluation of the current parameters.
+
+        Args:
+            model (torch.nn.Module):
+            epoch (int): epoch to which the result is attributed
+
+        """
+        self._jobs.put((epoch, snapshot(model.state_dict())))
+        self.pending[epoch] = time.time()
+
+    def _get(self, block):
+        while True:
+            try:
+                return self._results.get(timeout=1.) if block else self._results.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self._process.is_alive():
+                    raise RuntimeError('The evaluation worker exited with code %s.' %
+                                       self._process.exitcode)
+
+    def _accept(self, result):
+        """Check a result from the worker.
+
+        Returns:
+            result (tuple): `(epoch, metric)`, or None if the result is not used
+
+        """
+        epoch, metric, duration, error = result
+        self.pending.pop(epoch, None)
+        is_dropped = epoch in self.dropped
+        self.dropped.discard(epoch)
+        if error is not None:
+            raise RuntimeError('Evaluation of epoch %d failed in the worker:\n%s' % (epoch, error))
+        if metric is None:
+            logger.warning('Evaluation of epoch %d is skipped in favor of a newer snapshot.' % epoch)
+            return None
+        if is_dropped:
+            logger.warning('Evaluation of epoch %d arrived late and is ignored (%.3f, %.2f min).' %
+                           (epoch, metric, duration / 60))
+            return None
+        logger.info('Evaluation of epoch %d finished in the worker (%.2f min).' % (epoch, duration / 60))
+        return epoch, metric
+
+    def poll(self):
+        """Return results arrived so far without blocking.
+
+        Returns:
+            results (List[tuple]): `(epoch, metric)` in the order of epochs
+
+        """
+        results = []
+        while True:
+            result = self._get(block=False)
+            if result is None:
+                break
+            result = self._accept(result)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def resolve(self):
+        """Apply the late policy to evaluations still running before the next submission.
+
+        Returns:
+            results (List[tuple]): `(epoch, metric)` in the order of epochs
+
+        """
+        results = self.poll()
+        if self.policy == 'wait':
+            results += self.wait()
+        else:
+            for epoch in self.pending.keys():
+                if epoch not in self.dropped:
+                    logger.warning('Evaluation of epoch %d has not finished. Proceed without it.' % epoch)
+                    self.dropped.add(epoch)
+        return results
+
+    def wait(self):
+        """Block until all pending evaluations except dropped ones finish.
+
+        Returns:
+            results (List[tuple]): `(epoch, metric)` in the order of epochs
+
+        """
+        results = []
+        while any(epoch not in self.dropped for epoch in self.pending.keys()):
+            result = self._accept(self._get(block=True))
+            if result is not None:
+                results.append(result)
+        return results
+
+    def close(self):
+        """Wait for pending evaluations and stop the worker.
+
+        Returns:
+            results (List[tuple]): `(epoch, metric)` in the order of epochs
+
+        """
+        results = self.wait()
+        if len(self.pending) > 0:
+            self._process.terminate()  # only dropped evaluations are left
+        else:
+            self._jobs.put(None)
+        self._process.join()
+        return results
+
+
+def apply_eval_results(results, scheduler, reporter, name):
+    """Give metrics evaluated in the worker to the scheduler and the reporter.
+
+    Args:
+        results (List[tuple]): `(epoch, metric)` returned by AsyncEvaluator
+        scheduler (LRScheduler):
+        reporter (Reporter):
+        name (str): name of the metric
+
+    """
+    for epoch, metric in results:
+        logger.info('%s (dev, ep:%d): %.3f' % (name, epoch, metric))
+        scheduler.add_metric(metric, epoch)
+        reporter.add_epoch_metric(metric, epoch, name=name)
@@ -0,0 +1,160 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Checkpoint writer in the background."""
+
+import copy
+import inspect
+import logging
+import os
+import threading
+import torch
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZER_SHARD_SUFFIX = '.optim'
+OPTIMIZER_SHARD_KEYS = ['optimizer_state_dict', 'amp_state_dict', 'scaler_state_dict']
+
+
+def snapshot(obj):
+    """Copy tensors in a (nested) state dict to CPU memory.
+
+    Args:
+        obj: tensor, dict, list, tuple, or others
+    Returns:
+        obj: copy whose tensors are detached from training
+
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def load_to_cpu(path, mmap=False):
+    """Load a checkpoint to CPU memory.
+
+    Checkpoints include Python objects other than tensors (e.g., the scheduler),
+    so `weights_only` is disabled if supported (PyTorch >= 1.13).
+
+    Args:
+        path (str): path to the checkpoint
+        mmap (bool): memory-map tensors if supported (PyTorch >= 2.1)
+    Returns:
+        obj: loaded object
+
+    """
+    params = inspect.signature(torch.load).parameters
+    kwargs = {}
+    if 'weights_only' in params:
+        kwargs['weights_only'] = False
+    if mmap and 'mmap' in params:
+        kwargs['mmap'] = True
+    return torch.load(path, map_location='cpu', **kwargs)
+
+
+def save_atomic(obj, path):
+    """Save an object to a temporary file and rename it.
+
+    A partially written file never appears at `path` even if the process is killed.
+
+    Args:
+        obj: object to save
+        path (str): path to the output file
+
+    """
+    tmp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter(object):
+    """Write checkpoints in a background thread.
+
+    The state is copied to CPU memory on the training thread, and serialization,
+    renaming, and deletion of old checkpoints are done in the background. At most
+    one checkpoint is written at a time, so that the next save waits for the
+    previous one.
+
+    Args:
+        async_write (bool): write checkpoints in a background thread
+        shard (bool): save optimizer states to a separate file (`*.optim`)
+            so that the model can be loaded without optimizer states
+
+    """
+
+    def __init__(self, async_write=True, shard=False):
+        self.async_write = async_write
+        self.shard = shard
+        self._thread = None
+        self._error = None
+
+    def save(self, checkpoint, model_path, remove_paths=[]):
+        """Save a checkpoint.
+
+        Args:
+            checkpoint (dict): checkpoint including `model_state_dict`
+            model_path (str): path to the output file
+            remove_paths (List[str]): old checkpoints to delete after saving
+
+        """
+        self.wait()
+        checkpoint = snapshot(checkpoint)
+        if self.async_write:
+            self._thread = threading.Thread(target=self._write,
+                                            args=(checkpoint, model_path, remove_paths))
+            # NOTE: non-daemon thread to flush the last checkpoint at exit
+            self._thread.start()
+        else:
+            self._write(checkpoint, model_path, remove_paths)
+            self._raise()
+
+    def _write(self, checkpoint, model_path, remove_paths):
+        try:
+            if self.shard:
+                optimizer_shard = {k: checkpoint.pop(k) for k in OPTIMIZER_SHARD_KEYS if k in checkpoint}
+                save_atomic(optimizer_shard, model_path + OPTIMIZER_SHARD_SUFFIX)
+            elif os.path.isfile(model_path + OPTIMIZER_SHARD_SUFFIX):
+                os.remove(model_path + OPTIMIZER_SHARD_SUFFIX)  # stale shard
+            save_atomic(checkpoint, model_path)
+            for path in remove_paths:
+                for p in [path, path + OPTIMIZER_SHARD_SUFFIX]:
+                    if os.path.isfile(p):
+                        os.remove(p)
+            logger.info("=> Saved checkpoint: %s" % model_path)
+        except Exception as e:
+            self._error = e
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """Block until the checkpoint being written is flushed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._raise()
+
+    def close(self):
+        self.wait()
+
+
+def load_optimizer_shard(checkpoint, checkpoint_path):
+    """Merge optimizer states saved in a separate shard into a checkpoint.
+
+    Args:
+        checkpoint (dict): checkpoint loaded from `checkpoint_path`
+        checkpoint_path (str): path to the model checkpoint
+    Returns:
+        checkpoint (dict)
+
+    """
+    shard_path = checkpoint_path + OPTIMIZER_SHARD_SUFFIX
+    if 'optimizer_state_dict' not in checkpoint and os.path.isfile(shard_path):
+        checkpoint.update(load_to_cpu(shard_path))
+    return checkpoint
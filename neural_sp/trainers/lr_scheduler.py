@@ -8,6 +8,11 @@ import logging
 import os
 import torch
 
+from neural_sp.models.data_parallel import is_main_process
+from neural_sp.trainers.checkpoint_writer import (
+    CheckpointWriter,
+    OPTIMIZER_SHARD_SUFFIX
+)
 from neural_sp.trainers.optimizer import set_optimizer
 
 logger = logging.getLogger(__name__)
@@ -38,6 +43,9 @@ class LRScheduler(object):
         factor (float): factor of learning rate for Transformer
         noam (bool): learning rate scheduling for Transformer
         save_checkpoints_topk (int): save top-k checkpoints
+        scaler (torch.amp.GradScaler): gradient scaler for float16 mixed precision training
+        async_checkpoint (bool): write checkpoints in a background thread
+        shard_checkpoint (bool): save optimizer states to a separate file
 
     """
 
@@ -45,9 +53,12 @@ class LRScheduler(object):
                  decay_type, decay_start_epoch, decay_rate,
                  decay_patient_n_epochs=0, early_stop_patient_n_epochs=-1, lower_better=True,
                  warmup_start_lr=0, warmup_n_steps=0, peak_lr=1e6,
-                 model_size=0, factor=1, noam=False, save_checkpoints_topk=1):
+                 model_size=0, factor=1, noam=False, save_checkpoints_topk=1, scaler=None,
+                 async_checkpoint=False, shard_checkpoint=False):
 
         self.optimizer = optimizer
+        self.scaler = scaler
+        self.checkpoint_writer = CheckpointWriter(async_checkpoint, shard_checkpoint)
         self.noam = noam
 
         self._step = 0
@@ -99,7 +110,12 @@ class LRScheduler(object):
     def step(self, skip_optimizer=False):
         self._step += 1
         if not skip_optimizer:
-            self.optimizer.step()
+            if self.scaler is not None:
+                # skip updates with inf/NaN gradients and adjust the scale
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+            else:
+                self.optimizer.step()
         if self.noam:
             self._noam_lr()
         else:
@@ -108,6 +124,11 @@ class LRScheduler(object):
     def zero_grad(self):
         self.optimizer.zero_grad()
 
+    def unscale_grad(self):
+        """Unscale gradients in place before gradient clipping."""
+        if self.scaler is not None:
+            self.scaler.unscale_(self.optimizer)
+
     def _noam_lr(self):
         """Warm up and decay learning rate per step based on Transformer."""
         self.lr = self.base_lr * min(self._step ** (-0.5),
@@ -122,15 +143,43 @@ class LRScheduler(object):
                 self.warmup_n_steps * self._step + self.warmup_start_lr
             self._update_lr()
 
-    def epoch(self, metric=None):
+    def epoch(self, metric=None, defer_metric=False):
         """Decay learning rate per epoch.
 
         Args:
             metric: (float): A metric to evaluate
+            defer_metric (bool): the metric of this epoch is given later by `add_metric`
+                (e.g., when it is computed in a worker process)
 
         """
         self._epoch += 1
         self._is_topk = False
+
+        if not defer_metric:
+            self.add_metric(metric, self._epoch)
+
+        if not self.noam and self._epoch >= self.decay_start_epoch:
+            if self.decay_type == 'always':
+                # if is_best:
+                #     self.not_improved_n_epochs = 0
+                # else:
+                #     self.not_improved_n_epochs += 1
+                self.lr *= self.decay_rate
+                self._update_lr()
+                logger.info('Epoch %d: reducing learning rate to %.7f'
+                            % (self._epoch, self.lr))
+
+    def add_metric(self, metric, epoch=None):
+        """Record a validation metric and decay learning rate if it is not improved.
+
+        Args:
+            metric: (float): A metric to evaluate
+            epoch (int): epoch at which the model was evaluated (the current epoch by default)
+
+        """
+        if epoch is None:
+            epoch = self._epoch
+        self._is_topk = False
         is_best = False
 
         if metric is not None and not self.lower_better:
@@ -140,14 +189,14 @@ class LRScheduler(object):
             if len(self.topk_list) < self.topk or metric < self.topk_list[-1][1]:
                 topk = sum([v < metric for (ep, v) in self.topk_list]) + 1
                 logger.info('||||| Top-%d Score |||||' % topk)
-                self.topk_list.append((self.n_epochs, metric))
+                self.topk_list.append((epoch, metric))
                 self.topk_list = sorted(self.topk_list, key=lambda x: x[1])[:self.topk]
                 self._is_topk = True
                 is_best = (topk == 1)
                 for k, (ep, v) in enumerate(self.topk_list):
                     logger.info('----- Top-%d: epoch%d (%.3f)' % (k + 1, ep, v))
 
-        if not self.noam and self._epoch >= self.decay_start_epoch:
+        if not self.noam and epoch >= self.decay_start_epoch:
             if self.decay_type == 'metric':
                 if is_best:
                     # Improved
@@ -161,16 +210,7 @@ class LRScheduler(object):
                     self.lr *= self.decay_rate
                     self._update_lr()
                     logger.info('Epoch %d: reducing learning rate to %.7f'
-                                % (self._epoch, self.lr))
-            elif self.decay_type == 'always':
-                # if is_best:
-                #     self.not_improved_n_epochs = 0
-                # else:
-                #     self.not_improved_n_epochs += 1
-                self.lr *= self.decay_rate
-                self._update_lr()
-                logger.info('Epoch %d: reducing learning rate to %.7f'
-                            % (self._epoch, self.lr))
+                                % (epoch, self.lr))
 
     def _update_lr(self):
         """Reduce learning rate."""
@@ -194,18 +234,23 @@ class LRScheduler(object):
             epoch_detail (float): fine-grained epoch (used for MBR training)
 
         """
+        if not is_main_process():
+            return  # only the main process saves checkpoints in distributed training
+
         if epoch_detail is None:
             epoch_detail = self.n_epochs
         model_path = os.path.join(save_path, 'model.epoch-' + str(epoch_detail))
 
-        # Remove old checkpoints
+        # Old checkpoints are removed after saving the new one
+        self.checkpoint_writer.wait()
+        remove_paths = []
         if remove_old:
             for path in glob(os.path.join(save_path, 'model.epoch-*')):
-                if 'model.epoch-avg' in path:
+                if 'model.epoch-avg' in path or path.endswith(OPTIMIZER_SHARD_SUFFIX):
                     continue
                 epoch = int(path.split('-')[-1])
                 if epoch not in [ep for (ep, v) in self.topk_list]:
-                    os.remove(path)
+                    remove_paths.append(path)
 
         # Save parameters, optimizer, step index etc.
         checkpoint = {
@@ -214,18 +259,24 @@ class LRScheduler(object):
         }
         if amp is not None:
             checkpoint['amp_state_dict'] = amp.state_dict()
-        torch.save(checkpoint, model_path)
+        if self.scaler is not None:
+            checkpoint['scaler_state_dict'] = self.scaler.state_dict()
+        self.checkpoint_writer.save(checkpoint, model_path, remove_paths)
+        logger.info("=> Saving checkpoint (epoch:%s): %s" % (str(epoch_detail), model_path))
 
-        logger.info("=> Saved checkpoint (epoch:%s): %s" % (str(epoch_detail), model_path))
+    def wait_checkpoint(self):
+        """Block until the last checkpoint is written."""
+        self.checkpoint_writer.wait()
 
     def get_state_dict(self):
         """Return state of scheduler as a :class:`dict`.
 
         It contains an entry for every variable in self.__dict__ which
-        is not the optimizer.
+        is not the optimizer, the gradient scaler, or the checkpoint writer.
 
         """
-        dict = {k: v for k, v in self.__dict__.items() if k not in ['optimizer']}
+        dict = {k: v for k, v in self.__dict__.items()
+                if k not in ['optimizer', 'scaler', 'checkpoint_writer']}
         dict['optimizer_state_dict'] = self.optimizer.state_dict()
         return dict
 
@@ -238,7 +289,8 @@ class LRScheduler(object):
             use_cuda (bool): GPU mode
 
         """
-        self.__dict__.update({k: v for k, v in state_dict.items() if k != 'optimizer_state_dict'})
+        self.__dict__.update({k: v for k, v in state_dict.items()
+                              if k not in ['optimizer_state_dict', 'scaler', 'checkpoint_writer']})
         self.optimizer.load_state_dict(state_dict['optimizer_state_dict'])
         # https://discuss.pytorch.org/t/loading-a-saved-model-for-continue-training/17244/4
         for state in self.optimizer.state.values():
@@ -0,0 +1,151 @@
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Step-level profiler for training."""
+
+from collections import OrderedDict
+import contextlib
+import json
+import logging
+import os
+import time
+import torch
+
+from neural_sp.utils import null_context
+
+logger = logging.getLogger(__name__)
+
+_PROFILER = None  # active profiler
+
+
+def record_stage(name):
+    """Time a stage of the current training step.
+
+    This is a no-op unless a StepProfiler is profiling the current step,
+    so that it can be left in models and data loaders.
+
+    Args:
+        name (str): name of the stage. Nested stages are recorded as `outer/inner`.
+
+    """
+    if _PROFILER is None or not _PROFILER.active:
+        return null_context()
+    return _PROFILER.stage(name)
+
+
+class StepProfiler(object):
+    """Break down time per step into stages in a window of training steps.
+
+    Stages are marked with `record_stage`. At the end of the window, a table of
+    per-stage timings is logged and saved to `profile.json`, and a trace in the
+    Chrome trace event format is saved to `profile.trace.json`, which can be
+    opened with chrome://tracing or Perfetto.
+
+    Args:
+        save_path (str): path to the output directory
+        start_step (int): first step to be profiled (skip warm-up)
+        n_steps (int): number of steps to be profiled (disabled if 0)
+        use_cuda (bool): synchronize CUDA kernels at the boundaries of stages
+
+    """
+
+    def __init__(self, save_path, start_step=100, n_steps=0, use_cuda=False):
+        global _PROFILER
+        self.save_path = save_path
+        self.start_step = start_step
+        self.n_steps = n_steps
+        self.use_cuda = use_cuda
+
+        self._step = 0
+        self._stack = []
+        self._step_start = time.perf_counter()
+        self.events = []  # (step, name, start, duration) in seconds
+        self.step_times = []  # (start, duration) in seconds
+
+        if n_steps > 0:
+            _PROFILER = self
+
+    @property
+    def active(self):
+        return self.start_step <= self._step < self.start_step + self.n_steps
+
+    def _now(self):
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        start = self._now()
+        try:
+            with torch.autograd.profiler.record_function(path):
+                yield
+        finally:
+            self.events.append((self._step, path, start, self._now() - start))
+            self._stack.pop()
+
+    def step(self):
+        """Mark the end of a training step. Results are saved after the last step in the window."""
+        if self.active or self._step == self.start_step - 1:
+            now = self._now()
+            if self.active:
+                self.step_times.append((self._step_start, now - self._step_start))
+            self._step_start = now
+        self._step += 1
+        if self.n_steps > 0 and self._step == self.start_step + self.n_steps:
+            self.save()
+            self.close()
+
+    def summary(self):
+        """Aggregate timings per stage.
+
+        Returns:
+            stats (OrderedDict): stage -> dict of
+                calls (int): number of calls
+                total_ms (float): total time in milliseconds
+                ms_per_step (float): average time per step in milliseconds
+                ratio (float): ratio to the time per step
+
+        """
+        n_steps = max(1, len(self.step_times))
+        step_time = sum(duration for _, duration in self.step_times)
+        stats = OrderedDict()
+        stats['step'] = {'calls': len(self.step_times), 'total_ms': step_time * 1000,
+                         'ms_per_step': step_time * 1000 / n_steps, 'ratio': 1.}
+        for _, name, _, duration in self.events:
+            if name not in stats:
+                stats[name] = {'calls': 0, 'total_ms': 0.}
+            stats[name]['calls'] += 1
+            stats[name]['total_ms'] += duration * 1000
+        for name in stats.keys():
+            stats[name]['ms_per_step'] = stats[name]['total_ms'] / n_steps
+            stats[name]['ratio'] = stats[name]['total_ms'] / max(stats['step']['total_ms'], 1e-9)
+        return stats
+
+    def save(self):
+        stats = self.summary()
+        lines = ['%-40s %8s %12s %12s %7s' % ('stage', 'calls', 'total(ms)', 'ms/step', '%')]
+        for name, s in stats.items():
+            lines.append('%-40s %8d %12.2f %12.2f %7.2f' % (
+                name, s['calls'], s['total_ms'], s['ms_per_step'], s['ratio'] * 100))
+        logger.info('Profile of steps %d-%d:\n%s' % (
+            self.start_step, self.start_step + self.n_steps - 1, '\n'.join(lines)))
+
+        with open(os.path.join(self.save_path, 'profile.json'), 'w') as f:
+            json.dump(stats, f, indent=2)
+        events = [(self.start_step + i, 'step', start, duration)
+                  for i, (start, duration) in enumerate(self.step_times)] + self.events
+        t0 = min([start for _, _, start, _ in events], default=0)
+        trace = [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                  'ts': (start - t0) * 1e6, 'dur': duration * 1e6, 'args': {'step': step}}
+                 for step, name, start, duration in events]
+        with open(os.path.join(self.save_path, 'profile.trace.json'), 'w') as f:
+            json.dump({'traceEvents': trace}, f)
+        logger.info('Saved the profile: %s' % os.path.join(self.save_path, 'profile.json'))
+
+    def close(self):
+        global _PROFILER
+        if _PROFILER is self:
+            _PROFILER = None
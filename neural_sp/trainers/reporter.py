@@ -7,8 +7,13 @@ from tensorboardX import SummaryWriter
 import os
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import logging
 import matplotlib
+import queue
+import threading
+import torch
 matplotlib.use('Agg')
 
 plt.style.use('ggplot')
@@ -20,24 +25,58 @@ green = '#82b74b'
 logger = logging.getLogger(__name__)
 
 
+def average_observations(observations):
+    """Average observations over mini-batches.
+
+    Args:
+        observations (List[dict]): observations returned by the model
+    Returns:
+        observation (dict): average of values except for None
+
+    """
+    observation = {}
+    for k in observations[0].keys():
+        vs = [obsv[k] for obsv in observations if obsv.get(k) is not None]
+        observation[k] = sum(vs) / len(vs) if len(vs) > 0 else None
+    return observation
+
+
 class Reporter(object):
     """"Report loss, accuracy etc. during training.
 
+    Observations are aggregated in memory, and tensorboard logs, figures, and
+    CSV files are written by a background worker so that logging does not
+    block training.
+
     Args:
         save_path (str):
+        write (bool): write tensorboard logs and figures.
+            Set False except for the main process in distributed training.
+        report_step (int): write averages of scalars to tensorboard per this number of steps
 
     """
 
-    def __init__(self, save_path):
+    def __init__(self, save_path, write=True, report_step=1):
         self.save_path = save_path
+        self.write = write
+        self.report_step = max(1, report_step)
 
         # tensorboard
-        self.tf_writer = SummaryWriter(save_path)
+        self.tf_writer = SummaryWriter(save_path) if write else None
+        self._scalars = {}  # key -> [sum, count] since the last flush
+
+        # background worker
+        self._queue = queue.Queue()
+        self._worker = None
+        if write:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+        self._csv_n_rows = {}  # path -> number of rows already written
 
         # report per step
         self._step = 0
         self.obsv_train = {'loss': {}, 'acc': {}, 'ppl': {}}
-        self.obsv_train_local = {'loss': {}, 'acc': {}, 'ppl': {}}
+        self.obsv_train_local = {'loss': {}, 'acc': {}, 'ppl': {}}  # name -> [sum, count]
         self.obsv_dev = {'loss': {}, 'acc': {}, 'ppl': {}}
         self.steps = []
 
@@ -46,6 +85,20 @@ class Reporter(object):
         self.obsv_eval = []
         self.epochs = []
 
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                job[0](*job[1:])
+            except Exception as e:
+                logger.warning('Failed to write logs: %s' % e)
+
+    def _submit(self, func, *args):
+        if self._worker is not None:
+            self._queue.put((func, ) + args)
+
     def add(self, observation, is_eval=False):
         """Restore values per step.
 
@@ -67,9 +120,9 @@ class Reporter(object):
                 # average for training
                 if name not in self.obsv_train[metric].keys():
                     self.obsv_train[metric][name] = []
-                self.obsv_train[metric][name].append(
-                    np.mean(self.obsv_train_local[metric][name]))
-                logger.info('%s (train): %.3f' % (k, np.mean(self.obsv_train_local[metric][name])))
+                v_sum, count = self.obsv_train_local[metric][name]
+                self.obsv_train[metric][name].append(v_sum / count)
+                logger.info('%s (train): %.3f' % (k, v_sum / count))
 
                 if name not in self.obsv_dev[metric].keys():
                     self.obsv_dev[metric][name] = []
@@ -78,19 +131,49 @@ class Reporter(object):
                 self.add_tensorboard_scalar('dev' + '/' + metric + '/' + name, v)
             else:
                 if name not in self.obsv_train_local[metric].keys():
-                    self.obsv_train_local[metric][name] = []
-                self.obsv_train_local[metric][name].append(v)
+                    self.obsv_train_local[metric][name] = [0., 0]
+                self.obsv_train_local[metric][name][0] += v
+                self.obsv_train_local[metric][name][1] += 1
                 self.add_tensorboard_scalar('train' + '/' + metric + '/' + name, v)
 
     def add_tensorboard_scalar(self, key, value):
-        """Add scalar value to tensorboard."""
-        self.tf_writer.add_scalar(key, value, self._step)
+        """Add scalar value to tensorboard.
+
+        Values are averaged over `report_step` steps before being written.
+
+        """
+        if self.tf_writer is None:
+            return
+        if isinstance(value, torch.Tensor):
+            value = value.item()
+        if key not in self._scalars:
+            self._scalars[key] = [0., 0]
+        self._scalars[key][0] += value
+        self._scalars[key][1] += 1
 
     def add_tensorboard_histogram(self, key, value):
         """Add histogram value to tensorboard."""
-        self.tf_writer.add_histogram(key, value, self._step)
+        if self.tf_writer is None:
+            return
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu().numpy()
+        self._submit(self.tf_writer.add_histogram, key, np.array(value), self._step)
+
+    def flush(self):
+        """Write buffered scalars to tensorboard."""
+        if self.tf_writer is None or len(self._scalars) == 0:
+            return
+        scalars = {k: v_sum / count for k, (v_sum, count) in self._scalars.items()}
+        self._scalars = {}
+        self._submit(self._write_scalars, scalars, self._step)
+
+    def _write_scalars(self, scalars, step):
+        for k, v in scalars.items():
+            self.tf_writer.add_scalar(k, v, step)
 
     def step(self, is_eval=False):
+        if (self._step + 1) % self.report_step == 0:
+            self.flush()
         self._step += 1
         if is_eval:
             self.steps.append(self._step)
@@ -102,59 +185,96 @@ class Reporter(object):
         self._epoch += 1
         if metric is None:
             return
-        self.epochs.append(self._epoch)
+        self.add_epoch_metric(metric, self._epoch, name)
+
+    def add_epoch_metric(self, metric, epoch, name='wer'):
+        """Register a validation metric of an epoch, which may be given after the epoch ends."""
+        self.epochs.append(epoch)
 
         # register
         self.obsv_eval.append(metric)
+        if not self.write:
+            return
+        self._submit(self._plot_epoch, list(self.epochs), list(self.obsv_eval), name)
 
-        plt.clf()
+    def _plot_epoch(self, epochs, obsv_eval, name):
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
         upper = 0.1
-        plt.plot(self.epochs, self.obsv_eval, orange,
-                 label='dev', linestyle='-')
-        plt.xlabel('epoch', fontsize=12)
-        plt.ylabel(name, fontsize=12)
-        if max(self.obsv_eval) > 1:
-            upper = min(100, max(self.obsv_eval) + 1)
+        ax.plot(epochs, obsv_eval, orange,
+                label='dev', linestyle='-')
+        ax.set_xlabel('epoch', fontsize=12)
+        ax.set_ylabel(name, fontsize=12)
+        if max(obsv_eval) > 1:
+            upper = min(100, max(obsv_eval) + 1)
         else:
-            upper = min(upper, max(self.obsv_eval))
-        plt.ylim([0, upper])
-        plt.legend(loc="upper right", fontsize=12)
-        if os.path.isfile(os.path.join(self.save_path, name + ".png")):
-            os.remove(os.path.join(self.save_path, name + ".png"))
-        plt.savefig(os.path.join(self.save_path, name + ".png"))
+            upper = min(upper, max(obsv_eval))
+        ax.set_ylim([0, upper])
+        ax.legend(loc="upper right", fontsize=12)
+        self._savefig(fig, os.path.join(self.save_path, name + ".png"))
 
     def snapshot(self):
+        if not self.write:
+            return
+        obsv_train = {metric: {k: list(v) for k, v in obsv.items()}
+                      for metric, obsv in self.obsv_train.items()}
+        obsv_dev = {metric: {k: list(v) for k, v in obsv.items()}
+                    for metric, obsv in self.obsv_dev.items()}
+        self._submit(self._plot_steps, list(self.steps), obsv_train, obsv_dev)
+
+    def _plot_steps(self, steps, obsv_train, obsv_dev):
         # linestyles = ['solid', 'dashed', 'dotted', 'dashdotdotted']
         linestyles = ['-', '--', '-.', ':', ':', ':', ':', ':', ':', ':', ':', ':']
-        for metric in self.obsv_train.keys():
-            plt.clf()
+        for metric in obsv_train.keys():
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(111)
             upper = 0.1
-            for i, (k, v) in enumerate(sorted(self.obsv_train[metric].items())):
+            for i, (k, v) in enumerate(sorted(obsv_train[metric].items())):
                 # skip non-observed values
-                if np.mean(self.obsv_train[metric][k]) == 0:
+                if np.mean(obsv_train[metric][k]) == 0:
                     continue
 
-                plt.plot(self.steps, self.obsv_train[metric][k], blue,
-                         label=k + " (train)", linestyle=linestyles[i])
-                plt.plot(self.steps, self.obsv_dev[metric][k], orange,
-                         label=k + " (dev)", linestyle=linestyles[i])
-                upper = max(upper, max(self.obsv_train[metric][k]))
-                upper = max(upper, max(self.obsv_dev[metric][k]))
+                ax.plot(steps, obsv_train[metric][k], blue,
+                        label=k + " (train)", linestyle=linestyles[i])
+                ax.plot(steps, obsv_dev[metric][k], orange,
+                        label=k + " (dev)", linestyle=linestyles[i])
+                upper = max(upper, max(obsv_train[metric][k]))
+                upper = max(upper, max(obsv_dev[metric][k]))
 
                 # Save as csv file
-                if os.path.isfile(os.path.join(self.save_path, metric + '-' + k + ".csv")):
-                    os.remove(os.path.join(self.save_path, metric + '-' + k + ".csv"))
-                loss_graph = np.column_stack(
-                    (self.steps, self.obsv_train[metric][k], self.obsv_dev[metric][k]))
-                np.savetxt(os.path.join(self.save_path, metric + '-' + k + ".csv"), loss_graph, delimiter=",")
+                self._append_csv(os.path.join(self.save_path, metric + '-' + k + ".csv"),
+                                 np.column_stack((steps, obsv_train[metric][k], obsv_dev[metric][k])))
 
             if upper > 1:
                 upper = min(upper + 10, 300)  # for CE, CTC loss
 
-            plt.xlabel('step', fontsize=12)
-            plt.ylabel(metric, fontsize=12)
-            plt.ylim([0, upper])
-            plt.legend(loc="upper right", fontsize=12)
-            if os.path.isfile(os.path.join(self.save_path, metric + ".png")):
-                os.remove(os.path.join(self.save_path, metric + ".png"))
-            plt.savefig(os.path.join(self.save_path, metric + ".png"))
+            ax.set_xlabel('step', fontsize=12)
+            ax.set_ylabel(metric, fontsize=12)
+            ax.set_ylim([0, upper])
+            ax.legend(loc="upper right", fontsize=12)
+            self._savefig(fig, os.path.join(self.save_path, metric + ".png"))
+
+    def _append_csv(self, path, rows):
+        """Append rows that have not been written yet. The file is truncated at the first write."""
+        n_rows = self._csv_n_rows.get(path, 0)
+        with open(path, 'a' if n_rows > 0 else 'w') as f:
+            np.savetxt(f, rows[n_rows:], delimiter=",")
+        self._csv_n_rows[path] = len(rows)
+
+    def _savefig(self, fig, path):
+        # NOTE: replace the old figure at once so that it can be viewed during training
+        tmp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+        fig.savefig(tmp_path, format='png')
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """Flush all logs and stop the background worker."""
+        self.flush()
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+        if self.tf_writer is not None:
+            self.tf_writer.close()
@@ -3,6 +3,7 @@
 
 """Unility functions for general purposes."""
 
+import contextlib
 import os
 
 
@@ -30,3 +31,9 @@ def mkdir_join(path, *dir_name):
         else:
             path = os.path.join(path, dir_name[i])
     return path
+
+
+@contextlib.contextmanager
+def null_context():
+    """Context manager that does nothing (contextlib.nullcontext needs Python >= 3.7)."""
+    yield
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark peak CPU memory of relative self-attention versus sequence length.
+
+Usage:
+    python test/benchmark/bench_relative_attention.py --lengths 500 1000 2000 --attn_chunk_size 128
+
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import time
+import torch
+
+from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
+from neural_sp.models.modules.relative_multihead_attention import RelativeMultiheadAttentionMechanism as RelMHA
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(queue, xmax, attn_chunk_size, args):
+    torch.manual_seed(1)
+    torch.set_num_threads(args.n_threads)
+    attn = RelMHA(kdim=args.d_model, qdim=args.d_model, adim=args.d_model, odim=args.d_model,
+                  n_heads=args.n_heads, dropout=0.1, xl_like=True, attn_chunk_size=attn_chunk_size)
+    pos_emb = XLPositionalEmbedding(args.d_model, 0.1)
+    u_bias = torch.nn.Parameter(torch.zeros(args.n_heads, args.d_model // args.n_heads))
+    v_bias = torch.nn.Parameter(torch.zeros(args.n_heads, args.d_model // args.n_heads))
+    xs = torch.randn(args.batch_size, xmax, args.d_model, requires_grad=True)
+    mask = torch.ones(args.batch_size, xmax, xmax, dtype=torch.bool)
+    pos_embs = pos_emb(xs, zero_center_offset=True)
+
+    # warm up to exclude one-time allocation
+    attn.train()
+    xs_warmup = xs[:, :attn_chunk_size + 1].detach().requires_grad_()
+    cv, _ = attn(xs_warmup, xs_warmup, pos_emb(xs_warmup, zero_center_offset=True),
+                 mask[:, :attn_chunk_size + 1, :attn_chunk_size + 1], u_bias, v_bias)
+    cv.sum().backward()
+
+    base = peak_rss_mb()
+    start = time.time()
+    cv, _ = attn(xs, xs, pos_embs, mask, u_bias, v_bias)
+    cv.sum().backward()
+    queue.put((peak_rss_mb() - base, time.time() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[250, 500, 1000, 1500])
+    parser.add_argument('--attn_chunk_size', type=int, default=128)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--d_model', type=int, default=256)
+    parser.add_argument('--n_heads', type=int, default=4)
+    parser.add_argument('--n_threads', type=int, default=1)
+    args = parser.parse_args()
+
+    # return freed score tensors to the OS immediately so that ru_maxrss reflects live memory
+    os.environ.setdefault('MALLOC_MMAP_THRESHOLD_', '65536')
+    ctx = mp.get_context('spawn')
+    print('%8s %18s %18s %12s %12s' % ('T', 'full peak [MB]', 'chunk peak [MB]', 'full [s]', 'chunk [s]'))
+    for xmax in args.lengths:
+        results = []
+        for attn_chunk_size in [0, args.attn_chunk_size]:
+            # measure each setting in a fresh process since ru_maxrss never decreases
+            queue = ctx.Queue()
+            p = ctx.Process(target=run, args=(queue, xmax, attn_chunk_size, args))
+            p.start()
+            results.append(queue.get())
+            p.join()
+        print('%8d %18.1f %18.1f %12.3f %12.3f' % (xmax, results[0][0], results[1][0],
+                                                   results[0][1], results[1][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark throughput of the RNN encoder (full-context and latency-controlled).
+
+Usage:
+    python test/benchmark/bench_rnn_encoder.py --batch_size 16 --xmax 800 --n_layers 5
+
+"""
+
+import argparse
+import time
+import torch
+
+from neural_sp.models.seq2seq.encoders.rnn import RNNEncoder
+
+
+def build(enc_type, N_l, N_r, args):
+    return RNNEncoder(
+        input_dim=args.input_dim, enc_type=enc_type, n_units=args.n_units, n_projs=0, last_proj_dim=0,
+        n_layers=args.n_layers, n_layers_sub1=0, n_layers_sub2=0, dropout_in=0.1, dropout=0.1,
+        subsample='_'.join(['1'] * args.n_layers), subsample_type='drop', n_stacks=1, n_splices=1,
+        conv_in_channel=1, conv_channels='', conv_kernel_sizes='', conv_strides='', conv_poolings='',
+        conv_batch_norm=False, conv_layer_norm=False, conv_bottleneck_dim=0,
+        bidir_sum_fwd_bwd=False, task_specific_layer=False, param_init=0.1,
+        chunk_size_left=str(N_l), chunk_size_right=str(N_r), rsp_prob=0)
+
+
+def forward_layerwise(enc):
+    """One RNN call per layer with the same parameters as the multi-layer RNN."""
+    rnn = enc.rnn_stacked
+    layers = torch.nn.ModuleList()
+    for lth in range(rnn.num_layers):
+        input_size = rnn.input_size if lth == 0 else rnn.hidden_size * (2 if rnn.bidirectional else 1)
+        layers.append(type(rnn)(input_size, rnn.hidden_size, 1, batch_first=True,
+                                bidirectional=rnn.bidirectional))
+    layers.to(next(rnn.parameters()).device)
+
+    def forward(xs, xlens, streaming):
+        for layer in layers:
+            layer.flatten_parameters()
+            xs = enc.dropout(enc.padding(xs, xlens, layer)[0])
+        return xs, xlens
+    return forward
+
+
+def measure(enc, xs, xlens, n_iters, train):
+    enc.train(train)
+    elapsed = []
+    for i in range(n_iters + 1):
+        start = time.time()
+        if train:
+            enc(xs, xlens, task='all')['ys']['xs'].sum().backward()
+        else:
+            with torch.no_grad():
+                enc(xs, xlens, task='all')
+        if xs.is_cuda:
+            torch.cuda.synchronize()
+        if i > 0:  # skip warm-up
+            elapsed.append(time.time() - start)
+    return xlens.sum().item() * n_iters / sum(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--xmax', type=int, default=800)
+    parser.add_argument('--input_dim', type=int, default=80)
+    parser.add_argument('--n_units', type=int, default=256)
+    parser.add_argument('--n_layers', type=int, default=5)
+    parser.add_argument('--chunk_size_left', type=int, default=40)
+    parser.add_argument('--chunk_size_right', type=int, default=20)
+    parser.add_argument('--n_iters', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    torch.manual_seed(1)
+    xs = torch.randn(args.batch_size, args.xmax, args.input_dim, device=args.device)
+    xlens = torch.IntTensor([args.xmax - i for i in range(args.batch_size)])
+
+    print('%-24s %8s %18s %18s' % ('encoder', 'mode', 'baseline [fr/s]', 'optimized [fr/s]'))
+    for name, enc_type, N_l, N_r in [('BLSTM', 'blstm', 0, 0),
+                                     ('LC-BLSTM', 'blstm', args.chunk_size_left, args.chunk_size_right)]:
+        enc = build(enc_type, N_l, N_r, args).to(args.device)
+        for train in [False, True]:
+            opt = measure(enc, xs, xlens, args.n_iters, train)
+            # baseline: layer-wise (chunk-wise) encoding
+            if enc.rnn_stacked is not None:
+                enc._forward_stacked = forward_layerwise(enc)
+            if enc.lc_bidir:
+                enc._forward_latency_controlled_batch = lambda xs, xlens, N_l, N_r, enc=enc: \
+                    enc._forward_latency_controlled(xs, xlens, N_l, N_r, streaming=False)
+            base = measure(enc, xs, xlens, args.n_iters, train)
+            enc.__dict__.pop('_forward_stacked', None)
+            enc.__dict__.pop('_forward_latency_controlled_batch', None)
+            print('%-24s %8s %18.1f %18.1f' % (name, 'train' if train else 'eval', base, opt))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for datasets for ASR."""
+
+import importlib
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_df(n_utts=53):
+    xlens = np.sort(np.random.randint(100, 2000, n_utts))
+    ylens = np.random.randint(1, 50, n_utts)
+    return pd.DataFrame({'xlen': xlens, 'ylen': ylens})
+
+
+def sample_epoch(sampler, batch_size=None):
+    batches = []
+    is_new_epoch = False
+    while not is_new_epoch:
+        indices, is_new_epoch = sampler.sample_index(batch_size)
+        batches.append(indices)
+    sampler._reset()
+    return batches
+
+
+@pytest.mark.parametrize("shuffle_bucket", [False, True])
+@pytest.mark.parametrize("world_size", [2, 3])
+def test_batch_sampler_sharding(shuffle_bucket, world_size):
+    df = make_df()
+    module = importlib.import_module('neural_sp.datasets.asr')
+    samplers = [module.CustomBatchSampler(df, batch_size=4, dynamic_batching=False,
+                                          shuffle_bucket=shuffle_bucket, discourse_aware=False,
+                                          sort_stop_epoch=1e10, rank=rank, world_size=world_size)
+                for rank in range(world_size)]
+
+    for ep in range(2):
+        batches = [sample_epoch(sampler) for sampler in samplers]
+
+        # all ranks perform the same number of steps
+        n_steps = len(batches[0])
+        assert all(len(b) == n_steps for b in batches)
+
+        # mini-batches at each step are disjoint except for the last step
+        for step in range(n_steps - 1):
+            indices = sum([batches[rank][step] for rank in range(world_size)], [])
+            assert len(set(indices)) == len(indices)
+            # consecutive utterances sorted by length
+            assert max(indices) - min(indices) < 4 * world_size
+
+        # all utterances are covered
+        indices = set(i for b in batches for indices in b for i in indices)
+        assert indices == set(df.index)
+
+
+def test_batch_sampler_single_process():
+    df = make_df()
+    module = importlib.import_module('neural_sp.datasets.asr')
+    sampler = module.CustomBatchSampler(df, batch_size=4, dynamic_batching=False,
+                                        shuffle_bucket=False, discourse_aware=False,
+                                        sort_stop_epoch=1e10)
+    batches = sample_epoch(sampler)
+    assert [sorted(b) for b in batches] == [list(range(i, min(i + 4, len(df))))
+                                            for i in range(0, len(df), 4)]
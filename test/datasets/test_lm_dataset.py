@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for datasets for LM."""
+
+import importlib
+import numpy as np
+import pandas as pd
+import pickle
+import pytest
+
+
+VOCAB = 20
+
+
+def make_tsv(tmp_path, n_utts=50):
+    dict_path = tmp_path / 'dict.txt'
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+
+    rows = []
+    for i in np.random.permutation(n_utts):
+        ylen = np.random.randint(1, 10)
+        token_id = ' '.join(map(str, np.random.randint(4, VOCAB, ylen)))
+        rows.append(['utt%03d' % i, 'spk', '', 0, 0, '', token_id, ylen, VOCAB])
+    tsv_path = tmp_path / 'test.tsv'
+    pd.DataFrame(rows, columns=['utt_id', 'speaker', 'feat_path', 'xlen', 'xdim',
+                                'text', 'token_id', 'ylen', 'ydim']).to_csv(tsv_path, sep='\t', index=False)
+    return str(tsv_path), str(dict_path)
+
+
+def concat_utterances_reference(df, batch_size, backward=False, eos=2):
+    indices = list(df.index)
+    if backward:
+        indices = indices[::-1]
+    concat_ids = []
+    for i in indices:
+        concat_ids += [eos] + list(map(int, df['token_id'][i].split()))
+    concat_ids += [eos]
+    concat_ids = concat_ids[:len(concat_ids) // batch_size * batch_size]
+    return np.array(concat_ids).reshape((batch_size, -1))
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+@pytest.mark.parametrize("backward", [False, True])
+def test_concat_utterances(tmp_path, batch_size, backward):
+    tsv_path, dict_path = make_tsv(tmp_path)
+    module = importlib.import_module('neural_sp.datasets.lm')
+    dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='word',
+                             batch_size=batch_size, bptt=8, backward=backward, is_test=True)
+
+    assert np.array_equal(dataset.concat_ids,
+                          concat_utterances_reference(dataset.df, batch_size, backward))
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+@pytest.mark.parametrize("backward", [False, True])
+@pytest.mark.parametrize("chunk_size", [7, 100000])
+def test_binarized(tmp_path, batch_size, backward, chunk_size):
+    tsv_path, dict_path = make_tsv(tmp_path)
+    bin_path = str(tmp_path / 'test.bin')
+    module = importlib.import_module('neural_sp.datasets.lm')
+    n_tokens = module.binarize(tsv_path, bin_path, vocab=VOCAB, chunk_size=chunk_size)
+
+    kwargs = dict(dict_path=dict_path, unit='word', batch_size=batch_size,
+                  bptt=8, backward=backward, is_test=True)
+    dataset = module.Dataset(tsv_path=tsv_path, **kwargs)
+    dataset_bin = module.Dataset(tsv_path=bin_path, **kwargs)
+    assert dataset_bin.stream.dtype == np.uint16
+    assert len(dataset_bin.stream) == n_tokens
+    assert len(dataset_bin) == len(dataset)
+
+    # identical mini-batches
+    while True:
+        ys, is_new_epoch = dataset.next()
+        ys_bin, is_new_epoch_bin = dataset_bin.next()
+        assert ys_bin.dtype == np.int64
+        assert np.array_equal(ys, ys_bin)
+        assert is_new_epoch == is_new_epoch_bin
+        if is_new_epoch:
+            break
+
+
+def test_binarized_shuffle(tmp_path):
+    tsv_path, dict_path = make_tsv(tmp_path)
+    bin_path = str(tmp_path / 'test.bin')
+    module = importlib.import_module('neural_sp.datasets.lm')
+    module.binarize(tsv_path, bin_path, vocab=VOCAB)
+
+    dataset = module.Dataset(tsv_path=bin_path, dict_path=dict_path, unit='word',
+                             batch_size=1, bptt=8, shuffle=True)
+    utt_order = dataset.utt_order
+    assert not np.array_equal(utt_order, np.arange(dataset.n_utts))
+
+    # utterances are concatenated in the shuffled order without copying the stream
+    utts = np.split(np.asarray(dataset.stream), dataset.utt_offsets[1:])[:-1]
+    concat_ids = np.concatenate([utts[i] for i in utt_order] + [[2]])
+    assert np.array_equal(dataset.concat_ids[0], concat_ids)
+
+    dataset.reset()
+    assert not np.array_equal(dataset.utt_order, utt_order)
+    assert sorted(dataset.concat_ids[0].tolist()) == sorted(concat_ids.tolist())
+
+
+def test_binarized_pickle(tmp_path):
+    tsv_path, dict_path = make_tsv(tmp_path, n_utts=500)
+    bin_path = str(tmp_path / 'test.bin')
+    module = importlib.import_module('neural_sp.datasets.lm')
+    module.binarize(tsv_path, bin_path, vocab=VOCAB)
+
+    dataset = module.Dataset(tsv_path=bin_path, dict_path=dict_path, unit='word',
+                             batch_size=3, bptt=8)
+    # the memory-mapped stream is not copied into the pickle (e.g., for spawned workers)
+    data = pickle.dumps(dataset)
+    assert len(data) < len(dataset.stream) * dataset.stream.itemsize
+    dataset_copy = pickle.loads(data)
+    assert isinstance(dataset_copy.stream, np.memmap)
+    assert dataset_copy.stream.dtype == dataset.stream.dtype
+    assert np.array_equal(dataset_copy.concat_ids, dataset.concat_ids)
+    assert isinstance(dataset.stream, np.memmap)
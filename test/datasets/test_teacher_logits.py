@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the teacher logit store."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+def make_args_rnnlm(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=16,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=10,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize("topk", [1, 4, 100])
+def test_teacher_logit_store(tmp_path, topk):
+    module = importlib.import_module('neural_sp.datasets.teacher_logits')
+    vocab = 10
+    logits = {'utt%d' % i: torch.randn(i + 2, vocab) for i in range(5)}
+
+    writer = module.TeacherLogitWriter(str(tmp_path), topk, vocab)
+    for utt_id, lg in logits.items():
+        writer.add(utt_id, lg)
+    writer.close()
+
+    store = module.TeacherLogitStore(str(tmp_path))
+    assert len(store) == 5
+    assert 'utt0' in store and 'utt5' not in store
+    topk = min(topk, vocab)
+    for utt_id, lg in logits.items():
+        indices, log_probs = store[utt_id]
+        assert indices.shape == log_probs.shape == (lg.size(0), topk)
+        ref_log_probs, ref_indices = torch.topk(torch.log_softmax(lg, dim=-1), k=topk, dim=-1)
+        assert np.array_equal(indices, ref_indices.numpy())
+        assert np.allclose(log_probs, ref_log_probs.numpy(), atol=1e-2)
+    with pytest.raises(KeyError):
+        store['utt5']
+
+    # soft labels are renormalized over top-k tokens
+    teacher_topk = [store['utt0'], store['utt3']]
+    dense = module.topk2logits(teacher_topk, vocab, torch.device('cpu'))
+    assert dense.size() == (2, 5, vocab)
+    probs = torch.softmax(dense[0, :2], dim=-1)
+    ref = torch.softmax(lg.new_tensor(teacher_topk[0][1].astype(np.float32)), dim=-1)
+    assert torch.allclose(probs.sum(-1), torch.ones(2))
+    assert torch.allclose(torch.gather(probs, 1, torch.from_numpy(teacher_topk[0][0]).long()), ref)
+    assert not torch.isnan(torch.softmax(dense / 5., dim=-1)).any()
+
+
+def test_teacher_logit_store_from_lm(tmp_path):
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    generator = importlib.import_module('neural_sp.bin.asr.generate_teacher_logits')
+    module = importlib.import_module('neural_sp.datasets.teacher_logits')
+    rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    vocab, topk = 10, 4
+
+    torch.manual_seed(1)
+    lm = rnnlm.RNNLM(argparse.Namespace(**make_args_rnnlm()))
+    lm_dir = tmp_path / 'rnnlm'
+    lm_dir.mkdir()
+    train_utils.save_config(make_args_rnnlm(), str(lm_dir / 'conf.yml'))
+    torch.save({'model_state_dict': lm.state_dict()}, str(lm_dir / 'model.epoch-1'))
+    lm.eval()
+
+    teacher_lm = generator.load_teacher_lm(str(lm_dir / 'model.epoch-1'))
+    teacher_lm.eval()
+    ys = [[4, 5, 6], [7], []]
+    with torch.no_grad():
+        logits = generator.generate_lm_logits(teacher_lm, ys)
+    assert logits.size() == (len(ys), 4, vocab)
+
+    store_dir = tmp_path / 'store'
+    writer = module.TeacherLogitWriter(str(store_dir), topk, vocab)
+    for b, y in enumerate(ys):
+        writer.add('utt%d' % b, logits[b, :len(y) + 1])  # including <eos>
+    writer.close()
+
+    store = module.TeacherLogitStore(str(store_dir))
+    assert len(store) == len(ys)
+    for b, y in enumerate(ys):
+        indices, log_probs = store['utt%d' % b]
+        assert indices.shape == log_probs.shape == (len(y) + 1, topk)
+        # reference: token-by-token prediction of the original LM
+        state = None
+        tokens = [lm.eos] + y
+        with torch.no_grad():
+            for t in range(len(tokens)):
+                _, state, lp = lm.predict(torch.LongTensor([[tokens[t]]]), state)
+                ref_log_probs, ref_indices = torch.topk(lp[0, -1], k=topk)
+                assert np.array_equal(indices[t], ref_indices.numpy())
+                assert np.allclose(log_probs[t], ref_log_probs.numpy(), atol=1e-2)
@@ -403,6 +403,43 @@ def test_decoding(backward, lm_fusion, params):
                 assert len(scores[0]) == params['nbest']
 
 
+@pytest.mark.parametrize("lm_weight", [0.5, 2.0])
+def test_shallow_fusion_adaptive_softmax(monkeypatch, lm_weight):
+    vocab = 100  # large for adaptive softmax
+    args = make_args(vocab=vocab)
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=lm_weight, nbest=4)
+    eouts = torch.randn(1, 40, ENC_N_UNITS)
+    elens = torch.IntTensor([40])
+
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module_rnnlm.RNNLM(make_args_rnnlm(vocab=vocab, adaptive_softmax=True))
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+
+    # capture final hypotheses with their fused scores
+    end_hyps = []
+    lm_rescoring = module.BeamSearch.lm_rescoring
+
+    def capture(self, hyps, *args, **kwargs):
+        if len(end_hyps) == 0:
+            end_hyps.extend(hyps)
+        return lm_rescoring(self, hyps, *args, **kwargs)
+    monkeypatch.setattr(module.BeamSearch, 'lm_rescoring', capture)
+
+    with torch.no_grad():
+        dec.beam_search(eouts, elens, params, None, lm, None, None, None,
+                        nbest=params['nbest'], exclude_eos=False,
+                        refs_id=None, utt_ids=None, speakers=None)
+        # LM scores of candidates match those of the full softmax
+        scores_lm = lm.score_sequences([np.array(hyp['hyp'], dtype=np.int64) for hyp in end_hyps])
+    assert len(end_hyps) > 0
+    for hyp, score_lm in zip(end_hyps, scores_lm.tolist()):
+        assert hyp['score_lm'] == pytest.approx(score_lm, abs=1e-3)
+        # the LM score is included in the score for ranking
+        assert hyp['score'] == pytest.approx(hyp['score_att'] + lm_weight * hyp['score_lm'], abs=1e-3)
+
+
 @pytest.mark.parametrize(
     "params",
     [
@@ -455,3 +492,86 @@ def test_streaming_decoding(params):
             end_hyps, hyps, _ = out
             assert isinstance(end_hyps, list)
             assert isinstance(hyps, list)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'rnn_type': 'lstm'}),
+        ({'rnn_type': 'gru'}),
+        ({'attn_type': 'add', 'attn_n_heads': 4}),
+        ({'length_penalty': 0.1}),
+        ({'lm_fusion': 'deep'}),
+    ]
+)
+def test_forward_mbr(args):
+    length_penalty = args.pop('length_penalty', 0.)
+    args = make_args(mbr_training=True, **args)
+    params = make_decode_params(recog_beam_width=4, recog_length_penalty=length_penalty)
+
+    batch_size = 4
+    emax = 20
+    device = "cpu"
+
+    eouts = torch.randn(batch_size, emax, ENC_N_UNITS)
+    elens = torch.IntTensor([20, 18, 15, 10])
+    ylens = [4, 5, 3, 7]
+    ys = [np.random.randint(4, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+
+    if args['lm_fusion']:
+        module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        args['external_lm'] = module_rnnlm.RNNLM(make_args_rnnlm()).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        nbest_hyps, log_scores = dec.generate_nbest(eouts, elens, params, nbest=4)
+    assert len(nbest_hyps) == batch_size
+    for b in range(batch_size):
+        assert 1 <= len(nbest_hyps[b]) <= 4
+        assert len(set(tuple(hyp) for hyp in nbest_hyps[b])) == len(nbest_hyps[b])
+        assert all(len(hyp) <= math.ceil(elens[b].item()) for hyp in nbest_hyps[b])
+        assert all(dec.eos not in hyp for hyp in nbest_hyps[b])
+        assert log_scores[b].size(0) == len(nbest_hyps[b])
+
+    # risks are word (or token) error rates
+    from neural_sp.evaluators.edit_distance import compute_wer
+    refs = [ys[b] for b in range(batch_size) for _ in nbest_hyps[b]]
+    hyps = [hyp for b in range(batch_size) for hyp in nbest_hyps[b]]
+    for converter in [idx2token, None]:
+        risks = dec.compute_risks(refs, hyps, converter, device)
+        for ref, hyp, risk in zip(refs, hyps, risks.tolist()):
+            if converter is not None:
+                ref, hyp = converter(ref).split(), converter(hyp).split()
+            assert risk == pytest.approx(compute_wer(list(ref), list(hyp), normalize=True)[0] / 100)
+
+    dec.train()
+    loss, observation = dec(eouts, elens, ys, task='all', recog_params=params, idx2token=idx2token)
+    assert loss.dim() == 1
+    assert loss.size(0) == 1
+    assert observation['loss_mbr'] >= 0
+    loss.backward()
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_batch_edit_distance(monkeypatch, legacy):
+    if legacy:
+        # PyTorch < 1.5
+        monkeypatch.delattr(torch, 'cummin')
+    from neural_sp.evaluators.edit_distance import (
+        batch_edit_distance,
+        compute_wer
+    )
+
+    refs = [list(np.random.randint(0, 5, np.random.randint(0, 8))) for _ in range(50)]
+    hyps = [list(np.random.randint(0, 5, np.random.randint(0, 8))) for _ in range(50)]
+    dists = batch_edit_distance(
+        pad_list([torch.LongTensor(y) for y in refs], -1),
+        pad_list([torch.LongTensor(y) for y in hyps], -1),
+        torch.LongTensor([len(y) for y in refs]),
+        torch.LongTensor([len(y) for y in hyps]))
+    for ref, hyp, d in zip(refs, hyps, dists.tolist()):
+        assert d == compute_wer(ref, hyp)[0] / 100
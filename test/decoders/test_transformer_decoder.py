@@ -64,6 +64,7 @@ def make_args(**kwargs):
         share_chunkwise_attention=False,
         external_lm=None,
         lm_fusion='',
+        pack_sequences=False,
     )
     args.update(kwargs)
     return args
@@ -331,3 +332,40 @@ def test_decoding(backward, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'pe_type': 'none'}),
+        ({'backward': True}),
+        ({'lsm_prob': 0.1}),
+    ]
+)
+def test_forward_packed(args):
+    args = make_args(pack_sequences=True, dropout=0., dropout_emb=0., dropout_att=0., **args)
+
+    batch_size = 4
+    emax = 40
+    device = "cpu"
+
+    elens = torch.IntTensor([40, 35, 30, 20])
+    eouts = pad_list([torch.randn(elen, ENC_N_UNITS, device=device) for elen in elens.tolist()], 0.)
+    ylens = [2, 5, 3, 7]
+    ys = [np.random.randint(4, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec.train()
+
+    # packing must not change the loss
+    loss_packed, acc_packed, ppl_packed, _ = dec.forward_att(eouts, elens, ys)
+    assert dec.packing_stats.n_rows < batch_size
+    dec.pack_sequences = False
+    loss, acc, ppl, _ = dec.forward_att(eouts, elens, ys)
+    assert torch.allclose(loss_packed, loss, atol=1e-5)
+    assert abs(acc_packed - acc) < 1e-6
+
+    summary = dec.packing_stats.summary()
+    assert summary['efficiency'] > summary['efficiency_unpacked']
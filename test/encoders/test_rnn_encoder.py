@@ -219,3 +219,102 @@ def test_forward(args):
             enc_out_dict_sub2 = enc(xs, xlens, task='ys_sub2')
             assert enc_out_dict_sub2['ys_sub2']['xs'].size(0) == batch_size
             assert enc_out_dict_sub2['ys_sub2']['xs'].size(1) == enc_out_dict_sub2['ys_sub2']['xlens'].max()
+
+
+def split_layers(rnn):
+    """Single-layer RNNs with the same parameters as each layer of a multi-layer RNN."""
+    layers = []
+    for lth in range(rnn.num_layers):
+        input_size = rnn.input_size if lth == 0 else rnn.hidden_size * (2 if rnn.bidirectional else 1)
+        layer = type(rnn)(input_size, rnn.hidden_size, 1, batch_first=True, bidirectional=rnn.bidirectional)
+        layer.load_state_dict({n.replace('_l%d' % lth, '_l0'): p for n, p in rnn.named_parameters()
+                               if n.endswith('_l%d' % lth) or n.endswith('_l%d_reverse' % lth)})
+        layers.append(layer)
+    return layers
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        # single multi-layer RNN call
+        ({'enc_type': 'blstm'}),
+        ({'enc_type': 'bgru'}),
+        ({'enc_type': 'lstm'}),
+        ({'enc_type': 'conv_blstm'}),
+        # batched LC-BLSTM
+        ({'enc_type': 'blstm', 'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'bgru', 'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'chunk_size_left': "40", 'chunk_size_right': "0"}),
+        ({'enc_type': 'blstm', 'bidir_sum_fwd_bwd': True, 'n_projs': 8,
+          'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'max_pool',
+          'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_2_1", 'subsample_type': 'concat',
+          'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'subsample': "2_1_1_1", 'n_layers_sub1': 2,
+          'chunk_size_left': "40", 'chunk_size_right': "40",
+          'task_specific_layer': True}),
+    ]
+)
+def test_forward_fast_path(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    xmax = 455
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+
+    xs = torch.randn(batch_size, xmax, args['input_dim'], device=device)
+    xlens = torch.IntTensor([xmax - i * 7 for i in range(batch_size)])
+
+    with torch.no_grad():
+        enc_out_dict = enc(xs, xlens, task='all')
+
+        # reference: layer-wise (chunk-wise) encoding
+        if enc.rnn_stacked is not None:
+            layers = split_layers(enc.rnn_stacked)
+
+            def forward_layerwise(xs, xlens, streaming):
+                for layer in layers:
+                    xs = enc.dropout(enc.padding(xs, xlens, layer)[0])
+                return xs, xlens
+            enc._forward_stacked = forward_layerwise
+        if enc.lc_bidir:
+            enc._forward_latency_controlled_batch = lambda xs, xlens, N_l, N_r: \
+                enc._forward_latency_controlled(xs, xlens, N_l, N_r, streaming=False)
+        enc_out_dict_ref = enc(xs, xlens, task='all')
+
+    for task in ['ys', 'ys_sub1']:
+        if enc_out_dict_ref[task]['xs'] is None:
+            continue
+        assert enc_out_dict[task]['xs'].size() == enc_out_dict_ref[task]['xs'].size()
+        assert torch.allclose(enc_out_dict[task]['xs'], enc_out_dict_ref[task]['xs'], atol=1e-6)
+        assert torch.equal(enc_out_dict[task]['xlens'], enc_out_dict_ref[task]['xlens'])
+
+
+@pytest.mark.parametrize("enc_type", ['blstm', 'gru'])
+def test_load_layerwise_checkpoint(enc_type):
+    args = make_args(enc_type=enc_type)
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+    assert enc.rnn_stacked is not None
+    assert len(enc.rnn) == 0
+
+    # checkpoints saved with one RNN per layer
+    state_dict = {}
+    for n, p in enc.state_dict().items():
+        if n.startswith('rnn_stacked.'):
+            n = n[len('rnn_stacked.'):]
+            lth = int(n.split('_l')[1].split('_')[0])
+            n = 'rnn.%d.%s' % (lth, n.replace('_l%d' % lth, '_l0'))
+        state_dict['enc.' + n] = p
+
+    model = torch.nn.Module()
+    model.enc = module.RNNEncoder(**args)
+    model.load_state_dict(state_dict)
+    for n, p in enc.state_dict().items():
+        assert torch.equal(model.enc.state_dict()[n], p)
@@ -168,3 +168,69 @@ def test_forward(args):
             if args['n_layers_sub2'] > 0:
                 assert enc_out_dict['ys_sub2']['xs'].size(0) == batch_size
                 assert enc_out_dict['ys_sub2']['xs'].size(1) == enc_out_dict['ys_sub2']['xlens'][0]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'fused_attention': True}),
+        ({'pe_type': 'relative_xl', 'attn_chunk_size': 16}),
+        # LC-Transformer
+        ({'streaming_type': 'reshape', 'fused_attention': True,
+          'chunk_size_left': "64", 'chunk_size_current': "64", 'chunk_size_right': "32"}),
+        ({'streaming_type': 'reshape', 'pe_type': 'relative_xl', 'attn_chunk_size': 16,
+          'chunk_size_left': "64", 'chunk_size_current': "64", 'chunk_size_right': "32"}),
+        ({'streaming_type': 'mask', 'fused_attention': True,
+          'chunk_size_left': "64", 'chunk_size_current': "64", 'chunk_size_right': "32"}),
+        ({'streaming_type': 'mask', 'pe_type': 'relative_xl', 'attn_chunk_size': 16,
+          'chunk_size_left': "64", 'chunk_size_current': "64", 'chunk_size_right': "32"}),
+        # Multi-task
+        ({'n_layers_sub1': 2, 'task_specific_layer': True, 'fused_attention': True}),
+    ]
+)
+def test_forward_memory_efficient_attention(args):
+    """Attention weights are not available and must not be saved in evaluation."""
+    args = make_args(**args)
+
+    batch_size = 4
+    xmax = 400
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+
+    xs = np.random.randn(batch_size, xmax, args['input_dim']).astype(np.float32)
+    xlens = torch.IntTensor([len(x) - i * enc.subsampling_factor for i, x in enumerate(xs)])
+    xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+
+    enc.eval()
+    with torch.no_grad():
+        enc_out_dict = enc(xs, xlens, task='all')
+
+    assert enc_out_dict['ys']['xs'].size(0) == batch_size
+    assert enc_out_dict['ys']['xs'].size(1) == enc_out_dict['ys']['xlens'][0]
+    if enc.layers[0].self_attn.__class__.__name__ == 'MultiheadAttentionMechanism' and \
+            not enc.layers[0].self_attn.fused:
+        return  # scaled_dot_product_attention is not available
+    assert len(enc.aws_dict) == 0
+    assert len(enc.data_dict) > 0
+
+
+def test_band_mask():
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    xs = torch.zeros(2, 13, 4)
+    xlens = torch.IntTensor([13, 9])
+    _, mask = module.make_time_restricted_san_mask(xs, xlens, 2, 3, 1, 4)
+
+    dense = mask.to_dense()
+    assert dense.size() == (2, 13, 13)
+    for q_offset, chunk in [(0, 13), (0, 4), (4, 4), (12, 4)]:
+        # the band is built only for the given queries
+        band = mask.band(q_offset, chunk)
+        assert band.size() == (min(chunk, 13 - q_offset), 13)
+        assert torch.equal(band, mask.band()[q_offset:q_offset + chunk])
+
+        e = torch.zeros(2, band.size(0), 13, 1)
+        mask.masked_fill_(e, -1., q_offset)
+        assert torch.equal(e[:, :, :, 0] == 0, dense[:, q_offset:q_offset + chunk])
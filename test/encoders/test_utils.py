@@ -8,6 +8,7 @@ import numpy as np
 import pytest
 import torch
 
+from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
 
@@ -42,3 +43,58 @@ def test_chunkwise(N_l, N_c, N_r):
 
         assert xs_chunk.size() == xs.size()
         assert torch.equal(xs_chunk, xs)
+
+
+def test_chunkwise_view():
+    xs = torch.randn(4, 640, 80)
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.utils')
+    xs_chunk = module.chunkwise(xs, 0, 64, 0)
+    assert xs_chunk.size() == (40, 64, 80)
+    assert xs_chunk.data_ptr() == xs.data_ptr()
+
+
+def make_time_restricted_san_mask_dense(xs, xlens, N_l, N_c, N_r, n_chunks):
+    """Reference implementation with a dense mask."""
+    xx_mask = make_pad_mask(xlens.to(xs.device))
+    xx_mask = xx_mask.unsqueeze(1).repeat([1, xs.size(1), 1])
+    xx_mask_first = xx_mask.clone()
+    for chunk_idx in range(n_chunks):
+        offset = chunk_idx * N_c
+        xx_mask_first[:, offset:offset + N_c, :max(0, offset - N_l)] = 0
+        xx_mask_first[:, offset:offset + N_c, offset + (N_c + N_r):] = 0
+        xx_mask[:, offset:offset + N_c, :max(0, offset - N_l)] = 0
+        xx_mask[:, offset:offset + N_c, offset + N_c:] = 0
+    return xx_mask_first, xx_mask
+
+
+@pytest.mark.parametrize(
+    "N_l, N_c, N_r, n_chunks",
+    [
+        (16, 16, 8, 7),
+        (16, 16, 16, 7),
+        (10, 20, 10, 4),
+        (0, 20, 0, 4),
+        (8, 12, 4, 3),  # the last frames are not covered by chunks
+    ]
+)
+def test_time_restricted_san_mask(N_l, N_c, N_r, n_chunks):
+    batch_size = 4
+    xmax = 100
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+
+    xs = torch.randn(batch_size, xmax, 8)
+    xlens = torch.IntTensor([xmax - i * 7 for i in range(batch_size)])
+
+    xx_mask_first, xx_mask = module.make_time_restricted_san_mask(xs, xlens, N_l, N_c, N_r, n_chunks)
+    xx_mask_first_ref, xx_mask_ref = make_time_restricted_san_mask_dense(xs, xlens, N_l, N_c, N_r, n_chunks)
+
+    assert xx_mask.size() == xx_mask_ref.size()
+    assert torch.equal(xx_mask_first.to_dense(), xx_mask_first_ref)
+    assert torch.equal(xx_mask.to_dense(), xx_mask_ref)
+
+    # masked scores must be identical to the dense path
+    e = torch.randn(batch_size, xmax, xmax, 2, device=device)
+    e_ref = e.clone().masked_fill_(xx_mask_ref.unsqueeze(3) == 0, -1e9)
+    assert torch.equal(xx_mask.masked_fill_(e, -1e9), e_ref)
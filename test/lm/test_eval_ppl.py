@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for LM evaluation by perplexity."""
+
+import argparse
+import importlib
+import numpy as np
+import pandas as pd
+import pytest
+
+
+VOCAB = 20
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=32,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def make_dataset(tmp_path, batch_size, bptt, n_utts=50):
+    dict_path = tmp_path / 'dict.txt'
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+
+    rows = []
+    for i in range(n_utts):
+        ylen = np.random.randint(1, 10)
+        token_id = ' '.join(map(str, np.random.randint(4, VOCAB, ylen)))
+        rows.append(['utt%03d' % i, 'spk', '', 0, 0, '', token_id, ylen, VOCAB])
+    tsv_path = tmp_path / 'test.tsv'
+    pd.DataFrame(rows, columns=['utt_id', 'speaker', 'feat_path', 'xlen', 'xdim',
+                                'text', 'token_id', 'ylen', 'ydim']).to_csv(tsv_path, sep='\t', index=False)
+
+    module = importlib.import_module('neural_sp.datasets.lm')
+    return module.Dataset(tsv_path=str(tsv_path), dict_path=str(dict_path),
+                          unit='word', batch_size=batch_size, bptt=bptt,
+                          is_test=True)
+
+
+@pytest.mark.parametrize("n_caches", [0, 4])
+def test_eval_ppl_parallel(tmp_path, n_caches):
+    batch_size = 4
+    dataset = make_dataset(tmp_path, batch_size, bptt=8, n_utts=100)
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(make_args())
+    evaluator = importlib.import_module('neural_sp.evaluators.ppl')
+
+    ppl, loss = evaluator.eval_ppl([lm], dataset, batch_size=batch_size, bptt=8,
+                                   n_caches=n_caches)
+    ppl_parallel, loss_parallel = evaluator.eval_ppl([lm], dataset, batch_size=batch_size, bptt=8,
+                                                     n_caches=n_caches, n_workers=2)
+    assert np.allclose(ppl, ppl_parallel, rtol=1e-6)
+    assert np.allclose(loss, loss_parallel, rtol=1e-6)
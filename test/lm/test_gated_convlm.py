@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for GatedConvLM."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+VOCAB = 100  # large for adaptive softmax
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='gated_conv_custom',
+        kernel_size=4,
+        n_units=32,
+        n_projs=0,
+        n_layers=3,
+        emb_dim=32,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'kernel_size': 4}),
+        ({'kernel_size': 1}),
+        ({'n_projs': 16}),
+        ({'lsm_prob': 0.1}),
+        ({'adaptive_softmax': True}),
+        ({'tie_embedding': True}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+
+    ylens = [4, 5, 3, 7] * 20
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args)
+    lm = lm.to(device)
+    loss, state, observation = lm(ys, state=None, n_caches=0)
+    assert loss.item() >= 0
+    assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'kernel_size': 4}),
+        ({'kernel_size': 3}),
+        ({'kernel_size': 1}),
+        ({'n_projs': 16}),
+        ({'adaptive_softmax': True}),
+    ]
+)
+def test_step(args):
+    args = make_args(**args)
+
+    batch_size = 3
+    ymax = 8
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, ymax), device=device)
+    with torch.no_grad():
+        logits, out, _ = lm.decode(ys)
+        log_probs_ref = lm._log_softmax(logits.reshape(-1, logits.size(-1)), out.reshape(-1, out.size(-1)))
+        log_probs_ref = log_probs_ref.view(batch_size, ymax, -1)
+
+        state = None
+        for t in range(ymax):
+            log_probs, state = lm.step(ys[:, t], state)
+            assert log_probs.size() == (batch_size, VOCAB)
+            assert torch.allclose(log_probs, log_probs_ref[:, t], atol=1e-5)
+
+        # chunk-wise decoding continues from the left context
+        logits1, _, state_chunk = lm.decode(ys[:, :5], incremental=True)
+        logits2, _, _ = lm.decode(ys[:, 5:], state_chunk, incremental=True)
+        assert torch.allclose(torch.cat([logits1, logits2], dim=1), logits, atol=1e-5)
+
+        # reorder and merge hypotheses
+        perm_ids = [2, 0, 0]
+        state_reordered = lm.reorder_state(state, perm_ids)
+        state_merged = lm.merge_states([lm.reorder_state(state, [b]) for b in perm_ids])
+        y = torch.randint(4, VOCAB, (batch_size,), device=device)
+        log_probs1, _ = lm.step(y, state_reordered)
+        log_probs2, _ = lm.step(y, state_merged)
+        log_probs3, _ = lm.step(y[[1, 0, 2]], state)
+        assert torch.allclose(log_probs1, log_probs2)
+        assert torch.allclose(log_probs1[1], log_probs3[0], atol=1e-5)
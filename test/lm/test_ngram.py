@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for n-gram LM."""
+
+import importlib
+import math
+import numpy as np
+import pytest
+import torch
+
+
+VOCAB = 12  # including <blank>
+N_ORDER = 3
+
+
+def make_arpa(tmp_path, n_order=N_ORDER):
+    dict_path = tmp_path / 'dict.txt'
+    words = ['w%d' % i for i in range(4, VOCAB)]
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i, w in enumerate(words):
+            f.write('%s %d\n' % (w, i + 4))
+
+    # Randomly generate n-grams, all of whose prefixes exist
+    rng = np.random.RandomState(0)
+    ngrams = {1: [(w,) for w in ['<unk>', '<s>', '</s>'] + words[:-1]]}
+    # NOTE: the last word is not included in the LM
+    for n in range(2, n_order + 1):
+        ngrams[n] = []
+        for context in ngrams[n - 1]:
+            if context[-1] == '</s>':
+                continue
+            for w in words[:-1] + ['</s>']:
+                if rng.rand() < 0.4:
+                    ngrams[n].append(context + (w,))
+    entries = {}
+    for n in ngrams:
+        for ngram in ngrams[n]:
+            bow = round(-rng.rand(), 4) if n < n_order else None
+            entries[ngram] = (round(-3 * rng.rand(), 4), bow)
+
+    arpa_path = tmp_path / 'lm.arpa'
+    with open(arpa_path, 'w') as f:
+        f.write('\n\\data\\\n')
+        for n in ngrams:
+            f.write('ngram %d=%d\n' % (n, len(ngrams[n])))
+        for n in ngrams:
+            f.write('\n\\%d-grams:\n' % n)
+            for ngram in ngrams[n]:
+                logp, bow = entries[ngram]
+                f.write('%.4f\t%s' % (logp, ' '.join(ngram)))
+                f.write('\t%.4f\n' % bow if bow is not None else '\n')
+        f.write('\n\\end\\\n')
+    return str(arpa_path), str(dict_path), entries
+
+
+def logp_reference(entries, history, w, n_order=N_ORDER):
+    """Compute a backoff log10 probability in the textbook way."""
+    history = tuple(history[len(history) - (n_order - 1):])
+    if history + (w,) in entries:
+        return entries[history + (w,)][0]
+    if len(history) == 0:
+        return entries[('<unk>',)][0]
+    bow = entries[history][1] if history in entries else 0.
+    return bow + logp_reference(entries, history[1:], w)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_step(tmp_path, mmap):
+    arpa_path, dict_path, entries = make_arpa(tmp_path)
+    idx2token = {1: '<unk>', 2: '</s>', 3: '<pad>'}
+    idx2token.update({i: 'w%d' % i for i in range(4, VOCAB)})
+
+    module = importlib.import_module('neural_sp.models.lm.ngram')
+    lm = module.NgramLM(arpa_path, dict_path)
+    if mmap:
+        lm.save(str(tmp_path / 'lm'))
+        assert module.is_ngram_lm(str(tmp_path / 'lm'))
+        lm = module.NgramLM(str(tmp_path / 'lm'), dict_path)
+        assert isinstance(lm.keys, np.memmap)
+
+    batch_size = 8
+    ymax = 10
+    ys = torch.randint(4, VOCAB, (batch_size, ymax))
+    ys[:, 0] = 2  # <sos>
+    ys[0, 5] = 2  # <eos> in the middle
+    ys[1, 3] = 1  # <unk>
+
+    state = None
+    histories = [[] for _ in range(batch_size)]
+    for t in range(ymax):
+        log_probs, state = lm.step(ys[:, t:t + 1], state)
+        assert log_probs.size() == (batch_size, VOCAB)
+        for b in range(batch_size):
+            y = ys[b, t].item()
+            histories[b].append('<s>' if y == 2 else idx2token[y])
+            for w in range(1, VOCAB):
+                logp = logp_reference(entries, histories[b], idx2token[w]) * math.log(10)
+                assert abs(log_probs[b, w].item() - logp) < 1e-4, (b, t, w)
+
+    # reorder and merge hypotheses
+    perm_ids = [2, 0, 0]
+    state_reordered = lm.reorder_state(state, perm_ids)
+    state_merged = lm.merge_states([lm.reorder_state(state, [b]) for b in perm_ids])
+    y = torch.randint(4, VOCAB, (len(perm_ids),))
+    log_probs1, _ = lm.step(y, state_reordered)
+    log_probs2, _ = lm.step(y, state_merged)
+    assert torch.equal(log_probs1, log_probs2)
+
+    # batch prediction
+    _, _, log_probs_all = lm.predict(ys, None)
+    assert torch.equal(log_probs_all[:, -1], log_probs)
@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for offline N-best rescoring with LMs."""
+
+import argparse
+import importlib
+import math
+import numpy as np
+import pytest
+import sys
+import torch
+
+
+VOCAB = 7  # <blank>, <unk>, <eos>, <pad>, w4, w5, w6
+WORDS = ['w4', 'w5', 'w6']
+
+
+def make_args_rnnlm(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=16,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return args
+
+
+def bigram_logp(history, w):
+    """log10 probability of the fixed bigram LM (no backoff is necessary)."""
+    return -(0.1 * (['<s>'] + WORDS).index(history) + 0.2 * (WORDS + ['</s>']).index(w) + 0.1)
+
+
+def make_arpa(tmp_path):
+    arpa_path = str(tmp_path / 'lm.arpa')
+    unigrams = ['<unk>', '<s>', '</s>'] + WORDS
+    bigrams = [(h, w) for h in ['<s>'] + WORDS for w in WORDS + ['</s>']]
+    with open(arpa_path, 'w') as f:
+        f.write('\n\\data\\\nngram 1=%d\nngram 2=%d\n' % (len(unigrams), len(bigrams)))
+        f.write('\n\\1-grams:\n')
+        for w in unigrams:
+            f.write('%.4f\t%s\t-0.5000\n' % (-99 if w == '<s>' else -1., w))
+        f.write('\n\\2-grams:\n')
+        for h, w in bigrams:
+            f.write('%.4f\t%s %s\n' % (bigram_logp(h, w), h, w))
+        f.write('\n\\end\\\n')
+    return arpa_path
+
+
+def make_rnnlm(tmp_path):
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    torch.manual_seed(1)
+    lm = module.RNNLM(argparse.Namespace(**make_args_rnnlm()))
+    lm_dir = tmp_path / 'rnnlm'
+    lm_dir.mkdir()
+    train_utils.save_config(make_args_rnnlm(), str(lm_dir / 'conf.yml'))
+    torch.save({'model_state_dict': lm.state_dict()}, str(lm_dir / 'model.epoch-1'))
+    return str(lm_dir / 'model.epoch-1'), lm.eval()
+
+
+def score_rnnlm(lm, hyp, eos=2):
+    """Sum of log probabilities computed token by token."""
+    ys = [eos] + list(hyp) + [eos]
+    score = 0.
+    state = None
+    with torch.no_grad():
+        for t in range(len(ys) - 1):
+            _, state, log_probs = lm.predict(torch.LongTensor([[ys[t]]]), state)
+            score += log_probs[0, -1, ys[t + 1]].item()
+    return score
+
+
+def score_bigram_reverse(hyp):
+    words = ['<s>'] + ['w%d' % y for y in hyp[::-1]] + ['</s>']
+    return sum(bigram_logp(h, w) for h, w in zip(words[:-1], words[1:])) * math.log(10)
+
+
+@pytest.mark.parametrize("share_prefix", [False, True])
+def test_rescore(tmp_path, monkeypatch, share_prefix):
+    dict_path = tmp_path / 'dict.txt'
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i, w in enumerate(WORDS):
+            f.write('%s %d\n' % (w, i + 4))
+    arpa_path = make_arpa(tmp_path)
+    rnnlm_path, rnnlm = make_rnnlm(tmp_path)
+
+    nbest = [('utt1', -1.0, [4, 5, 6]),
+             ('utt1', -1.2, [4, 5]),
+             ('utt1', -1.5, [4, 5, 5, 6]),
+             ('utt2', -2.0, [6]),
+             ('utt2', -2.1, [])]
+    nbest_path = str(tmp_path / 'nbest.txt')
+    with open(nbest_path, 'w') as f:
+        for utt_id, score, hyp in nbest:
+            f.write('%s\t%.6f\t%s\n' % (utt_id, score, ' '.join(map(str, hyp))))
+
+    # forward RNNLM and backward n-gram LM
+    out_path = str(tmp_path / 'nbest_rescored.txt')
+    argv = ['rescore.py', '--nbest', nbest_path, '--out', out_path, '--dict', str(dict_path),
+            '--lm', rnnlm_path, '--lm_weight', '0.5', '--lm_bwd', arpa_path, '--lm_bwd_weight', '0.3']
+    if share_prefix:
+        argv += ['--share_prefix']
+    monkeypatch.setattr(sys, 'argv', argv)
+    module = importlib.import_module('neural_sp.bin.lm.rescore')
+    module.main()
+
+    expected = {}
+    for utt_id, score, hyp in nbest:
+        score += 0.5 * score_rnnlm(rnnlm, hyp) + 0.3 * score_bigram_reverse(hyp)
+        expected.setdefault(utt_id, []).append((score, ' '.join(map(str, hyp))))
+
+    results = {}
+    with open(out_path) as f:
+        for line in f:
+            utt_id, score, hyp = line.rstrip('\n').split('\t')
+            results.setdefault(utt_id, []).append((float(score), hyp))
+
+    assert list(results.keys()) == ['utt1', 'utt2']
+    # LM scores change the 1-best hypotheses of the fixed N-best list
+    assert [hyp for _, hyp in results['utt1']][0] != '4 5 6'
+    assert [hyp for _, hyp in results['utt2']][0] != '6'
+    for utt_id in expected.keys():
+        # hypotheses are reranked by the combined scores
+        ranked = sorted(expected[utt_id], key=lambda x: -x[0])
+        assert [hyp for _, hyp in results[utt_id]] == [hyp for _, hyp in ranked]
+        assert np.allclose([s for s, _ in results[utt_id]], [s for s, _ in ranked], atol=1e-4)
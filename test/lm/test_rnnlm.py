@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -72,3 +73,245 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'lm_type': 'lstm', 'n_layers': 2}),
+        ({'lm_type': 'gru', 'n_layers': 2}),
+        ({'adaptive_softmax': True}),
+    ]
+)
+def test_step(args):
+    args = make_args(**args)
+
+    batch_size = 3
+    ymax = 8
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, ymax), device=device)
+    with torch.no_grad():
+        logits, out, _ = lm.decode(ys, None)
+        log_probs_ref = lm._log_softmax(logits.reshape(-1, logits.size(-1)), out.reshape(-1, out.size(-1)))
+        log_probs_ref = log_probs_ref.view(batch_size, ymax, -1)
+
+        state = None
+        for t in range(ymax):
+            log_probs, state = lm.step(ys[:, t], state)
+            assert log_probs.size() == (batch_size, VOCAB)
+            assert torch.allclose(log_probs, log_probs_ref[:, t], atol=1e-5)
+
+        # reorder and merge hypotheses
+        perm_ids = [2, 0, 0]
+        state_reordered = lm.reorder_state(state, perm_ids)
+        state_merged = lm.merge_states([lm.reorder_state(state, [b]) for b in perm_ids])
+        y = torch.randint(4, VOCAB, (batch_size,), device=device)
+        log_probs1, _ = lm.step(y, state_reordered)
+        log_probs2, _ = lm.step(y, state_merged)
+        log_probs3, _ = lm.step(y[[1, 0, 2]], state)
+        assert torch.allclose(log_probs1, log_probs2)
+        assert torch.allclose(log_probs1[1], log_probs3[0], atol=1e-5)
+
+
+def _cache_loss_reference(lm, ys, n_caches):
+    """Token-by-token neural cache computation for a single sequence."""
+    nlls = []
+    state = None
+    cache_ids, cache_keys = [], []
+    for t in range(ys.size(1) - 1):
+        logits, out, state = lm.decode(ys[:, t:t + 1], state)
+        probs = torch.softmax(logits[0, 0], dim=-1)
+        target = ys[0, t + 1].item()
+        prob = probs[target]
+        if len(cache_ids) > 0:
+            keys = torch.cat(cache_keys[-n_caches:], dim=0)  # `[n_keys, n_units]`
+            attn = torch.softmax(lm.cache_theta * torch.matmul(keys, out[0, 0]), dim=0)
+            cache_prob = sum(a for a, idx in zip(attn, cache_ids[-n_caches:]) if idx == target)
+            prob = (1 - lm.cache_lambda) * prob + lm.cache_lambda * cache_prob
+        nlls.append(-torch.log(prob))
+        cache_ids.append(target)
+        cache_keys.append(out[0])
+    return torch.stack(nlls)
+
+
+@pytest.mark.parametrize("n_caches", [1, 5, 20])
+def test_forward_cache(n_caches):
+    args = make_args()
+
+    batch_size = 2
+    bptt = 8
+    n_segments = 3
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    # a small vocabulary to make cache hits frequent
+    ys = torch.randint(4, 10, (batch_size, (bptt - 1) * n_segments + 1), device=device)
+    with torch.no_grad():
+        nll_ref = torch.stack([_cache_loss_reference(lm, ys[b:b + 1], n_caches)
+                               for b in range(batch_size)])  # `[B, T]`
+
+    lm.reset_cache()
+    state = None
+    for i in range(n_segments):
+        # the last token in each segment is fed as the input of the next segment
+        ys_seg = ys[:, i * (bptt - 1):i * (bptt - 1) + bptt].numpy()
+        loss, state, observation = lm(ys_seg, state, is_eval=True, n_caches=n_caches)
+        assert lm.cache_attn.size() == (batch_size, bptt - 1, n_caches)
+        loss_ref = nll_ref[:, i * (bptt - 1):(i + 1) * (bptt - 1)].mean()
+        assert torch.allclose(loss, loss_ref, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'adaptive_softmax': False}),
+        ({'adaptive_softmax': True}),
+    ]
+)
+def test_step_candidates(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    topk = 5
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, 3), device=device)
+    with torch.no_grad():
+        _, _, log_probs_predict = lm.predict(ys)
+        assert torch.allclose(log_probs_predict.exp().sum(-1), torch.ones(batch_size, 3), atol=1e-5)
+
+        state = None
+        for t in range(ys.size(1)):
+            log_probs, _ = lm.step(ys[:, t], state)
+            candidates = torch.randint(0, VOCAB, (batch_size, topk), device=device)
+            candidates[0] = torch.arange(topk)  # head only
+            log_probs_cand, state = lm.step(ys[:, t], state, candidates)
+            assert log_probs_cand.size() == (batch_size, topk)
+            assert torch.allclose(log_probs_cand, torch.gather(log_probs, 1, candidates), atol=1e-5)
+            assert torch.allclose(log_probs_predict[:, t], log_probs, atol=1e-5)
+
+
+@pytest.mark.parametrize("share_prefix", [True, False])
+def test_score_sequences(share_prefix):
+    args = make_args()
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    # N-best hypotheses sharing prefixes
+    ys = [np.array([2, 5, 6, 7, 2]), np.array([2, 5, 6, 8]), np.array([2, 5, 9, 7, 10, 2]),
+          np.array([2]), np.array([2, 11, 2])]
+    with torch.no_grad():
+        scores = lm.score_sequences(ys, share_prefix=share_prefix)
+        assert scores.size() == (len(ys),)
+        for b, y in enumerate(ys):
+            if len(y) == 1:
+                assert scores[b].item() == 0
+                continue
+            y = torch.from_numpy(y).unsqueeze(0)
+            _, _, log_probs = lm.predict(y[:, :-1], None)
+            score = log_probs[0].gather(1, y[0, 1:].unsqueeze(1)).sum()
+            assert torch.allclose(scores[b], score, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args, dtype, atol", [
+        ({}, 'float32', 1e-5),
+        ({'tie_embedding': True, 'n_units': 16, 'emb_dim': 32}, 'float32', 1e-5),  # fuse output layers
+        ({'adaptive_softmax': True}, 'float32', 1e-5),
+        ({}, 'bfloat16', 0.1),
+        ({'lm_type': 'gru'}, 'int8', 0.1),
+        ({}, 'int8', 0.1),
+    ]
+)
+def test_prepare_for_inference(args, dtype, atol):
+    args = make_args(**args)
+
+    batch_size = 3
+    ymax = 5
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, ymax), device=device)
+    with torch.no_grad():
+        log_probs_ref = []
+        state = None
+        for t in range(ymax):
+            log_probs, state = lm.step(ys[:, t], state)
+            log_probs_ref.append(log_probs)
+
+        lm.prepare_for_inference(dtype)
+        assert lm.embed_cache.size() == (VOCAB, args.emb_dim)
+        assert 'embed_cache' not in lm.state_dict()
+        if args.tie_embedding:
+            assert lm.output_proj is None
+        state = None
+        for t in range(ymax):
+            log_probs, state = lm.step(ys[:, t], state)
+            assert log_probs.dtype == torch.float32
+            assert torch.allclose(log_probs, log_probs_ref[t], atol=atol)
+
+    # The cache is cleared when parameters can be updated
+    lm.train()
+    assert lm.embed_cache is None
+
+
+def test_prepare_for_inference_int8_legacy(monkeypatch):
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(make_args())
+    # PyTorch < 1.3
+    monkeypatch.delattr(torch, 'quantization')
+    with pytest.raises(ValueError):
+        lm.prepare_for_inference('int8')
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'lm_type': 'lstm'}),
+        ({'lm_type': 'gru'}),
+        ({'n_units_null_context': 16}),
+        ({'residual': True}),
+        ({'use_glu': True}),
+    ]
+)
+def test_forward_packed(args):
+    args = make_args(pack_sequences=True, dropout_in=0., dropout_hidden=0., **args)
+
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args)
+    eos = lm.eos
+    ys1 = [eos] + np.random.randint(4, VOCAB, 5).tolist()
+    ys2 = [eos] + np.random.randint(4, VOCAB, 3).tolist()
+
+    # each sentence in a row is independent of the others
+    lm.eval()
+    with torch.no_grad():
+        ys = torch.LongTensor([ys1 + ys2])
+        logits = lm.decode(ys, None, segment_ids=torch.cumsum(ys == eos, dim=1))[0]
+        logits1 = lm.decode(torch.LongTensor([ys1]), None)[0]
+        logits2 = lm.decode(torch.LongTensor([ys2]), None)[0]
+    assert torch.allclose(logits, torch.cat([logits1, logits2], dim=1), atol=1e-5)
+
+    loss, _, observation = lm([np.array(ys1 + ys2 + [eos])], state=None)
+    assert loss.item() >= 0
+    assert lm.packing_stats.summary()['seqs_per_row'] == 2
@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -82,3 +83,59 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize("mem_len", [5, 12, 40])
+def test_ring_memory(mem_len):
+    args = make_args(mem_len=mem_len, recog_mem_len=0)
+
+    batch_size = 3
+    bptt = 7
+    n_segments = 6
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+    lm = module.TransformerXL(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, n_segments * bptt), device=device)
+    with torch.no_grad():
+        mems_ring, mems_ref = None, lm.init_memory()
+        for i in range(n_segments):
+            ys_seg = ys[:, i * bptt:(i + 1) * bptt]
+            logits, _, mems_ring = lm.decode(ys_seg, mems=mems_ring)
+            logits_ref, _, mems_ref = lm.decode(ys_seg, mems=mems_ref)
+            assert isinstance(mems_ring, module.RingMemory)
+            assert isinstance(mems_ref, list)
+            assert lm.memory_length(mems_ring) == lm.memory_length(mems_ref) == min((i + 1) * bptt, mem_len)
+            assert torch.allclose(logits, logits_ref, atol=1e-5)
+            for m, m_ref in zip(mems_ring.read(), mems_ref):
+                assert torch.equal(m, m_ref)
+
+
+@pytest.mark.parametrize("dtype", ['float32', 'bfloat16', 'int8'])
+def test_prepare_for_inference(dtype):
+    args = make_args()
+
+    batch_size = 3
+    ymax = 5
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+    lm = module.TransformerXL(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, ymax), device=device)
+    with torch.no_grad():
+        _, _, log_probs_ref = lm.predict(ys)
+        lm.prepare_for_inference(dtype)
+        assert lm.embed_cache is not None
+        _, _, log_probs = lm.predict(ys)
+        assert log_probs.dtype == torch.float32
+        assert torch.allclose(log_probs, log_probs_ref, atol=1e-5 if dtype == 'float32' else 0.1)
+
+        # The cache is cleared when weights are loaded
+        lm.load_state_dict(lm.state_dict())
+        assert lm.embed_cache is None
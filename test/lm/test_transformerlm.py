@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -79,3 +80,81 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'transformer_pe_type': 'add'}),
+        ({'transformer_pe_type': 'none'}),
+        ({'transformer_pe_type': '1dconv3L'}),
+        ({'tie_embedding': True}),
+        ({'adaptive_softmax': True}),
+    ]
+)
+def test_step(args):
+    args = make_args(**args)
+
+    batch_size = 3
+    ymax = 8
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args)
+    lm = lm.to(device)
+    lm.eval()
+
+    ys = torch.randint(4, VOCAB, (batch_size, ymax), device=device)
+    with torch.no_grad():
+        logits, out, _ = lm.decode(ys, None)
+        log_probs_ref = lm._log_softmax(logits.reshape(-1, logits.size(-1)), out.reshape(-1, out.size(-1)))
+        log_probs_ref = log_probs_ref.view(batch_size, ymax, -1)
+
+        state = None
+        for t in range(ymax):
+            log_probs, state = lm.step(ys[:, t], state)
+            assert log_probs.size() == (batch_size, VOCAB)
+            assert torch.allclose(log_probs, log_probs_ref[:, t], atol=1e-5)
+
+        # reorder and merge hypotheses
+        perm_ids = [2, 0, 0]
+        state_reordered = lm.reorder_state(state, perm_ids)
+        state_merged = lm.merge_states([lm.reorder_state(state, [b]) for b in perm_ids])
+        y = torch.randint(4, VOCAB, (batch_size,), device=device)
+        log_probs1, _ = lm.step(y, state_reordered)
+        log_probs2, _ = lm.step(y, state_merged)
+        log_probs3, _ = lm.step(y[[1, 0, 2]], state)
+        assert torch.allclose(log_probs1, log_probs2)
+        assert torch.allclose(log_probs1[1], log_probs3[0], atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'transformer_pe_type': 'add'}),
+        ({'transformer_pe_type': 'none'}),
+    ]
+)
+@pytest.mark.parametrize("legacy", [False, True])
+def test_forward_packed(monkeypatch, args, legacy):
+    args = make_args(pack_sequences=True, dropout_in=0., dropout_hidden=0., dropout_att=0., **args)
+    if legacy:
+        # PyTorch < 1.5
+        monkeypatch.delattr(torch, 'cummax')
+
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args)
+    eos = lm.eos
+    ys1 = [eos] + np.random.randint(4, VOCAB, 5).tolist()
+    ys2 = [eos] + np.random.randint(4, VOCAB, 3).tolist()
+
+    # each sentence in a row is independent of the others
+    lm.eval()
+    with torch.no_grad():
+        ys = torch.LongTensor([ys1 + ys2])
+        logits = lm.decode(ys, None, segment_ids=torch.cumsum(ys == eos, dim=1))[0]
+        logits1 = lm.decode(torch.LongTensor([ys1]), None)[0]
+        logits2 = lm.decode(torch.LongTensor([ys2]), None)[0]
+    assert torch.allclose(logits, torch.cat([logits1, logits2], dim=1), atol=1e-5)
+
+    loss, _, observation = lm([np.array(ys1 + ys2 + [eos])], state=None)
+    assert loss.item() >= 0
+    assert lm.packing_stats.summary()['seqs_per_row'] == 2
@@ -83,3 +83,85 @@ def test_forward_incremental(args):
         assert cv.size() == (batch_size, 1, args['enc_dim'])
         assert alpha.size() == (batch_size, xmax)
         assert aws.size() == (batch_size, 1, xmax)
+
+
+def integrate_and_fire_loop(eouts, alpha_norm, elens, ylens, beta):
+    """Reference implementation with frame-by-frame and per-utterance loops."""
+    bs, xmax, enc_dim = eouts.size()
+    ymax = int(ylens.max().item())
+    cv = eouts.new_zeros(bs, ymax + 1, enc_dim)
+    aws = eouts.new_zeros(bs, ymax + 1, xmax)
+    n_tokens = torch.zeros(bs, dtype=torch.int64)
+    state = eouts.new_zeros(bs, enc_dim)
+    alpha_accum = eouts.new_zeros(bs)
+    for j in range(xmax):
+        alpha_accum_prev = alpha_accum.clone()
+        alpha_accum += alpha_norm[:, j]
+        for b in range(bs):
+            if j > elens[b] - 1 or n_tokens[b].item() >= ylens[b]:
+                continue
+            if alpha_accum[b] < beta - 1e-4:
+                state[b] += alpha_norm[b, j, None] * eouts[b, j]
+                aws[b, n_tokens[b], j] += alpha_norm[b, j]
+            else:
+                ak1 = 1 - alpha_accum_prev[b]
+                ak2 = alpha_norm[b, j] - ak1
+                cv[b, n_tokens[b]] = state[b] + ak1 * eouts[b, j]
+                aws[b, n_tokens[b], j] += ak1
+                n_tokens[b] += 1
+                state[b] = ak2 * eouts[b, j]
+                alpha_accum[b] = ak2
+                aws[b, n_tokens[b], j] += ak2
+    return cv[:, :ymax], aws[:, :ymax]
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.9])
+@pytest.mark.parametrize("legacy", [False, True])
+def test_forward_parallel_equivalence(monkeypatch, threshold, legacy):
+    args = make_args(threshold=threshold)
+    if legacy:
+        # PyTorch < 1.5
+        monkeypatch.delattr(torch, 'cummin')
+
+    batch_size = 4
+    xmax = 40
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+    cif.train()
+
+    for _ in range(10):
+        eouts = torch.randn(batch_size, xmax, args['enc_dim'], device=device)
+        elens = torch.IntTensor([xmax - 3 * i for i in range(batch_size)])
+        ylens = torch.IntTensor([8 - i for i in range(batch_size)])
+
+        cv, alpha, aws = cif(eouts, elens, ylens, mode='parallel')
+        alpha_norm = alpha / alpha.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
+        cv_ref, aws_ref = integrate_and_fire_loop(eouts, alpha_norm, elens, ylens, threshold)
+        assert torch.allclose(aws, aws_ref, atol=1e-5)
+        assert torch.allclose(cv, cv_ref, atol=1e-4)
+
+
+def test_forward_incremental_batch():
+    args = make_args()
+
+    batch_size = 4
+    xmax = 40
+    device = "cpu"
+
+    eouts = torch.randn(batch_size, xmax, args['enc_dim'], device=device)
+    elens = torch.IntTensor([xmax - 5 * i for i in range(batch_size)])
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+    cif.eval()
+
+    cv, alpha, aws = cif(eouts, elens, mode='incremental')
+    assert cv.size() == (batch_size, 1, args['enc_dim'])
+    for b in range(batch_size):
+        cv_b, _, aws_b = cif(eouts[b:b + 1, :elens[b]], elens[b:b + 1], mode='incremental')
+        assert torch.allclose(cv[b:b + 1], cv_b, atol=1e-6)
+        assert torch.allclose(aws[b:b + 1, :, :elens[b]], aws_b, atol=1e-6)
@@ -174,3 +174,144 @@ def test_forward_hard(args):
         if args['chunk_size'] > 1:
             assert beta is not None
             assert beta.size() == (batch_size, args['n_heads_mono'] * args['n_heads_chunk'], 1, klen)
+
+
+def head_synchronous_alpha_loop(alpha, eps_wait):
+    """Reference implementation with per-utterance and per-head loops."""
+    alpha = alpha.clone()
+    bs, n_heads_ma = alpha.size()[:2]
+    for b in range(bs):
+        if alpha[b].sum() == 0:
+            continue
+        leftmost = alpha[b, :, -1].nonzero()[:, -1].min().item()
+        rightmost = alpha[b, :, -1].nonzero()[:, -1].max().item()
+        for h in range(n_heads_ma):
+            if alpha[b, h, -1].sum().item() == 0:
+                alpha[b, h, -1, min(rightmost, leftmost + eps_wait)] = 1
+                continue
+            if alpha[b, h, -1].nonzero()[:, -1].min().item() >= leftmost + eps_wait:
+                alpha[b, h, -1, :] = 0
+                alpha[b, h, -1, leftmost + eps_wait] = 1
+    return alpha
+
+
+@pytest.mark.parametrize("eps_wait", [1, 2, 5])
+def test_head_synchronous_alpha(eps_wait):
+    batch_size = 8
+    n_heads_mono = 4
+    klen = 40
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    for _ in range(10):
+        boundaries = torch.randint(0, klen, (batch_size, n_heads_mono))
+        alpha = torch.zeros(batch_size, n_heads_mono, 1, klen)
+        alpha.scatter_(3, boundaries.view(batch_size, n_heads_mono, 1, 1), 1)
+        # drop boundaries of some heads and all heads of the first utterance
+        alpha *= (torch.rand(batch_size, n_heads_mono, 1, 1) > 0.3).float()
+        alpha[0] = 0
+        assert torch.equal(module.head_synchronous_alpha(alpha, eps_wait),
+                           head_synchronous_alpha_loop(alpha, eps_wait))
+
+
+def test_decot_parallel():
+    args = make_args(n_heads_mono=4, chunk_size=4, atype='scaled_dot', decot=True, lookahead=2)
+
+    batch_size = 4
+    klen = 40
+    qlen = 5
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    e_ma = torch.randn(batch_size, args['n_heads_mono'], qlen, klen)
+    aw_prev = torch.zeros(batch_size, args['n_heads_mono'], 1, klen)
+    aw_prev[:, :, :, 0] = 1
+    trigger_points = torch.randint(0, klen - 3, (batch_size, qlen))
+
+    torch.manual_seed(1)
+    alpha, _ = mocha.parallel(e_ma, aw_prev, trigger_points)
+
+    # reference implementation with per-utterance loops
+    torch.manual_seed(1)
+    mocha.decot = False
+    p_choose = torch.sigmoid(module.add_gaussian_noise(e_ma, mocha.noise_std))
+    cumprod_1mp_choose = module.safe_cumprod(1 - p_choose, eps=mocha.eps)
+    alpha_ref = []
+    for i in range(qlen):
+        denom = torch.clamp(cumprod_1mp_choose[:, :, i:i + 1], min=mocha.eps, max=1.0)
+        aw_prev = p_choose[:, :, i:i + 1] * cumprod_1mp_choose[:, :, i:i + 1] * torch.cumsum(
+            aw_prev / denom, dim=-1)
+        for b in range(batch_size):
+            aw_prev[b, :, :, trigger_points[b, i:i + 1] + args['lookahead'] + 1:] = 0
+        alpha_ref.append(aw_prev)
+    alpha_ref = torch.cat(alpha_ref, dim=2)
+    assert torch.allclose(alpha, alpha_ref)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_heads_mono': 1, 'chunk_size': 1}),
+        ({'n_heads_mono': 1, 'chunk_size': 4}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 1, 'chunk_size': 1, 'atype': 'scaled_dot'}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 1, 'chunk_size': 4, 'atype': 'scaled_dot'}),
+    ]
+)
+def test_forward_hard_batch(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    klen = 40
+    qlen = 5
+    eps_wait = 2
+
+    key = torch.randn(batch_size, klen, args['kdim'])
+    value = torch.randn(batch_size, klen, args['kdim'])
+    query = torch.randn(batch_size, qlen, args['qdim'])
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha.eval()
+
+    def decode(key, value, query):
+        mocha.reset()
+        alpha, cvs, alphas = None, [], []
+        for i in range(qlen):
+            cv, alpha, _, _ = mocha(key, value, query[:, i:i + 1], mask=None, aw_prev=alpha,
+                                    mode='hard', cache=False, eps_wait=eps_wait)
+            cvs.append(cv)
+            alphas.append(alpha)
+        return torch.cat(cvs, dim=1), torch.cat(alphas, dim=2)
+
+    with torch.no_grad():
+        cv_batch, alpha_batch = decode(key, value, query)
+        for b in range(batch_size):
+            cv, alpha = decode(key[b:b + 1], value[b:b + 1], query[b:b + 1])
+            assert torch.equal(alpha, alpha_batch[b:b + 1])
+            assert torch.allclose(cv, cv_batch[b:b + 1], atol=1e-6)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4])
+def test_forward_autocast(chunk_size):
+    args = make_args(chunk_size=chunk_size, atype='scaled_dot', dropout=0.)
+
+    batch_size = 4
+    klen = 40
+    key = torch.randn(batch_size, klen, args['kdim'])
+    query = torch.randn(batch_size, 1, args['qdim'])
+    src_mask = key.new_ones(batch_size, 1, klen).byte()
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha.train()
+
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        # energy functions are computed in float32
+        e_ma = mocha.monotonic_energy(key, query, src_mask)
+        assert e_ma.dtype == torch.float32
+        if chunk_size > 1:
+            assert mocha.chunk_energy(key, query, src_mask).dtype == torch.float32
+
+        cv, alpha, _, _ = mocha(key, key, query, mask=src_mask, mode='parallel')
+    assert alpha.dtype == torch.float32
+    cv.float().sum().backward()
+    assert all(torch.isfinite(p.grad).all() for p in mocha.parameters() if p.grad is not None)
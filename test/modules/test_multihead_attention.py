@@ -63,3 +63,29 @@ def test_forward(args):
         cv, aws, _, _ = out
         assert cv.size() == (batch_size, 1, value.size(2))
         assert aws.size() == (batch_size, args['n_heads'], 1, klen)
+
+
+def test_forward_fused():
+    args = make_args(dropout=0.)
+
+    batch_size = 4
+    klen = 40
+    qlen = 5
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.modules.multihead_attention')
+    attention = module.MultiheadAttentionMechanism(**args).to(device)
+    attention_fused = module.MultiheadAttentionMechanism(**args, fused=True).to(device)
+    attention_fused.load_state_dict(attention.state_dict())
+    if not attention_fused.fused:
+        pytest.skip('scaled_dot_product_attention is not available')
+
+    key = torch.randn(batch_size, klen, args['kdim'], device=device)
+    query = torch.randn(batch_size, qlen, args['qdim'], device=device)
+    mask = torch.ones(batch_size, qlen, klen, device=device).byte()
+    mask[1:, :, -10:] = 0
+
+    cv, aws, _, _ = attention(key, key, query, mask=mask)
+    cv_fused, aws_fused, _, _ = attention_fused(key, key, query, mask=mask)
+    assert aws_fused is None
+    assert torch.allclose(cv, cv_fused, atol=1e-5)
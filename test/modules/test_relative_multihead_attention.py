@@ -82,3 +82,61 @@ def test_forward(args):
     cv, aws = out
     assert cv.size() == (batch_size, qlen, args['kdim'])
     assert aws.size() == (batch_size, args['n_heads'], qlen, qlen + mlen)
+
+
+@pytest.mark.parametrize(
+    "xl_like, mlen, attn_chunk_size, band",
+    [
+        (False, 0, 1, False),
+        (False, 0, 4, False),
+        (False, 0, 4, True),
+        (True, 0, 5, False),
+        (True, 0, 5, True),
+        (True, 20, 3, False),
+        (True, 20, 6, False),
+    ]
+)
+def test_forward_chunkwise(xl_like, mlen, attn_chunk_size, band):
+    args = make_args(xl_like=xl_like, dropout=0., bias=True)
+
+    batch_size = 4
+    qlen = 13
+    device = "cpu"
+
+    module_mha = importlib.import_module('neural_sp.models.modules.relative_multihead_attention')
+    attention = module_mha.RelativeMultiheadAttentionMechanism(**args).to(device)
+    attention_chunk = module_mha.RelativeMultiheadAttentionMechanism(
+        **args, attn_chunk_size=attn_chunk_size).to(device)
+    attention_chunk.load_state_dict(attention.state_dict())
+
+    cat = torch.randn(batch_size, mlen + qlen, args['kdim'], device=device, requires_grad=True)
+    module_embedding = importlib.import_module('neural_sp.models.modules.positional_embedding')
+    pos_emb = module_embedding.XLPositionalEmbedding(args['kdim'], 0.)
+    pos_embs = pos_emb(cat[:, -qlen:], mlen=mlen, zero_center_offset=mlen == 0)
+
+    xlens = torch.IntTensor([mlen + qlen - i for i in range(batch_size)])
+    if band:
+        module_enc = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+        _, mask = module_enc.make_time_restricted_san_mask(cat, xlens, 2, 3, 1, 4)
+        mask_dense = mask.to_dense()
+    else:
+        module_utils = importlib.import_module('neural_sp.models.torch_utils')
+        mask = module_utils.make_pad_mask(xlens).unsqueeze(1).repeat([1, qlen, 1])
+        mask_dense = mask
+
+    if xl_like:
+        u_bias = torch.randn(args['n_heads'], args['adim'] // args['n_heads'], device=device)
+        v_bias = torch.randn(args['n_heads'], args['adim'] // args['n_heads'], device=device)
+    else:
+        u_bias, v_bias = None, None
+
+    attention.train()
+    attention_chunk.train()
+    cv, aws = attention(cat, cat[:, -qlen:], pos_embs, mask_dense, u_bias, v_bias)
+    cv_chunk, aws_chunk = attention_chunk(cat, cat[:, -qlen:], pos_embs, mask, u_bias, v_bias)
+    assert aws_chunk is None
+    assert torch.allclose(cv, cv_chunk, atol=1e-5)
+
+    grad = torch.autograd.grad(cv.sum(), cat)[0]
+    grad_chunk = torch.autograd.grad(cv_chunk.sum(), cat)[0]
+    assert torch.allclose(grad, grad_chunk, atol=1e-5)
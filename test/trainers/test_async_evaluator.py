@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for evaluation in a worker process."""
+
+import importlib
+import os
+import pytest
+import time
+import torch
+from types import SimpleNamespace
+
+
+def build_linear(args, save_path):
+    return torch.nn.Linear(4, 3, bias=False), None
+
+
+def eval_weight_sum(model, dataloader, args, epoch):
+    time.sleep(args.sleep)
+    if args.fail:
+        raise ValueError('evaluation failed')
+    return model.weight.sum().item()
+
+
+def make_args(**kwargs):
+    args = dict(
+        sleep=0.,
+        fail=False,
+    )
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+def make_evaluator(tmp_path, policy='wait', **kwargs):
+    module = importlib.import_module('neural_sp.trainers.async_evaluator')
+    return module.AsyncEvaluator(build_linear, eval_weight_sum, make_args(**kwargs),
+                                 str(tmp_path), policy=policy)
+
+
+def test_wait(tmp_path):
+    evaluator = make_evaluator(tmp_path, policy='wait')
+    model = torch.nn.Linear(4, 3, bias=False)
+    expected = []
+    for epoch in [1, 2]:
+        with torch.no_grad():
+            model.weight.fill_(epoch)
+        evaluator.submit(model, epoch)
+        expected.append((epoch, 12. * epoch))
+        with torch.no_grad():
+            model.weight.fill_(-1)  # must not affect the snapshot
+        results = evaluator.resolve()
+        assert results == expected[-1:]
+    assert evaluator.close() == []
+    assert os.path.isfile(os.path.join(tmp_path, 'eval.log'))
+
+
+def test_skip(tmp_path):
+    evaluator = make_evaluator(tmp_path, policy='skip', sleep=1.)
+    model = torch.nn.Linear(4, 3, bias=False)
+    for epoch in [1, 2, 3]:
+        with torch.no_grad():
+            model.weight.fill_(epoch)
+        assert evaluator.resolve() == []  # never waits
+        evaluator.submit(model, epoch)
+    # epochs 1 and 2 are dropped, and only the last one is waited for at the end
+    assert evaluator.close() == [(3, 36.)]
+
+
+def test_error(tmp_path):
+    evaluator = make_evaluator(tmp_path, fail=True)
+    evaluator.submit(torch.nn.Linear(4, 3, bias=False), 1)
+    with pytest.raises(RuntimeError, match='evaluation failed'):
+        evaluator.wait()
+
+
+@pytest.mark.parametrize("decay_type", ['metric', 'always'])
+def test_deferred_metric(decay_type):
+    model = torch.nn.Linear(4, 3)
+    module = importlib.import_module('neural_sp.trainers.lr_scheduler')
+    scheduler = module.LRScheduler(torch.optim.Adam(model.parameters(), lr=1e-3), 1e-3,
+                                   decay_type=decay_type, decay_start_epoch=1, decay_rate=0.5,
+                                   save_checkpoints_topk=1)
+    scheduler_sync = module.LRScheduler(torch.optim.Adam(model.parameters(), lr=1e-3), 1e-3,
+                                        decay_type=decay_type, decay_start_epoch=1, decay_rate=0.5,
+                                        save_checkpoints_topk=1)
+
+    # metrics arrive one epoch late
+    metrics = [3., 2., 2.5]
+    for ep, metric in enumerate(metrics):
+        scheduler_sync.epoch(metric)
+        if ep > 0:
+            scheduler.add_metric(metrics[ep - 1], ep)
+        scheduler.epoch(defer_metric=True)
+    scheduler.add_metric(metrics[-1], len(metrics))
+
+    assert scheduler.n_epochs == 3
+    assert scheduler.topk_list == scheduler_sync.topk_list == [(2, 2.)]
+    assert scheduler.lr == scheduler_sync.lr
+
+
+def test_average_observations():
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    observation = module.average_observations([{'loss.att': 1., 'acc.att': None},
+                                               {'loss.att': 3., 'acc.att': 0.5}])
+    assert observation == {'loss.att': 2., 'acc.att': 0.5}
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for checkpoint averaging."""
+
+import importlib
+import os
+import pytest
+import torch
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super(Model, self).__init__()
+        self.linear = torch.nn.Linear(4, 3)
+        self.bn = torch.nn.BatchNorm1d(3)
+
+
+def save_checkpoints(save_dir, n_epochs):
+    models = []
+    for ep in range(1, n_epochs + 1):
+        model = Model()
+        model.bn.num_batches_tracked.fill_(ep)
+        torch.save({'model_state_dict': model.state_dict(), 'optimizer_state_dict': {}},
+                   os.path.join(save_dir, 'model.epoch-%d' % ep))
+        models.append(model)
+    return models
+
+
+@pytest.mark.parametrize("ema_decay", [None, 0.5])
+def test_average_checkpoints(tmp_path, ema_decay):
+    module = importlib.import_module('neural_sp.bin.eval_utils')
+    models = save_checkpoints(str(tmp_path), n_epochs=5)
+    best_model_path = os.path.join(tmp_path, 'model.epoch-5')
+
+    model = Model()
+    module.average_checkpoints(model, best_model_path, n_average=3, ema_decay=ema_decay)
+
+    if ema_decay is None:
+        weights = [1 / 3] * 3
+    else:
+        weights = [0.25, 0.25, 0.5]
+        assert module.ema_weights(3, ema_decay) == weights
+    expected = sum(w * m.linear.weight.detach().double() for w, m in zip(weights, models[2:]))
+    assert torch.allclose(model.linear.weight.double(), expected)
+    assert model.linear.weight.dtype == torch.float32
+    # integer buffers are copied from the latest checkpoint
+    assert model.bn.num_batches_tracked.item() == 5
+
+    # the cache is reused while member checkpoints are unchanged
+    avg_files = [f for f in os.listdir(tmp_path) if f.startswith('model-avg3')]
+    assert len(avg_files) == 1
+    avg_path = os.path.join(tmp_path, avg_files[0])
+    mtime = os.path.getmtime(avg_path)
+    model_cached = Model()
+    module.average_checkpoints(model_cached, best_model_path, n_average=3, ema_decay=ema_decay)
+    assert os.path.getmtime(avg_path) == mtime
+    assert torch.equal(model_cached.linear.weight, model.linear.weight)
+
+    # the cache is invalidated if a member checkpoint is overwritten
+    save_checkpoints(str(tmp_path), n_epochs=5)
+    model_new = Model()
+    module.average_checkpoints(model_new, best_model_path, n_average=3, ema_decay=ema_decay)
+    assert not torch.equal(model_new.linear.weight, model.linear.weight)
+
+
+def test_average_checkpoints_topk(tmp_path):
+    module = importlib.import_module('neural_sp.bin.eval_utils')
+    models = save_checkpoints(str(tmp_path), n_epochs=5)
+    os.remove(os.path.join(tmp_path, 'model.epoch-4'))
+
+    model = Model()
+    module.average_checkpoints(model, os.path.join(tmp_path, 'model.epoch-2'), n_average=2,
+                               topk_list=[(2, 1.), (4, 2.), (5, 3.), (1, 4.)])
+    # missing checkpoints are skipped
+    expected = (models[1].linear.weight + models[4].linear.weight) / 2
+    assert torch.allclose(model.linear.weight, expected)
+
+
+def test_average_checkpoints_path(tmp_path):
+    module = importlib.import_module('neural_sp.bin.eval_utils')
+    save_checkpoints(str(tmp_path), n_epochs=5)
+    best_model_path = os.path.join(tmp_path, 'model.epoch-5')
+    topk_list = [(2, 1.), (5, 2.), (1, 3.)]
+
+    # offline averaging of top-k epochs (average_checkpoints.py --topk)
+    module.average_checkpoints(None, best_model_path, n_average=2, topk_list=topk_list)
+    avg_path = module.averaged_checkpoint_path(best_model_path, 2, topk=True)
+    assert os.path.basename(avg_path) == 'model-avg2_topk'
+    mtime = os.path.getmtime(avg_path)
+
+    # averaging of previous epochs does not overwrite it
+    module.average_checkpoints(Model(), best_model_path, n_average=2)
+    module.average_checkpoints(Model(), best_model_path, n_average=2, ema_decay=0.5)
+    assert sorted(f for f in os.listdir(tmp_path) if f.startswith('model-avg')) == \
+        ['model-avg2', 'model-avg2_ema0.5', 'model-avg2_topk']
+
+    # evaluation with the same options reuses it
+    module.average_checkpoints(Model(), best_model_path, n_average=2, topk_list=topk_list)
+    assert os.path.getmtime(avg_path) == mtime
@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for checkpoint writer."""
+
+import importlib
+import os
+import pytest
+import torch
+from types import SimpleNamespace
+
+
+def make_args(**kwargs):
+    args = dict(
+        decay_type='always',
+        decay_start_epoch=1,
+        decay_rate=0.5,
+        save_checkpoints_topk=1,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize("async_checkpoint", [True, False])
+@pytest.mark.parametrize("shard_checkpoint", [True, False])
+def test_save_checkpoint(tmp_path, async_checkpoint, shard_checkpoint):
+    model = torch.nn.Linear(4, 3)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    module = importlib.import_module('neural_sp.trainers.lr_scheduler')
+    scheduler = module.LRScheduler(optimizer, 1e-3, async_checkpoint=async_checkpoint,
+                                   shard_checkpoint=shard_checkpoint, **make_args())
+
+    for ep, metric in enumerate([3., 2., 2.5]):
+        model(torch.randn(2, 4)).sum().backward()
+        scheduler.step()
+        scheduler.epoch(metric)
+        scheduler.save_checkpoint(SimpleNamespace(module=model), str(tmp_path))
+        weight = model.weight.detach().clone()
+        with torch.no_grad():
+            model.weight.add_(1)  # must not affect the checkpoint being written
+    scheduler.wait_checkpoint()
+
+    # only the best checkpoint (epoch 2) and the last one (epoch 3) remain
+    files = sorted(f for f in os.listdir(tmp_path))
+    expected = ['model.epoch-2', 'model.epoch-3']
+    if shard_checkpoint:
+        expected = ['model.epoch-2', 'model.epoch-2.optim', 'model.epoch-3', 'model.epoch-3.optim']
+    assert files == expected
+
+    writer = importlib.import_module('neural_sp.trainers.checkpoint_writer')
+    checkpoint = writer.load_to_cpu(os.path.join(tmp_path, 'model.epoch-3'))
+    assert torch.equal(checkpoint['model_state_dict']['weight'], weight)
+    assert ('optimizer_state_dict' in checkpoint) != shard_checkpoint
+
+    # resume
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    model_new = torch.nn.Linear(4, 3)
+    model_new.use_cuda = False
+    scheduler_new = module.LRScheduler(torch.optim.Adam(model_new.parameters(), lr=1e-3), 1e-3,
+                                       **make_args())
+    train_utils.load_checkpoint(os.path.join(tmp_path, 'model.epoch-3'), model_new, scheduler_new)
+    assert torch.equal(model_new.weight, weight)
+    assert scheduler_new.n_epochs == 3
+    assert len(scheduler_new.optimizer.state) > 0
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_load_to_cpu_legacy(tmp_path, monkeypatch, mmap):
+    module = importlib.import_module('neural_sp.trainers.checkpoint_writer')
+    path = os.path.join(tmp_path, 'model.epoch-1')
+    torch.save({'model_state_dict': {'weight': torch.ones(2)}, 'topk_list': [(1, 2.)]}, path)
+
+    # options unsupported by older PyTorch must not be passed
+    torch_load = torch.load
+
+    def legacy_load(f, map_location=None):
+        return torch_load(f, map_location=map_location, weights_only=False)
+    monkeypatch.setattr(torch, 'load', legacy_load)
+    checkpoint = module.load_to_cpu(path, mmap=mmap)
+    assert torch.equal(checkpoint['model_state_dict']['weight'], torch.ones(2))
+    assert checkpoint['topk_list'] == [(1, 2.)]
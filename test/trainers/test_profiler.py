@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for step-level profiler."""
+
+import importlib
+import json
+import os
+
+
+def test_step_profiler(tmp_path):
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    profiler = module.StepProfiler(str(tmp_path), start_step=2, n_steps=3)
+
+    for step in range(8):
+        with module.record_stage('forward'):
+            with module.record_stage('encoder'):
+                pass
+        with module.record_stage('backward'):
+            pass
+        profiler.step()
+        # results are saved at the end of the window
+        assert os.path.isfile(os.path.join(tmp_path, 'profile.json')) == (step >= 4)
+
+    stats = json.load(open(os.path.join(tmp_path, 'profile.json')))
+    assert list(stats.keys()) == ['step', 'forward/encoder', 'forward', 'backward']
+    assert all(s['calls'] == 3 for s in stats.values())
+    assert stats['forward']['total_ms'] >= stats['forward/encoder']['total_ms']
+
+    trace = json.load(open(os.path.join(tmp_path, 'profile.trace.json')))['traceEvents']
+    assert len(trace) == 3 * 4
+    assert sorted(set(e['args']['step'] for e in trace)) == [2, 3, 4]
+
+    # stages are not recorded after the window
+    assert module._PROFILER is None
+    assert len(profiler.events) == 3 * 3
+
+
+def test_step_profiler_disabled(tmp_path):
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    profiler = module.StepProfiler(str(tmp_path), start_step=0, n_steps=0)
+    for step in range(3):
+        with module.record_stage('forward'):
+            pass
+        profiler.step()
+    profiler.close()
+    assert len(profiler.events) == 0
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for reporter."""
+
+import importlib
+import numpy as np
+import os
+import pytest
+import torch
+
+
+@pytest.mark.parametrize("report_step", [1, 3])
+def test_reporter(tmp_path, report_step):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    reporter = module.Reporter(str(tmp_path), report_step=report_step)
+
+    n_steps = 0
+    for _ in range(2):
+        for step in range(4):
+            reporter.add({'loss.att': float(step), 'acc.att': 0.5, 'ppl.att': None})
+            reporter.add_tensorboard_scalar('total_norm', torch.tensor(1.))
+            reporter.step()
+            n_steps += 1
+        reporter.add({'loss.att': 2., 'acc.att': 0.4}, is_eval=True)
+        reporter.step(is_eval=True)
+        n_steps += 1
+        reporter.snapshot()
+    reporter.epoch(10., name='wer')
+    reporter.close()
+
+    assert reporter.obsv_train['loss']['att'] == [1.5, 1.5]
+    assert reporter.obsv_dev['acc']['att'] == [0.4, 0.4]
+    assert reporter.steps == [5, 10]
+    # CSV files are appended and include all snapshots
+    csv = np.loadtxt(os.path.join(tmp_path, 'loss-att.csv'), delimiter=',')
+    assert np.allclose(csv, [[5, 1.5, 2.], [10, 1.5, 2.]])
+    for name in ['loss.png', 'acc.png', 'wer.png']:
+        assert os.path.isfile(os.path.join(tmp_path, name))
+    assert not any(f.endswith('.tmp') for f in os.listdir(tmp_path))
+
+
+def test_reporter_no_write(tmp_path):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    reporter = module.Reporter(str(tmp_path), write=False)
+    reporter.add({'loss.att': 1.})
+    reporter.add_tensorboard_scalar('learning_rate', 1e-3)
+    reporter.step()
+    reporter.add({'loss.att': 2.}, is_eval=True)
+    reporter.step(is_eval=True)
+    reporter.snapshot()
+    reporter.epoch(10.)
+    reporter.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,40 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Binarize a dataset tsv file for memory-mapped LM training."""
+
+import argparse
+from distutils.util import strtobool
+
+from neural_sp.datasets.lm import binarize
+from neural_sp.datasets.utils import count_vocab_size
+
+parser = argparse.ArgumentParser()
+parser.add_argument('tsv', type=str,
+                    help='dataset tsv file')
+parser.add_argument('bin', type=str,
+                    help='output binary file (*.bin)')
+parser.add_argument('--dict', type=str, required=True,
+                    help='dictionary file')
+parser.add_argument('--min_n_tokens', type=int, default=1,
+                    help='exclude utterances shorter than this value')
+parser.add_argument('--serialize', type=strtobool, default=False,
+                    help='serialize text according to onset in dialogue')
+parser.add_argument('--corpus', type=str, default='',
+                    help='name of corpus')
+args = parser.parse_args()
+
+
+def main():
+
+    n_tokens = binarize(args.tsv, args.bin, vocab=count_vocab_size(args.dict),
+                        min_n_tokens=args.min_n_tokens,
+                        serialize=args.serialize, corpus=args.corpus)
+    print('Wrote %d tokens to %s' % (n_tokens, args.bin))
+
+
+if __name__ == '__main__':
+    main()
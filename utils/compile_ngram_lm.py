@@ -0,0 +1,31 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compile an ARPA file into memory-mappable arrays for NgramLM."""
+
+import argparse
+
+from neural_sp.models.lm.ngram import NgramLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('arpa', type=str,
+                    help='ARPA file')
+parser.add_argument('dict', type=str,
+                    help='dictionary file of the ASR model')
+parser.add_argument('out', type=str,
+                    help='output directory')
+args = parser.parse_args()
+
+
+def main():
+
+    lm = NgramLM(args.arpa, args.dict)
+    lm.save(args.out)
+    print('Saved %d-gram LM (%d n-grams) to %s' % (lm.n_order, len(lm.keys) - 1, args.out))
+
+
+if __name__ == '__main__':
+    main()